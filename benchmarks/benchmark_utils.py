@@ -0,0 +1,118 @@
+"""
+Common utilities for benchmarks - time measurement, scaling curves and comparison with stored baselines
+"""
+
+import json
+import math
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_DIR = os.path.join(SCRIPT_DIR, 'baselines')
+
+
+@dataclass
+class BenchmarkResult:
+    """ Result of a single benchmark case for a single input size """
+
+    case_name: str
+    size: int  # input size, in units of the case (e.g. number of detections)
+    time_s: float  # best time of all repeats
+    peak_memory_bytes: Optional[int] = None  # if measured
+
+    def get_throughput(self) -> float:
+        """ Processed input units per second """
+        return self.size / self.time_s if self.time_s > 0 else math.inf
+
+
+def measure_time(func: Callable[[], None], repeats: int = 3) -> float:
+    """ Run the function a few times and return the best time (the least disturbed by other processes)
+
+    :param func: function to measure, without arguments
+    :param repeats: number of runs
+    """
+    best_time_s = math.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best_time_s = min(best_time_s, time.perf_counter() - start_time)
+    return best_time_s
+
+
+def calculate_scaling_exponent(results: List[BenchmarkResult]) -> Optional[float]:
+    """ Fit time ~ size^k on the log-log scale (k=1 for linear scaling, k=2 for quadratic).
+    None if there are fewer than two sizes
+    """
+    results = [r for r in results if r.time_s > 0]
+    if len(results) < 2:
+        return None
+
+    log_sizes = np.log([r.size for r in results])
+    log_times = np.log([r.time_s for r in results])
+    slope, _ = np.polyfit(log_sizes, log_times, deg=1)
+    return float(slope)
+
+
+def group_results_by_case(results: List[BenchmarkResult]) -> Dict[str, List[BenchmarkResult]]:
+    grouped_results = {}  # type: Dict[str, List[BenchmarkResult]]
+    for result in results:
+        grouped_results.setdefault(result.case_name, []).append(result)
+    return grouped_results
+
+
+def create_report(results: List[BenchmarkResult], size_units: Dict[str, str]) -> str:
+    """ Text report with the scaling curve of each case
+
+    :param results: results of all cases
+    :param size_units: name of the input size unit for each case
+    """
+    lines = []
+    for case_name, case_results in group_results_by_case(results).items():
+        scaling_exponent = calculate_scaling_exponent(case_results)
+        scaling_txt = f'time ~ size^{scaling_exponent:.2f}' if scaling_exponent is not None else 'single size'
+        lines.append(f'{case_name} ({scaling_txt}):')
+        for result in case_results:
+            line = f'    {result.size:>12,} {size_units.get(case_name, "")}: {result.time_s * 1000:12.2f} ms, ' \
+                   f'{result.get_throughput():14,.0f} /s'
+            if result.peak_memory_bytes is not None:
+                line += f', peak memory {result.peak_memory_bytes / 1024**2:.0f} MB'
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def save_baseline(file_path: str, results: List[BenchmarkResult]):
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, 'w') as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+
+
+def load_baseline(file_path: str) -> List[BenchmarkResult]:
+    with open(file_path) as f:
+        return [BenchmarkResult(**values) for values in json.load(f)]
+
+
+def compare_with_baseline(results: List[BenchmarkResult],
+                          baseline_results: List[BenchmarkResult],
+                          tolerance: float) -> List[str]:
+    """ Compare times with the baseline (for the same case and size)
+
+    :param tolerance: allowed ratio of the time to the baseline time, e.g. 1.3 for 30% slowdown
+    :return: descriptions of regressions, empty if there are none
+    """
+    baseline_times = {(r.case_name, r.size): r.time_s for r in baseline_results}
+
+    regressions = []
+    for result in results:
+        baseline_time_s = baseline_times.get((result.case_name, result.size))
+        if baseline_time_s is None or baseline_time_s <= 0:
+            continue
+
+        ratio = result.time_s / baseline_time_s
+        if ratio > tolerance:
+            regressions.append(f'{result.case_name} [{result.size:,}]: {result.time_s * 1000:.2f} ms, '
+                               f'{ratio:.2f}x of baseline {baseline_time_s * 1000:.2f} ms')
+    return regressions
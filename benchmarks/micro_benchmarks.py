@@ -0,0 +1,316 @@
+"""
+Micro-benchmarks of the processing hot paths (detections NMS, model input preprocessing, stitching of tile results,
+vectorization of masks and rasterization of the processed area mask), on synthetic inputs of increasing size.
+
+Run from the repository root (CPU only, no network access needed):
+    PYTHONPATH=$PYTHONPATH:`pwd`/src:`pwd` python3 -m benchmarks.micro_benchmarks [--quick] [--save-baseline]
+
+Times are compared with the baseline saved on the same machine (see `--baseline`), exit code is 1 on regressions.
+"""
+
+import argparse
+import math
+import os
+import sys
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+import cv2
+import numpy as np
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsRasterLayer, QgsRectangle, QgsVectorLayer
+
+from benchmarks.benchmark_utils import (BASELINES_DIR, BenchmarkResult, calculate_scaling_exponent, compare_with_baseline,
+                                        create_report, load_baseline, measure_time, save_baseline)
+from deepness.common.processing_parameters.standardization_parameters import StandardizationParameters
+from deepness.processing import processing_utils
+from deepness.processing.map_processor.map_processor_detection import MapProcessorDetection
+from deepness.processing.models import preprocessing_utils
+from deepness.processing.models.detector import Detection, Detector
+from deepness.processing.processing_utils import BoundingBox
+from deepness.processing.tile_params import TileParams
+from test.test_utils import get_dummy_fotomap_small_path, init_qgis
+
+DEFAULT_BASELINE_FILE_PATH = os.path.join(BASELINES_DIR, 'micro_benchmarks.json')
+
+
+@dataclass
+class MicroBenchmarkCase:
+    name: str
+    size_unit: str  # what the input size is, e.g. number of detections
+    sizes: List[int]
+    quick_sizes: List[int]  # smaller sizes, for a quick check
+    prepare: Callable[[int], Callable[[], None]]  # creates inputs of the given size, returns the function to measure
+
+
+def _create_random_detections(number_of_detections: int, seed: int = 0) -> List[Detection]:
+    """ Detections with a constant density on the map (about one object per 100x100 px),
+    each object detected twice (as in overlapping tiles), so that about half of detections is removed by NMS
+    """
+    rng = np.random.default_rng(seed)
+    number_of_objects = max(1, number_of_detections // 2)
+    map_size_px = int(math.sqrt(number_of_objects) * 100)
+
+    xy_min = rng.uniform(0, map_size_px, size=(number_of_objects, 2))
+    wh = rng.uniform(20, 60, size=(number_of_objects, 2))
+    xyxy = np.concatenate([xy_min, xy_min + wh], axis=1)
+    xyxy = np.concatenate([xyxy, xyxy + rng.normal(0, 2, size=xyxy.shape)])[:number_of_detections]
+    confidences = rng.uniform(0.3, 1.0, size=len(xyxy))
+
+    return [Detection(bbox=BoundingBox(x_min=int(x_min), y_min=int(y_min), x_max=int(x_max), y_max=int(y_max)),
+                      conf=float(conf), clss=0)
+            for (x_min, y_min, x_max, y_max), conf in zip(xyxy, confidences)]
+
+
+def _prepare_non_max_suppression_fast(number_of_detections: int):
+    detections = _create_random_detections(number_of_detections)
+    boxes = np.array([det.get_bbox_xyxy() for det in detections])
+    probs = np.array([det.conf for det in detections])
+    return lambda: Detector.non_max_suppression_fast(boxes=boxes, probs=probs, iou_threshold=0.5)
+
+
+def _prepare_non_max_kdtree(number_of_detections: int):
+    detections = sorted(_create_random_detections(number_of_detections), reverse=True)
+    return lambda: MapProcessorDetection.non_max_kdtree(detections, iou_threshold=0.5)
+
+
+def _prepare_remove_overlaping_detections(number_of_detections: int):
+    detections = _create_random_detections(number_of_detections)
+    return lambda: MapProcessorDetection.remove_overlaping_detections(detections, iou_threshold=0.5)
+
+
+def _prepare_preprocessing(number_of_tiles: int):
+    """ The same steps as in `ModelBase.preprocessing`, for a batch of RGBA tiles """
+    tiles_batched = np.random.default_rng(0).integers(0, 256, size=(number_of_tiles, 512, 512, 4), dtype=np.uint8)
+    standardization_parameters = StandardizationParameters(channels_number=3)
+    standardization_parameters.set_mean_std(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+
+    def preprocessing():
+        tiles = preprocessing_utils.limit_channels_number(tiles_batched, limit=3)
+        tiles = preprocessing_utils.normalize_values_to_01(tiles)
+        tiles = preprocessing_utils.standardize_values(tiles, params=standardization_parameters)
+        preprocessing_utils.transpose_nhwc_to_nchw(tiles)
+
+    return preprocessing
+
+
+def _prepare_set_mask_on_full_img(number_of_tiles: int):
+    """ Small tiles (32 px, with overlap), to keep the full image in memory also for 100k tiles """
+    params = SimpleNamespace(tile_size_px=32, processing_stride_px=24)
+    bins_number = int(math.ceil(math.sqrt(number_of_tiles)))
+    size_px = (bins_number - 1) * params.processing_stride_px + params.tile_size_px
+    processing_extent = QgsRectangle(0, 0, size_px, size_px)
+
+    tiles_params = [
+        TileParams(x_bin_number=i % bins_number, y_bin_number=i // bins_number,
+                   x_bins_number=bins_number, y_bins_number=bins_number,
+                   params=params, rlayer_units_per_pixel=1, processing_extent=processing_extent)
+        for i in range(number_of_tiles)
+    ]
+    full_result_img = np.zeros((1, size_px, size_px), dtype=np.uint8)
+    tile_result = np.ones((1, params.tile_size_px, params.tile_size_px), dtype=np.uint8)
+
+    def set_mask_on_full_img():
+        for tile_params in tiles_params:
+            tile_params.set_mask_on_full_img(full_result_img=full_result_img, tile_result=tile_result)
+
+    return set_mask_on_full_img
+
+
+def _create_random_blobs_mask(megapixels: int) -> np.ndarray:
+    """ Mask with about one blob (some of them with holes) per 100x100 px """
+    rng = np.random.default_rng(0)
+    size_px = int(math.sqrt(megapixels * 1e6))
+    mask_img = np.zeros((size_px, size_px), dtype=np.uint8)
+
+    number_of_blobs = size_px * size_px // 10000
+    for i, ((x, y), radius) in enumerate(zip(rng.integers(0, size_px, size=(number_of_blobs, 2)),
+                                              rng.integers(10, 40, size=number_of_blobs))):
+        cv2.circle(mask_img, (int(x), int(y)), int(radius), color=1, thickness=-1)
+        if i % 4 == 0:
+            cv2.circle(mask_img, (int(x), int(y)), int(radius) // 3, color=0, thickness=-1)
+    return mask_img
+
+
+def _find_mask_contours(megapixels: int):
+    mask_img = _create_random_blobs_mask(megapixels)
+    contours, hierarchy = cv2.findContours(mask_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    extent = QgsRectangle(0, 0, mask_img.shape[1], mask_img.shape[0])
+    return contours, hierarchy, extent
+
+
+def _prepare_transform_contours_yx_pixels_to_target_crs(megapixels: int):
+    contours, _, extent = _find_mask_contours(megapixels)
+    return lambda: processing_utils.transform_contours_yx_pixels_to_target_crs(
+        contours=contours, extent=extent, rlayer_units_per_pixel=1)
+
+
+def _prepare_convert_cv_contours_to_features(megapixels: int):
+    contours, hierarchy, extent = _find_mask_contours(megapixels)
+    contours = processing_utils.transform_contours_yx_pixels_to_target_crs(
+        contours=contours, extent=extent, rlayer_units_per_pixel=1)
+
+    def convert_cv_contours_to_features():
+        processing_utils.convert_cv_contours_to_features(
+            features=[], cv_contours=contours, hierarchy=hierarchy[0],
+            is_hole=False, current_holes=[], current_contour_index=0)
+
+    return convert_cv_contours_to_features
+
+
+def _create_mask_vlayer_with_detailed_polygon(rlayer: QgsRasterLayer, size_px: int) -> QgsVectorLayer:
+    """ Mask layer with a single polygon with a detailed outline (2000 vertices) and 10 holes, covering the map """
+    center = size_px / 2
+
+    angles = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+    radiuses = center * (0.8 + 0.15 * np.sin(angles * 50))
+    outline = [QgsPointXY(center + r * np.cos(a), center + r * np.sin(a)) for a, r in zip(angles, radiuses)]
+    holes = []
+    for i in range(10):
+        hole_center = center + center * 0.5 * np.cos(i), center + center * 0.5 * np.sin(i)
+        holes.append([QgsPointXY(hole_center[0] + center * 0.05 * np.cos(a), hole_center[1] + center * 0.05 * np.sin(a))
+                      for a in angles[::20]])
+
+    vlayer_mask = QgsVectorLayer('Polygon', 'mask', 'memory')
+    vlayer_mask.setCrs(rlayer.crs())
+    feature = QgsFeature()
+    feature.setGeometry(QgsGeometry.fromPolygonXY([outline, *holes]))
+    vlayer_mask.dataProvider().addFeatures([feature])
+    return vlayer_mask
+
+
+def _prepare_create_area_mask_image(megapixels: int):
+    rlayer = QgsRasterLayer(get_dummy_fotomap_small_path(), 'fotomap')
+    size_px = int(math.sqrt(megapixels * 1e6))
+    vlayer_mask = _create_mask_vlayer_with_detailed_polygon(rlayer, size_px)
+
+    return lambda: processing_utils.create_area_mask_image(
+        vlayer_mask=vlayer_mask,
+        rlayer=rlayer,
+        extended_extent=QgsRectangle(0, 0, size_px, size_px),
+        rlayer_units_per_pixel=1,
+        image_shape_yx=(size_px, size_px))
+
+
+def _prepare_create_chunked_area_mask(number_of_polygons: int):
+    """ Mask layer with many small parcels (squares of 50 px) scattered over a large map (100 megapixels),
+    with the mask read for 1000 tiles (512 px), as when checking which tiles to process
+    """
+    rlayer = QgsRasterLayer(get_dummy_fotomap_small_path(), 'fotomap')
+    size_px, tile_size_px = 10_000, 512
+    rng = np.random.default_rng(0)
+
+    vlayer_mask = QgsVectorLayer('Polygon', 'mask', 'memory')
+    vlayer_mask.setCrs(rlayer.crs())
+    features = []
+    for x, y in rng.uniform(0, size_px - 50, size=(number_of_polygons, 2)):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromRect(QgsRectangle(x, y, x + 50, y + 50)))
+        features.append(feature)
+    vlayer_mask.dataProvider().addFeatures(features)
+    tiles_yx = rng.integers(0, size_px - tile_size_px, size=(1000, 2))
+
+    def create_chunked_area_mask():
+        area_mask = processing_utils.create_chunked_area_mask(
+            vlayer_mask=vlayer_mask,
+            rlayer=rlayer,
+            extended_extent=QgsRectangle(0, 0, size_px, size_px),
+            rlayer_units_per_pixel=1,
+            image_shape_yx=(size_px, size_px))
+        for y, x in tiles_yx:
+            area_mask[y:y + tile_size_px, x:x + tile_size_px]
+
+    return create_chunked_area_mask
+
+
+DETECTIONS_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+TILES_SIZES = [1_000, 10_000, 100_000]
+MEGAPIXELS_SIZES = [10, 30, 100]
+
+MICRO_BENCHMARK_CASES = [
+    MicroBenchmarkCase('non_max_suppression_fast', 'detections', DETECTIONS_SIZES, [1_000, 10_000],
+                       _prepare_non_max_suppression_fast),
+    MicroBenchmarkCase('non_max_kdtree', 'detections', DETECTIONS_SIZES, [1_000, 10_000], _prepare_non_max_kdtree),
+    MicroBenchmarkCase('remove_overlaping_detections', 'detections', DETECTIONS_SIZES, [1_000, 10_000],
+                       _prepare_remove_overlaping_detections),
+    MicroBenchmarkCase('preprocessing', 'tiles (512 px)', [1, 4, 16, 64], [1, 4], _prepare_preprocessing),
+    MicroBenchmarkCase('set_mask_on_full_img', 'tiles (32 px)', TILES_SIZES, [1_000, 10_000],
+                       _prepare_set_mask_on_full_img),
+    MicroBenchmarkCase('transform_contours_yx_pixels_to_target_crs', 'megapixels', MEGAPIXELS_SIZES, [2, 10],
+                       _prepare_transform_contours_yx_pixels_to_target_crs),
+    MicroBenchmarkCase('convert_cv_contours_to_features', 'megapixels', MEGAPIXELS_SIZES, [2, 10],
+                       _prepare_convert_cv_contours_to_features),
+    MicroBenchmarkCase('create_area_mask_image', 'megapixels', MEGAPIXELS_SIZES, [2, 10], _prepare_create_area_mask_image),
+    MicroBenchmarkCase('create_chunked_area_mask', 'polygons', [1_000, 10_000, 100_000], [1_000, 10_000],
+                       _prepare_create_chunked_area_mask),
+]
+
+
+def run_case(case: MicroBenchmarkCase, sizes: List[int], repeats: int, max_time_s: float) -> List[BenchmarkResult]:
+    """ Run the case for increasing sizes. Sizes for which the predicted time (extrapolated from the scaling curve
+    of the smaller sizes) exceeds `max_time_s` are skipped, e.g. 1M detections for a quadratic algorithm
+    """
+    results = []  # type: List[BenchmarkResult]
+    for size in sizes:
+        if results:
+            scaling_exponent = max(calculate_scaling_exponent(results) or 1.0, 1.0)
+            predicted_time_s = results[-1].time_s * (size / results[-1].size) ** scaling_exponent
+            if predicted_time_s > max_time_s:
+                print(f'{case.name}: skipping size {size:,} and above, predicted time {predicted_time_s:.0f} s')
+                break
+
+        func = case.prepare(size)
+        time_s = measure_time(func, repeats=repeats)
+        results.append(BenchmarkResult(case_name=case.name, size=size, time_s=time_s))
+        print(f'{case.name} [{size:,} {case.size_unit}]: {time_s * 1000:.2f} ms')
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the processing hot paths')
+    parser.add_argument('--quick', action='store_true', help='Only the smaller input sizes')
+    parser.add_argument('--cases', nargs='+', choices=[case.name for case in MICRO_BENCHMARK_CASES],
+                        help='Cases to run (all by default)')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of runs of each case, the best time is reported')
+    parser.add_argument('--max-time-s', type=float, default=60.0,
+                        help='Skip sizes for which a single run is predicted to take longer')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE_PATH, help='Baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.3,
+                        help='Allowed ratio of time to the baseline time, before reporting a regression')
+    args = parser.parse_args(argv)
+
+    init_qgis()
+
+    results = []  # type: List[BenchmarkResult]
+    for case in MICRO_BENCHMARK_CASES:
+        if args.cases and case.name not in args.cases:
+            continue
+        sizes = case.quick_sizes if args.quick else case.sizes
+        results += run_case(case, sizes, repeats=args.repeats, max_time_s=args.max_time_s)
+
+    print()
+    print(create_report(results, size_units={case.name: case.size_unit for case in MICRO_BENCHMARK_CASES}))
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f'\nBaseline saved to {args.baseline}')
+        return 0
+
+    try:
+        baseline_results = load_baseline(args.baseline)
+    except FileNotFoundError:
+        print(f'\nNo baseline in {args.baseline}, run with --save-baseline to create it')
+        return 0
+
+    regressions = compare_with_baseline(results, baseline_results, tolerance=args.tolerance)
+    if regressions:
+        print('\nRegressions compared to the baseline:\n    ' + '\n    '.join(regressions))
+        return 1
+
+    print('\nNo regressions compared to the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
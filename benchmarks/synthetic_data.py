@@ -0,0 +1,261 @@
+"""
+Generation of synthetic inputs for end-to-end benchmarks - large rasters, processed area masks and tiny ONNX models
+with configurable output shapes and compute cost
+"""
+
+import json
+import math
+import os
+from typing import Tuple
+
+import cv2
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from osgeo import gdal, osr
+from qgis.core import QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsPointXY, QgsRectangle, QgsVectorLayer
+
+from deepness.processing.models.model_types import ModelType
+
+GEOTIFF_EPSG = 32633  # UTM 33N, metric units
+GEOTIFF_ORIGIN_XY = (500000.0, 5800000.0)  # upper left corner
+
+XYZ_TILE_SIZE_PX = 256
+XYZ_ZOOM = 19  # about 30 cm per pixel
+XYZ_FIRST_TILE_XY = (2 ** XYZ_ZOOM // 2 + 10000, 2 ** XYZ_ZOOM // 2 - 200000)  # upper left tile, in central Europe
+WEB_MERCATOR_WORLD_SIZE_M = 2 * math.pi * 6378137
+
+DETECTOR_GRID_CELL_PX = 16  # one candidate object in each cell of the detector output
+ONNX_OPSET = 13
+
+
+def _create_synthetic_image_block(y_start: int, height: int, width: int, channel: int, max_value: int,
+                                  rng: np.random.Generator, x_start: int = 0) -> np.ndarray:
+    """ Smooth pattern (different for each channel) with noise, to look a bit like an ortophoto """
+    yy = np.arange(y_start, y_start + height, dtype=np.float32)[:, None]
+    xx = np.arange(x_start, x_start + width, dtype=np.float32)[None, :]
+    pattern = (np.sin(xx / (40 + 7 * channel)) * np.cos(yy / (60 + 5 * channel)) + 1) / 2
+    noise = rng.random((height, width), dtype=np.float32)
+    return ((0.8 * pattern + 0.2 * noise) * max_value).astype(np.uint16 if max_value > 255 else np.uint8)
+
+
+def create_synthetic_geotiff(file_path: str,
+                             size_px: int,
+                             number_of_bands: int,
+                             is_uint16: bool = False,
+                             resolution_m_per_px: float = 0.1,
+                             seed: int = 0) -> QgsRectangle:
+    """ Create a square GeoTIFF with a synthetic image, written in blocks of rows (the image is not kept in memory)
+
+    :param size_px: width and height of the image
+    :param number_of_bands: e.g. 3 for RGB, more for multispectral images
+    :param is_uint16: whether bands are 16-bit (as usual for multispectral images), 8-bit otherwise
+    :return: extent of the raster
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(file_path, size_px, size_px, number_of_bands, gdal.GDT_UInt16 if is_uint16 else gdal.GDT_Byte,
+                            options=['TILED=YES', 'BIGTIFF=IF_SAFER'])
+    x_min, y_max = GEOTIFF_ORIGIN_XY
+    dataset.SetGeoTransform((x_min, resolution_m_per_px, 0, y_max, 0, -resolution_m_per_px))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(GEOTIFF_EPSG)
+    dataset.SetProjection(srs.ExportToWkt())
+
+    rng = np.random.default_rng(seed)
+    rows_in_block = 1024
+    for y_start in range(0, size_px, rows_in_block):
+        height = min(rows_in_block, size_px - y_start)
+        for band_number in range(1, number_of_bands + 1):
+            block = _create_synthetic_image_block(
+                y_start, height, size_px, channel=band_number, max_value=4095 if is_uint16 else 255, rng=rng)
+            dataset.GetRasterBand(band_number).WriteArray(block, 0, y_start)
+
+    dataset.FlushCache()
+    dataset = None  # closes the file
+
+    size_m = size_px * resolution_m_per_px
+    return QgsRectangle(x_min, y_max - size_m, x_min + size_m, y_max)
+
+
+def create_synthetic_xyz_tiles(dir_path: str, size_px: int, seed: int = 0) -> Tuple[str, QgsRectangle]:
+    """ Create a local XYZ tiles layer (PNG files) with a synthetic image. QGIS reads such a layer as a single ARGB32 band
+    (like web map services), so it is processed with composite byte channels
+
+    :param size_px: minimal width and height of the image (rounded up to full tiles)
+    :return: tuple (URI of the layer for the 'wms' provider, extent of the tiles in EPSG:3857)
+    """
+    rng = np.random.default_rng(seed)
+    number_of_tiles = int(math.ceil(size_px / XYZ_TILE_SIZE_PX))
+    first_x, first_y = XYZ_FIRST_TILE_XY
+
+    for i in range(number_of_tiles):
+        tile_dir_path = os.path.join(dir_path, str(XYZ_ZOOM), str(first_x + i))
+        os.makedirs(tile_dir_path, exist_ok=True)
+        for j in range(number_of_tiles):
+            tile_file_path = os.path.join(tile_dir_path, f'{first_y + j}.png')
+            if os.path.exists(tile_file_path):
+                continue
+            channels = [_create_synthetic_image_block(j * XYZ_TILE_SIZE_PX, XYZ_TILE_SIZE_PX, XYZ_TILE_SIZE_PX,
+                                                      channel=channel, max_value=255, rng=rng,
+                                                      x_start=i * XYZ_TILE_SIZE_PX) for channel in range(3)]
+            cv2.imwrite(tile_file_path, np.stack(channels, axis=2))
+
+    tile_size_m = WEB_MERCATOR_WORLD_SIZE_M / 2 ** XYZ_ZOOM
+    x_min = -WEB_MERCATOR_WORLD_SIZE_M / 2 + first_x * tile_size_m
+    y_max = WEB_MERCATOR_WORLD_SIZE_M / 2 - first_y * tile_size_m
+    extent = QgsRectangle(x_min, y_max - number_of_tiles * tile_size_m, x_min + number_of_tiles * tile_size_m, y_max)
+
+    uri = f'type=xyz&url=file://{dir_path}/{{z}}/{{x}}/{{y}}.png&zmin={XYZ_ZOOM}&zmax={XYZ_ZOOM}&crs=EPSG:3857'
+    return uri, extent
+
+
+def get_xyz_resolution_cm_per_px() -> float:
+    return WEB_MERCATOR_WORLD_SIZE_M / 2 ** XYZ_ZOOM / XYZ_TILE_SIZE_PX * 100
+
+
+def create_mask_vlayer(extent: QgsRectangle, crs: QgsCoordinateReferenceSystem, is_ellipse: bool) -> QgsVectorLayer:
+    """ Create a memory layer with the processed area - an ellipse inscribed in the extent (to have partially masked
+    tiles), or a rectangle slightly inside the extent (e.g. to limit processing of a XYZ layer, which covers the world)
+    """
+    if is_ellipse:
+        angles = np.linspace(0, 2 * np.pi, 360, endpoint=False)
+        points = [QgsPointXY(extent.center().x() + extent.width() / 2 * np.cos(a),
+                             extent.center().y() + extent.height() / 2 * np.sin(a)) for a in angles]
+    else:
+        margin = extent.width() * 0.001
+        points = [QgsPointXY(x, y) for x, y in [
+            (extent.xMinimum() + margin, extent.yMinimum() + margin), (extent.xMaximum() - margin, extent.yMinimum() + margin),
+            (extent.xMaximum() - margin, extent.yMaximum() - margin), (extent.xMinimum() + margin, extent.yMaximum() - margin)]]
+
+    vlayer = QgsVectorLayer('Polygon', 'processed_area', 'memory')
+    vlayer.setCrs(crs)
+    feature = QgsFeature()
+    feature.setGeometry(QgsGeometry.fromPolygonXY([points]))
+    vlayer.dataProvider().addFeatures([feature])
+    vlayer.updateExtents()
+    return vlayer
+
+
+class _OnnxGraphBuilder:
+    """ Helper to build a graph from nodes with random weights """
+
+    def __init__(self, seed: int):
+        self.nodes = []
+        self.initializers = []
+        self._rng = np.random.default_rng(seed)
+        self._names_counter = 0
+
+    def _create_name(self, prefix: str) -> str:
+        self._names_counter += 1
+        return f'{prefix}_{self._names_counter}'
+
+    def add_constant(self, value: np.ndarray) -> str:
+        name = self._create_name('const')
+        self.initializers.append(numpy_helper.from_array(value, name=name))
+        return name
+
+    def add_node(self, op_type: str, inputs: list, **attributes) -> str:
+        output = self._create_name(op_type.lower())
+        self.nodes.append(helper.make_node(op_type, inputs=inputs, outputs=[output], **attributes))
+        return output
+
+    def add_conv(self, x: str, in_channels: int, out_channels: int, kernel_size: int) -> str:
+        weights = self._rng.normal(0, 0.1, size=(out_channels, in_channels, kernel_size, kernel_size)).astype(np.float32)
+        bias = np.zeros(out_channels, dtype=np.float32)
+        return self.add_node('Conv', [x, self.add_constant(weights), self.add_constant(bias)],
+                             kernel_shape=[kernel_size, kernel_size], pads=[kernel_size // 2] * 4)
+
+
+def create_dummy_model(file_path: str,
+                       model_type: ModelType,
+                       number_of_channels: int = 3,
+                       input_size_px: int = 256,
+                       number_of_conv_layers: int = 2,
+                       conv_channels: int = 16,
+                       number_of_classes: int = 2,
+                       scale_factor: int = 2,
+                       resolution_cm_per_px: float = 10,
+                       seed: int = 0):
+    """ Create a tiny ONNX model (with random weights) of the given type, with the outputs expected by the plugin
+
+    Compute cost is controlled with `number_of_conv_layers` and `conv_channels`
+    (3x3 convolutions on the full tile resolution, cost ~ layers * channels^2 per pixel).
+
+    :param number_of_channels: number of model inputs (image channels)
+    :param input_size_px: width and height of the model input (tile size)
+    :param number_of_classes: number of output classes for segmentation and detection models
+    :param scale_factor: output size multiplier for superresolution models
+    :param resolution_cm_per_px: resolution saved in the model metadata
+    """
+    builder = _OnnxGraphBuilder(seed)
+    s = input_size_px
+
+    x = 'input'
+    x_channels = number_of_channels
+    for _ in range(number_of_conv_layers):
+        x = builder.add_node('Relu', [builder.add_conv(x, x_channels, conv_channels, kernel_size=3)])
+        x_channels = conv_channels
+
+    metadata = {'model_type': model_type.value, 'resolution': resolution_cm_per_px, 'tiles_overlap': 10}
+    if model_type == ModelType.SEGMENTATION:
+        output = builder.add_node('Softmax', [builder.add_conv(x, x_channels, number_of_classes, kernel_size=1)], axis=1)
+        output_shape = ['batch', number_of_classes, s, s]
+        metadata.update(seg_thresh=0.5, class_names={i: f'class_{i}' for i in range(number_of_classes)})
+    elif model_type == ModelType.REGRESSION:
+        output = builder.add_node('Sigmoid', [builder.add_conv(x, x_channels, 1, kernel_size=1)])
+        output_shape = ['batch', 1, s, s]
+    elif model_type == ModelType.SUPERRESOLUTION:
+        x = builder.add_node('Sigmoid', [builder.add_conv(x, x_channels, 3 * scale_factor ** 2, kernel_size=1)])
+        output = builder.add_node('DepthToSpace', [x], blocksize=scale_factor, mode='CRD')
+        output_shape = ['batch', 3, s * scale_factor, s * scale_factor]
+    elif model_type == ModelType.RECOGNITION:
+        output = builder.add_node('Flatten', [builder.add_node('GlobalAveragePool', [x])], axis=1)
+        output_shape = ['batch', x_channels]
+    elif model_type == ModelType.DETECTION:
+        # YOLOv5-like output (batch, candidates, [x, y, w, h, objectness, class probabilities...]),
+        # with a candidate in the center of each grid cell and objectness depending on the image
+        grid_size = s // DETECTOR_GRID_CELL_PX
+        number_of_candidates = grid_size ** 2
+        pooled = builder.add_node('AveragePool', [x], kernel_shape=[DETECTOR_GRID_CELL_PX] * 2,
+                                  strides=[DETECTOR_GRID_CELL_PX] * 2)
+
+        def to_candidates(y: str, channels: int) -> str:
+            """ (batch, channels, grid, grid) -> (batch, candidates, channels) """
+            y = builder.add_node('Reshape', [y, builder.add_constant(np.array([0, channels, -1], dtype=np.int64))])
+            return builder.add_node('Transpose', [y], perm=[0, 2, 1])
+
+        objectness = to_candidates(builder.add_node('Sigmoid', [builder.add_conv(pooled, x_channels, 1, kernel_size=1)]), 1)
+        classes = to_candidates(
+            builder.add_node('Softmax', [builder.add_conv(pooled, x_channels, number_of_classes, kernel_size=1)], axis=1),
+            number_of_classes)
+
+        cells_xy = (np.stack(np.meshgrid(np.arange(grid_size), np.arange(grid_size)), axis=-1).reshape(-1, 2) + 0.5) \
+            * DETECTOR_GRID_CELL_PX
+        boxes_xywh = np.concatenate([cells_xy, np.full_like(cells_xy, 1.5 * DETECTOR_GRID_CELL_PX)], axis=1)
+        boxes = builder.add_node('Add', [
+            builder.add_node('Mul', [objectness, builder.add_constant(np.zeros(1, dtype=np.float32))]),  # broadcast batch
+            builder.add_constant(boxes_xywh[None].astype(np.float32))])
+
+        output = builder.add_node('Concat', [boxes, objectness, classes], axis=2)
+        output_shape = ['batch', number_of_candidates, 5 + number_of_classes]
+        metadata.update(det_type='YOLO_v5_v7_DEFAULT', det_conf=0.5, det_iou_thresh=0.4,
+                        class_names={i: f'class_{i}' for i in range(number_of_classes)})
+    else:
+        raise Exception(f'Unsupported model type: {model_type}')
+
+    builder.nodes.append(helper.make_node('Identity', inputs=[output], outputs=['output']))
+    graph = helper.make_graph(
+        builder.nodes,
+        name=f'dummy_{model_type.value.lower()}',
+        inputs=[helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch', number_of_channels, s, s])],
+        outputs=[helper.make_tensor_value_info('output', TensorProto.FLOAT, output_shape)],
+        initializer=builder.initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', ONNX_OPSET)])
+
+    for key, value in metadata.items():
+        metadata_prop = model.metadata_props.add()
+        metadata_prop.key = key
+        metadata_prop.value = json.dumps(value)
+
+    onnx.checker.check_model(model)
+    onnx.save(model, file_path)
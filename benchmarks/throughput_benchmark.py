@@ -0,0 +1,330 @@
+"""
+End-to-end throughput benchmark - runs map processors of all model types (and the training data export) headless,
+on large synthetic rasters with tiny ONNX models of configurable compute cost, for combinations of processing
+parameters (overlap, batch size, local cache, processed area mask).
+
+Run from the repository root (CPU only, no network access needed):
+    PYTHONPATH=$PYTHONPATH:`pwd`/src:`pwd` python3 -m benchmarks.throughput_benchmark --megapixels 10 100
+
+Each configuration runs in a separate process, to measure its peak memory.
+Times are compared with the baseline saved on the same machine (see `--baseline`), exit code is 1 on regressions.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from qgis.core import QgsRasterLayer, QgsRectangle
+
+from benchmarks.benchmark_utils import (BASELINES_DIR, SCRIPT_DIR, BenchmarkResult, compare_with_baseline, create_report,
+                                        load_baseline, save_baseline)
+from benchmarks.synthetic_data import (create_dummy_model, create_mask_vlayer, create_synthetic_geotiff,
+                                       create_synthetic_xyz_tiles, get_xyz_resolution_cm_per_px)
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.common.processing_parameters.training_data_export_parameters import TrainingDataExportParameters
+from deepness.processing import processing_utils
+from deepness.processing.batch_processing.batch_job import (create_channels_mapping, create_processing_parameters,
+                                                          get_default_parameter_values)
+from deepness.processing.map_processor.map_processing_result import MapProcessingResultSuccess
+from deepness.processing.map_processor.map_processor import MapProcessor
+from deepness.processing.map_processor.map_processor_training_data_export import MapProcessorTrainingDataExport
+from deepness.processing.models.detector import Detector
+from deepness.processing.models.model_types import ModelDefinition, ModelType
+from test.test_utils import TEST_DATA_DIR, init_qgis
+
+DEFAULT_BASELINE_FILE_PATH = os.path.join(BASELINES_DIR, 'throughput_benchmark.json')
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'deepness_benchmark_data')
+
+TRAINING_DATA_EXPORT = 'TrainingDataExport'  # benchmarked as a processing type, next to the model types
+PROCESSING_TYPES = [model_type.value for model_type in ModelType] + [TRAINING_DATA_EXPORT]
+
+GEOTIFF_RESOLUTION_CM_PER_PX = 10
+RASTER_KINDS = {  # raster kind: (number of bands, whether bands are 16-bit), None for XYZ tiles (single ARGB32 band)
+    'rgb': (3, False),
+    'multispectral': (8, True),
+    'argb32': None,
+}
+RECOGNITION_QUERY_IMAGE_PATH = os.path.join(TEST_DATA_DIR, 'dummy_recognition_image.png')
+RESULT_LINE_PREFIX = 'BENCHMARK_RESULT:'  # to find the result in the output of the subprocess
+
+
+@dataclass
+class ThroughputConfiguration:
+    processing_type: str  # model type (value of `ModelType`) or `TRAINING_DATA_EXPORT`
+    raster_kind: str  # key of `RASTER_KINDS`
+    megapixels: int  # size of the (square) raster
+    overlap_percentage: float
+    batch_size: int
+    local_cache: bool
+    with_mask: bool  # whether only the area within a polygon (ellipse inscribed in the raster) is processed
+
+    def get_case_name(self) -> str:
+        """ Name of the configuration without the raster size, to show the scaling with the size """
+        name = f'{self.processing_type}/{self.raster_kind}/overlap_{self.overlap_percentage:g}%/batch_{self.batch_size}'
+        if self.local_cache:
+            name += '/local_cache'
+        if self.with_mask:
+            name += '/mask'
+        return name
+
+
+@dataclass
+class ModelCost:
+    """ Input size and compute cost of the dummy models, see `create_dummy_model` """
+
+    tile_size_px: int
+    number_of_conv_layers: int
+    conv_channels: int
+
+
+def prepare_raster(data_dir: str, raster_kind: str, megapixels: int) -> Tuple[QgsRasterLayer, QgsRectangle, float]:
+    """ Create the synthetic raster (once, it is reused between runs) and load it
+
+    :return: tuple (raster layer, extent of the generated image, resolution in cm per pixel)
+    """
+    size_px = int(math.sqrt(megapixels * 1e6))
+    raster_name = f'{raster_kind}_{megapixels}mp'
+
+    if RASTER_KINDS[raster_kind] is None:
+        uri, extent = create_synthetic_xyz_tiles(os.path.join(data_dir, raster_name), size_px)  # skips existing tiles
+        return QgsRasterLayer(uri, raster_name, 'wms'), extent, get_xyz_resolution_cm_per_px()
+
+    file_path = os.path.join(data_dir, f'{raster_name}.tif')
+    if not os.path.exists(file_path):
+        number_of_bands, is_uint16 = RASTER_KINDS[raster_kind]
+        tmp_file_path = os.path.join(data_dir, f'{raster_name}.tmp.tif')  # not to reuse a partially written file
+        create_synthetic_geotiff(tmp_file_path, size_px, number_of_bands, is_uint16=is_uint16,
+                                 resolution_m_per_px=GEOTIFF_RESOLUTION_CM_PER_PX / 100)
+        os.rename(tmp_file_path, file_path)
+    rlayer = QgsRasterLayer(file_path, raster_name)
+    return rlayer, rlayer.extent(), GEOTIFF_RESOLUTION_CM_PER_PX
+
+
+def get_number_of_model_inputs(raster_kind: str) -> int:
+    """ All bands of GeoTIFF rasters, RGB channels of the ARGB32 band """
+    return RASTER_KINDS[raster_kind][0] if RASTER_KINDS[raster_kind] is not None else 3
+
+
+def prepare_model_file(data_dir: str, model_type: ModelType, number_of_channels: int, model_cost: ModelCost) -> str:
+    """ Create the dummy model (once, it is reused between runs) and return its file path """
+    file_path = os.path.join(
+        data_dir, f'{model_type.value}_{number_of_channels}ch_{model_cost.tile_size_px}px_'
+                  f'{model_cost.number_of_conv_layers}x{model_cost.conv_channels}.onnx')
+    if not os.path.exists(file_path):
+        create_dummy_model(file_path, model_type,
+                           number_of_channels=number_of_channels,
+                           input_size_px=model_cost.tile_size_px,
+                           number_of_conv_layers=model_cost.number_of_conv_layers,
+                           conv_channels=model_cost.conv_channels)
+    return file_path
+
+
+def create_map_processor(configuration: ThroughputConfiguration,
+                         model_cost: ModelCost,
+                         data_dir: str,
+                         output_dir: str) -> MapProcessor:
+    """ Create the map processor for the configuration, with parameters created as in the batch processing """
+    rlayer, extent, resolution_cm_per_px = prepare_raster(data_dir, configuration.raster_kind, configuration.megapixels)
+    if not rlayer.isValid():
+        raise Exception(f"Invalid raster layer '{rlayer.source()}'!")
+
+    if RASTER_KINDS[configuration.raster_kind] is None:
+        # XYZ layer covers the whole world, so it is always processed only within the generated tiles
+        vlayer_mask = create_mask_vlayer(extent, rlayer.crs(), is_ellipse=configuration.with_mask)
+    elif configuration.with_mask:
+        vlayer_mask = create_mask_vlayer(extent, rlayer.crs(), is_ellipse=True)
+    else:
+        vlayer_mask = None
+
+    number_of_model_inputs = get_number_of_model_inputs(configuration.raster_kind)
+    job_values = dict(
+        resolution_cm_per_px=resolution_cm_per_px,
+        batch_size=configuration.batch_size,
+        local_cache=configuration.local_cache,
+        processing_overlap={'percentage': configuration.overlap_percentage},
+    )
+    runner_values = dict(
+        input_layer_id=rlayer.id(),
+        mask_layer_id=None,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER if vlayer_mask is None else ProcessedAreaType.FROM_POLYGONS,
+        input_channels_mapping=create_channels_mapping(
+            processing_utils.create_image_channels_for_rlayer(rlayer), number_of_model_inputs),
+    )
+
+    if configuration.processing_type == TRAINING_DATA_EXPORT:
+        params = create_processing_parameters(
+            parameters_class=TrainingDataExportParameters,
+            default_values=dict(tile_size_px=model_cost.tile_size_px),
+            job_values=job_values,
+            export_image_tiles=True,
+            segmentation_mask_layer_id=None,
+            output_directory_path=output_dir,
+            **runner_values)
+        return MapProcessorTrainingDataExport(rlayer=rlayer, vlayer_mask=vlayer_mask, map_canvas=None, params=params)
+
+    model_definition = ModelDefinition.get_definition_for_type(ModelType(configuration.processing_type))
+    model_file_path = prepare_model_file(data_dir, model_definition.model_type, number_of_model_inputs, model_cost)
+    model = model_definition.model_class(model_file_path)
+    model.check_loaded_model_outputs()
+
+    if model_definition.model_type == ModelType.DETECTION:
+        runner_values['output_file_path'] = os.path.join(output_dir, 'detections')
+    elif model_definition.model_type == ModelType.SUPERRESOLUTION:
+        job_values['scale_factor'] = 2  # as in `create_dummy_model`
+    elif model_definition.model_type == ModelType.RECOGNITION:
+        runner_values['query_image_path'] = RECOGNITION_QUERY_IMAGE_PATH
+        runner_values['embeddings_index_dir'] = output_dir
+
+    params = create_processing_parameters(
+        parameters_class=model_definition.parameters_class,
+        default_values=get_default_parameter_values(model),
+        job_values=job_values,
+        model=model,
+        **runner_values)
+    if isinstance(model, Detector):
+        model.set_model_type_param(params.detector_type)
+
+    return model_definition.map_processor_class(rlayer=rlayer, vlayer_mask=vlayer_mask, map_canvas=None, params=params)
+
+
+def run_configuration(configuration: ThroughputConfiguration, model_cost: ModelCost, data_dir: str) -> Dict[str, Any]:
+    """ Run the processing of the configuration in this process
+
+    :return: processing stats (see `ProcessingStats.to_dict`)
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        map_processor = create_map_processor(configuration, model_cost, data_dir, output_dir)
+        map_processor.run()  # synchronously, as in the batch processing
+
+        result = map_processor.get_processing_result()
+        if not isinstance(result, MapProcessingResultSuccess):
+            raise Exception(f'Processing of {configuration.get_case_name()} failed: {result.message}')
+
+        return map_processor.processing_stats.to_dict()
+
+
+def run_configuration_in_subprocess(configuration: ThroughputConfiguration,
+                                    model_cost: ModelCost,
+                                    data_dir: str) -> Dict[str, Any]:
+    """ Run the processing of the configuration in a new process, so that its peak memory is not affected
+    by the previous configurations (and by the data generation)
+    """
+    command = [sys.executable, '-m', 'benchmarks.throughput_benchmark',
+               '--data-dir', data_dir,
+               '--tile-size', str(model_cost.tile_size_px),
+               '--conv-layers', str(model_cost.number_of_conv_layers),
+               '--conv-channels', str(model_cost.conv_channels),
+               '--single-configuration', json.dumps(asdict(configuration))]
+    process = subprocess.run(command, cwd=os.path.dirname(SCRIPT_DIR), capture_output=True, text=True)
+
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_LINE_PREFIX):
+            return json.loads(line[len(RESULT_LINE_PREFIX):])
+    raise Exception(f'Processing of {configuration.get_case_name()} failed:\n{process.stdout}\n{process.stderr}')
+
+
+def create_configurations(args: argparse.Namespace) -> List[ThroughputConfiguration]:
+    configurations = []
+    for values in itertools.product(args.processing_types, args.raster_kinds, args.megapixels, args.overlaps,
+                                    args.batch_sizes, args.local_cache, args.mask):
+        configuration = ThroughputConfiguration(*values)
+        if configuration.processing_type == ModelType.RECOGNITION.value and configuration.local_cache:
+            continue  # tile embeddings are stored in the index, without the tiles cache
+        configurations.append(configuration)
+    return configurations
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() in ['1', 'true', 'yes']
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='End-to-end throughput benchmark of the map processing')
+    parser.add_argument('--processing-types', nargs='+', choices=PROCESSING_TYPES, default=PROCESSING_TYPES,
+                        help='Model types (and the training data export) to run (all by default)')
+    parser.add_argument('--raster-kinds', nargs='+', choices=list(RASTER_KINDS), default=list(RASTER_KINDS))
+    parser.add_argument('--megapixels', nargs='+', type=int, default=[10], help='Sizes of the rasters')
+    parser.add_argument('--overlaps', nargs='+', type=float, default=[10.0], help='Tiles overlap, in percent')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1])
+    parser.add_argument('--local-cache', nargs='+', type=_parse_bool, default=[False], help='e.g. `false true`')
+    parser.add_argument('--mask', nargs='+', type=_parse_bool, default=[False],
+                        help='Whether to process only the area within a polygon, e.g. `false true`')
+    parser.add_argument('--tile-size', type=int, default=256, help='Input size of the dummy models')
+    parser.add_argument('--conv-layers', type=int, default=2, help='Number of 3x3 convolutions in the dummy models')
+    parser.add_argument('--conv-channels', type=int, default=16, help='Channels of convolutions in the dummy models')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Directory for the generated rasters and models')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run all configurations in this process (e.g. for debugging), peak memory is not reliable')
+    parser.add_argument('--single-configuration', help=argparse.SUPPRESS)  # used to run a configuration in a subprocess
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE_PATH, help='Baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.3,
+                        help='Allowed ratio of time to the baseline time, before reporting a regression')
+    args = parser.parse_args(argv)
+
+    model_cost = ModelCost(args.tile_size, args.conv_layers, args.conv_channels)
+    os.makedirs(args.data_dir, exist_ok=True)
+    init_qgis()
+
+    if args.single_configuration is not None:
+        configuration = ThroughputConfiguration(**json.loads(args.single_configuration))
+        stats = run_configuration(configuration, model_cost, args.data_dir)
+        print(RESULT_LINE_PREFIX + json.dumps(stats))
+        return 0
+
+    configurations = create_configurations(args)
+    for configuration in configurations:  # generated before the measurements, to not include it in the time
+        rlayer, _, _ = prepare_raster(args.data_dir, configuration.raster_kind, configuration.megapixels)
+        if configuration.processing_type != TRAINING_DATA_EXPORT:
+            prepare_model_file(args.data_dir, ModelType(configuration.processing_type),
+                               get_number_of_model_inputs(configuration.raster_kind), model_cost)
+
+    results = []  # type: List[BenchmarkResult]
+    for i, configuration in enumerate(configurations):
+        print(f'[{i + 1}/{len(configurations)}] {configuration.get_case_name()}, {configuration.megapixels} MP')
+        if args.in_process:
+            stats = run_configuration(configuration, model_cost, args.data_dir)
+        else:
+            stats = run_configuration_in_subprocess(configuration, model_cost, args.data_dir)
+
+        print(f'    {stats["total_time_s"]:.1f} s, {stats["tiles_per_second"] or 0:.2f} tiles/s, ' +
+              ', '.join(f'{stage}: {values["time_s"]:.1f} s' for stage, values in stats['stages'].items()))
+        results.append(BenchmarkResult(
+            case_name=configuration.get_case_name(),
+            size=configuration.megapixels,
+            time_s=stats['total_time_s'],
+            peak_memory_bytes=stats['peak_rss_bytes'],
+        ))
+
+    print()
+    print(create_report(results, size_units={result.case_name: 'MP' for result in results}))
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f'\nBaseline saved to {args.baseline}')
+        return 0
+
+    try:
+        baseline_results = load_baseline(args.baseline)
+    except FileNotFoundError:
+        print(f'\nNo baseline in {args.baseline}, run with --save-baseline to create it')
+        return 0
+
+    regressions = compare_with_baseline(results, baseline_results, tolerance=args.tolerance)
+    if regressions:
+        print('\nRegressions compared to the baseline:\n    ' + '\n    '.join(regressions))
+        return 1
+
+    print('\nNo regressions compared to the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
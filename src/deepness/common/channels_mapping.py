@@ -17,6 +17,9 @@ class ImageChannel:
     def __init__(self, name):
         self.name = name
 
+    def __repr__(self):
+        return str(self)  # so that lists of channels have a deterministic representation
+
     def get_band_number(self):
         raise NotImplementedError('Base class not implemented!')
 
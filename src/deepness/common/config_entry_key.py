@@ -23,6 +23,9 @@ class ConfigEntryKey(enum.Enum):
     MODEL_BATCH_SIZE = enum.auto(), 1
     PROCESS_LOCAL_CACHE = enum.auto(), False
     PREPROCESSING_TILES_OVERLAP = enum.auto(), 15
+    TILES_CACHE_SIZE_MB = enum.auto(), 0  # 0 - cache disabled
+    LIVE_PREVIEW_ENABLED = enum.auto(), False
+    SKIP_EMPTY_TILES = enum.auto(), False
 
     SEGMENTATION_PROBABILITY_THRESHOLD_ENABLED = enum.auto(), True
     SEGMENTATION_PROBABILITY_THRESHOLD_VALUE = enum.auto(), 0.5
@@ -40,6 +43,9 @@ class ConfigEntryKey(enum.Enum):
     DATA_EXPORT_SEGMENTATION_MASK_ENABLED = enum.auto(), False
     DATA_EXPORT_SEGMENTATION_MASK_ID = enum.auto(), ''
 
+    PROCESSING_MAX_RUNNING_TASKS = enum.auto(), 1
+    PROCESSING_CPU_THREADS = enum.auto(), 0  # 0 - no limit
+
     INPUT_CHANNELS_MAPPING__ADVANCED_MODE = enum.auto, False
     INPUT_CHANNELS_MAPPING__MAPPING_LIST_STR = enum.auto, []
 
@@ -10,3 +10,9 @@ LOG_TAB_NAME = PLUGIN_NAME
 
 # enable some debugging options (e.g. printing exceptions) - set in terminal before running qgis
 IS_DEBUG = os.getenv("IS_DEBUG", 'False').lower() in ('true', '1', 't')
+
+# directory to save JSON files with time of processing stages of each run (see ProcessingStats). Not saved if not set
+PROCESSING_STATS_DIR = os.getenv("DEEPNESS_PROCESSING_STATS_DIR")
+
+# memory budget of a single processing, in MB (see memory_budget.py). A fraction of the available RAM if not set
+MEMORY_BUDGET_MB = os.getenv("DEEPNESS_MEMORY_BUDGET_MB")
@@ -1,7 +1,8 @@
 import enum
 from dataclasses import dataclass
+from typing import Optional
 
-from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters
+from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters, ResultsReuseParameters
 from deepness.processing.models.model_base import ModelBase
 
 
@@ -56,10 +57,36 @@ class DetectorType(enum.Enum):
         return [x.value for x in DetectorType]
 
 
+class DetectionOutputFormat(enum.Enum):
+    """ Format of the file in which detections are saved """
+
+    GEOPACKAGE = 'GeoPackage'
+    FLATGEOBUF = 'FlatGeobuf'
+
+    def get_driver_name(self) -> str:
+        if self == DetectionOutputFormat.GEOPACKAGE:
+            return 'GPKG'
+        elif self == DetectionOutputFormat.FLATGEOBUF:
+            return 'FlatGeobuf'
+        else:
+            raise ValueError(f'Unknown detection output format: {self}')
+
+    def get_file_extension(self) -> str:
+        if self == DetectionOutputFormat.GEOPACKAGE:
+            return 'gpkg'
+        elif self == DetectionOutputFormat.FLATGEOBUF:
+            return 'fgb'
+        else:
+            raise ValueError(f'Unknown detection output format: {self}')
+
+    def get_all_display_values():
+        return [x.value for x in DetectionOutputFormat]
+
+
 @dataclass
-class DetectionParameters(MapProcessingParameters):
+class _DetectionModelParameters(MapProcessingParameters):
     """
-    Parameters for Inference of detection model (including pre/post-processing) obtained from UI.
+    Required parameters for Inference of detection model, before the ones with default values
     """
 
     model: ModelBase  # wrapper of the loaded model
@@ -67,4 +94,34 @@ class DetectionParameters(MapProcessingParameters):
     confidence: float
     iou_threshold: float
 
+
+@dataclass
+class DetectionParameters(ResultsReuseParameters, _DetectionModelParameters):
+    """
+    Parameters for Inference of detection model (including pre/post-processing) obtained from UI.
+
+    Raw outputs store keeps the candidates before NMS, it cannot be used with the cascaded detection.
+    """
+
     detector_type: DetectorType = DetectorType.YOLO_v5_v7_DEFAULT  # parameters specific for each model type
+
+    output_format: DetectionOutputFormat = DetectionOutputFormat.GEOPACKAGE  # format of the file with detections
+    output_file_path: Optional[str] = None  # file to save the detections in (without extension). Temporary file if None
+
+    # Cascaded (coarse-to-fine) detection, for sparse objects. First pass is done at a lower resolution, and only tiles
+    # close to the objects found there are processed at the full resolution. Single-pass detection if resolution is None
+    cascade_resolution_cm_per_px: Optional[float] = None  # resolution of the first (coarse) pass
+    cascade_model: Optional[ModelBase] = None  # model for the coarse pass (e.g. a smaller one). The same model if None
+    cascade_confidence: Optional[float] = None  # confidence for the coarse pass (usually lower). `confidence` if None
+    cascade_margin_px: int = 32  # margin around objects from the coarse pass (in full resolution pixels)
+
+    raw_outputs_min_confidence: float = 0.05  # lower confidence candidates are not stored (again if `confidence` is lower)
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.raw_outputs_dir_path is not None and self.is_cascade_enabled:
+            raise Exception("Raw outputs store cannot be used with the cascaded detection! Please disable one of them")
+
+    @property
+    def is_cascade_enabled(self) -> bool:
+        return self.cascade_resolution_cm_per_px is not None
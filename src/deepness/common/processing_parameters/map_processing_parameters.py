@@ -54,3 +54,46 @@ class MapProcessingParameters:
     @property
     def processing_stride_px(self):
         return self.tile_size_px - self.processing_overlap_px
+
+
+@dataclass
+class ResultsReuseParameters:
+    """
+    Options for reusing results of tiles between runs, and for skipping tiles, in segmentation and detection.
+    Options are disabled if None (or 0, or False).
+
+    Checkpoints, incremental processing, tiles results cache and raw outputs store keep the results of tiles
+    in different ways, so only one of them can be enabled (see `check_results_reuse_options`). Incremental processing
+    does not need checkpoints, as an interrupted run can be continued by running it again.
+    Checkpoints, incremental processing and raw outputs store are only in batch processing (not set in the plugin GUI).
+
+    It is a base class placed before the parameters with required fields (e.g. `SegmentationParameters`),
+    so that these fields with default values follow the required ones.
+    """
+
+    checkpoint_dir_path: Optional[str] = None  # checkpoints, to resume interrupted processing
+    incremental_dir_path: Optional[str] = None  # results of previous runs, to process only tiles with changed input
+    tiles_cache_size_mb: int = 0  # in-memory cache of tile results (e.g. while panning the map), with a global tiles grid
+    raw_outputs_dir_path: Optional[str] = None  # raw outputs of all tiles, to repeat post-processing without the model
+    skip_empty_tiles: bool = False  # do not run the model on tiles with only nodata or a single value
+
+    def __post_init__(self):
+        check_results_reuse_options(self)
+
+
+def check_results_reuse_options(params: ResultsReuseParameters):
+    """
+    Check that only one of the options reusing results of tiles is enabled, see `ResultsReuseParameters`
+
+    :param params: processing parameters with the options (e.g. `SegmentationParameters`)
+    :raises Exception: if more than one option is enabled
+    """
+    enabled_options = [name for name, is_enabled in [
+        ('checkpoints', params.checkpoint_dir_path is not None),
+        ('incremental processing', params.incremental_dir_path is not None),
+        ('tiles results cache', params.tiles_cache_size_mb > 0),
+        ('raw outputs store', params.raw_outputs_dir_path is not None),
+    ] if is_enabled]
+
+    if len(enabled_options) > 1:
+        raise Exception(f"Options {', '.join(enabled_options)} cannot be used together! Please enable only one of them")
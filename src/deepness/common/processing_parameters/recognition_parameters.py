@@ -1,6 +1,6 @@
 import enum
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 from deepness.common.processing_parameters.map_processing_parameters import \
     MapProcessingParameters
@@ -15,3 +15,16 @@ class RecognitionParameters(MapProcessingParameters):
 
     query_image_path: str  # path to query image
     model: ModelBase  # wrapper of the loaded model
+
+    # more query images to search for, using the same tile embeddings (one result layer for each query image)
+    additional_query_image_paths: List[str] = field(default_factory=list)
+    # directory for indexes of tile embeddings, reused for next queries on the same map. Temporary directory if None
+    embeddings_index_dir: Optional[str] = None
+
+    # if set, only the k best matching tiles are found for each query image (and returned as a layer with tile outlines)
+    top_k: Optional[int] = None
+    heatmap_with_top_k: bool = False  # whether to create also the similarity heatmap in the top-k mode
+
+    @property
+    def all_query_image_paths(self) -> List[str]:
+        return [self.query_image_path] + list(self.additional_query_image_paths)
@@ -12,3 +12,5 @@ class RegressionParameters(MapProcessingParameters):
 
     output_scaling: float  # scaling factor for the model output (keep 1 if maximum model output value is 1)
     model: ModelBase  # wrapper of the loaded model
+
+    skip_empty_tiles: bool = False  # do not run the model on tiles with only nodata or a single value (e.g. margins of a mosaic)
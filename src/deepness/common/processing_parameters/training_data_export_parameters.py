@@ -1,9 +1,21 @@
+import enum
 from dataclasses import dataclass
 from typing import Optional
 
 from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters
 
 
+class TrainingDataExportFormat(enum.Enum):
+    """ Format in which the exported tiles are saved """
+
+    PNG_FILES = 'PNG files'  # one file for each tile
+    TAR_SHARDS = 'TAR shards'  # PNG files packed into tar archives, with an index file
+    NPZ_SHARDS = 'NPZ shards'  # raw arrays packed into compressed numpy archives, with an index file
+
+    def get_all_display_values():
+        return [x.value for x in TrainingDataExportFormat]
+
+
 @dataclass
 class TrainingDataExportParameters(MapProcessingParameters):
     """
@@ -13,3 +25,14 @@ class TrainingDataExportParameters(MapProcessingParameters):
     export_image_tiles: bool  # whether to export input image tiles
     segmentation_mask_layer_id: Optional[str]  # id for mask, to be exported as separate tiles
     output_directory_path: str  # path where the output files will be saved
+
+    output_format: TrainingDataExportFormat = TrainingDataExportFormat.PNG_FILES
+    png_compression_level: int = 3  # 0-9, higher values give smaller files, but are slower
+    tiles_per_shard: int = 1000  # number of files in one shard, for sharded formats
+    number_of_workers: Optional[int] = None  # number of threads encoding the tiles. Number of CPUs if None
+
+    # filtering of the exported tiles, to export only useful ones
+    min_area_coverage: float = 0.0  # minimum fraction of the tile within the processed area (0-1)
+    min_labelled_fraction: float = 0.0  # minimum fraction of the tile covered by the segmentation mask (0-1)
+    skip_empty_tiles: bool = False  # whether to skip tiles with only nodata or a single value (see `is_tile_empty`)
+    min_valid_pixels_fraction: float = 0.0  # with `skip_empty_tiles`, minimum fraction of the tile which is not nodata (0-1)
@@ -12,6 +12,9 @@ class TempFilesHandler:
     def get_results_img_path(self):
         return path.join(self._temp_dir, 'results.dat')
 
+    def get_results_chunks_dir_path(self):
+        return path.join(self._temp_dir, 'results_chunks')
+
     def get_area_mask_img_path(self):
         return path.join(self._temp_dir, 'area_mask.dat')
 
@@ -7,10 +7,11 @@ Skeleton of this file was generate with the QGis plugin to create plugin skeleto
 
 import logging
 import traceback
+from typing import Optional, Tuple
 
-from qgis.core import Qgis, QgsApplication, QgsProject, QgsVectorLayer
+from qgis.core import Qgis, QgsLayerTreeGroup, QgsProject, QgsVectorLayer
 from qgis.gui import QgisInterface
-from qgis.PyQt.QtCore import QCoreApplication, Qt
+from qgis.PyQt.QtCore import QCoreApplication, Qt, QTimer
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QMessageBox
 
@@ -24,10 +25,15 @@ from deepness.images.get_image_path import get_icon_path
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultCanceled,
                                                                      MapProcessingResultFailed,
                                                                      MapProcessingResultSuccess)
+from deepness.processing.map_processor.map_processor import MapProcessor
 from deepness.processing.map_processor.map_processor_training_data_export import MapProcessorTrainingDataExport
+from deepness.processing.processing_scheduler import ProcessingJob, ProcessingScheduler
 
 cv2 = LazyPackageLoader('cv2')
 
+LIVE_PREVIEW_DELAY_MS = 700  # time after the last change of the map canvas extent, before the live preview is updated
+LIVE_PREVIEW_LAYERS_GROUP_NAME = 'live_preview'
+
 
 class Deepness:
     """ QGIS Plugin Implementation - main class of the plugin.
@@ -52,7 +58,15 @@ class Deepness:
 
         self.pluginIsActive = False
         self.dockwidget = None
-        self._map_processor = None
+        self._processing_scheduler = ProcessingScheduler()  # runs the processing tasks, possibly a few at the same time
+
+        # live preview - processing of the visible part is repeated when the map canvas extent changes
+        self._live_preview_params = None  # type: Optional[MapProcessingParameters]
+        self._live_preview_job = None  # type: Optional[ProcessingJob]
+        self._live_preview_timer = QTimer()  # to process only the final extent, when the map is panned or zoomed
+        self._live_preview_timer.setSingleShot(True)
+        self._live_preview_timer.setInterval(LIVE_PREVIEW_DELAY_MS)
+        self._live_preview_timer.timeout.connect(self._run_live_preview)
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -160,6 +174,7 @@ class Deepness:
 
         # disconnects
         self.dockwidget.closingPlugin.disconnect(self.onClosePlugin)
+        self._live_preview_params = None
 
         # remove this statement if dockwidget is to remain
         # for reuse if plugin is reopened
@@ -195,9 +210,11 @@ class Deepness:
             if self.dockwidget is None:
                 # Create the dockwidget (after translation) and keep reference
                 self.dockwidget = DeepnessDockWidget(self.iface)
+                self.dockwidget.set_processing_scheduler(self._processing_scheduler)
                 self._layers_changed(None)
                 QgsProject.instance().layersAdded.connect(self._layers_changed)
                 QgsProject.instance().layersRemoved.connect(self._layers_changed)
+                self.iface.mapCanvas().extentsChanged.connect(self._map_canvas_extents_changed)
 
             # connect to provide cleanup on closing of dockwidget
             self.dockwidget.closingPlugin.connect(self.onClosePlugin)
@@ -208,11 +225,6 @@ class Deepness:
             self.dockwidget.show()
 
     def _are_map_processing_parameters_are_correct(self, params: MapProcessingParameters):
-        if self._map_processor and self._map_processor.is_busy():
-            msg = "Error! Processing already in progress! Please wait or cancel previous task."
-            self.iface.messageBar().pushMessage(PLUGIN_NAME, msg, level=Qgis.Critical, duration=7)
-            return False
-
         rlayer = QgsProject.instance().mapLayers()[params.input_layer_id]
         if rlayer is None:
             msg = "Error! Please select the layer to process first!"
@@ -227,7 +239,10 @@ class Deepness:
         return True
 
     def _display_processing_started_info(self):
-        msg = "Processing in progress... Cool! It's tea time!"
+        if self._processing_scheduler.get_running_jobs():
+            msg = "Processing added to the queue... Cool! It's tea time!"
+        else:
+            msg = "Processing in progress... Cool! It's tea time!"
         self.iface.messageBar().pushMessage(PLUGIN_NAME, msg, level=Qgis.Info, duration=2)
 
     def _run_training_data_export(self, training_data_export_parameters: TrainingDataExportParameters):
@@ -240,22 +255,33 @@ class Deepness:
         if training_data_export_parameters.processed_area_type == ProcessedAreaType.FROM_POLYGONS:
             vlayer = QgsProject.instance().mapLayers()[training_data_export_parameters.mask_layer_id]
 
-        self._map_processor = MapProcessorTrainingDataExport(
+        map_processor = MapProcessorTrainingDataExport(
             rlayer=rlayer,
             vlayer_mask=vlayer,  # layer with masks
             map_canvas=self.iface.mapCanvas(),
             params=training_data_export_parameters)
-        self._map_processor.finished_signal.connect(self._map_processor_finished)
-        self._map_processor.show_img_signal.connect(self._show_img)
-        QgsApplication.taskManager().addTask(self._map_processor)
-        self._display_processing_started_info()
+        self._add_processing_job(map_processor, name=f'Training data export: {rlayer.name()}')
 
     def _run_model_inference(self, params: MapProcessingParameters):
-        from deepness.processing.models.model_types import ModelDefinition  # import here to avoid pulling external dependencies to early
-
         if not self._are_map_processing_parameters_are_correct(params):
             return
 
+        if self.dockwidget.is_live_preview_enabled():
+            self._live_preview_params = params
+            self._run_live_preview()
+            return
+
+        self._live_preview_params = None
+        map_processor, name = self._create_model_map_processor(params)
+        self._add_processing_job(map_processor, name=name)
+
+    def _create_model_map_processor(self, params: MapProcessingParameters) -> Tuple[MapProcessor, str]:
+        """ Create the map processor for the model inference
+
+        :return: tuple (map processor, name of the processing job)
+        """
+        from deepness.processing.models.model_types import ModelDefinition  # import here to avoid pulling external dependencies to early
+
         vlayer = None
 
         rlayer = QgsProject.instance().mapLayers()[params.input_layer_id]
@@ -265,15 +291,74 @@ class Deepness:
         model_definition = ModelDefinition.get_definition_for_params(params)
         map_processor_class = model_definition.map_processor_class
 
-        self._map_processor = map_processor_class(
+        map_processor = map_processor_class(
             rlayer=rlayer,
             vlayer_mask=vlayer,
             map_canvas=self.iface.mapCanvas(),
             params=params)
-        self._map_processor.finished_signal.connect(self._map_processor_finished)
-        self._map_processor.show_img_signal.connect(self._show_img)
-        QgsApplication.taskManager().addTask(self._map_processor)
+        return map_processor, f'{model_definition.model_type.value}: {rlayer.name()}'
+
+    def _map_canvas_extents_changed(self):
+        if self._live_preview_params is None:
+            return
+        if not self.dockwidget.is_live_preview_enabled():
+            self._live_preview_params = None  # disabled in the UI
+            return
+
+        self._live_preview_timer.start()  # restarted with every change
+
+    def _run_live_preview(self):
+        """ Process the currently visible part with the live preview parameters. The previous live preview
+        processing is canceled, if not finished yet - results of its processed tiles are kept in the tiles cache
+        """
+        if self._live_preview_params is None:
+            return
+
+        if self._live_preview_job is not None and not self._live_preview_job.is_done():
+            self._processing_scheduler.cancel_job(self._live_preview_job.job_id)
+
+        map_processor, name = self._create_model_map_processor(self._live_preview_params)
+        if not map_processor.memory_plan.is_feasible():
+            msg = f'Error! Live preview refused: {map_processor.memory_plan.create_message()}'
+            self.iface.messageBar().pushMessage(PLUGIN_NAME, msg, level=Qgis.Critical, duration=14)
+            return
+
+        map_processor.finished_signal.connect(lambda result: self._live_preview_finished(map_processor, result))
+        self._live_preview_job = self._processing_scheduler.add_job(map_processor, name=f'Live preview - {name}')
+
+    def _live_preview_finished(self, map_processor: MapProcessor, result: MapProcessingResult):
+        """ Slot for finished live preview processing - its layers replace the layers of the previous one,
+        without showing the result message
+        """
+        if isinstance(result, MapProcessingResultFailed):
+            msg = f'Error! Live preview processing error: "{result.message}"!'
+            self.iface.messageBar().pushMessage(PLUGIN_NAME, msg, level=Qgis.Critical, duration=14)
+        if not isinstance(result, MapProcessingResultSuccess):
+            return
+
+        # groups with layers of the results were just added by the processor (in `MapProcessor.finished`)
+        groups = map_processor.get_created_layers_groups()
+        root = QgsProject.instance().layerTreeRoot()
+        for previous_group in root.children():
+            if isinstance(previous_group, QgsLayerTreeGroup) and previous_group.name() == LIVE_PREVIEW_LAYERS_GROUP_NAME \
+                    and previous_group not in groups:
+                QgsProject.instance().removeMapLayers(previous_group.findLayerIds())
+                root.removeChildNode(previous_group)
+
+        for group in groups:
+            group.setName(LIVE_PREVIEW_LAYERS_GROUP_NAME)
+
+    def _add_processing_job(self, map_processor: MapProcessor, name: str):
+        """ Queue the processing, unless it would not fit in memory (then it is refused before starting) """
+        if not map_processor.memory_plan.is_feasible():
+            msg = f'Error! Processing refused: {map_processor.memory_plan.create_message()}'
+            self.iface.messageBar().pushMessage(PLUGIN_NAME, msg, level=Qgis.Critical, duration=14)
+            return
+
+        map_processor.finished_signal.connect(self._map_processor_finished)
+        map_processor.show_img_signal.connect(self._show_img)
         self._display_processing_started_info()
+        self._processing_scheduler.add_job(map_processor, name=name)
 
     @staticmethod
     def _show_img(img_rgb, window_name: str):
@@ -313,5 +398,3 @@ class Deepness:
             msgBox.setText(message_to_show)
             msgBox.setStyleSheet("QLabel{min-width:800 px; font-size: 24px;} QPushButton{ width:250px; font-size: 18px; }")
             msgBox.exec()
-
-        self._map_processor = None
@@ -25,6 +25,7 @@ from deepness.common.processing_parameters.superresolution_parameters import Sup
 from deepness.common.processing_parameters.training_data_export_parameters import TrainingDataExportParameters
 from deepness.processing.models.model_base import ModelBase
 from deepness.widgets.input_channels_mapping.input_channels_mapping_widget import InputChannelsMappingWidget
+from deepness.widgets.processing_queue_widget.processing_queue_widget import ProcessingQueueWidget
 from deepness.widgets.training_data_export_widget.training_data_export_widget import TrainingDataExportWidget
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -52,11 +53,16 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self._input_channels_mapping_widget = InputChannelsMappingWidget(self)  # mapping of model and input ortophoto channels
         self._training_data_export_widget = TrainingDataExportWidget(self)  # widget with UI for data export tool
+        self._processing_queue_widget = ProcessingQueueWidget(self)  # queue of the started processing tasks
 
         self._create_connections()
         self._setup_misc_ui()
         self._load_ui_from_config()
 
+    def set_processing_scheduler(self, processing_scheduler):
+        """ Set the scheduler of processing tasks, to show its queue """
+        self._processing_queue_widget.set_processing_scheduler(processing_scheduler)
+
     def _show_debug_warning(self):
         """ Show label with warning if we are running debug mode """
         self.label_debugModeWarning.setVisible(IS_DEBUG)
@@ -79,6 +85,7 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
             self._input_channels_mapping_widget.load_ui_from_config()
             self._training_data_export_widget.load_ui_from_config()
+            self._processing_queue_widget.load_ui_from_config()
 
             # NOTE: load the model after setting the model_type above
             model_file_path = ConfigEntryKey.MODEL_FILE_PATH.get()
@@ -91,6 +98,9 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             self.spinBox_batchSize.setValue(ConfigEntryKey.MODEL_BATCH_SIZE.get())
             self.checkBox_local_cache.setChecked(ConfigEntryKey.PROCESS_LOCAL_CACHE.get())
             self.spinBox_processingTileOverlapPercentage.setValue(ConfigEntryKey.PREPROCESSING_TILES_OVERLAP.get())
+            self.spinBox_tilesCacheSize_mb.setValue(ConfigEntryKey.TILES_CACHE_SIZE_MB.get())
+            self.checkBox_livePreview.setChecked(ConfigEntryKey.LIVE_PREVIEW_ENABLED.get())
+            self.checkBox_skipEmptyTiles.setChecked(ConfigEntryKey.SKIP_EMPTY_TILES.get())
 
             self.doubleSpinBox_probabilityThreshold.setValue(
                 ConfigEntryKey.SEGMENTATION_PROBABILITY_THRESHOLD_VALUE.get())
@@ -123,6 +133,9 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         ConfigEntryKey.MODEL_BATCH_SIZE.set(self.spinBox_batchSize.value())
         ConfigEntryKey.PROCESS_LOCAL_CACHE.set(self.checkBox_local_cache.isChecked())
         ConfigEntryKey.PREPROCESSING_TILES_OVERLAP.set(self.spinBox_processingTileOverlapPercentage.value())
+        ConfigEntryKey.TILES_CACHE_SIZE_MB.set(self.spinBox_tilesCacheSize_mb.value())
+        ConfigEntryKey.LIVE_PREVIEW_ENABLED.set(self.checkBox_livePreview.isChecked())
+        ConfigEntryKey.SKIP_EMPTY_TILES.set(self.checkBox_skipEmptyTiles.isChecked())
 
         ConfigEntryKey.SEGMENTATION_PROBABILITY_THRESHOLD_ENABLED.set(
             self.checkBox_pixelClassEnableThreshold.isChecked())
@@ -139,6 +152,7 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self._input_channels_mapping_widget.save_ui_to_config()
         self._training_data_export_widget.save_ui_to_config()
+        self._processing_queue_widget.save_ui_to_config()
 
     def _rlayer_updated(self):
         self._input_channels_mapping_widget.set_rlayer(self._get_input_layer())
@@ -156,6 +170,7 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.verticalLayout_inputChannelsMapping.addWidget(self._input_channels_mapping_widget)
         self.verticalLayout_trainingDataExport.addWidget(self._training_data_export_widget)
+        self.verticalLayout.insertWidget(0, self._processing_queue_widget)  # above the 'Run' button
 
         self.mMapLayerComboBox_inputLayer.setFilters(QgsMapLayerProxyModel.RasterLayer)
         self.mMapLayerComboBox_areaMaskLayer.setFilters(QgsMapLayerProxyModel.VectorLayer)
@@ -177,6 +192,11 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         show_mask_combobox = (self.get_selected_processed_area_type() == ProcessedAreaType.FROM_POLYGONS)
         self.mMapLayerComboBox_areaMaskLayer.setVisible(show_mask_combobox)
         self.label_areaMaskLayer.setVisible(show_mask_combobox)
+        self.checkBox_livePreview.setEnabled(self.get_selected_processed_area_type() == ProcessedAreaType.VISIBLE_PART)
+
+    def is_live_preview_enabled(self) -> bool:
+        """ Whether processing of the visible part should be repeated when the map canvas extent changes """
+        return self.checkBox_livePreview.isEnabled() and self.checkBox_livePreview.isChecked()
 
     def get_selected_processed_area_type(self) -> ProcessedAreaType:
         combobox = self.comboBox_processedAreaSelection  # type: QComboBox
@@ -499,6 +519,8 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             postprocessing_dilate_erode_size=postprocessing_dilate_erode_size,
             pixel_classification__probability_threshold=self._get_pixel_classification_threshold(),
             model=self._model,
+            tiles_cache_size_mb=self.spinBox_tilesCacheSize_mb.value(),
+            skip_empty_tiles=self.checkBox_skipEmptyTiles.isChecked(),
         )
         return params
 
@@ -535,6 +557,8 @@ class DeepnessDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             iou_threshold=self.doubleSpinBox_iouScore.value(),
             model=self._model,
             detector_type=DetectorType(self.comboBox_detectorType.currentText()),
+            tiles_cache_size_mb=self.spinBox_tilesCacheSize_mb.value(),
+            skip_empty_tiles=self.checkBox_skipEmptyTiles.isChecked(),
         )
 
         return params
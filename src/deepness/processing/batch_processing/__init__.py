@@ -0,0 +1,7 @@
+""" Headless (batch) processing of raster files, without the plugin GUI.
+
+Usage:
+    python -m deepness.processing.batch_processing job.json
+
+See `batch_job.BatchJob` for the description of the job file.
+"""
@@ -0,0 +1,33 @@
+""" Entry point of the batch processing, see `deepness.processing.batch_processing` """
+
+import argparse
+import logging
+import sys
+
+from qgis.core import QgsApplication
+
+from deepness.processing.batch_processing.batch_job import BatchJob
+from deepness.processing.batch_processing.batch_runner import BatchRunner
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Process raster files with a model, without the QGIS GUI')
+    parser.add_argument('job_file_path', help='JSON or YAML file with the job definition (see `BatchJob`)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    job = BatchJob.from_file(args.job_file_path)
+
+    # QGIS installation path is taken from the QGIS_PREFIX_PATH environment variable
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    try:
+        all_succeeded = BatchRunner(job).run()
+    finally:
+        qgs.exitQgis()
+
+    return 0 if all_succeeded else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
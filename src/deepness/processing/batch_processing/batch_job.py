@@ -0,0 +1,312 @@
+""" This file implements the definition of a batch processing job, read from a JSON (or YAML) job file """
+
+import dataclasses
+import enum
+import glob
+import importlib.util
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from deepness.common.channels_mapping import ChannelsMapping, ImageChannel
+from deepness.common.lazy_package_loader import LazyPackageLoader
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.processing.models.model_base import ModelBase
+from deepness.processing.raster_mosaic import find_raster_files
+
+yaml = LazyPackageLoader('yaml')
+
+# parameters set for each raster by the batch runner, they cannot be specified in the job file
+RUNNER_PARAMETERS = ['model', 'input_layer_id', 'mask_layer_id', 'processed_area_type', 'output_file_path']
+
+
+@dataclass
+class BatchJob:
+    """
+    Batch processing job - a queue of raster files processed with one model (or a few models, reading each tile once)
+    and the same parameters.
+
+    Example of a JSON job file. Relative paths are relative to the job file directory:
+
+        {
+          "model_file_path": "models/trees.onnx",
+          "model_type": "Segmentor",
+          "output_dir_path": "results",
+          "rasters": ["orthophotos/*.tif"],
+          "mask_file_path": "area.gpkg",
+          "mosaic_name": "survey",
+          "parameters": {
+            "resolution_cm_per_px": 5,
+            "batch_size": 4,
+            "processing_overlap": {"percentage": 15},
+            "input_channels_mapping": [0, 1, 2],
+            "checkpoint_dir_path": "/data/checkpoints"
+          },
+          "additional_models": [
+            {"model_file_path": "models/heights.onnx", "model_type": "Regressor",
+             "parameters": {"resolution_cm_per_px": 5, "processing_overlap": {"percentage": 15}}}
+          ]
+        }
+
+    Keys:
+     - model_type - value of `ModelType`, optional (taken from the model metadata if not specified),
+     - rasters - raster files, glob patterns or directories (with raster files of `raster_mosaic.RASTER_FILE_EXTENSIONS`),
+     - mask_file_path - optional, only the area within the polygons is processed,
+     - mosaic_name - optional, all rasters are processed as one mosaic, with results in one output,
+     - parameters - fields of the parameters class of the model type, e.g. `SegmentationParameters`. Processing overlap
+       is given as {"percentage": float} or {"overlap_px": int}, input channels mapping as the image channel (counted
+       from 0) for each model input. Options only in batch processing: checkpoint_dir_path, incremental_dir_path
+       or raw_outputs_dir_path (one of them),
+     - additional_models - optional, processed in the same pass, reading each tile once (see `MapProcessorMultiModel`).
+       They need the same tiles grid (resolution, tile size and overlap).
+
+    The same keys can be given in a YAML file (.yaml or .yml), if PyYAML is installed.
+    Parameters not specified in the job file are taken from the model metadata (as in the plugin GUI).
+    """
+
+    model_file_path: str
+    raster_file_paths: List[str]
+    output_dir_path: str
+    model_type: Optional[str] = None  # value of `ModelType`. Taken from the model metadata if None
+    mask_file_path: Optional[str] = None  # vector file with polygons of the processed area. Entire rasters if None
+    parameters: Dict[str, Any] = field(default_factory=dict)  # values of the processing parameters
+    mosaic_name: Optional[str] = None  # name of the mosaic of all rasters (see `raster_mosaic`). Rasters processed separately if None
+    additional_models: List['BatchJobModel'] = field(default_factory=list)  # models processed with the same tiles
+
+    def get_models(self) -> List['BatchJobModel']:
+        """ Main model and additional models of the job """
+        main_model = BatchJobModel(
+            model_file_path=self.model_file_path, model_type=self.model_type, parameters=self.parameters)
+        return [main_model] + self.additional_models
+
+    @classmethod
+    def from_file(cls, file_path: str) -> 'BatchJob':
+        """ Load the job from a JSON or YAML file (YAML needs PyYAML, which is not a requirement of the plugin) """
+        is_yaml = os.path.splitext(file_path)[1].lower() in ['.yaml', '.yml']
+        if is_yaml and importlib.util.find_spec('yaml') is None:
+            raise Exception(f"PyYAML is required to read the YAML job file '{file_path}'! "
+                            f"Please install it ('pip install pyyaml') or use a JSON job file")
+
+        with open(file_path) as f:
+            if is_yaml:
+                values = yaml.safe_load(f)
+            else:
+                values = json.load(f)
+        return cls.from_dict(values, base_dir_path=os.path.dirname(os.path.abspath(file_path)))
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any], base_dir_path: str = '') -> 'BatchJob':
+        """ Create the job from the values of a job file
+
+        :param values: values read from the job file
+        :param base_dir_path: directory for relative paths in the job file
+        """
+        unknown_keys = set(values) - {'model_file_path', 'rasters', 'output_dir_path', 'model_type', 'mask_file_path',
+                                      'parameters', 'mosaic_name', 'additional_models'}
+        if unknown_keys:
+            raise Exception(f"Unknown keys in the job file: {sorted(unknown_keys)}")
+        for key in ['model_file_path', 'rasters', 'output_dir_path']:
+            if key not in values:
+                raise Exception(f"Missing '{key}' in the job file!")
+
+        def get_path(path: str) -> str:
+            return os.path.join(base_dir_path, os.path.expanduser(path))
+
+        raster_file_paths = []
+        for raster in values['rasters']:
+            raster_file_path = get_path(raster)
+            if glob.has_magic(raster_file_path):
+                raster_file_paths += sorted(glob.glob(raster_file_path))
+            elif os.path.isdir(raster_file_path):
+                raster_file_paths += find_raster_files(raster_file_path)
+            else:
+                raster_file_paths.append(raster_file_path)
+        if not raster_file_paths:
+            raise Exception("No raster files to process in the job file!")
+        raster_file_paths = list(dict.fromkeys(os.path.normpath(path) for path in raster_file_paths))  # matched twice
+
+        additional_models = []
+        for model_values in values.get('additional_models') or []:
+            unknown_keys = set(model_values) - {'model_file_path', 'model_type', 'parameters'}
+            if unknown_keys:
+                raise Exception(f"Unknown keys of the additional model in the job file: {sorted(unknown_keys)}")
+            if 'model_file_path' not in model_values:
+                raise Exception("Missing 'model_file_path' of the additional model in the job file!")
+            additional_models.append(BatchJobModel(
+                model_file_path=get_path(model_values['model_file_path']),
+                model_type=model_values.get('model_type'),
+                parameters=get_job_parameters(model_values)))
+
+        job = cls(
+            model_file_path=get_path(values['model_file_path']),
+            raster_file_paths=raster_file_paths,
+            output_dir_path=get_path(values['output_dir_path']),
+            model_type=values.get('model_type'),
+            mask_file_path=get_path(values['mask_file_path']) if values.get('mask_file_path') else None,
+            parameters=get_job_parameters(values),
+            mosaic_name=values.get('mosaic_name'),
+            additional_models=additional_models,
+        )
+        check_model_names_unique([model.model_file_path for model in job.get_models()])
+        return job
+
+
+@dataclass
+class BatchJobModel:
+    """ Model of the batch job, with its processing parameters """
+
+    model_file_path: str
+    model_type: Optional[str] = None  # value of `ModelType`. Taken from the model metadata if None
+    parameters: Dict[str, Any] = field(default_factory=dict)  # values of the processing parameters
+
+
+def get_job_parameters(values: Dict[str, Any]) -> Dict[str, Any]:
+    """ Values of the processing parameters of a model in the job file """
+    parameters = dict(values.get('parameters') or {})
+    runner_parameters = set(parameters) & set(RUNNER_PARAMETERS)
+    if runner_parameters:
+        raise Exception(f"Parameters set by the batch runner cannot be specified in the job file: {sorted(runner_parameters)}")
+    return parameters
+
+
+def get_model_name(model_file_path: str) -> str:
+    """ Name of the model (file name without extension), used for the names of its result files with many models """
+    return os.path.splitext(os.path.basename(model_file_path))[0]
+
+
+def check_model_names_unique(model_file_paths: List[str]):
+    """ Check that results of the models of the job are saved in different files
+
+    :raises Exception: if names of some models are the same
+    """
+    model_names = [get_model_name(model_file_path) for model_file_path in model_file_paths]
+    if len(set(model_names)) != len(model_names):
+        raise Exception(f"Models with the same name would overwrite results of each other: {model_file_paths}. "
+                        f"Please rename them")
+
+
+def get_raster_name(raster_file_path: str) -> str:
+    """ Name of the raster (file name without extension), used for the names of its result files """
+    return os.path.splitext(os.path.basename(raster_file_path))[0]
+
+
+def check_raster_names_unique(raster_file_paths: List[str]):
+    """ Check that results of the rasters (processed separately) are saved in different files,
+    e.g. rasters with the same file name in different directories would overwrite results of each other
+
+    :raises Exception: if names of some rasters are the same
+    """
+    raster_file_paths_by_name = {}  # type: Dict[str, List[str]]
+    for raster_file_path in raster_file_paths:
+        raster_file_paths_by_name.setdefault(get_raster_name(raster_file_path), []).append(raster_file_path)
+
+    clashing_paths = [paths for paths in raster_file_paths_by_name.values() if len(paths) > 1]
+    if clashing_paths:
+        raise Exception(f"Rasters with the same name would overwrite results of each other: {clashing_paths}. "
+                        f"Please rename them, split them into separate jobs or process them as a mosaic")
+
+
+def get_default_parameter_values(model: ModelBase) -> Dict[str, Any]:
+    """ Default values of the processing parameters, from the model metadata (as in the plugin GUI)
+
+    :param model: loaded model
+    :return: values of parameters, for all model types (only ones of the used parameters class are taken)
+    """
+    values = {
+        'tile_size_px': model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        'batch_size': model.get_model_batch_size() or 1,
+        'local_cache': False,
+        'processing_overlap': {'percentage': model.get_metadata_tiles_overlap() or 0},
+        'postprocessing_dilate_erode_size': model.get_metadata_segmentation_small_segment() or 0,
+        'output_scaling': model.get_metadata_regression_output_scaling() or 1.0,
+    }
+
+    metadata_values = {
+        'resolution_cm_per_px': model.get_metadata_resolution(),
+        'pixel_classification__probability_threshold': model.get_metadata_segmentation_threshold(),
+        'confidence': model.get_metadata_detection_confidence(),
+        'iou_threshold': model.get_metadata_detection_iou_threshold(),
+        'detector_type': model.get_detector_type(),
+    }
+    values.update({name: value for name, value in metadata_values.items() if value is not None})
+
+    # tile size from the metadata may be different than the model input size only for models with dynamic input size
+    if isinstance(values['tile_size_px'], str) and model.get_metadata_tile_size() is not None:
+        values['tile_size_px'] = model.get_metadata_tile_size()
+
+    return values
+
+
+def create_processing_overlap(values: Dict[str, Any]) -> ProcessingOverlap:
+    """ Create the processing overlap from job file values: {'percentage': float} or {'overlap_px': int} """
+    if 'overlap_px' in values:
+        return ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PIXELS, overlap_px=int(values['overlap_px']))
+    if 'percentage' in values:
+        return ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=values['percentage'])
+    raise Exception(f"Invalid processing overlap: {values}. Expected 'percentage' or 'overlap_px'")
+
+
+def create_channels_mapping(image_channels: List[ImageChannel],
+                            number_of_model_inputs: int,
+                            mapping_list: Optional[List[int]] = None) -> ChannelsMapping:
+    """ Create the mapping of model inputs to image channels
+
+    :param image_channels: channels of the processed raster
+    :param number_of_model_inputs: number of model input channels
+    :param mapping_list: index of the image channel for each model input. Default mapping (in order) if None
+    """
+    channels_mapping = ChannelsMapping()
+    channels_mapping.set_image_channels(image_channels)
+    channels_mapping.set_number_of_model_inputs(number_of_model_inputs)
+
+    if mapping_list is not None:
+        if len(mapping_list) != number_of_model_inputs:
+            raise Exception(f"Invalid input channels mapping: {mapping_list}. "
+                            f"Expected an image channel for each of {number_of_model_inputs} model inputs")
+        for model_input_number, image_channel_index in enumerate(mapping_list):
+            channels_mapping.set_image_channel_for_model_input(model_input_number, image_channel_index)
+
+    return channels_mapping
+
+
+def create_processing_parameters(parameters_class: type,
+                                 default_values: Dict[str, Any],
+                                 job_values: Dict[str, Any],
+                                 **runner_values):
+    """ Create the processing parameters from the job file values
+
+    :param parameters_class: parameters class of the model type (e.g. `SegmentationParameters`)
+    :param default_values: default values of the parameters (see `get_default_parameter_values`),
+        values not used by `parameters_class` are skipped
+    :param job_values: values of the parameters from the job file. Enums are given by their values
+        and the processing overlap as a dict (see `create_processing_overlap`)
+    :param runner_values: values set by the batch runner (e.g. model or input layer id)
+    :return: instance of `parameters_class`
+    """
+    fields = {f.name: f for f in dataclasses.fields(parameters_class)}
+
+    unknown_names = set(job_values) - set(fields)
+    if unknown_names:
+        raise Exception(f"Unknown parameters for {parameters_class.__name__}: {sorted(unknown_names)}")
+
+    values = {name: value for name, value in default_values.items() if name in fields}
+    values.update(job_values)
+
+    kwargs = {}
+    for name, value in values.items():
+        field_type = fields[name].type
+        if name == 'processing_overlap':
+            value = create_processing_overlap(value)
+        elif isinstance(field_type, type) and issubclass(field_type, enum.Enum):
+            value = field_type(value)
+        kwargs[name] = value
+    kwargs.update(runner_values)
+
+    missing_names = [name for name, f in fields.items()
+                     if name not in kwargs
+                     and f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING]
+    if missing_names:
+        raise Exception(f"Missing parameters (not in the job file nor in the model metadata): {missing_names}")
+
+    return parameters_class(**kwargs)
@@ -0,0 +1,270 @@
+""" This file implements running of a batch processing job, on a standalone QgsApplication (without the plugin GUI) """
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from osgeo import gdal
+from qgis.core import QgsRasterLayer, QgsVectorLayer
+
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.processing import processing_utils, raster_mosaic
+from deepness.processing.batch_processing.batch_job import (BatchJob, BatchJobModel, check_raster_names_unique,
+                                                          create_channels_mapping, create_processing_parameters,
+                                                          get_default_parameter_values, get_model_name, get_raster_name)
+from deepness.processing.map_processor.map_processing_result import (MapProcessingResultCanceled,
+                                                                     MapProcessingResultFailed,
+                                                                     MapProcessingResultSuccess)
+from deepness.processing.map_processor.map_processor import MapProcessor
+from deepness.processing.map_processor.map_processor_multi_model import MapProcessorMultiModel
+from deepness.processing.map_processor.utils.sparse_chunked_image import SparseChunkedImage
+from deepness.processing.models.detector import Detector
+from deepness.processing.models.model_base import ModelBase
+from deepness.processing.models.model_types import ModelDefinition, ModelType
+
+
+class BatchRunner:
+    """
+    Runs a batch processing job - processes all rasters of the job one after another, with models loaded once.
+    Processing runs in the calling thread (not in the QGIS task manager), so QgsApplication needs to be initialized.
+    Additional models of the job are processed in the same pass as the main model, see `MapProcessorMultiModel`.
+
+    Rasters can be processed as one mosaic (if `BatchJob.mosaic_name` is set), with results in one output named
+    after the mosaic. Results are saved in the output directory, in files named after the rasters
+    (and after the models, if the job has additional models):
+     - detections as vector files (in the format from the parameters),
+     - results of other models as GeoTIFF files, with one band for each output channel.
+    A summary of all rasters (status, message and processing time) is saved in `SUMMARY_FILE_NAME`,
+    and time of the processing stages of each raster in a file with `PROCESSING_STATS_FILE_SUFFIX`.
+    """
+
+    SUMMARY_FILE_NAME = 'batch_summary.json'
+    PROCESSING_STATS_FILE_SUFFIX = '_processing_stats.json'
+
+    def __init__(self, job: BatchJob):
+        self.job = job
+        self.job_models = job.get_models()  # type: List[BatchJobModel]
+        self.models = []  # type: List[ModelBase]  # loaded models, in the order of `job_models`
+        self.model_definitions = []  # type: List[ModelDefinition]
+        self.vlayer_mask = None  # type: QgsVectorLayer
+
+    def run(self) -> bool:
+        """ Process all rasters of the job. Processing continues after a failure of a single raster
+
+        :return: True if all rasters were processed successfully
+        """
+        if self.job.mosaic_name is None:
+            check_raster_names_unique(self.job.raster_file_paths)  # before any results are saved
+
+        os.makedirs(self.job.output_dir_path, exist_ok=True)
+        for job_model in self.job_models:
+            self._load_model(job_model)
+
+        if self.job.mask_file_path is not None:
+            self.vlayer_mask = QgsVectorLayer(self.job.mask_file_path)
+            if not self.vlayer_mask.isValid():
+                raise Exception(f"Invalid mask layer '{self.job.mask_file_path}'!")
+
+        raster_file_paths = self.job.raster_file_paths
+        if self.job.mosaic_name is not None:
+            raster_file_paths = [self._create_mosaic()]
+
+        summary = []  # type: List[Dict[str, Any]]
+        for i, raster_file_path in enumerate(raster_file_paths):
+            logging.info(f'Processing raster {i + 1}/{len(raster_file_paths)}: {raster_file_path}')
+            start_time = time.time()
+            try:
+                status, message = self._process_raster(raster_file_path)
+            except Exception as e:
+                logging.exception(f'Failed to process raster {raster_file_path}:')
+                status, message = 'failed', str(e)
+
+            summary.append(dict(
+                raster_file_path=raster_file_path,
+                status=status,
+                message=message,
+                processing_time_s=round(time.time() - start_time, 3),
+            ))
+            logging.info(f'Raster {raster_file_path}: {status}\n{message}')
+
+            # saved after each raster, to have the summary also if the job is interrupted
+            with open(os.path.join(self.job.output_dir_path, self.SUMMARY_FILE_NAME), 'w') as f:
+                json.dump(summary, f, indent=2)
+
+        return all(raster_summary['status'] == 'success' for raster_summary in summary)
+
+    def _load_model(self, job_model: BatchJobModel):
+        """ Load the model once, it is shared by processing of all rasters """
+        model_type = job_model.model_type
+        if model_type is None:
+            model_type = ModelBase.get_model_type_from_metadata(job_model.model_file_path)
+            if model_type is None:
+                raise Exception(f"Model type of '{job_model.model_file_path}' not specified in the job file "
+                                f"nor in the model metadata!")
+
+        model_definition = ModelDefinition.get_definition_for_type(ModelType(model_type))
+        if model_definition.model_type == ModelType.RECOGNITION:
+            raise Exception("Recognition models are not supported in batch processing!")
+
+        model = model_definition.model_class(job_model.model_file_path)
+        model.check_loaded_model_outputs()
+        self.models.append(model)
+        self.model_definitions.append(model_definition)
+
+    def _create_mosaic(self) -> str:
+        """ Create the mosaic of all rasters of the job, processed with one tiles grid.
+        Only the area covered by the rasters (and within the job mask) is processed, see `raster_mosaic`
+
+        :return: path of the mosaic VRT file
+        """
+        vrt_file_path = os.path.join(self.job.output_dir_path, f'{self.job.mosaic_name}.vrt')
+        logging.info(f'Creating mosaic of {len(self.job.raster_file_paths)} rasters: {vrt_file_path}')
+        _, self.vlayer_mask = raster_mosaic.create_mosaic_layers(
+            raster_file_paths=self.job.raster_file_paths,
+            vrt_file_path=vrt_file_path,
+            vlayer_mask=self.vlayer_mask)
+        return vrt_file_path
+
+    def _get_result_names(self, raster_name: str) -> List[str]:
+        """ Names of the result files of the raster, for each model """
+        if len(self.job_models) == 1:
+            return [raster_name]
+        return [f'{raster_name}_{get_model_name(job_model.model_file_path)}' for job_model in self.job_models]
+
+    def _create_processing_parameters(self, rlayer: QgsRasterLayer, model_index: int, result_name: str):
+        model = self.models[model_index]
+        model_definition = self.model_definitions[model_index]
+        job_values = dict(self.job_models[model_index].parameters)
+        channels_mapping = create_channels_mapping(
+            image_channels=processing_utils.create_image_channels_for_rlayer(rlayer),
+            number_of_model_inputs=model.get_number_of_channels(),
+            mapping_list=job_values.pop('input_channels_mapping', None))
+
+        runner_values = dict(
+            model=model,
+            input_layer_id=rlayer.id(),
+            mask_layer_id=None,
+            processed_area_type=ProcessedAreaType.ENTIRE_LAYER if self.vlayer_mask is None else ProcessedAreaType.FROM_POLYGONS,
+            input_channels_mapping=channels_mapping,
+        )
+        if model_definition.model_type == ModelType.DETECTION:
+            runner_values['output_file_path'] = os.path.join(self.job.output_dir_path, result_name)
+
+        params = create_processing_parameters(
+            parameters_class=model_definition.parameters_class,
+            default_values=get_default_parameter_values(model),
+            job_values=job_values,
+            **runner_values)
+
+        if isinstance(model, Detector):
+            model.set_model_type_param(params.detector_type)
+        return params
+
+    def _run_map_processors(self, rlayer: QgsRasterLayer, params_of_models: list) -> List[MapProcessor]:
+        """ Process the raster with all models, in one pass if there are many models
+
+        :return: map processors of the models, with the processing results
+        """
+        if len(params_of_models) == 1:
+            map_processor = self.model_definitions[0].map_processor_class(
+                rlayer=rlayer,
+                vlayer_mask=self.vlayer_mask,
+                map_canvas=None,  # visible part of the map cannot be processed
+                params=params_of_models[0])
+            map_processor.run()
+            return [map_processor]
+
+        multi_model_processor = MapProcessorMultiModel(
+            rlayer=rlayer,
+            vlayer_mask=self.vlayer_mask,
+            map_canvas=None,
+            models_with_params=[(params.model, params) for params in params_of_models])
+        multi_model_processor.run()
+        return multi_model_processor.map_processors
+
+    def _process_raster(self, raster_file_path: str):
+        """ Process a single raster and save its results
+
+        :return: tuple (status, message)
+        """
+        raster_name = get_raster_name(raster_file_path)
+        rlayer = QgsRasterLayer(raster_file_path, raster_name)
+        if not rlayer.isValid():
+            raise Exception(f"Invalid raster layer '{raster_file_path}'!")
+
+        result_names = self._get_result_names(raster_name)
+        params_of_models = [self._create_processing_parameters(rlayer, i, result_name)
+                            for i, result_name in enumerate(result_names)]
+        map_processors = self._run_map_processors(rlayer, params_of_models)
+
+        statuses_and_messages = [self._save_results(map_processor, model_definition, result_name)
+                                 for map_processor, model_definition, result_name
+                                 in zip(map_processors, self.model_definitions, result_names)]
+        if len(statuses_and_messages) == 1:
+            return statuses_and_messages[0]
+
+        status = next((status for status, _ in statuses_and_messages if status != 'success'), 'success')
+        message = '\n'.join(f'{result_name}: {message}'
+                            for result_name, (_, message) in zip(result_names, statuses_and_messages))
+        return status, message
+
+    def _save_results(self, map_processor: MapProcessor, model_definition: ModelDefinition, result_name: str):
+        """ Save results of the processor (of a single model)
+
+        :return: tuple (status, message)
+        """
+        result = map_processor.get_processing_result()
+        map_processor.save_processing_stats(
+            os.path.join(self.job.output_dir_path, f'{result_name}{self.PROCESSING_STATS_FILE_SUFFIX}'))
+
+        if isinstance(result, MapProcessingResultFailed):
+            if result.exception is not None:
+                logging.error(f'Failed to process {result_name}:', exc_info=result.exception)
+                return 'failed', str(result.exception)
+            return 'failed', result.message
+        if isinstance(result, MapProcessingResultCanceled):
+            return 'canceled', ''
+        assert isinstance(result, MapProcessingResultSuccess)
+
+        if model_definition.model_type != ModelType.DETECTION:  # detections are already saved by the processor
+            self._save_result_img(
+                map_processor, model_definition, os.path.join(self.job.output_dir_path, f'{result_name}.tif'))
+        return 'success', result.message
+
+    @staticmethod
+    def _save_result_img(map_processor: MapProcessor, model_definition: ModelDefinition, file_path: str):
+        """ Save the result image of the processor (for the base extent) as a GeoTIFF file """
+        units_per_pixel = map_processor.rlayer_units_per_pixel
+        if model_definition.model_type == ModelType.SUPERRESOLUTION:
+            img = np.asarray(map_processor.get_result_img()).transpose((2, 0, 1))  # channels last in superresolution
+            units_per_pixel /= map_processor.params.scale_factor
+        else:
+            img = map_processor.get_result_img(dense=False)
+            if not isinstance(img, SparseChunkedImage):
+                img = np.asarray(img)
+
+        extent = map_processor.base_extent
+        geo_transform = [extent.xMinimum(), units_per_pixel, 0,
+                         extent.yMaximum(), 0, -units_per_pixel]
+
+        data_type = gdal.GDT_Byte if img.dtype == np.uint8 else gdal.GDT_Float32
+        driver = gdal.GetDriverByName('GTiff')
+        if isinstance(img, SparseChunkedImage):
+            # written chunk by chunk, blocks without any chunk are not stored in the file
+            dataset = driver.Create(file_path, img.shape[2], img.shape[1], img.shape[0], data_type,
+                                    options=['COMPRESS=DEFLATE', 'TILED=YES', 'SPARSE_OK=TRUE'])
+            for y_min, x_min, chunk_img in img.iterate_chunks():
+                for i in range(img.shape[0]):
+                    dataset.GetRasterBand(i + 1).WriteArray(chunk_img[i], x_min, y_min)
+        else:
+            dataset = driver.Create(file_path, img.shape[2], img.shape[1], img.shape[0], data_type, options=['COMPRESS=DEFLATE'])
+            for i in range(img.shape[0]):
+                dataset.GetRasterBand(i + 1).WriteArray(img[i])
+
+        dataset.SetProjection(map_processor.rlayer.crs().toWkt())  # also for a CRS without authority id
+        dataset.SetGeoTransform(geo_transform)
+        dataset.FlushCache()
+        dataset = None  # closes the file
@@ -2,6 +2,9 @@
 This file contains utilities related to Extent processing
 """
 
+import math
+from typing import Tuple
+
 from qgis.core import QgsCoordinateTransform
 from qgis.core import QgsRasterLayer
 from qgis.core import QgsRectangle
@@ -100,6 +103,64 @@ def calculate_extended_processing_extent(base_extent: QgsRectangle,
     return extended_extent
 
 
+def calculate_extended_processing_extent_on_global_grid(base_extent: QgsRectangle,
+                                                        params: MapProcessingParameters,
+                                                        rlayer: QgsRasterLayer,
+                                                        rlayer_units_per_pixel: float) -> Tuple[QgsRectangle, Tuple[int, int]]:
+    """Calculate the "extended" processing extent, with tiles aligned to a global grid of tiles.
+    The grid is anchored to the rlayer (top-left corner of its extent, or CRS origin for infinite layers),
+    not to the processed area, so the same tile has the same position for different processed areas
+    (e.g. while panning the map with visible part processing), and its results can be reused.
+
+    Parameters
+    ----------
+    base_extent : QgsRectangle
+        Base extent of the processed ortophoto, which is not rounded to the tile size
+    params : MapProcessingParameters
+        Processing parameters
+    rlayer : QgsRasterLayer
+        processed layer
+    rlayer_units_per_pixel : float
+        how many rlayer CRS units are in 1 pixel
+
+    Returns
+    -------
+    Tuple[QgsRectangle, Tuple[int, int]]
+        The "extended" processing extent, and (x, y) number of the first tile in the global grid
+    """
+    rlayer_extent_infinite = rlayer.extent().isEmpty()  # empty extent for infinite layers
+    if rlayer_extent_infinite:
+        grid_origin_x, grid_origin_y = 0.0, 0.0
+    else:
+        grid_origin_x, grid_origin_y = rlayer.extent().xMinimum(), rlayer.extent().yMaximum()
+
+    # the same margin as for the extent not aligned to the global grid - half-overlap at every border
+    additional_pixels_in_units = params.processing_overlap_px // 2 * rlayer_units_per_pixel
+    stride_in_units = params.processing_stride_px * rlayer_units_per_pixel
+    tile_size_in_units = params.tile_size_px * rlayer_units_per_pixel
+    eps = 1e-6  # to not add a tile due to floating point errors
+
+    first_tile_x = math.floor((base_extent.xMinimum() - additional_pixels_in_units - grid_origin_x) / stride_in_units + eps)
+    first_tile_y = math.floor((grid_origin_y - base_extent.yMaximum() - additional_pixels_in_units) / stride_in_units + eps)
+    if not rlayer_extent_infinite:
+        first_tile_x, first_tile_y = max(first_tile_x, 0), max(first_tile_y, 0)
+    x_min = grid_origin_x + first_tile_x * stride_in_units
+    y_max = grid_origin_y - first_tile_y * stride_in_units
+
+    x_bins_number = max(1, math.ceil(
+        (base_extent.xMaximum() + additional_pixels_in_units - x_min - tile_size_in_units) / stride_in_units - eps) + 1)
+    y_bins_number = max(1, math.ceil(
+        (y_max - base_extent.yMinimum() + additional_pixels_in_units - tile_size_in_units) / stride_in_units - eps) + 1)
+
+    extended_extent = QgsRectangle(
+        x_min,
+        y_max - (y_bins_number - 1) * stride_in_units - tile_size_in_units,
+        x_min + (x_bins_number - 1) * stride_in_units + tile_size_in_units,
+        y_max,
+    )
+    return extended_extent, (first_tile_x, first_tile_y)
+
+
 def is_extent_infinite_or_too_big(rlayer: QgsRasterLayer) -> bool:
     """Check whether layer covers whole earth (infinite extent) or or is too big for processing"""
     rlayer_extent = rlayer.extent()
@@ -212,3 +273,31 @@ def calculate_base_extent_bbox_in_full_image(image_size_y: int,
         y_max=image_size_y - 1 - round((base_extent.yMinimum() - extended_extent.yMinimum()) / rlayer_units_per_pixel),
     )
     return base_extent_bbox_in_full_image
+
+
+def calculate_tiles_grid_size(extended_extent: QgsRectangle,
+                              rlayer_units_per_pixel: float,
+                              params: MapProcessingParameters) -> Tuple[int, int, int, int]:
+    """Calculate size of the processed image (for the extended extent) and number of tiles covering it
+
+    Parameters
+    ----------
+    extended_extent : QgsRectangle
+        Extended extent of processing
+    rlayer_units_per_pixel : float
+        Number of layer units per a single image pixel
+    params : MapProcessingParameters
+        Processing parameters, with the tile size and stride
+
+    Returns
+    -------
+    Tuple[int, int, int, int]
+        (img_size_x_pixels, img_size_y_pixels, x_bins_number, y_bins_number)
+    """
+    img_size_x_pixels = round(extended_extent.width() / rlayer_units_per_pixel)  # how many columns (x)
+    img_size_y_pixels = round(extended_extent.height() / rlayer_units_per_pixel)  # how many rows (y)
+
+    # as the extended extent has full tiles, this should divide without any rest
+    x_bins_number = round((img_size_x_pixels - params.tile_size_px) / params.processing_stride_px) + 1
+    y_bins_number = round((img_size_y_pixels - params.tile_size_px) / params.processing_stride_px) + 1
+    return img_size_x_pixels, img_size_y_pixels, x_bins_number, y_bins_number
@@ -4,6 +4,8 @@
 
 from typing import Callable, Optional
 
+from deepness.processing.processing_stats import ProcessingStats
+
 
 class MapProcessingResult:
     """
@@ -26,6 +28,7 @@ class MapProcessingResultSuccess(MapProcessingResult):
 
     def __init__(self, message: str = '', gui_delegate: Optional[Callable] = None):
         super().__init__(message=message, gui_delegate=gui_delegate)
+        self.processing_stats = None  # type: Optional[ProcessingStats]  # set by the MapProcessor when finished
 
 
 class MapProcessingResultFailed(MapProcessingResult):
@@ -1,23 +1,28 @@
 """ This file implements core map processing logic """
 
 import logging
-from typing import List, Optional, Tuple
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
-from qgis.core import QgsRasterLayer, QgsTask, QgsVectorLayer
+from qgis.core import QgsLayerTreeGroup, QgsProject, QgsRasterLayer, QgsTask, QgsVectorLayer
 from qgis.gui import QgsMapCanvas
 from qgis.PyQt.QtCore import pyqtSignal
 
-from deepness.common.defines import IS_DEBUG
-from deepness.common.lazy_package_loader import LazyPackageLoader
+from deepness.common.defines import IS_DEBUG, PROCESSING_STATS_DIR
 from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters, ProcessedAreaType
 from deepness.common.temp_files_handler import TempFilesHandler
-from deepness.processing import extent_utils, processing_utils
-from deepness.processing.map_processor.map_processing_result import MapProcessingResult, MapProcessingResultFailed
+from deepness.processing import extent_utils, memory_budget, processing_utils
+from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultFailed,
+                                                                     MapProcessingResultSuccess)
+from deepness.processing.map_processor.utils.chunked_area_mask import ChunkedAreaMask
+from deepness.processing.map_processor.utils.shared_tiles_reader import SharedTilesReader
+from deepness.processing.map_processor.utils.sparse_chunked_image import SparseChunkedImage
+from deepness.processing.memory_budget import MemoryItem, StorageType
+from deepness.processing.processing_stats import ProcessingStage, ProcessingStats
 from deepness.processing.tile_params import TileParams
 
-cv2 = LazyPackageLoader('cv2')
-
 
 class MapProcessor(QgsTask):
     """
@@ -56,16 +61,19 @@ class MapProcessor(QgsTask):
         self._processing_finished = False
         self.rlayer = rlayer
         self.vlayer_mask = vlayer_mask
+        self.map_canvas = map_canvas
         self.params = params
         self._assert_qgis_doesnt_need_reload()
         self._processing_result = MapProcessingResultFailed('Failed to get processing result!')
+        self.processing_stats = ProcessingStats()  # time of the processing stages, measured during `run`
+        self._created_layers_groups = []  # type: List[QgsLayerTreeGroup]  # top level groups added with the results
+        self._is_number_of_threads_set = False
+        self._number_of_threads = None  # type: Optional[int]  # for the models, applied when the processing starts
 
         self.stride_px = self.params.processing_stride_px  # stride in pixels
         self.rlayer_units_per_pixel = processing_utils.convert_meters_to_rlayer_units(
             self.rlayer, self.params.resolution_m_per_px)  # number of rlayer units for one tile pixel
 
-        self.file_handler = TempFilesHandler() if self.params.local_cache else None
-
         # extent in which the actual required area is contained, without additional extensions, rounded to rlayer grid
         self.base_extent = extent_utils.calculate_base_processing_extent_in_rlayer_crs(
             map_canvas=map_canvas,
@@ -75,15 +83,27 @@ class MapProcessor(QgsTask):
 
         # extent which should be used during model inference, as it includes extra margins to have full tiles,
         # rounded to rlayer grid
-        self.extended_extent = extent_utils.calculate_extended_processing_extent(
-            base_extent=self.base_extent,
-            rlayer=self.rlayer,
-            params=self.params,
-            rlayer_units_per_pixel=self.rlayer_units_per_pixel)
-
-        # processed rlayer dimensions (for extended_extent)
-        self.img_size_x_pixels = round(self.extended_extent.width() / self.rlayer_units_per_pixel)  # how many columns (x)
-        self.img_size_y_pixels = round(self.extended_extent.height() / self.rlayer_units_per_pixel)  # how many rows (y)
+        self.global_tiles_grid_offset = None  # type: Optional[Tuple[int, int]]  # (x, y) number of the first tile in the global grid
+        if self._is_tiles_grid_global():
+            self.extended_extent, self.global_tiles_grid_offset = \
+                extent_utils.calculate_extended_processing_extent_on_global_grid(
+                    base_extent=self.base_extent,
+                    rlayer=self.rlayer,
+                    params=self.params,
+                    rlayer_units_per_pixel=self.rlayer_units_per_pixel)
+        else:
+            self.extended_extent = extent_utils.calculate_extended_processing_extent(
+                base_extent=self.base_extent,
+                rlayer=self.rlayer,
+                params=self.params,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel)
+
+        # processed rlayer dimensions (for extended_extent), and number of tiles in x and y dimensions
+        self.img_size_x_pixels, self.img_size_y_pixels, self.x_bins_number, self.y_bins_number = \
+            extent_utils.calculate_tiles_grid_size(
+                extended_extent=self.extended_extent,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+                params=self.params)
 
         # Coordinate of base image within extended image (images for base_extent and extended_extent)
         self.base_extent_bbox_in_full_image = extent_utils.calculate_base_extent_bbox_in_full_image(
@@ -92,21 +112,32 @@ class MapProcessor(QgsTask):
             extended_extent=self.extended_extent,
             rlayer_units_per_pixel=self.rlayer_units_per_pixel)
 
-        # Number of tiles in x and y dimensions which will be used during processing
-        # As we are using "extended_extent" this should divide without any rest
-        self.x_bins_number = round((self.img_size_x_pixels - self.params.tile_size_px) / self.stride_px) + 1
-        self.y_bins_number = round((self.img_size_y_pixels - self.params.tile_size_px) / self.stride_px) + 1
-
-        # Mask determining area to process (within extended_extent coordinates)
-        self.area_mask_img = processing_utils.create_area_mask_image(
-            vlayer_mask=self.vlayer_mask,
-            rlayer=self.rlayer,
-            extended_extent=self.extended_extent,
-            rlayer_units_per_pixel=self.rlayer_units_per_pixel,
-            image_shape_yx=(self.img_size_y_pixels, self.img_size_x_pixels),
-            files_handler=self.file_handler)  # type: Optional[np.ndarray]
+        # large images are stored on disk if selected by the user, or if they would not fit in the memory budget
+        self.memory_plan = memory_budget.plan_memory_usage(
+            memory_items=self._get_memory_items(),
+            budget_bytes=memory_budget.get_memory_budget_bytes(),
+            free_disk_bytes=memory_budget.get_free_disk_bytes(),
+            force_memmap=self.params.local_cache)
+        self.file_handler = TempFilesHandler() if self.memory_plan.storage_type == StorageType.MEMMAP else None
+
+        # Mask determining area to process (within extended_extent coordinates), rasterized when used
+        self.area_mask_img = None  # type: Optional[ChunkedAreaMask]
+        if self.memory_plan.is_feasible():  # otherwise processing is refused in `run`
+            self.area_mask_img = processing_utils.create_chunked_area_mask(
+                vlayer_mask=self.vlayer_mask,
+                rlayer=self.rlayer,
+                extended_extent=self.extended_extent,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+                image_shape_yx=(self.img_size_y_pixels, self.img_size_x_pixels))
 
         self._result_img = None
+        self._shared_tiles_reader = None  # type: Optional[SharedTilesReader]
+
+    def set_shared_tiles_reader(self, shared_tiles_reader: SharedTilesReader):
+        """ Read tiles with the reader shared with other processors (processing the same tiles in parallel),
+        instead of reading them directly from the layer. The processor needs to be added to the reader as a consumer
+        """
+        self._shared_tiles_reader = shared_tiles_reader
 
     def set_results_img(self, img):
         if self._result_img is not None:
@@ -114,12 +145,77 @@ class MapProcessor(QgsTask):
 
         self._result_img = img
 
-    def get_result_img(self):
+    def get_result_img(self, dense: bool = True):
+        """
+        :param dense: whether a sparse result image (`SparseChunkedImage`, e.g. from processing within polygons)
+            is converted to a numpy array (for the whole base extent, it may be large)
+        """
         if self._result_img is None:
             raise Exception("Result image not yet created!")
 
+        if dense and isinstance(self._result_img, SparseChunkedImage):
+            return self._result_img.to_dense()
         return self._result_img
 
+    def _get_memory_items(self) -> List[MemoryItem]:
+        """ Estimate the memory needed by the processing, at its peak (see `memory_budget.plan_memory_usage`).
+        Called in `__init__`, before attributes of the child classes are set
+        """
+        memory_items = []
+        if self.vlayer_mask is not None:
+            memory_items.append(MemoryItem(  # bit-packed, at most (see `ChunkedAreaMask`)
+                'area mask', self.img_size_y_pixels * self.img_size_x_pixels // 8, can_be_memmapped=False))
+
+        number_of_channels = self.params.input_channels_mapping.get_number_of_model_inputs()
+        tile_size_bytes = self.params.tile_size_px ** 2 * number_of_channels
+        memory_items.append(MemoryItem(  # uint8 tile images and float32 model input
+            'tiles batch', self.params.batch_size * tile_size_bytes * (1 + 4), can_be_memmapped=False))
+        return memory_items
+
+    def _is_tiles_grid_global(self) -> bool:
+        """ Whether tiles should be aligned to a global grid, anchored to the rlayer instead of the processed area,
+        so that results of the same tiles can be reused between processing of different areas
+        """
+        return False
+
+    def get_global_tile_xy_bins(self, tile_params: TileParams) -> Tuple[int, int]:
+        """ Get (x, y) number of the tile in the global grid (see `_is_tiles_grid_global`) """
+        return (self.global_tiles_grid_offset[0] + tile_params.x_bin_number,
+                self.global_tiles_grid_offset[1] + tile_params.y_bin_number)
+
+    @staticmethod
+    def combine_tile_filters(*tile_filters: Optional[Callable[..., bool]]) -> Optional[Callable[..., bool]]:
+        """ Combine tile filters of the same kind (`tile_params_filter` or `tile_img_filter`, see `tiles_generator`),
+        tile is processed if accepted by all of them (checked in order)
+        """
+        tile_filters = [f for f in tile_filters if f is not None]
+        if not tile_filters:
+            return None
+        if len(tile_filters) == 1:
+            return tile_filters[0]
+        return lambda *args: all(f(*args) for f in tile_filters)
+
+    def _get_input_nodata_values(self) -> Optional[np.ndarray]:
+        """ Get nodata value of the rlayer for each channel of the tile image (NaN if not defined for the band).
+        None if the tile image is not made of standalone bands (then nodata is rendered as a regular value)
+        """
+        input_channels_mapping = self.params.input_channels_mapping
+        if not input_channels_mapping.are_all_inputs_standalone_bands():
+            return None
+
+        data_provider = self.rlayer.dataProvider()
+        nodata_values = []
+        for i in range(input_channels_mapping.get_number_of_model_inputs()):
+            band_number = input_channels_mapping.get_image_channel_for_model_input(i).get_band_number()
+            if data_provider.sourceHasNoDataValue(band_number) and data_provider.useSourceNoDataValue(band_number):
+                nodata_values.append(data_provider.sourceNoDataValue(band_number))
+            else:
+                nodata_values.append(np.nan)
+
+        if np.all(np.isnan(nodata_values)):
+            return None
+        return np.array(nodata_values)
+
     def _assert_qgis_doesnt_need_reload(self):
         """ If the plugin is somehow invalid, it cannot compare the enums correctly
         I suppose it could be fixed somehow, but no need to investigate it now,
@@ -129,9 +225,28 @@ class MapProcessor(QgsTask):
         if self.params.processed_area_type.__class__ != ProcessedAreaType:
             raise Exception("Disable plugin, restart QGis and enable plugin again!")
 
+    def set_number_of_threads(self, number_of_threads: Optional[int]):
+        """ Set the number of CPU threads for the models (None for the ONNX Runtime default). It is applied when
+        the processing starts, in the task thread, as it recreates the model sessions (which may take a while)
+        """
+        self._is_number_of_threads_set = True
+        self._number_of_threads = number_of_threads
+
+    def _get_models(self) -> list:
+        """ Models used by the processing """
+        return []
+
     def run(self):
+        self.processing_stats.start()
         try:
-            self._processing_result = self._run()
+            if self._is_number_of_threads_set:
+                for model in self._get_models():
+                    model.set_number_of_threads(self._number_of_threads)
+
+            if self.memory_plan.is_feasible():
+                self._processing_result = self._run()
+            else:
+                self._processing_result = MapProcessingResultFailed(self.memory_plan.create_message())
         except Exception as e:
             logging.exception("Error occurred in MapProcessor:")
             msg = "Unhandled exception occurred. See Python Console for details"
@@ -139,24 +254,64 @@ class MapProcessor(QgsTask):
             if IS_DEBUG:
                 raise e
 
+        self.processing_stats.finish()
+        if isinstance(self._processing_result, MapProcessingResultSuccess):
+            self._processing_result.processing_stats = self.processing_stats
+            self._processing_result.message += self.processing_stats.create_summary_message()
+            if self.memory_plan.is_memmap_chosen_automatically():
+                self._processing_result.message += self.memory_plan.create_message()
+        if PROCESSING_STATS_DIR:
+            self.save_processing_stats(os.path.join(
+                PROCESSING_STATS_DIR, f'{time.strftime("%Y%m%d_%H%M%S")}_{self.__class__.__name__}.json'))
+
         self._processing_finished = True
         return True
 
     def _run(self) -> MapProcessingResult:
         raise NotImplementedError('Base class not implemented!')
 
+    def get_processing_result(self) -> MapProcessingResult:
+        """ Result of the processing, available after `run` (e.g. when running outside of the task manager) """
+        return self._processing_result
+
+    def _get_processing_stats_values(self) -> Dict[str, Any]:
+        """ Values describing the processing, saved with its stats (to compare runs with different settings) """
+        return dict(
+            processor=self.__class__.__name__,
+            layer_name=self.rlayer.name(),
+            result=self._processing_result.__class__.__name__,
+            tile_size_px=self.params.tile_size_px,
+            stride_px=self.stride_px,
+            batch_size=self.params.batch_size,
+            resolution_cm_per_px=self.params.resolution_cm_per_px,
+            number_of_tiles=self.x_bins_number * self.y_bins_number,
+            storage_type=self.memory_plan.storage_type.value,
+            estimated_peak_memory_bytes=self.memory_plan.get_peak_memory_bytes(),
+        )
+
+    def save_processing_stats(self, file_path: str):
+        """ Save the stats of the finished processing as a JSON file """
+        try:
+            self.processing_stats.save_json(file_path, **self._get_processing_stats_values())
+        except OSError:
+            logging.exception(f"Failed to save processing stats to '{file_path}':")
+
     def finished(self, result: bool):
         if result:
             gui_delegate = self._processing_result.gui_delegate
             if gui_delegate is not None:
+                root = QgsProject.instance().layerTreeRoot()
+                previous_nodes = root.children()
                 gui_delegate()
+                self._created_layers_groups = [node for node in root.children()
+                                               if isinstance(node, QgsLayerTreeGroup) and node not in previous_nodes]
         else:
             self._processing_result = MapProcessingResultFailed("Unhandled processing error!")
         self.finished_signal.emit(self._processing_result)
 
-    @staticmethod
-    def is_busy():
-        return True
+    def get_created_layers_groups(self) -> List[QgsLayerTreeGroup]:
+        """ Top level groups of the layer tree with the result layers, added when the processing finished """
+        return self._created_layers_groups
 
     def _show_image(self, img, window_name='img'):
         self.show_img_signal.emit(img, window_name)
@@ -168,11 +323,9 @@ class MapProcessor(QgsTask):
         :param full_img:
         :return:
         """
-        # TODO look for some inplace operation to save memory
-        # cv2.copyTo(src=full_img, mask=area_mask_img, dst=full_img)  # this doesn't work due to implementation details
-        
-        for i in range(full_img.shape[0]):
-            full_img[i] = cv2.copyTo(src=full_img[i], mask=self.area_mask_img)
+        if self.area_mask_img is not None:
+            for i in range(full_img.shape[0]):
+                self.area_mask_img.apply_to_image(full_img[i])  # in place, chunk by chunk
 
         b = self.base_extent_bbox_in_full_image
         result_img = full_img[:, b.y_min:b.y_max+1, b.x_min:b.x_max+1]
@@ -190,9 +343,25 @@ class MapProcessor(QgsTask):
 
         return full_result_img
 
-    def tiles_generator(self) -> Tuple[np.ndarray, TileParams]:
+    def _create_tile_params(self, x_bin_number: int, y_bin_number: int) -> TileParams:
+        return TileParams(
+            x_bin_number=x_bin_number, y_bin_number=y_bin_number,
+            x_bins_number=self.x_bins_number, y_bins_number=self.y_bins_number,
+            params=self.params,
+            processing_extent=self.extended_extent,
+            rlayer_units_per_pixel=self.rlayer_units_per_pixel)
+
+    def tiles_generator(self,
+                        tile_params_filter: Optional[Callable[[TileParams], bool]] = None,
+                        tile_img_filter: Optional[Callable[[np.ndarray, TileParams], bool]] = None,
+                        ) -> Tuple[np.ndarray, TileParams]:
         """
         Iterate over all tiles, as a Python generator function
+
+        :param tile_params_filter: optional function deciding whether a tile (within the mask) should be processed.
+            Image is not read for the tiles for which it returns False
+        :param tile_img_filter: optional function deciding whether a tile should be processed, based on its image
+            (already read, so it is meant for filters which need the image content)
         """
         total_tiles = self.x_bins_number * self.y_bins_number
 
@@ -201,30 +370,48 @@ class MapProcessor(QgsTask):
                 tile_no = y_bin_number * self.x_bins_number + x_bin_number
                 progress = tile_no / total_tiles * 100
                 self.setProgress(progress)
-                print(f" Processing tile {tile_no} / {total_tiles} [{progress:.2f}%]")
-                tile_params = TileParams(
-                    x_bin_number=x_bin_number, y_bin_number=y_bin_number,
-                    x_bins_number=self.x_bins_number, y_bins_number=self.y_bins_number,
-                    params=self.params,
-                    processing_extent=self.extended_extent,
-                    rlayer_units_per_pixel=self.rlayer_units_per_pixel)
+                logging.debug(f"Processing tile {tile_no} / {total_tiles} [{progress:.2f}%]")
+                tile_params = self._create_tile_params(x_bin_number, y_bin_number)
+                if self._shared_tiles_reader is not None:
+                    self._shared_tiles_reader.set_position(self, tile_params)
 
                 if not tile_params.is_tile_within_mask(self.area_mask_img):
                     continue  # tile outside of mask - to be skipped
-                
-                tile_img = processing_utils.get_tile_image(
-                    rlayer=self.rlayer, extent=tile_params.extent, params=self.params)
+
+                if tile_params_filter is not None and not tile_params_filter(tile_params):
+                    continue
+
+                with self.processing_stats.measure(ProcessingStage.TILE_READ):
+                    if self._shared_tiles_reader is not None:
+                        tile_img = self._shared_tiles_reader.get_tile_image(self, tile_params)
+                    else:
+                        tile_img = processing_utils.get_tile_image(
+                            rlayer=self.rlayer, extent=tile_params.extent, params=self.params)
+                self.processing_stats.add_tile_read(tile_img)
+
+                if tile_img_filter is not None and not tile_img_filter(tile_img, tile_params):
+                    continue
 
                 yield tile_img, tile_params
 
-    def tiles_generator_batched(self) -> Tuple[np.ndarray, List[TileParams]]:
+        if self._shared_tiles_reader is not None:
+            self._shared_tiles_reader.set_consumer_finished(self)
+
+    def tiles_generator_batched(self,
+                                tile_params_filter: Optional[Callable[[TileParams], bool]] = None,
+                                tile_img_filter: Optional[Callable[[np.ndarray, TileParams], bool]] = None,
+                                ) -> Tuple[np.ndarray, List[TileParams]]:
         """
         Iterate over all tiles, as a Python generator function, but return them in batches
+
+        :param tile_params_filter: see `tiles_generator`
+        :param tile_img_filter: see `tiles_generator`
         """
 
         tile_img_batch, tile_params_batch = [], []
 
-        for tile_img, tile_params in self.tiles_generator():
+        for tile_img, tile_params in self.tiles_generator(tile_params_filter=tile_params_filter,
+                                                          tile_img_filter=tile_img_filter):
             tile_img_batch.append(tile_img)
             tile_params_batch.append(tile_params)
 
@@ -1,17 +1,33 @@
 """ This file implements map processing for detection model """
-from typing import List
+import copy
+import dataclasses
+import logging
+import os
+import pickle
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from qgis.core import QgsFeature, QgsGeometry, QgsProject, QgsVectorLayer
+from qgis.core import QgsFeature, QgsGeometry, QgsProject, QgsRectangle, QgsVectorLayer
 
-from deepness.common.processing_parameters.detection_parameters import DetectionParameters
-from deepness.processing import processing_utils
+from deepness.common.misc import TMP_DIR_PATH
+from deepness.common.processing_parameters.detection_parameters import DetectionOutputFormat, DetectionParameters
+from deepness.processing import extent_utils, processing_utils
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultCanceled,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor_with_model import MapProcessorWithModel
+from deepness.processing.map_processor.utils.cache_key import compute_file_hash
 from deepness.processing.map_processor.utils.ckdtree import cKDTree
+from deepness.processing.map_processor.utils.detections_vector_file_sink import DetectionsVectorFileSink
+from deepness.processing.map_processor.utils.incremental_manifest import IncrementalManifest
+from deepness.processing.map_processor.utils.processing_checkpoint import ProcessingCheckpoint
+from deepness.processing.map_processor.utils.raw_outputs_store import RawOutputsStore
+from deepness.processing.map_processor.utils.tiles_results_cache import TILES_RESULTS_CACHE
+from deepness.processing.memory_budget import MemoryItem
 from deepness.processing.models.detector import Detection, Detector
+from deepness.processing.models.model_base import ModelBase
+from deepness.processing.processing_stats import ProcessingStage
 from deepness.processing.tile_params import TileParams
 from deepness.processing.models.detector import DetectorType
 
@@ -22,6 +38,12 @@ class MapProcessorDetection(MapProcessorWithModel):
     of different classes, which area (bounding boxes) may overlap)
     """
 
+    CHECKPOINT_DETECTIONS_FILE_NAME = 'detections.pkl'  # detections of completed tiles, for resuming the processing
+    INCREMENTAL_DETECTIONS_FILE_NAME = 'tiles_detections.pkl'  # detections of each tile, for incremental processing
+    # rough estimate of detections kept in memory until the end of the processing (before removing overlapping ones)
+    ESTIMATED_DETECTIONS_PER_TILE = 50
+    ESTIMATED_DETECTION_SIZE_BYTES = 1000  # python objects with the bounding box (and the compact mask, if any)
+
     def __init__(self,
                  params: DetectionParameters,
                  **kwargs):
@@ -31,66 +53,567 @@ class MapProcessorDetection(MapProcessorWithModel):
             **kwargs)
         self.detection_parameters = params
         self.model = params.model  # type: Detector
+        self._all_detections = None
+        self._cascade_tiles_total = 0
+        self._cascade_tiles_skipped = 0
+        self._output_files_id = str(uuid.uuid4()).replace('-', '')
+
+    def _set_model_inference_params(self):
+        """ Set the detection parameters of the model. Set when the processing starts, not in the constructor,
+        as the model may be shared with other queued tasks (and with the coarse pass of the cascade)
+        """
         self.model.set_inference_params(
-            confidence=params.confidence,
-            iou_threshold=params.iou_threshold
+            confidence=self.detection_parameters.confidence,
+            iou_threshold=self.detection_parameters.iou_threshold
         )
-        self.model.set_model_type_param(model_type=params.detector_type)
-        self._all_detections = None
+        self.model.set_model_type_param(model_type=self.detection_parameters.detector_type)
+
+    def _get_models(self) -> List[ModelBase]:
+        if self.detection_parameters.cascade_model is None:
+            return [self.model]
+        return [self.model, self.detection_parameters.cascade_model]
+
+    def _get_memory_items(self) -> List[MemoryItem]:
+        detections_size_bytes = self.x_bins_number * self.y_bins_number \
+            * self.ESTIMATED_DETECTIONS_PER_TILE * self.ESTIMATED_DETECTION_SIZE_BYTES
+        return super()._get_memory_items() + [
+            MemoryItem('detections', detections_size_bytes, can_be_memmapped=False),
+        ]
+
+    def _is_tiles_grid_global(self) -> bool:
+        return self.params.tiles_cache_size_mb > 0
 
     def get_all_detections(self) -> List[Detection]:
         return self._all_detections
 
     def _run(self) -> MapProcessingResult:
-        all_bounding_boxes = []  # type: List[Detection]
-        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
-            if self.isCanceled():
+        params = self.detection_parameters
+        self._set_model_inference_params()
+        processing_values = dict(
+            confidence=params.confidence,
+            iou_threshold=params.iou_threshold,
+            detector_type=params.detector_type,
+            cascade_resolution_cm_per_px=params.cascade_resolution_cm_per_px,
+            cascade_model_hash=compute_file_hash(params.cascade_model.model_file_path) if params.cascade_model else None,
+            cascade_confidence=params.cascade_confidence,
+            cascade_margin_px=params.cascade_margin_px)
+
+        # at most one of them is enabled (see `check_results_reuse_options`)
+        incremental_manifest = self._create_incremental_manifest(params.incremental_dir_path, **processing_values)
+        checkpoint = self._create_checkpoint(params.checkpoint_dir_path, **processing_values)
+        tiles_cache_key = self._create_tiles_results_cache_key(
+            params.tiles_cache_size_mb,
+            confidence=params.confidence,
+            iou_threshold=params.iou_threshold,
+            detector_type=params.detector_type)
+        raw_outputs_store = self._create_detections_raw_outputs_store()
+        is_from_raw_outputs = raw_outputs_store is not None and raw_outputs_store.is_complete()
+
+        tile_params_filter = None
+        if params.is_cascade_enabled:
+            tile_params_filter = self._run_cascade_coarse_pass()
+            if tile_params_filter is None:
                 return MapProcessingResultCanceled()
 
-            bounding_boxes_in_tile_batched = self._process_tile(tile_img_batched, tile_params_batched)
-            all_bounding_boxes += [d for det in bounding_boxes_in_tile_batched for d in det]
+        all_bounding_boxes_restricted = self._detect_objects(
+            tile_params_filter=tile_params_filter,
+            checkpoint=checkpoint,
+            incremental_manifest=incremental_manifest,
+            tiles_cache_key=tiles_cache_key,
+            raw_outputs_store=raw_outputs_store)
+        if all_bounding_boxes_restricted is None:
+            return MapProcessingResultCanceled()
 
-        with_rot = self.detection_parameters.detector_type == DetectorType.YOLO_ULTRALYTICS_OBB
-
-        if len(all_bounding_boxes) > 0:
-            all_bounding_boxes_nms = self.remove_overlaping_detections(all_bounding_boxes, iou_threshold=self.detection_parameters.iou_threshold, with_rot=with_rot)
-            all_bounding_boxes_restricted = self.limit_bounding_boxes_to_processed_area(all_bounding_boxes_nms)
-        else:
-            all_bounding_boxes_restricted = []
-
-        gui_delegate = self._create_vlayer_for_output_bounding_boxes(all_bounding_boxes_restricted)
+        with self.processing_stats.measure(ProcessingStage.LAYERS_CREATION):
+            gui_delegate = self._create_vlayer_for_output_bounding_boxes(all_bounding_boxes_restricted)
 
         result_message = self._create_result_message(all_bounding_boxes_restricted)
+        if params.is_cascade_enabled:
+            result_message += self._create_cascade_result_message()
+        result_message += self._create_results_reuse_message(
+            incremental_manifest, is_tiles_cache_used=tiles_cache_key is not None, is_from_raw_outputs=is_from_raw_outputs)
         self._all_detections = all_bounding_boxes_restricted
+
+        if checkpoint is not None:
+            checkpoint.remove()
+
         return MapProcessingResultSuccess(
             message=result_message,
             gui_delegate=gui_delegate,
         )
 
+    def _create_detections_raw_outputs_store(self) -> Optional[RawOutputsStore]:
+        """ Create the store of raw model outputs, if enabled. Stored outputs are removed,
+        if candidates with the required confidence were not stored (see `raw_outputs_min_confidence`)
+        """
+        params = self.detection_parameters
+        raw_outputs_store = self._create_raw_outputs_store(params.raw_outputs_dir_path, detector_type=params.detector_type)
+        if raw_outputs_store is not None and raw_outputs_store.is_complete() \
+                and raw_outputs_store.get_metadata()['min_confidence'] > params.confidence:
+            raw_outputs_store.remove()
+        return raw_outputs_store
+
+    def _detect_objects(self,
+                        tile_params_filter: Optional[Callable[[TileParams], bool]] = None,
+                        checkpoint: Optional[ProcessingCheckpoint] = None,
+                        incremental_manifest: Optional[IncrementalManifest] = None,
+                        tiles_cache_key: Optional[str] = None,
+                        raw_outputs_store: Optional[RawOutputsStore] = None) -> Optional[List[Detection]]:
+        """ Run the model on all tiles (accepted by the filter), then remove overlapping detections
+        and detections outside of the processed area
+
+        :param tile_params_filter: see `MapProcessor.tiles_generator`
+        :param checkpoint: checkpoint to resume from and to save the detections of processed tiles in
+        :param incremental_manifest: manifest of the previous run, to process only tiles with changed input
+        :param tiles_cache_key: key of the processing parameters in the tiles results cache. Cache not used if None
+        :param raw_outputs_store: store of raw model outputs, to post-process them without running the model
+            (if the store is complete) or to save them for later. Not used if None
+        :return: list of detections, or None if processing was canceled
+        """
+        all_bounding_boxes = []  # type: List[Detection]
+        tile_img_filter = None
+        detections_file = None
+        tiles_detections = None  # type: Optional[Dict[int, List[Detection]]]
+
+        if checkpoint is not None:
+            all_bounding_boxes += self._load_checkpoint_detections(checkpoint)
+            detections_file = open(checkpoint.get_file_path(self.CHECKPOINT_DETECTIONS_FILE_NAME), 'ab')
+            tile_params_filter = self.combine_tile_filters(checkpoint.is_tile_to_process, tile_params_filter)
+        if incremental_manifest is not None:
+            tiles_detections = self._load_incremental_detections(incremental_manifest)
+            tile_img_filter = incremental_manifest.is_tile_changed
+            tile_params_filter = self._create_incremental_tile_params_filter(
+                incremental_manifest, tiles_detections, tile_params_filter)
+        if tiles_cache_key is not None:
+            tile_params_filter = self.combine_tile_filters(
+                tile_params_filter, self._create_cached_tiles_filter(tiles_cache_key, all_bounding_boxes))
+        if self.detection_parameters.skip_empty_tiles:
+            tile_img_filter = self.combine_tile_filters(
+                tile_img_filter, self._create_empty_tiles_detections_filter(incremental_manifest, tiles_detections))
+
+        try:
+            for bounding_boxes_in_tile_batched, tile_params_batched in self._tiles_detections_batched(
+                    raw_outputs_store=raw_outputs_store,
+                    tile_params_filter=tile_params_filter,
+                    tile_img_filter=tile_img_filter):
+                if self.isCanceled():
+                    self._save_interrupted_detections(checkpoint, detections_file, incremental_manifest, tiles_detections)
+                    return None
+
+                all_bounding_boxes += [d for det in bounding_boxes_in_tile_batched for d in det]
+                self._store_tiles_detections(bounding_boxes_in_tile_batched, tile_params_batched, checkpoint, detections_file,
+                                             incremental_manifest, tiles_detections, tiles_cache_key)
+        finally:
+            if detections_file is not None:
+                detections_file.close()
+
+        if incremental_manifest is not None:
+            self._save_incremental_detections(incremental_manifest, tiles_detections)
+            all_bounding_boxes = [d for bounding_boxes_in_tile in tiles_detections.values() for d in bounding_boxes_in_tile]
+
+        return self._postprocess_detections(all_bounding_boxes)
+
+    def _postprocess_detections(self, all_bounding_boxes: List[Detection]) -> List[Detection]:
+        """ Remove overlapping detections (from neighbouring tiles) and detections outside of the processed area """
+        if len(all_bounding_boxes) == 0:
+            return []
+
+        with_rot = self.detection_parameters.detector_type == DetectorType.YOLO_ULTRALYTICS_OBB
+        with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+            all_bounding_boxes_nms = self.remove_overlaping_detections(
+                all_bounding_boxes, iou_threshold=self.detection_parameters.iou_threshold, with_rot=with_rot)
+            return self.limit_bounding_boxes_to_processed_area(all_bounding_boxes_nms)
+
+    def _store_tiles_detections(self,
+                                bounding_boxes_in_tile_batched: List[List[Detection]],
+                                tile_params_batched: List[TileParams],
+                                checkpoint: Optional[ProcessingCheckpoint],
+                                detections_file,
+                                incremental_manifest: Optional[IncrementalManifest],
+                                tiles_detections: Optional[Dict[int, List[Detection]]],
+                                tiles_cache_key: Optional[str]):
+        """ Store detections of the processed tiles, for the next runs """
+        if checkpoint is not None:
+            tile_numbers = [checkpoint.get_tile_number(tile_params) for tile_params in tile_params_batched]
+            pickle.dump((tile_numbers, bounding_boxes_in_tile_batched), detections_file)
+            checkpoint.mark_tiles_completed(tile_params_batched, flush_results=lambda: self._flush_file(detections_file))
+
+        if incremental_manifest is not None:
+            for tile_params, bounding_boxes_in_tile in zip(tile_params_batched, bounding_boxes_in_tile_batched):
+                tiles_detections[incremental_manifest.get_tile_number(tile_params)] = bounding_boxes_in_tile
+                incremental_manifest.set_tile_processed(tile_params)
+
+        if tiles_cache_key is not None:
+            for tile_params, bounding_boxes_in_tile in zip(tile_params_batched, bounding_boxes_in_tile_batched):
+                self._add_bounding_boxes_to_tiles_cache(tiles_cache_key, tile_params, bounding_boxes_in_tile)
+
+    def _save_interrupted_detections(self,
+                                     checkpoint: Optional[ProcessingCheckpoint],
+                                     detections_file,
+                                     incremental_manifest: Optional[IncrementalManifest],
+                                     tiles_detections: Optional[Dict[int, List[Detection]]]):
+        """ Save detections of the processed tiles, so that the processing can be continued in the next run """
+        if checkpoint is not None:
+            checkpoint.save(flush_results=lambda: self._flush_file(detections_file))
+        if incremental_manifest is not None:
+            self._save_incremental_detections(incremental_manifest, tiles_detections)
+
+    @staticmethod
+    def _flush_file(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    @staticmethod
+    def _create_incremental_tile_params_filter(incremental_manifest: IncrementalManifest,
+                                               tiles_detections: Dict[int, List[Detection]],
+                                               cascade_filter: Optional[Callable[[TileParams], bool]],
+                                               ) -> Optional[Callable[[TileParams], bool]]:
+        """ Wrap the filter of the cascade (if any), to drop the previous detections of tiles rejected by it """
+        if cascade_filter is None:
+            return None
+
+        def tile_params_filter(tile_params: TileParams) -> bool:
+            if cascade_filter(tile_params):
+                return True
+            # no objects in the tile now, but there may be some in a later run, with the same tile input
+            tiles_detections.pop(incremental_manifest.get_tile_number(tile_params), None)
+            incremental_manifest.invalidate_tile(tile_params)
+            return False
+
+        return tile_params_filter
+
+    def _create_empty_tiles_detections_filter(self,
+                                              incremental_manifest: Optional[IncrementalManifest],
+                                              tiles_detections: Optional[Dict[int, List[Detection]]],
+                                              ) -> Callable[[np.ndarray, TileParams], bool]:
+        """ Create a filter of empty tiles (see `_create_empty_tiles_filter`), without detections in them """
+        def set_empty_tile_detections(tile_params: TileParams):
+            if incremental_manifest is not None:
+                tiles_detections[incremental_manifest.get_tile_number(tile_params)] = []
+                incremental_manifest.set_tile_processed(tile_params)
+
+        return self._create_empty_tiles_filter(on_empty_tile=set_empty_tile_detections)
+
+    def _create_cached_tiles_filter(self,
+                                    tiles_cache_key: str,
+                                    all_bounding_boxes: List[Detection]) -> Callable[[TileParams], bool]:
+        """ Create a tile filter (see `tiles_generator`), which adds detections of tiles from the cache
+        to `all_bounding_boxes`, so that only tiles not present in the cache are processed
+        """
+        def is_tile_not_cached(tile_params: TileParams) -> bool:
+            cached_bounding_boxes = TILES_RESULTS_CACHE.get((tiles_cache_key, self.get_global_tile_xy_bins(tile_params)))
+            if cached_bounding_boxes is None:
+                return True
+
+            bounding_boxes = copy.deepcopy(cached_bounding_boxes)
+            self.convert_bounding_boxes_to_absolute_positions(bounding_boxes, tile_params)
+            all_bounding_boxes.extend(bounding_boxes)
+            self._number_of_cached_tiles += 1
+            return False
+
+        return is_tile_not_cached
+
+    def _load_checkpoint_detections(self, checkpoint: ProcessingCheckpoint) -> List[Detection]:
+        """ Load detections of tiles completed before the processing was interrupted.
+        The file is rewritten with only these detections, dropping detections of tiles not marked as completed
+        (and a possibly incomplete last record), so that new detections can be appended to it.
+        """
+        file_path = checkpoint.get_file_path(self.CHECKPOINT_DETECTIONS_FILE_NAME)
+        records = []
+        if checkpoint.is_resumed and os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                while True:
+                    try:
+                        tile_numbers, bounding_boxes_batched = pickle.load(f)
+                    except (EOFError, pickle.UnpicklingError):
+                        break
+                    if all(checkpoint.is_tile_number_completed(tile_number) for tile_number in tile_numbers):
+                        records.append((tile_numbers, bounding_boxes_batched))
+
+        tmp_file_path = file_path + '.tmp'
+        with open(tmp_file_path, 'wb') as f:
+            for record in records:
+                pickle.dump(record, f)
+        os.replace(tmp_file_path, file_path)
+
+        return [d for _, bounding_boxes_batched in records for det in bounding_boxes_batched for d in det]
+
+    def _tiles_detections_batched(self,
+                                  raw_outputs_store: Optional[RawOutputsStore],
+                                  tile_params_filter: Optional[Callable[[TileParams], bool]],
+                                  tile_img_filter: Optional[Callable[[np.ndarray, TileParams], bool]],
+                                  ) -> Iterator[Tuple[List[List[Detection]], List[TileParams]]]:
+        """ Iterate over detections in tiles (in absolute positions), in batches.
+        If the raw outputs store is used, detections are post-processed from the stored raw model outputs
+        (see `MapProcessorWithModel._raw_outputs_batched`)
+        """
+        if raw_outputs_store is None:
+            for tile_img_batched, tile_params_batched in self.tiles_generator_batched(tile_params_filter=tile_params_filter,
+                                                                                      tile_img_filter=tile_img_filter):
+                yield self._process_tile(tile_img_batched, tile_params_batched), tile_params_batched
+        else:
+            for raw_outputs_batched, tile_params_batched in self._raw_outputs_batched(raw_outputs_store,
+                                                                                      tile_params_filter=tile_params_filter,
+                                                                                      tile_img_filter=tile_img_filter):
+                with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+                    bounding_boxes_batched = self.model.postprocessing(raw_outputs_batched)
+                yield self._convert_bounding_boxes_batched_to_absolute_positions(bounding_boxes_batched, tile_params_batched), \
+                    tile_params_batched
+
+    def _compact_raw_outputs(self, raw_outputs: List[np.ndarray]) -> List[np.ndarray]:
+        # only candidates which can pass the confidence threshold, usually a small fraction of all of them
+        return self.model.compact_raw_output(raw_outputs, min_confidence=self.detection_parameters.raw_outputs_min_confidence)
+
+    def _get_raw_outputs_metadata(self) -> dict:
+        return {'min_confidence': self.detection_parameters.raw_outputs_min_confidence}
+
+    def _add_bounding_boxes_to_tiles_cache(self,
+                                           tiles_cache_key: str,
+                                           tile_params: TileParams,
+                                           bounding_boxes: List[Detection]):
+        """ Add detections of the tile to the cache, with positions relative to the tile """
+        bounding_boxes_relative = copy.deepcopy(bounding_boxes)
+        for det in bounding_boxes_relative:
+            det.convert_to_global(offset_x=-tile_params.start_pixel_x, offset_y=-tile_params.start_pixel_y)
+
+        TILES_RESULTS_CACHE.put(
+            (tiles_cache_key, self.get_global_tile_xy_bins(tile_params)),
+            bounding_boxes_relative,
+            size_bytes=len(pickle.dumps(bounding_boxes_relative)))
+
+    def _load_incremental_detections(self, incremental_manifest: IncrementalManifest) -> Dict[int, List[Detection]]:
+        """ Load detections of each tile from the previous run (before removing overlapping detections) """
+        file_path = incremental_manifest.get_file_path(self.INCREMENTAL_DETECTIONS_FILE_NAME)
+        if not incremental_manifest.has_previous_results or not os.path.exists(file_path):
+            return {}
+
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+
+    def _save_incremental_detections(self,
+                                     incremental_manifest: IncrementalManifest,
+                                     tiles_detections: Dict[int, List[Detection]]):
+        """ Save detections of each tile (replaced atomically), and then the manifest """
+        file_path = incremental_manifest.get_file_path(self.INCREMENTAL_DETECTIONS_FILE_NAME)
+        tmp_file_path = file_path + '.tmp'
+        with open(tmp_file_path, 'wb') as f:
+            pickle.dump(tiles_detections, f)
+        os.replace(tmp_file_path, file_path)
+        incremental_manifest.save()
+
+    def _run_cascade_coarse_pass(self) -> Optional[Callable[[TileParams], bool]]:
+        """ First pass of the cascaded detection - detect objects at the coarse resolution (which is fast),
+        to process at the full resolution only tiles containing any candidate objects.
+
+        :return: filter of tiles for the full resolution pass, or None if processing was canceled
+        """
+        params = self.detection_parameters
+        coarse_model = params.cascade_model if params.cascade_model is not None else params.model
+        coarse_params = dataclasses.replace(
+            params,
+            resolution_cm_per_px=params.cascade_resolution_cm_per_px,
+            tile_size_px=self._get_cascade_tile_size_px(coarse_model),
+            model=coarse_model,
+            confidence=params.cascade_confidence if params.cascade_confidence is not None else params.confidence,
+            cascade_resolution_cm_per_px=None,
+            cascade_model=None,
+        )
+
+        coarse_units_per_pixel = processing_utils.convert_meters_to_rlayer_units(
+            self.rlayer, coarse_params.resolution_m_per_px)
+        coarse_extended_extent = extent_utils.calculate_extended_processing_extent(
+            base_extent=self.base_extent,
+            rlayer=self.rlayer,
+            params=coarse_params,
+            rlayer_units_per_pixel=coarse_units_per_pixel)
+
+        def convert_coarse_xyxy_to_full_image(coarse_xyxy: np.ndarray) -> np.ndarray:
+            # coarse image pixels -> rlayer crs -> full resolution image pixels
+            scale = coarse_units_per_pixel / self.rlayer_units_per_pixel
+            offset_x = (coarse_extended_extent.xMinimum() - self.extended_extent.xMinimum()) / self.rlayer_units_per_pixel
+            offset_y = (self.extended_extent.yMaximum() - coarse_extended_extent.yMaximum()) / self.rlayer_units_per_pixel
+            return coarse_xyxy * scale + np.array([offset_x, offset_y, offset_x, offset_y])
+
+        coarse_tiles_params = self._create_tiles_params_for_grid(coarse_params, coarse_units_per_pixel, coarse_extended_extent)
+        coarse_tiles_params = [  # only tiles within the processed area, as in the full resolution pass
+            tile_params for tile_params in coarse_tiles_params
+            if self._is_region_within_mask(convert_coarse_xyxy_to_full_image(self._get_tile_xyxy(tile_params)))]
+
+        # the model may be shared between both passes, so the full resolution parameters are restored afterwards
+        coarse_model.set_inference_params(confidence=coarse_params.confidence, iou_threshold=coarse_params.iou_threshold)
+        coarse_model.set_model_type_param(model_type=coarse_params.detector_type)
+        try:
+            coarse_detections = self._detect_objects_in_tiles(coarse_model, coarse_params, coarse_tiles_params)
+        finally:
+            self._set_model_inference_params()
+
+        if coarse_detections is None:
+            return None
+
+        logging.info(f'Cascade coarse pass: {len(coarse_detections)} candidate objects in {len(coarse_tiles_params)} tiles')
+        candidate_regions = self._convert_coarse_detections_to_candidate_regions(
+            coarse_detections, convert_coarse_xyxy_to_full_image)
+        self._cascade_tiles_total = 0
+        self._cascade_tiles_skipped = 0
+
+        def tile_params_filter(tile_params: TileParams) -> bool:
+            self._cascade_tiles_total += 1
+            is_tile_needed = self.is_tile_intersecting_regions(tile_params, candidate_regions)
+            if not is_tile_needed:
+                self._cascade_tiles_skipped += 1
+            return is_tile_needed
+
+        return tile_params_filter
+
+    def _get_cascade_tile_size_px(self, coarse_model: Detector) -> int:
+        """ Tile size for the coarse pass - input size of the coarse model. For models with dynamic input size
+        (given as a string), the tile size from the model metadata, or the same as in the full resolution pass
+        """
+        tile_size_px = coarse_model.get_input_size_in_pixels()[0]  # same x and y dimensions, so take x
+        if isinstance(tile_size_px, str):
+            tile_size_px = coarse_model.get_metadata_tile_size() or self.params.tile_size_px
+        return tile_size_px
+
+    @staticmethod
+    def _create_tiles_params_for_grid(params: DetectionParameters,
+                                      rlayer_units_per_pixel: float,
+                                      extended_extent: QgsRectangle) -> List[TileParams]:
+        """ Parameters of all tiles of a grid different than the one of this processor (e.g. at another resolution) """
+        _, _, x_bins_number, y_bins_number = extent_utils.calculate_tiles_grid_size(
+            extended_extent=extended_extent, rlayer_units_per_pixel=rlayer_units_per_pixel, params=params)
+        return [TileParams(x_bin_number=x_bin_number, y_bin_number=y_bin_number,
+                           x_bins_number=x_bins_number, y_bins_number=y_bins_number,
+                           params=params,
+                           processing_extent=extended_extent,
+                           rlayer_units_per_pixel=rlayer_units_per_pixel)
+                for y_bin_number in range(y_bins_number) for x_bin_number in range(x_bins_number)]
+
+    @staticmethod
+    def _get_tile_xyxy(tile_params: TileParams) -> np.ndarray:
+        """ Tile (x_min, y_min, x_max, y_max) in its image pixels, to the further edge of the last pixel """
+        return np.array([tile_params.start_pixel_x, tile_params.start_pixel_y,
+                         tile_params.start_pixel_x + tile_params.params.tile_size_px,
+                         tile_params.start_pixel_y + tile_params.params.tile_size_px], dtype=np.float64)
+
+    def _is_region_within_mask(self, region_xyxy: np.ndarray) -> bool:
+        """ Whether the region (x_min, y_min, x_max, y_max) in full resolution image pixels
+        has any part within the processed area
+        """
+        if self.area_mask_img is None:
+            return True
+        x_min, y_min = np.floor(region_xyxy[:2]).astype(np.int64)
+        x_max, y_max = np.ceil(region_xyxy[2:]).astype(np.int64) - 1  # inclusive
+        return bool(self.area_mask_img.count_non_zero_pixels_in_rectangles(np.array([[x_min, y_min, x_max, y_max]]))[0] > 0)
+
+    def _detect_objects_in_tiles(self,
+                                 model: Detector,
+                                 params: DetectionParameters,
+                                 tiles_params: List[TileParams]) -> Optional[List[Detection]]:
+        """ Run the model on the tiles (e.g. of the coarse pass grid, read with their own parameters), in batches,
+        then remove overlapping detections. Inference parameters of the model need to be set already
+
+        :return: detections in pixels of the tiles grid image, or None if processing was canceled
+        """
+        all_bounding_boxes = []  # type: List[Detection]
+        for i in range(0, len(tiles_params), params.batch_size):
+            if self.isCanceled():
+                return None
+
+            tile_params_batched = tiles_params[i:i + params.batch_size]
+            with self.processing_stats.measure(ProcessingStage.TILE_READ):
+                tile_img_batched = np.array([
+                    processing_utils.get_tile_image(rlayer=self.rlayer, extent=tile_params.extent, params=params)
+                    for tile_params in tile_params_batched])
+            for tile_img in tile_img_batched:
+                self.processing_stats.add_tile_read(tile_img)
+
+            bounding_boxes_batched = self._detect_objects_in_tiles_batch(model, tile_img_batched, tile_params_batched)
+            all_bounding_boxes += [d for det in bounding_boxes_batched for d in det]
+
+        if len(all_bounding_boxes) == 0:
+            return []
+        with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+            return self.remove_overlaping_detections(all_bounding_boxes, iou_threshold=params.iou_threshold,
+                                                     with_rot=params.detector_type == DetectorType.YOLO_ULTRALYTICS_OBB)
+
+    def _convert_coarse_detections_to_candidate_regions(self,
+                                                        coarse_detections: List[Detection],
+                                                        convert_coarse_xyxy_to_full_image: Callable[[np.ndarray], np.ndarray],
+                                                        ) -> np.ndarray:
+        """ Convert bounding boxes from the coarse pass image to the full resolution image, extended with a margin
+
+        :return: array of regions (x_min, y_min, x_max, y_max) in full resolution image pixels, shape (N, 4)
+        """
+        if len(coarse_detections) == 0:
+            return np.zeros((0, 4), dtype=np.float64)
+
+        coarse_xyxy = np.array([det.get_bbox_xyxy() for det in coarse_detections], dtype=np.float64)
+        coarse_xyxy[:, 2:] += 1  # to the further edge of the last pixel
+
+        regions = convert_coarse_xyxy_to_full_image(coarse_xyxy)
+        margin = self.detection_parameters.cascade_margin_px
+        regions += np.array([-margin, -margin, margin, margin])
+        return regions
+
+    @staticmethod
+    def is_tile_intersecting_regions(tile_params: TileParams, regions_xyxy: np.ndarray) -> bool:
+        """ Check if tile (in full image pixels) intersects any of the regions (x_min, y_min, x_max, y_max) """
+        if len(regions_xyxy) == 0:
+            return False
+
+        tile_x_min = tile_params.start_pixel_x
+        tile_y_min = tile_params.start_pixel_y
+        tile_x_max = tile_x_min + tile_params.params.tile_size_px
+        tile_y_max = tile_y_min + tile_params.params.tile_size_px
+
+        x_min, y_min, x_max, y_max = regions_xyxy.T
+        is_intersecting = (x_min < tile_x_max) & (x_max > tile_x_min) & (y_min < tile_y_max) & (y_max > tile_y_min)
+        return bool(np.any(is_intersecting))
+
+    def get_cascade_tiles_statistics(self) -> Tuple[int, int]:
+        """ Number of tiles considered in the full resolution pass of cascaded detection, and how many of them
+        were skipped (as no candidate objects were found there in the coarse pass)
+
+        :return: tuple (total_tiles, skipped_tiles)
+        """
+        return self._cascade_tiles_total, self._cascade_tiles_skipped
+
+    def _create_cascade_result_message(self) -> str:
+        total, skipped = self.get_cascade_tiles_statistics()
+        skipped_percentage = skipped / total * 100 if total else 0
+        return f'Cascade detection: skipped {skipped} of {total} tiles ({skipped_percentage:.2f} %) ' \
+               f'in the full resolution pass\n'
+
     def limit_bounding_boxes_to_processed_area(self, bounding_boxes: List[Detection]) -> List[Detection]:
         """
         Limit all bounding boxes to the constrained area that we process.
         E.g. if we are detecting peoples in a circle, we don't want to count peoples in the entire rectangle
 
+        Coverage of all bounding boxes is calculated with the area mask chunks, without rasterizing the whole mask.
+
         :return:
         """
-        bounding_boxes_restricted = []
-        for det in bounding_boxes:
-            # if bounding box is not in the area_mask_img (at least in some percentage) - remove it
+        if len(bounding_boxes) == 0:
+            return []
 
-            if self.area_mask_img is not None:
-                det_slice = det.bbox.get_slice()
-                area_subimg = self.area_mask_img[det_slice]
-                pixels_in_area = np.count_nonzero(area_subimg)
-            else:
-                det_bounding_box = det.bbox
-                pixels_in_area = self.base_extent_bbox_in_full_image.calculate_overlap_in_pixels(det_bounding_box)
-            total_pixels = det.bbox.get_area()
-            coverage = pixels_in_area / total_pixels
-            if coverage > 0.5:  # some arbitrary value, 50% seems reasonable
-                bounding_boxes_restricted.append(det)
+        bboxes_xyxy = np.array([det.get_bbox_xyxy() for det in bounding_boxes], dtype=np.int64)
+        x_min, y_min, x_max, y_max = bboxes_xyxy.T
+
+        # if bounding box is not in the area_mask_img (at least in some percentage) - remove it
+        if self.area_mask_img is not None:
+            pixels_in_area = self.area_mask_img.count_non_zero_pixels_in_rectangles(bboxes_xyxy)
+        else:
+            # same as BoundingBox.calculate_overlap_in_pixels, for all bounding boxes
+            b = self.base_extent_bbox_in_full_image
+            dx = np.minimum(x_max, b.x_max) - np.maximum(x_min, b.x_min)
+            dy = np.minimum(y_max, b.y_max) - np.maximum(y_min, b.y_min)
+            pixels_in_area = np.where((dx >= 0) & (dy >= 0), dx * dy, 0)
 
-        return bounding_boxes_restricted
+        total_pixels = (y_max - y_min + 1) * (x_max - x_min + 1)  # same as BoundingBox.get_area
+        coverage = pixels_in_area / total_pixels
+        is_in_area = coverage > 0.5  # some arbitrary value, 50% seems reasonable
+
+        return [det for det, keep in zip(bounding_boxes, is_in_area) if keep]
 
     def _create_result_message(self, bounding_boxes: List[Detection]) -> str:
         # hack, allways one output
@@ -118,8 +641,71 @@ class MapProcessorDetection(MapProcessorWithModel):
 
         return txt
 
+    def _get_output_file_path(self, channel_id: int) -> str:
+        """ Path of the file for detections of the given class (GeoPackage keeps all classes in one file) """
+        output_format = self.detection_parameters.output_format
+
+        file_path_base = self.detection_parameters.output_file_path
+        if file_path_base is None:
+            file_path_base = os.path.join(TMP_DIR_PATH, f'detections__{self._output_files_id}')
+
+        if output_format == DetectionOutputFormat.GEOPACKAGE:
+            return f'{file_path_base}.{output_format.get_file_extension()}'
+        return f'{file_path_base}_{channel_id}.{output_format.get_file_extension()}'
+
+    def _create_feature_for_detection(self, det: Detection) -> Optional[QgsFeature]:
+        """ Create polygon feature (bounding box or instance mask outline) with attributes for a single detection """
+        if det.mask is None:
+            bbox_corners_pixels = det.bbox.get_4_corners()
+            polygon_crs = processing_utils.transform_points_list_xy_to_target_crs(
+                points=bbox_corners_pixels,
+                extent=self.extended_extent,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+            )
+        else:
+            # contours are found only within the (small) area of the mask, then moved to its position
+            contours, _ = cv2.findContours(det.mask.to_mask(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours = sorted(contours, key=cv2.contourArea, reverse=True)
+
+            x_offset, y_offset = det.mask.x_offset, det.mask.y_offset
+
+            if len(contours) == 0:
+                return None
+
+            countur = contours[0]
+
+            corners = []
+            for point in countur:
+                corners.append(int(point[0][0]) + x_offset)
+                corners.append(int(point[0][1]) + y_offset)
+
+            mask_corners_pixels = cv2.convexHull(np.array(corners).reshape((-1, 2))).squeeze()
+
+            polygon_crs = processing_utils.transform_points_list_xy_to_target_crs(
+                points=mask_corners_pixels,
+                extent=self.extended_extent,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+            )
+
+        feature = QgsFeature(DetectionsVectorFileSink.get_fields())
+        polygon_xy_vec_vec = [
+            polygon_crs
+        ]
+        geometry = QgsGeometry.fromPolygonXY(polygon_xy_vec_vec)
+        feature.setGeometry(geometry)
+        feature.setAttributes([
+            int(det.clss),
+            self.model.get_channel_name(0, det.clss),
+            float(det.conf),
+            float(np.degrees(det.bbox.rot)),
+        ])
+        return feature
+
     def _create_vlayer_for_output_bounding_boxes(self, bounding_boxes: List[Detection]):
-        vlayers = []
+        """ Save detections to a vector file (one layer for each class), in batches.
+        Only the finished files are loaded as layers, in the GUI thread.
+        """
+        layers_uris_and_names = []
 
         # hack, allways one output
         model_outputs = self._get_indexes_of_model_output_channels_to_create()
@@ -129,71 +715,32 @@ class MapProcessorDetection(MapProcessorWithModel):
             filtered_bounding_boxes = [det for det in bounding_boxes if det.clss == channel_id]
             print(f'Detections for class {channel_id}: {len(filtered_bounding_boxes)}')
 
-            features = []
+            layer_name = self.model.get_channel_name(0, channel_id)
+            sink = DetectionsVectorFileSink(
+                file_path=self._get_output_file_path(channel_id),
+                layer_name=layer_name,
+                output_format=self.detection_parameters.output_format,
+                crs=self.rlayer.crs())
+
             for det in filtered_bounding_boxes:
-                if det.mask is None:
-                    bbox_corners_pixels = det.bbox.get_4_corners()
-                    bbox_corners_crs = processing_utils.transform_points_list_xy_to_target_crs(
-                        points=bbox_corners_pixels,
-                        extent=self.extended_extent,
-                        rlayer_units_per_pixel=self.rlayer_units_per_pixel,
-                    )
-                    feature = QgsFeature()
-                    polygon_xy_vec_vec = [
-                        bbox_corners_crs
-                    ]
-                    geometry = QgsGeometry.fromPolygonXY(polygon_xy_vec_vec)
-                    feature.setGeometry(geometry)
-                    features.append(feature)
-                else:
-                    contours, _ = cv2.findContours(det.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    contours = sorted(contours, key=cv2.contourArea, reverse=True)
-
-                    x_offset, y_offset = det.mask_offsets
-
-                    if len(contours) > 0:
-                        countur = contours[0]
-
-                        corners = []
-                        for point in countur:
-                            corners.append(int(point[0][0]) + x_offset)
-                            corners.append(int(point[0][1]) + y_offset)
-
-                        mask_corners_pixels = cv2.convexHull(np.array(corners).reshape((-1, 2))).squeeze()
-
-                        mask_corners_crs = processing_utils.transform_points_list_xy_to_target_crs(
-                            points=mask_corners_pixels,
-                            extent=self.extended_extent,
-                            rlayer_units_per_pixel=self.rlayer_units_per_pixel,
-                        )
-
-                        feature = QgsFeature()
-                        polygon_xy_vec_vec = [
-                            mask_corners_crs
-                        ]
-                        geometry = QgsGeometry.fromPolygonXY(polygon_xy_vec_vec)
-                        feature.setGeometry(geometry)
-                        features.append(feature)
-
-            vlayer = QgsVectorLayer("multipolygon", self.model.get_channel_name(0, channel_id), "memory")
-            vlayer.setCrs(self.rlayer.crs())
-            prov = vlayer.dataProvider()
-
-            color = vlayer.renderer().symbol().color()
-            OUTPUT_VLAYER_COLOR_TRANSPARENCY = 80
-            color.setAlpha(OUTPUT_VLAYER_COLOR_TRANSPARENCY)
-            vlayer.renderer().symbol().setColor(color)
-            # TODO - add also outline for the layer (thicker black border)
-
-            prov.addFeatures(features)
-            vlayer.updateExtents()
-
-            vlayers.append(vlayer)
+                feature = self._create_feature_for_detection(det)
+                if feature is not None:
+                    sink.add_feature(feature)
+
+            layers_uris_and_names.append((sink.finish(), layer_name))
 
         # accessing GUI from non-GUI thread is not safe, so we need to delegate it to the GUI thread
         def add_to_gui():
             group = QgsProject.instance().layerTreeRoot().insertGroup(0, 'model_output')
-            for vlayer in vlayers:
+            for layer_uri, layer_name in layers_uris_and_names:
+                vlayer = QgsVectorLayer(layer_uri, layer_name, 'ogr')
+
+                color = vlayer.renderer().symbol().color()
+                OUTPUT_VLAYER_COLOR_TRANSPARENCY = 80
+                color.setAlpha(OUTPUT_VLAYER_COLOR_TRANSPARENCY)
+                vlayer.renderer().symbol().setColor(color)
+                # TODO - add also outline for the layer (thicker black border)
+
                 QgsProject.instance().addMapLayer(vlayer, False)
                 group.addLayer(vlayer)
 
@@ -268,8 +815,19 @@ class MapProcessorDetection(MapProcessorWithModel):
             det.convert_to_global(offset_x=tile_params.start_pixel_x, offset_y=tile_params.start_pixel_y)
 
     def _process_tile(self, tile_img: np.ndarray, tile_params_batched: List[TileParams]) -> np.ndarray:
-        bounding_boxes_batched: List[Detection] = self.model.process(tile_img)
-
+        return self._detect_objects_in_tiles_batch(self.model, tile_img, tile_params_batched)
+
+    def _detect_objects_in_tiles_batch(self,
+                                       model: Detector,
+                                       tile_img_batched: np.ndarray,
+                                       tile_params_batched: List[TileParams]) -> List[List[Detection]]:
+        """ Detect objects in a batch of tiles, in absolute positions (in pixels of the tiles grid image) """
+        bounding_boxes_batched: List[Detection] = model.process(tile_img_batched, processing_stats=self.processing_stats)
+        return self._convert_bounding_boxes_batched_to_absolute_positions(bounding_boxes_batched, tile_params_batched)
+
+    def _convert_bounding_boxes_batched_to_absolute_positions(self,
+                                                               bounding_boxes_batched: List[List[Detection]],
+                                                               tile_params_batched: List[TileParams]) -> List[List[Detection]]:
         for bounding_boxes, tile_params in zip(bounding_boxes_batched, tile_params_batched):
             self.convert_bounding_boxes_to_absolute_positions(bounding_boxes, tile_params)
 
@@ -0,0 +1,152 @@
+""" This file implements running several models over the same tiles in one pass """
+
+import dataclasses
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from qgis.core import QgsRasterLayer, QgsTask, QgsVectorLayer
+from qgis.gui import QgsMapCanvas
+from qgis.PyQt.QtCore import pyqtSignal
+
+from deepness.common.channels_mapping import ChannelsMapping
+from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters
+from deepness.processing import processing_utils
+from deepness.processing.map_processor.map_processing_result import MapProcessingResult
+from deepness.processing.map_processor.map_processor import MapProcessor
+from deepness.processing.map_processor.utils.shared_tiles_reader import SharedTilesReader
+from deepness.processing.models.model_base import ModelBase
+from deepness.processing.models.model_types import ModelDefinition
+from deepness.processing.tile_params import TileParams
+
+
+class MapProcessorMultiModel(QgsTask):
+    """
+    Runs several models (e.g. segmentation, detection and regression) over the same tiles in one pass.
+    Each tile is read once (see `SharedTilesReader`), and processed by the map processors of all models -
+    each with its own channels mapping, preprocessing and post-processing, producing its own results.
+
+    Processors run in parallel threads, so models need the same tiles grid - the same resolution, tile size,
+    overlap and processed area.
+    """
+
+    # signal emitted when processing of all models is finished, with the results (in the order of models)
+    finished_signal = pyqtSignal(list)
+
+    PROGRESS_UPDATE_INTERVAL_S = 0.5
+
+    def __init__(self,
+                 rlayer: QgsRasterLayer,
+                 vlayer_mask: Optional[QgsVectorLayer],
+                 map_canvas: Optional[QgsMapCanvas],
+                 models_with_params: List[Tuple[ModelBase, MapProcessingParameters]]):
+        """
+        :param rlayer: raster layer which is being processed
+        :param vlayer_mask: vector layer with outline of area which should be processed (within rlayer)
+        :param map_canvas: active map canvas (in the GUI), required if processing visible map area
+        :param models_with_params: models with their processing parameters (of the model type)
+        """
+        QgsTask.__init__(self, self.__class__.__name__)
+        if not models_with_params:
+            raise Exception("No models to process!")
+
+        self.rlayer = rlayer
+        self.map_processors = []  # type: List[MapProcessor]
+        for model, params in models_with_params:
+            params = dataclasses.replace(params, model=model)
+            map_processor_class = ModelDefinition.get_definition_for_params(params).map_processor_class
+            self.map_processors.append(map_processor_class(
+                rlayer=rlayer,
+                vlayer_mask=vlayer_mask,
+                map_canvas=map_canvas,
+                params=params))
+
+        self._check_tiles_grids_are_compatible()
+        self._processing_results = []  # type: List[MapProcessingResult]
+
+        image_channels_indexes = sorted({
+            index for map_processor in self.map_processors for index in self._get_image_channels_indexes(map_processor)})
+        self._read_params = dataclasses.replace(
+            self.map_processors[0].params,
+            input_channels_mapping=self._create_channels_mapping_for_image_channels(image_channels_indexes))
+
+        self.shared_tiles_reader = SharedTilesReader(
+            read_tile_image=self._read_tile_image,
+            max_tiles_ahead=2 * max(map_processor.params.batch_size for map_processor in self.map_processors))
+        for map_processor in self.map_processors:
+            self.shared_tiles_reader.add_consumer(
+                map_processor,
+                channels_indexes=[image_channels_indexes.index(index)
+                                  for index in self._get_image_channels_indexes(map_processor)])
+            map_processor.set_shared_tiles_reader(self.shared_tiles_reader)
+
+    def _check_tiles_grids_are_compatible(self):
+        first_processor = self.map_processors[0]
+        for map_processor in self.map_processors[1:]:
+            if map_processor.extended_extent != first_processor.extended_extent \
+                    or map_processor.rlayer_units_per_pixel != first_processor.rlayer_units_per_pixel \
+                    or map_processor.params.tile_size_px != first_processor.params.tile_size_px \
+                    or map_processor.stride_px != first_processor.stride_px:
+                raise Exception(
+                    f"Models need the same tiles grid to be processed in one pass (resolution, tile size, overlap "
+                    f"and processed area)! Tiles of {map_processor.params.tile_size_px} px with stride "
+                    f"{map_processor.stride_px} px at {map_processor.params.resolution_cm_per_px} cm/px differ from tiles of "
+                    f"{first_processor.params.tile_size_px} px with stride {first_processor.stride_px} px "
+                    f"at {first_processor.params.resolution_cm_per_px} cm/px")
+
+    @staticmethod
+    def _get_image_channels_indexes(map_processor: MapProcessor) -> List[int]:
+        """ Indexes of the image channels for the model inputs of the processor """
+        channels_mapping = map_processor.params.input_channels_mapping
+        return [channels_mapping.get_image_channel_index_for_model_input(i)
+                for i in range(channels_mapping.get_number_of_model_inputs())]
+
+    def _create_channels_mapping_for_image_channels(self, image_channels_indexes: List[int]) -> ChannelsMapping:
+        """ Channels mapping reading the image channels (needed by any model), in the order of indexes """
+        channels_mapping = ChannelsMapping()
+        channels_mapping.set_image_channels(self.map_processors[0].params.input_channels_mapping.get_image_channels())
+        channels_mapping.set_number_of_model_inputs(len(image_channels_indexes))
+        for i, image_channel_index in enumerate(image_channels_indexes):
+            channels_mapping.set_image_channel_for_model_input(i, image_channel_index)
+        return channels_mapping
+
+    def _read_tile_image(self, tile_params: TileParams):
+        return processing_utils.get_tile_image(rlayer=self.rlayer, extent=tile_params.extent, params=self._read_params)
+
+    def _run_map_processor(self, map_processor: MapProcessor):
+        try:
+            map_processor.run()
+        finally:
+            self.shared_tiles_reader.set_consumer_finished(map_processor)  # e.g. if the processing failed
+
+    def run(self):
+        threads = [threading.Thread(target=self._run_map_processor, args=(map_processor,))
+                   for map_processor in self.map_processors]
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads):
+            if self.isCanceled():
+                for map_processor in self.map_processors:
+                    map_processor.cancel()
+            self.setProgress(sum(map_processor.progress() for map_processor in self.map_processors) / len(self.map_processors))
+            time.sleep(self.PROGRESS_UPDATE_INTERVAL_S)
+
+        for thread in threads:
+            thread.join()
+        self._processing_results = [map_processor.get_processing_result() for map_processor in self.map_processors]
+        logging.info(f'Multi-model processing: {self.shared_tiles_reader.number_of_tiles_read} tiles read '
+                     f'for {len(self.map_processors)} models')
+        return True
+
+    def get_processing_results(self) -> List[MapProcessingResult]:
+        """ Results of all models (in the order of models), available after `run` """
+        return self._processing_results
+
+    def finished(self, result: bool):
+        # layers of all models are added to the GUI (and their finished signals emitted) in the GUI thread
+        for map_processor in self.map_processors:
+            map_processor.finished(result)
+        self._processing_results = [map_processor.get_processing_result() for map_processor in self.map_processors]
+        self.finished_signal.emit(self._processing_results)
@@ -2,12 +2,12 @@
 
 import os
 import uuid
-from typing import List
+from typing import List, Optional, Tuple
 
 import numpy as np
-from numpy.linalg import norm
 from osgeo import gdal, osr
-from qgis.core import QgsProject, QgsRasterLayer
+from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsProject, QgsRasterLayer, QgsVectorLayer
+from qgis.PyQt.QtCore import QVariant
 
 from deepness.common.defines import IS_DEBUG
 from deepness.common.lazy_package_loader import LazyPackageLoader
@@ -17,6 +17,11 @@ from deepness.processing.map_processor.map_processing_result import (MapProcessi
                                                                      MapProcessingResultFailed,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor_with_model import MapProcessorWithModel
+from deepness.processing.map_processor.utils.cache_key import compute_file_hash, create_cache_key
+from deepness.processing.map_processor.utils.tile_embeddings_index import TileEmbeddingsIndex
+from deepness.processing.map_processor.utils.tiles_grid_heatmap import TilesGridHeatmap
+from deepness.processing.memory_budget import MemoryItem
+from deepness.processing.tile_params import TileParams
 
 cv2 = LazyPackageLoader('cv2')
 
@@ -30,63 +35,214 @@ class MapProcessorRecognition(MapProcessorWithModel):
         super().__init__(params=params, model=params.model, **kwargs)
         self.recognition_parameters = params
         self.model = params.model
+        self._heatmaps = None  # type: Optional[List[TilesGridHeatmap]]
+        self._top_k_matches = None
+
+    def _get_memory_items(self) -> List[MemoryItem]:
+        # tile embeddings are always memory-mapped (see `TileEmbeddingsIndex`),
+        # heatmaps are stored on a grid of tile edges and saved row by row (see `TilesGridHeatmap`)
+        heatmap_cells = (2 * self.x_bins_number + 2) * (2 * self.y_bins_number + 2)
+        number_of_queries = len(self.params.all_query_image_paths)
+        return super()._get_memory_items() + [
+            MemoryItem('similarity heatmaps', number_of_queries * heatmap_cells * (4 + 4 + 2), can_be_memmapped=False),
+        ]
 
     def _run(self) -> MapProcessingResult:
-        try:
-            query_img = cv2.imread(self.recognition_parameters.query_image_path)
-            assert query_img is not None, f"Error occurred while reading query image: {self.recognition_parameters.query_image_path}"
-        except Exception as e:
-            return MapProcessingResultFailed(f"Error occurred while reading query image: {e}")
-
-        # some hardcoded code for recognition model
-        query_img = cv2.cvtColor(query_img, cv2.COLOR_BGR2RGB)
-        query_img_resized = cv2.resize(query_img, self.model.get_input_shape()[2:4][::-1])
-        query_img_batched = np.array([query_img_resized])
-
-        query_img_emb = self.model.process(query_img_batched)[0][0]
-
-        final_shape_px = (
-            self.img_size_y_pixels,
-            self.img_size_x_pixels,
+        if not self._get_tiles_params_within_mask():
+            return MapProcessingResultSuccess(message='Recognition ended, no tiles to process within the processed area')
+
+        query_imgs_embeddings = []
+        for query_image_path in self.recognition_parameters.all_query_image_paths:
+            try:
+                query_img = cv2.imread(query_image_path)
+                assert query_img is not None, f"Error occurred while reading query image: {query_image_path}"
+            except Exception as e:
+                return MapProcessingResultFailed(f"Error occurred while reading query image: {e}")
+
+            # some hardcoded code for recognition model
+            query_img = cv2.cvtColor(query_img, cv2.COLOR_BGR2RGB)
+            query_img_resized = cv2.resize(query_img, self.model.get_input_shape()[2:4][::-1])
+            query_img_batched = np.array([query_img_resized])
+
+            query_imgs_embeddings.append(self.model.process(query_img_batched)[0][0])
+
+        index = TileEmbeddingsIndex(self._get_embeddings_index_dir())
+        if index.exists():
+            print(f'Using existing tile embeddings index: {index.index_dir}')
+            index.load()
+        else:
+            if not self._create_embeddings_index(index):
+                return MapProcessingResultCanceled()
+
+        query_imgs_embeddings = np.array(query_imgs_embeddings)
+        query_names = [os.path.splitext(os.path.basename(query_image_path))[0]
+                       for query_image_path in self.recognition_parameters.all_query_image_paths]
+        tiles_xy_bins = index.get_tiles_xy_bins()
+        top_k = self.recognition_parameters.top_k
+
+        gui_delegates = []
+        result_message = ''
+        if top_k is not None:
+            top_k_indices, top_k_similarities = index.query_top_k(query_imgs_embeddings, k=top_k)
+            self._top_k_matches = []
+            for query_name, indices, query_similarities in zip(query_names, top_k_indices, top_k_similarities):
+                matches = [(int(x_bin), int(y_bin), float(similarity))
+                           for (x_bin, y_bin), similarity in zip(tiles_xy_bins[indices], query_similarities)]
+                self._top_k_matches.append(matches)
+                gui_delegates.append(self._create_vlayer_for_top_k_matches(matches, layer_name=query_name))
+                result_message += self._create_top_k_result_message(matches, query_name)
+
+        if top_k is None or self.recognition_parameters.heatmap_with_top_k:
+            # cosine similarity of each query image to each tile, all at once
+            similarities = index.query(query_imgs_embeddings)
+            gui_delegates += self._create_heatmaps(similarities, tiles_xy_bins, query_names)
+
+            x_high, y_high = tiles_xy_bins[np.argmax(similarities[0])]
+            result_message += self._create_result_message(self._heatmaps[0].image_shape_yx, x_high*self.params.tile_size_px, y_high*self.params.tile_size_px)
+
+        def gui_delegate():
+            for delegate in gui_delegates:
+                delegate()
+
+        return MapProcessingResultSuccess(
+            message=result_message,
+            gui_delegate=gui_delegate,
         )
 
+    def _create_heatmaps(self, similarities: np.ndarray, tiles_xy_bins: np.ndarray, query_names: List[str]) -> list:
+        """ Create a raster with similarity of each tile, for each query image.
+        Similarity is constant within a tile, so it is accumulated on a grid of tile edges, not for each pixel
+
+        :return: list of gui delegates, adding the rasters to the project
+        """
         stride = self.stride_px
-        full_result_img = np.zeros(final_shape_px, np.float32)
-        mask = np.zeros_like(full_result_img, dtype=np.int16)
-        highest = 0
-        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
-            if self.isCanceled():
-                return MapProcessingResultCanceled()
+        size = self.params.tile_size_px
 
-            tile_result_batched = self._process_tile(tile_img_batched)[0]
+        heatmaps = []
+        gui_delegates = []
+        for query_name, query_similarities in zip(query_names, similarities):
+            heatmap = TilesGridHeatmap(
+                tiles_xy_px=tiles_xy_bins * stride,
+                tile_size_px=size,
+                image_shape_yx=(self.img_size_y_pixels, self.img_size_x_pixels))
+            heatmap.set_tiles_values(query_similarities)
 
-            for tile_result, tile_params in zip(tile_result_batched, tile_params_batched):
-                cossim = np.dot(query_img_emb, tile_result)/(norm(query_img_emb)*norm(tile_result))
+            x_high, y_high = tiles_xy_bins[np.argmax(query_similarities)]
+            heatmap.add_tile_outline(x_px=x_high * stride, y_px=y_high * stride, size_px=size)
+            heatmaps.append(heatmap)
 
-                x_bin = tile_params.x_bin_number
-                y_bin = tile_params.y_bin_number
-                size = self.params.tile_size_px
+            gui_delegates.append(self._create_rlayers_from_heatmap_for_base_extent(heatmap, layer_name=query_name))
 
-                if cossim > highest:
-                    highest = cossim
-                    x_high = x_bin
-                    y_high = y_bin
+        self._heatmaps = heatmaps
+        return gui_delegates
 
-                full_result_img[y_bin*stride:y_bin*stride+size, x_bin*stride:x_bin*stride + size] += cossim
-                mask[y_bin*stride:y_bin*stride+size, x_bin*stride:x_bin*stride + size] += 1
+    def get_result_img(self, dense: bool = True) -> np.ndarray:
+        """ Full resolution similarity image for the first query image (created on request, it may be large).
+        The image is always dense (`dense` is kept for compatibility with `MapProcessor.get_result_img`)
+        """
+        return self.get_all_result_imgs()[0]
 
-        full_result_img = full_result_img/mask
-        self.set_results_img(full_result_img)
+    def get_all_result_imgs(self) -> List[np.ndarray]:
+        """ Result images for all query images (in the same order as `RecognitionParameters.all_query_image_paths`) """
+        if self._heatmaps is None:
+            raise Exception("Result image not yet created!")
+        return [heatmap.get_full_image() for heatmap in self._heatmaps]
 
-        gui_delegate = self._create_rlayers_from_images_for_base_extent(self.get_result_img(), x_high, y_high, size, stride)
-        result_message = self._create_result_message(self.get_result_img(), x_high*self.params.tile_size_px, y_high*self.params.tile_size_px)
-        return MapProcessingResultSuccess(
-            message=result_message,
-            gui_delegate=gui_delegate,
+    def get_top_k_matches(self) -> List[List[Tuple[int, int, float]]]:
+        """ Best matching tiles for all query images, in top-k mode
+
+        :return: for each query image, list of (x_bin_number, y_bin_number, similarity), from the best match
+        """
+        return self._top_k_matches
+
+    def _create_top_k_result_message(self, matches: List[Tuple[int, int, float]], query_name: str) -> str:
+        txt = f'Recognition ended, {len(matches)} best matches for "{query_name}":\n'
+        for rank, (x_bin, y_bin, similarity) in enumerate(matches, start=1):
+            txt += f' {rank}. tile at {x_bin * self.stride_px}, {y_bin * self.stride_px}: score = {similarity:.4f}\n'
+        return txt
+
+    def _create_vlayer_for_top_k_matches(self, matches: List[Tuple[int, int, float]], layer_name: str):
+        """ Create a layer with outlines of the best matching tiles, with their rank and score """
+        vlayer = QgsVectorLayer("polygon", f'{layer_name} - top {len(matches)}', "memory")
+        vlayer.setCrs(self.rlayer.crs())
+        prov = vlayer.dataProvider()
+        prov.addAttributes([QgsField('rank', QVariant.Int), QgsField('score', QVariant.Double)])
+        vlayer.updateFields()
+
+        features = []
+        for rank, (x_bin, y_bin, similarity) in enumerate(matches, start=1):
+            tile_params = self._create_tile_params(x_bin_number=x_bin, y_bin_number=y_bin)
+            feature = QgsFeature(vlayer.fields())
+            feature.setGeometry(QgsGeometry.fromRect(tile_params.extent))
+            feature.setAttributes([rank, similarity])
+            features.append(feature)
+
+        prov.addFeatures(features)
+        vlayer.updateExtents()
+
+        # accessing GUI from non-GUI thread is not safe, so we need to delegate it to the GUI thread
+        def add_to_gui():
+            group = QgsProject.instance().layerTreeRoot().insertGroup(0, 'Recognition best matches')
+            QgsProject.instance().addMapLayer(vlayer, False)
+            group.addLayer(vlayer)
+
+        return add_to_gui
+
+    def _get_embeddings_index_dir(self) -> str:
+        """ Index directory, specific for all parameters which influence the tile embeddings """
+        tiles_xy_bins = [(tile_params.x_bin_number, tile_params.y_bin_number)
+                         for tile_params in self._get_tiles_params_within_mask()]
+
+        index_key = create_cache_key(
+            layer_source=self.rlayer.source(),
+            extent=self.extended_extent.toString(),
+            rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+            tile_size_px=self.params.tile_size_px,
+            stride_px=self.stride_px,
+            input_channels_mapping=self.params.input_channels_mapping,
+            tiles_xy_bins=tiles_xy_bins,
+            model_hash=compute_file_hash(self.model.model_file_path),
         )
 
-    def _create_result_message(self, result_img: List[np.ndarray], x_high, y_high) -> str:
-        txt = f"Recognition ended, best result found at {x_high}, {y_high}, {result_img.shape}"
+        index_base_dir = self.recognition_parameters.embeddings_index_dir
+        if index_base_dir is None:
+            index_base_dir = os.path.join(TMP_DIR_PATH, 'tile_embeddings_index')
+        return os.path.join(index_base_dir, index_key)
+
+    def _get_tiles_params_within_mask(self) -> List[TileParams]:
+        """ Parameters of all tiles to process, without reading the tile images """
+        tiles_params = []
+        for y_bin_number in range(self.y_bins_number):
+            for x_bin_number in range(self.x_bins_number):
+                tile_params = self._create_tile_params(x_bin_number=x_bin_number, y_bin_number=y_bin_number)
+                if tile_params.is_tile_within_mask(self.area_mask_img):
+                    tiles_params.append(tile_params)
+        return tiles_params
+
+    def _create_embeddings_index(self, index: TileEmbeddingsIndex) -> bool:
+        """ Run the model over all tiles and save their embeddings in the index
+
+        :return: False if processing was canceled
+        """
+        number_of_tiles = len(self._get_tiles_params_within_mask())
+        embedding_size = self.model.get_number_of_output_channels()[0]
+        index.create(number_of_tiles=number_of_tiles, embedding_size=embedding_size)
+
+        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
+            if self.isCanceled():
+                return False
+
+            tile_result_batched = self._process_tile(tile_img_batched)[0]
+            index.add_tiles(
+                tiles_xy_bins=[(tile_params.x_bin_number, tile_params.y_bin_number) for tile_params in tile_params_batched],
+                embeddings=tile_result_batched)
+
+        index.finish()
+        print(f'Created tile embeddings index: {index.index_dir}')
+        return True
+
+    def _create_result_message(self, result_img_shape: Tuple[int, int], x_high, y_high) -> str:
+        txt = f"Recognition ended, best result found at {x_high}, {y_high}, {result_img_shape}"
         return txt
 
     def limit_extended_extent_image_to_base_extent_with_mask(self, full_img):
@@ -128,28 +284,19 @@ class MapProcessorRecognition(MapProcessorWithModel):
         rlayer.setCrs(self.rlayer.crs())
         return rlayer
 
-    def _create_rlayers_from_images_for_base_extent(
-        self, result_img: np.ndarray,
-        x_high,
-        y_high,
-        size,
-        stride
+    def _create_rlayers_from_heatmap_for_base_extent(
+        self,
+        heatmap: TilesGridHeatmap,
+        layer_name: str = "",
     ):
-        y = y_high * stride
-        x = x_high * stride
-
-        result_img[y, x:x+size-1] = 1
-        result_img[y+size-1, x:x+size-1] = 1
-        result_img[y:y+size-1, x] = 1
-        result_img[y:y+size-1, x+size-1] = 1
-
         # TODO: We are creating a new file for each layer.
         # Maybe can we pass ownership of this file to QGis?
         # Or maybe even create vlayer directly from array, without a file?
 
         random_id = str(uuid.uuid4()).replace("-", "")
-        file_path = os.path.join(TMP_DIR_PATH, f"{random_id}.tif")
-        self.save_result_img_as_tif(file_path=file_path, img=np.expand_dims(result_img, axis=2))
+        file_name = f"{layer_name}___{random_id}.tif" if layer_name else f"{random_id}.tif"
+        file_path = os.path.join(TMP_DIR_PATH, file_name)
+        self.save_result_heatmap_as_tif(file_path=file_path, heatmap=heatmap)
 
         rlayer = self.load_rlayer_from_file(file_path)
         OUTPUT_RLAYER_OPACITY = 0.5
@@ -167,10 +314,11 @@ class MapProcessorRecognition(MapProcessorWithModel):
 
         return add_to_gui
 
-    def save_result_img_as_tif(self, file_path: str, img: np.ndarray):
+    def save_result_heatmap_as_tif(self, file_path: str, heatmap: TilesGridHeatmap):
         """
         As we cannot pass easily an numpy array to be displayed as raster layer, we create temporary geotif files,
-        which will be loaded as layer later on
+        which will be loaded as layer later on.
+        Heatmap is written block by block, so the full resolution image is never kept in memory.
 
         Partially based on example from:
         https://gis.stackexchange.com/questions/82031/gdal-python-set-projection-of-a-raster-not-working
@@ -190,17 +338,9 @@ class MapProcessorRecognition(MapProcessorWithModel):
         ]
 
         driver = gdal.GetDriverByName("GTiff")
-        n_lines = img.shape[0]
-        n_cols = img.shape[1]
-        n_chanels = img.shape[2]
-        # data_type = gdal.GDT_Byte
+        n_lines, n_cols = heatmap.image_shape_yx
         data_type = gdal.GDT_Float32
-        grid_data = driver.Create(
-            "grid_data", n_cols, n_lines, n_chanels, data_type
-        )  # , options)
-        # loop over chanels
-        for i in range(1, img.shape[2] + 1):
-            grid_data.GetRasterBand(i).WriteArray(img[:, :, i - 1])
+        grid_data = driver.Create(file_path, n_cols, n_lines, 1, data_type)
 
         # crs().srsid()  - maybe we can use the ID directly - but how?
         # srs.ImportFromEPSG()
@@ -209,10 +349,16 @@ class MapProcessorRecognition(MapProcessorWithModel):
 
         grid_data.SetProjection(srs.ExportToWkt())
         grid_data.SetGeoTransform(geo_transform)
-        driver.CreateCopy(file_path, grid_data, 0)
+
+        band = grid_data.GetRasterBand(1)
+        for y_start, block in heatmap.iterate_row_blocks():
+            band.WriteArray(block, 0, y_start)
+
+        grid_data.FlushCache()
+        grid_data = None  # closes the file
 
     def _process_tile(self, tile_img: np.ndarray) -> np.ndarray:
-        result = self.model.process(tile_img)
+        result = self.model.process(tile_img, processing_stats=self.processing_stats)
 
         # NOTE - currently we are saving result as float32, so we are losing some accuraccy.
         # result = np.clip(result, 0, 255)  # old version with uint8_t - not used anymore
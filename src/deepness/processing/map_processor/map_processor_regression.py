@@ -13,6 +13,8 @@ from deepness.common.processing_parameters.regression_parameters import Regressi
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultCanceled,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor_with_model import MapProcessorWithModel
+from deepness.processing.memory_budget import MemoryItem
+from deepness.processing.processing_stats import ProcessingStage
 
 
 class MapProcessorRegression(MapProcessorWithModel):
@@ -30,6 +32,14 @@ class MapProcessorRegression(MapProcessorWithModel):
         self.regression_parameters = params
         self.model = params.model
 
+    def _get_memory_items(self) -> List[MemoryItem]:
+        image_size_px = self.img_size_y_pixels * self.img_size_x_pixels
+        number_of_outputs = len(self.params.model.get_number_of_output_channels())
+        return super()._get_memory_items() + [
+            MemoryItem('result images', number_of_outputs * image_size_px, can_be_memmapped=True),
+            MemoryItem('post-processing', image_size_px, can_be_memmapped=False),  # masking of a single channel
+        ]
+
     def _run(self) -> MapProcessingResult:
         number_of_output_channels = len(self._get_indexes_of_model_output_channels_to_create())
         final_shape_px = (number_of_output_channels, self.img_size_y_pixels, self.img_size_x_pixels)
@@ -37,23 +47,28 @@ class MapProcessorRegression(MapProcessorWithModel):
         # NOTE: consider whether we can use float16/uint16 as datatype
         full_result_imgs = self._get_array_or_mmapped_array(final_shape_px)
 
-        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
+        tile_img_filter = self._create_empty_tiles_filter() if self.regression_parameters.skip_empty_tiles else None
+        for tile_img_batched, tile_params_batched in self.tiles_generator_batched(tile_img_filter=tile_img_filter):
             if self.isCanceled():
                 return MapProcessingResultCanceled()
 
             tile_results_batched = self._process_tile(tile_img_batched)
 
-            for tile_results, tile_params in zip(tile_results_batched, tile_params_batched):
-                tile_params.set_mask_on_full_img(
-                    tile_result=tile_results,
-                    full_result_img=full_result_imgs)
+            with self.processing_stats.measure(ProcessingStage.STITCHING):
+                for tile_results, tile_params in zip(tile_results_batched, tile_params_batched):
+                    tile_params.set_mask_on_full_img(
+                        tile_result=tile_results,
+                        full_result_img=full_result_imgs)
 
         # plt.figure(); plt.imshow(full_result_img); plt.show(block=False); plt.pause(0.001)
         full_result_imgs = self.limit_extended_extent_images_to_base_extent_with_mask(full_imgs=full_result_imgs)
         self.set_results_img(full_result_imgs)
 
-        gui_delegate = self._create_rlayers_from_images_for_base_extent(self.get_result_img())
+        with self.processing_stats.measure(ProcessingStage.LAYERS_CREATION):
+            gui_delegate = self._create_rlayers_from_images_for_base_extent(self.get_result_img())
         result_message = self._create_result_message(self.get_result_img())
+        if self.regression_parameters.skip_empty_tiles:
+            result_message += self._create_empty_tiles_result_message()
         return MapProcessingResultSuccess(
             message=result_message,
             gui_delegate=gui_delegate,
@@ -153,7 +168,7 @@ class MapProcessorRegression(MapProcessorWithModel):
         print(f'***** {file_path = }')
 
     def _process_tile(self, tile_img: np.ndarray) -> np.ndarray:
-        many_result = self.model.process(tile_img)
+        many_result = self.model.process(tile_img, processing_stats=self.processing_stats)
         many_outputs = []
 
         for result in many_result:
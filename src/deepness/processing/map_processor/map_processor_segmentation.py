@@ -1,16 +1,25 @@
 """ This file implements map processing for segmentation model """
 
-from typing import Callable
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 from qgis.core import QgsProject, QgsVectorLayer
 
 from deepness.common.lazy_package_loader import LazyPackageLoader
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
 from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
 from deepness.processing import processing_utils
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultCanceled,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor_with_model import MapProcessorWithModel
+from deepness.processing.map_processor.utils.incremental_manifest import IncrementalManifest
+from deepness.processing.map_processor.utils.processing_checkpoint import ProcessingCheckpoint
+from deepness.processing.map_processor.utils.raw_outputs_store import RawOutputsStore
+from deepness.processing.map_processor.utils.sparse_chunked_image import SparseChunkedImage
+from deepness.processing.map_processor.utils.tiles_results_cache import TILES_RESULTS_CACHE
+from deepness.processing.memory_budget import MemoryItem
+from deepness.processing.processing_stats import ProcessingStage
+from deepness.processing.tile_params import TileParams
 
 cv2 = LazyPackageLoader('cv2')
 
@@ -20,6 +29,8 @@ class MapProcessorSegmentation(MapProcessorWithModel):
     MapProcessor specialized for Segmentation model (where each pixel is assigned to one class).
     """
 
+    RESULTS_FILE_NAME = 'results.dat'  # raw results, kept with a checkpoint or incremental processing manifest
+
     def __init__(self,
                  params: SegmentationParameters,
                  **kwargs):
@@ -30,46 +41,280 @@ class MapProcessorSegmentation(MapProcessorWithModel):
         self.segmentation_parameters = params
         self.model = params.model
 
+    def _get_memory_items(self) -> List[MemoryItem]:
+        image_size_px = self.img_size_y_pixels * self.img_size_x_pixels
+        if self._is_result_img_sparse():
+            # only chunks around the polygons are allocated, and post-processed region by region
+            image_size_px = processing_utils.estimate_area_mask_bounding_boxes_size_px(
+                vlayer_mask=self.vlayer_mask,
+                rlayer=self.rlayer,
+                extended_extent=self.extended_extent,
+                rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+                image_shape_yx=(self.img_size_y_pixels, self.img_size_x_pixels),
+                margin_px=max(self.params.tile_size_px, SparseChunkedImage.DEFAULT_CHUNK_SIZE_PX))
+        number_of_outputs = len(self.params.model.get_number_of_output_channels())
+        return super()._get_memory_items() + [
+            MemoryItem('result image', number_of_outputs * image_size_px, can_be_memmapped=True),
+            # single channel copies, in the median blur and in the vectorization of each class
+            MemoryItem('post-processing', 2 * image_size_px, can_be_memmapped=False),
+        ]
+
+    def _is_tiles_grid_global(self) -> bool:
+        return self.params.tiles_cache_size_mb > 0
+
+    def _is_result_img_sparse(self) -> bool:
+        """ Whether the result image is a `SparseChunkedImage` - when processing within polygons, which may cover
+        a small part of their extent. Called in `__init__`, before attributes of this class are set
+        """
+        return self.params.processed_area_type == ProcessedAreaType.FROM_POLYGONS \
+            and self.params.checkpoint_dir_path is None \
+            and self.params.incremental_dir_path is None  # results stored with them need to be a memory-mapped file
+
+    def _create_result_img(self, final_shape_px: Tuple[int, int, int]):
+        if self._is_result_img_sparse():
+            return SparseChunkedImage(
+                shape=final_shape_px,
+                dtype=np.uint8,
+                chunks_dir_path=self.file_handler.get_results_chunks_dir_path() if self.file_handler is not None else None)
+        return self._get_array_or_mmapped_array(final_shape_px)
+
     def _run(self) -> MapProcessingResult:
+        params = self.segmentation_parameters
         final_shape_px = (len(self._get_indexes_of_model_output_channels_to_create()), self.img_size_y_pixels, self.img_size_x_pixels)
-
-        full_result_img = self._get_array_or_mmapped_array(final_shape_px)
-
-        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
+        processing_values = dict(
+            probability_threshold=params.pixel_classification__probability_threshold,
+            final_shape_px=final_shape_px)
+
+        # at most one of them is enabled (see `check_results_reuse_options`)
+        incremental_manifest = self._create_incremental_manifest(params.incremental_dir_path, **processing_values)
+        checkpoint = self._create_checkpoint(params.checkpoint_dir_path, **processing_values)
+        tiles_cache_key = self._create_tiles_results_cache_key(
+            params.tiles_cache_size_mb, probability_threshold=params.pixel_classification__probability_threshold)
+        raw_outputs_store = self._create_raw_outputs_store(params.raw_outputs_dir_path, final_shape_px=final_shape_px)
+        is_from_raw_outputs = raw_outputs_store is not None and raw_outputs_store.is_complete()
+
+        full_result_img = self._create_full_result_img(final_shape_px, checkpoint, incremental_manifest)
+        tile_params_filter, tile_img_filter = self._create_tile_filters(
+            full_result_img, checkpoint, incremental_manifest, tiles_cache_key)
+
+        for tile_result_batched, tile_params_batched in self._tiles_results_batched(raw_outputs_store=raw_outputs_store,
+                                                                                    tile_params_filter=tile_params_filter,
+                                                                                    tile_img_filter=tile_img_filter):
             if self.isCanceled():
+                self._save_interrupted_results(full_result_img, checkpoint, incremental_manifest)
                 return MapProcessingResultCanceled()
 
-            tile_result_batched = self._process_tile(tile_img_batched)
-
-            for tile_result, tile_params in zip(tile_result_batched, tile_params_batched):
-                tile_params.set_mask_on_full_img(
-                    tile_result=tile_result,
-                    full_result_img=full_result_img)
+            with self.processing_stats.measure(ProcessingStage.STITCHING):
+                for tile_result, tile_params in zip(tile_result_batched, tile_params_batched):
+                    tile_params.set_mask_on_full_img(
+                        tile_result=tile_result,
+                        full_result_img=full_result_img)
 
-        blur_size = int(self.segmentation_parameters.postprocessing_dilate_erode_size // 2) * 2 + 1  # needs to be odd
+            self._store_tiles_results(
+                tile_result_batched, tile_params_batched, full_result_img, checkpoint, incremental_manifest, tiles_cache_key)
 
-        for i in range(full_result_img.shape[0]):
-            full_result_img[i] = cv2.medianBlur(full_result_img[i], blur_size)
+        full_result_img = self._release_stored_results(full_result_img, checkpoint, incremental_manifest)
+        full_result_img = self._postprocess_result_img(full_result_img)
+        self.set_results_img(full_result_img)
 
-        full_result_img = self.limit_extended_extent_image_to_base_extent_with_mask(full_img=full_result_img)
+        with self.processing_stats.measure(ProcessingStage.LAYERS_CREATION):
+            gui_delegate = self._create_vlayer_from_mask_for_base_extent(self.get_result_img(dense=False))
 
-        self.set_results_img(full_result_img)
+        result_message = self._create_result_message(self.get_result_img(dense=False))
+        result_message += self._create_results_reuse_message(
+            incremental_manifest, is_tiles_cache_used=tiles_cache_key is not None, is_from_raw_outputs=is_from_raw_outputs)
 
-        gui_delegate = self._create_vlayer_from_mask_for_base_extent(self.get_result_img())
+        if checkpoint is not None:
+            checkpoint.remove()
 
-        result_message = self._create_result_message(self.get_result_img())
         return MapProcessingResultSuccess(
             message=result_message,
             gui_delegate=gui_delegate,
         )
 
+    def _create_full_result_img(self,
+                                final_shape_px: Tuple[int, int, int],
+                                checkpoint: Optional[ProcessingCheckpoint],
+                                incremental_manifest: Optional[IncrementalManifest]):
+        """ Create the image for results of all tiles. With a checkpoint or incremental processing, the results
+        are kept in a file with them, to be available in the next run
+        """
+        if incremental_manifest is not None:
+            return np.memmap(
+                incremental_manifest.get_file_path(self.RESULTS_FILE_NAME),
+                dtype=np.uint8,
+                mode='r+' if incremental_manifest.has_previous_results else 'w+',
+                shape=final_shape_px)
+        if checkpoint is not None:
+            return np.memmap(
+                checkpoint.get_file_path(self.RESULTS_FILE_NAME),
+                dtype=np.uint8,
+                mode='r+' if checkpoint.is_resumed else 'w+',
+                shape=final_shape_px)
+        return self._create_result_img(final_shape_px)
+
+    def _create_tile_filters(self,
+                             full_result_img: np.ndarray,
+                             checkpoint: Optional[ProcessingCheckpoint],
+                             incremental_manifest: Optional[IncrementalManifest],
+                             tiles_cache_key: Optional[str],
+                             ) -> Tuple[Optional[Callable[[TileParams], bool]],
+                                        Optional[Callable[[np.ndarray, TileParams], bool]]]:
+        """ Create filters of tiles to process (see `tiles_generator`), skipping tiles with results from the previous runs
+        (and empty tiles, if enabled)
+
+        :return: tuple (tile_params_filter, tile_img_filter)
+        """
+        tile_params_filter = None
+        tile_img_filter = None
+        if checkpoint is not None:
+            tile_params_filter = checkpoint.is_tile_to_process
+        if incremental_manifest is not None:
+            # results of all tiles are kept with the manifest, only tiles with changed input are processed again
+            tile_img_filter = incremental_manifest.is_tile_changed
+        if tiles_cache_key is not None:
+            tile_params_filter = self._create_cached_tiles_filter(tiles_cache_key, full_result_img)
+
+        if self.segmentation_parameters.skip_empty_tiles:
+            def set_empty_tile_result(tile_params: TileParams):
+                # the same result as for a tile outside of the processed area
+                # (results of the tile from the previous run need to be overwritten in the incremental processing)
+                tile_params.set_mask_on_full_img(
+                    tile_result=np.zeros((full_result_img.shape[0], self.params.tile_size_px, self.params.tile_size_px), dtype=np.uint8),
+                    full_result_img=full_result_img)
+                if incremental_manifest is not None:
+                    incremental_manifest.set_tile_processed(tile_params)
+
+            tile_img_filter = self.combine_tile_filters(
+                tile_img_filter, self._create_empty_tiles_filter(on_empty_tile=set_empty_tile_result))
+
+        return tile_params_filter, tile_img_filter
+
+    def _store_tiles_results(self,
+                             tile_result_batched: np.ndarray,
+                             tile_params_batched: List[TileParams],
+                             full_result_img: np.ndarray,
+                             checkpoint: Optional[ProcessingCheckpoint],
+                             incremental_manifest: Optional[IncrementalManifest],
+                             tiles_cache_key: Optional[str]):
+        """ Mark tiles (with results already set on the full result image) as processed, for the next runs """
+        if checkpoint is not None:
+            checkpoint.mark_tiles_completed(tile_params_batched, flush_results=full_result_img.flush)
+        if incremental_manifest is not None:
+            for tile_params in tile_params_batched:
+                incremental_manifest.set_tile_processed(tile_params)
+        if tiles_cache_key is not None:
+            for tile_result, tile_params in zip(tile_result_batched, tile_params_batched):
+                tile_result = tile_result.astype(np.uint8)
+                TILES_RESULTS_CACHE.put(
+                    (tiles_cache_key, self.get_global_tile_xy_bins(tile_params)), tile_result, tile_result.nbytes)
+
+    @staticmethod
+    def _save_interrupted_results(full_result_img: np.ndarray,
+                                  checkpoint: Optional[ProcessingCheckpoint],
+                                  incremental_manifest: Optional[IncrementalManifest]):
+        """ Save results of the processed tiles, so that the processing can be continued in the next run """
+        if checkpoint is not None:
+            checkpoint.save(flush_results=full_result_img.flush)
+        if incremental_manifest is not None:
+            full_result_img.flush()
+            incremental_manifest.save()
+
+    def _release_stored_results(self,
+                                full_result_img: np.ndarray,
+                                checkpoint: Optional[ProcessingCheckpoint],
+                                incremental_manifest: Optional[IncrementalManifest]) -> np.ndarray:
+        """ Finish storing the raw results of all tiles, before the post-processing modifies them in place
+
+        :return: image with the results, to be post-processed
+        """
+        if checkpoint is not None:
+            checkpoint.invalidate()
+        if incremental_manifest is None:
+            return full_result_img
+
+        full_result_img.flush()
+        incremental_manifest.save()
+        # the stored results need to stay raw, for the next runs
+        result_img_copy = self._get_array_or_mmapped_array(full_result_img.shape)
+        result_img_copy[:] = full_result_img
+        return result_img_copy
+
+    def _postprocess_result_img(self,
+                                full_result_img: Union[np.ndarray, SparseChunkedImage]
+                                ) -> Union[np.ndarray, SparseChunkedImage]:
+        """ Median blur of the results, and limiting them to the base extent with the mask """
+        blur_size = int(self.segmentation_parameters.postprocessing_dilate_erode_size // 2) * 2 + 1  # needs to be odd
+
+        with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+            if isinstance(full_result_img, SparseChunkedImage):
+                return self._postprocess_sparse_result_img(full_result_img, blur_size=blur_size)
+
+            for i in range(full_result_img.shape[0]):
+                full_result_img[i] = cv2.medianBlur(full_result_img[i], blur_size)
+
+        return self.limit_extended_extent_image_to_base_extent_with_mask(full_img=full_result_img)
+
+    def _postprocess_sparse_result_img(self, full_result_img: SparseChunkedImage, blur_size: int) -> SparseChunkedImage:
+        """ Median blur and limiting to the base extent with the mask (as `limit_extended_extent_image_to_base_extent_with_mask`),
+        region by region - equal to the post-processing of the dense image, as regions are separated by zeros
+        """
+        for region in full_result_img.iterate_regions(margin_px=blur_size // 2):
+            for i in range(region.img.shape[0]):
+                region.img[i] = cv2.medianBlur(region.img[i], blur_size)
+            region.img[:, self.area_mask_img[region.get_slice_yx()] == 0] = 0
+            full_result_img.set_region(region)
+
+        b = self.base_extent_bbox_in_full_image
+        return full_result_img.crop(b.y_min, b.x_min, b.y_max + 1 - b.y_min, b.x_max + 1 - b.x_min)
+
+    def _tiles_results_batched(self,
+                               raw_outputs_store: Optional[RawOutputsStore],
+                               tile_params_filter: Optional[Callable[[TileParams], bool]],
+                               tile_img_filter: Optional[Callable[[np.ndarray, TileParams], bool]],
+                               ) -> Iterator[Tuple[np.ndarray, List[TileParams]]]:
+        """ Iterate over results of tiles (after post-processing), in batches.
+        If the raw outputs store is used, results are post-processed from the stored raw model outputs
+        (see `MapProcessorWithModel._raw_outputs_batched`)
+        """
+        if raw_outputs_store is None:
+            for tile_img_batched, tile_params_batched in self.tiles_generator_batched(tile_params_filter=tile_params_filter,
+                                                                                      tile_img_filter=tile_img_filter):
+                yield self._process_tile(tile_img_batched), tile_params_batched
+        else:
+            for raw_outputs_batched, tile_params_batched in self._raw_outputs_batched(raw_outputs_store,
+                                                                                      tile_params_filter=tile_params_filter,
+                                                                                      tile_img_filter=tile_img_filter):
+                with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+                    tile_result_batched = self._postprocess_model_output(self.model.postprocessing(raw_outputs_batched))
+                yield tile_result_batched, tile_params_batched
+
+    def _compact_raw_outputs(self, raw_outputs: List[np.ndarray]) -> List[np.ndarray]:
+        # probabilities do not need the full precision, and half of the size matters for whole maps
+        return [raw_output.astype(np.float16) for raw_output in raw_outputs]
+
+    def _create_cached_tiles_filter(self, tiles_cache_key: str, full_result_img: np.ndarray) -> Callable[[TileParams], bool]:
+        """ Create a tile filter (see `tiles_generator`), which sets the results of tiles from the cache
+        on the full result image, so that only tiles not present in the cache are processed
+        """
+        def is_tile_not_cached(tile_params: TileParams) -> bool:
+            tile_result = TILES_RESULTS_CACHE.get((tiles_cache_key, self.get_global_tile_xy_bins(tile_params)))
+            if tile_result is None:
+                return True
+
+            tile_params.set_mask_on_full_img(tile_result=tile_result, full_result_img=full_result_img)
+            self._number_of_cached_tiles += 1
+            return False
+
+        return is_tile_not_cached
+
     def _check_output_layer_is_sigmoid_and_has_more_than_one_name(self, output_id: int) -> bool:
         if self.model.outputs_names is None or self.model.outputs_are_sigmoid is None:
             return False
 
         return len(self.model.outputs_names[output_id]) > 1 and self.model.outputs_are_sigmoid[output_id]
 
-    def _create_result_message(self, result_img: np.ndarray) -> str:
+    def _create_result_message(self, result_img: Union[np.ndarray, SparseChunkedImage]) -> str:
 
         txt = f'Segmentation done, with the following statistics:\n'
 
@@ -77,10 +322,13 @@ class MapProcessorSegmentation(MapProcessorWithModel):
 
             txt += f'Channels for output {output_id}:\n'
 
-            unique, counts = np.unique(result_img[output_id], return_counts=True)
-            counts_map = {}
-            for i in range(len(unique)):
-                counts_map[unique[i]] = counts[i]
+            if isinstance(result_img, SparseChunkedImage):
+                counts_map = result_img.count_values(output_id)
+            else:
+                unique, counts = np.unique(result_img[output_id], return_counts=True)
+                counts_map = {}
+                for i in range(len(unique)):
+                    counts_map[unique[i]] = counts[i]
 
             # # we cannot simply take image dimensions, because we may have irregular processing area from polygon
             number_of_pixels_in_processing_area = np.sum([counts_map[k] for k in counts_map.keys()])
@@ -100,7 +348,18 @@ class MapProcessorSegmentation(MapProcessorWithModel):
 
         return txt
 
-    def _create_vlayer_from_mask_for_base_extent(self, mask_img) -> Callable:
+    @staticmethod
+    def _iterate_mask_img_parts(mask_img: Union[np.ndarray, SparseChunkedImage]) -> Iterator[Tuple[np.ndarray, int, int]]:
+        """ Iterate over parts of the mask image to vectorize, as (image, x_offset, y_offset).
+        A sparse image is split into regions - objects are always within a single region
+        """
+        if isinstance(mask_img, SparseChunkedImage):
+            for region in mask_img.iterate_regions():
+                yield region.img, region.x_min, region.y_min
+        else:
+            yield mask_img, 0, 0
+
+    def _create_vlayer_from_mask_for_base_extent(self, mask_img: Union[np.ndarray, SparseChunkedImage]) -> Callable:
         """ create vector layer with polygons from the mask image
         :return: function to be called in GUI thread
         """
@@ -109,25 +368,28 @@ class MapProcessorSegmentation(MapProcessorWithModel):
         for output_id, layer_sizes in enumerate(self._get_indexes_of_model_output_channels_to_create()):
             output_vlayers = []
             for channel_id in range(layer_sizes):
-                local_mask_img = np.uint8(mask_img[output_id] == (channel_id + 1)) # we add 1 to avoid 0 values, find the MADD1 code for explanation
-
-                contours, hierarchy = cv2.findContours(local_mask_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-                contours = processing_utils.transform_contours_yx_pixels_to_target_crs(
-                    contours=contours,
-                    extent=self.base_extent,
-                    rlayer_units_per_pixel=self.rlayer_units_per_pixel)
                 features = []
 
-                if len(contours):
-                    processing_utils.convert_cv_contours_to_features(
-                        features=features,
-                        cv_contours=contours,
-                        hierarchy=hierarchy[0],
-                        is_hole=False,
-                        current_holes=[],
-                        current_contour_index=0)
-                else:
-                    pass  # just nothing, we already have an empty list of features
+                for mask_img_part, x_offset, y_offset in self._iterate_mask_img_parts(mask_img):
+                    local_mask_img = np.uint8(mask_img_part[output_id] == (channel_id + 1)) # we add 1 to avoid 0 values, find the MADD1 code for explanation
+
+                    contours, hierarchy = cv2.findContours(local_mask_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                           offset=(x_offset, y_offset))
+                    contours = processing_utils.transform_contours_yx_pixels_to_target_crs(
+                        contours=contours,
+                        extent=self.base_extent,
+                        rlayer_units_per_pixel=self.rlayer_units_per_pixel)
+
+                    if len(contours):
+                        processing_utils.convert_cv_contours_to_features(
+                            features=features,
+                            cv_contours=contours,
+                            hierarchy=hierarchy[0],
+                            is_hole=False,
+                            current_holes=[],
+                            current_contour_index=0)
+                    else:
+                        pass  # just nothing, we already have an empty list of features
 
                 layer_name = self.model.get_channel_name(output_id, channel_id)
                 vlayer = QgsVectorLayer("multipolygon", layer_name, "memory")
@@ -165,7 +427,12 @@ class MapProcessorSegmentation(MapProcessorWithModel):
         return add_to_gui
 
     def _process_tile(self, tile_img_batched: np.ndarray) -> np.ndarray:
-        many_result = self.model.process(tile_img_batched)
+        many_result = self.model.process(tile_img_batched, processing_stats=self.processing_stats)
+        with self.processing_stats.measure(ProcessingStage.POSTPROCESSING):
+            return self._postprocess_model_output(many_result)
+
+    def _postprocess_model_output(self, many_result: List[np.ndarray]) -> np.ndarray:
+        """ Convert model outputs (probabilities) for a batch of tiles to class maps (thresholding and argmax) """
         many_outputs = []
 
         for result in many_result:
@@ -13,6 +13,8 @@ from deepness.common.processing_parameters.superresolution_parameters import Sup
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResult, MapProcessingResultCanceled,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor_with_model import MapProcessorWithModel
+from deepness.processing.memory_budget import MemoryItem
+from deepness.processing.processing_stats import ProcessingStage
 
 
 class MapProcessorSuperresolution(MapProcessorWithModel):
@@ -30,6 +32,14 @@ class MapProcessorSuperresolution(MapProcessorWithModel):
         self.superresolution_parameters = params
         self.model = params.model
 
+    def _get_memory_items(self) -> List[MemoryItem]:
+        scale_factor = self.params.scale_factor
+        result_size_px = int(self.img_size_y_pixels * scale_factor) * int(self.img_size_x_pixels * scale_factor)
+        number_of_output_channels = self.params.model.get_number_of_output_channels()[0]
+        return super()._get_memory_items() + [
+            MemoryItem('result image', number_of_output_channels * result_size_px, can_be_memmapped=True),
+        ]
+
     def _run(self) -> MapProcessingResult:
         number_of_output_channels = self.model.get_number_of_output_channels()
         
@@ -41,23 +51,28 @@ class MapProcessorSuperresolution(MapProcessorWithModel):
         # NOTE: consider whether we can use float16/uint16 as datatype
         full_result_imgs = self._get_array_or_mmapped_array(final_shape_px)
 
-        for tile_img_batched, tile_params_batched in self.tiles_generator_batched():
+        tile_img_filter = self._create_empty_tiles_filter() if self.superresolution_parameters.skip_empty_tiles else None
+        for tile_img_batched, tile_params_batched in self.tiles_generator_batched(tile_img_filter=tile_img_filter):
             if self.isCanceled():
                 return MapProcessingResultCanceled()
 
             tile_results_batched = self._process_tile(tile_img_batched)
 
-            for tile_results, tile_params in zip(tile_results_batched, tile_params_batched):
-                full_result_imgs[int(tile_params.start_pixel_y*self.superresolution_parameters.scale_factor):int((tile_params.start_pixel_y+tile_params.stride_px)*self.superresolution_parameters.scale_factor),
-                                int(tile_params.start_pixel_x*self.superresolution_parameters.scale_factor):int((tile_params.start_pixel_x+tile_params.stride_px)*self.superresolution_parameters.scale_factor),
-                                :] = tile_results.transpose(1, 2, 0)  # transpose to chanels last
+            with self.processing_stats.measure(ProcessingStage.STITCHING):
+                for tile_results, tile_params in zip(tile_results_batched, tile_params_batched):
+                    full_result_imgs[int(tile_params.start_pixel_y*self.superresolution_parameters.scale_factor):int((tile_params.start_pixel_y+tile_params.stride_px)*self.superresolution_parameters.scale_factor),
+                                    int(tile_params.start_pixel_x*self.superresolution_parameters.scale_factor):int((tile_params.start_pixel_x+tile_params.stride_px)*self.superresolution_parameters.scale_factor),
+                                    :] = tile_results.transpose(1, 2, 0)  # transpose to chanels last
 
         # plt.figure(); plt.imshow(full_result_img); plt.show(block=False); plt.pause(0.001)
         full_result_imgs = self.limit_extended_extent_image_to_base_extent_with_mask(full_img=full_result_imgs)
         self.set_results_img(full_result_imgs)
 
-        gui_delegate = self._create_rlayers_from_images_for_base_extent(self.get_result_img())
+        with self.processing_stats.measure(ProcessingStage.LAYERS_CREATION):
+            gui_delegate = self._create_rlayers_from_images_for_base_extent(self.get_result_img())
         result_message = self._create_result_message(self.get_result_img())
+        if self.superresolution_parameters.skip_empty_tiles:
+            result_message += '\n' + self._create_empty_tiles_result_message()
         return MapProcessingResultSuccess(
             message=result_message,
             gui_delegate=gui_delegate,
@@ -164,7 +179,7 @@ class MapProcessorSuperresolution(MapProcessorWithModel):
         print(f'***** {file_path = }')
 
     def _process_tile(self, tile_img: np.ndarray) -> np.ndarray:
-        result = self.model.process(tile_img)
+        result = self.model.process(tile_img, processing_stats=self.processing_stats)
         result[np.isnan(result)] = 0
         result *= self.superresolution_parameters.output_scaling
 
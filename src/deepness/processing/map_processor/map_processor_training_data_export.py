@@ -2,20 +2,20 @@
 
 import datetime
 import os
+from typing import List, Optional
 
 import numpy as np
 from qgis.core import QgsProject
 
-from deepness.common.lazy_package_loader import LazyPackageLoader
 from deepness.common.processing_parameters.training_data_export_parameters import TrainingDataExportParameters
 from deepness.processing import processing_utils
 from deepness.processing.map_processor.map_processing_result import (MapProcessingResultCanceled,
                                                                      MapProcessingResultSuccess)
 from deepness.processing.map_processor.map_processor import MapProcessor
+from deepness.processing.map_processor.utils.training_data_writer import TrainingDataWriter
+from deepness.processing.memory_budget import MemoryItem
 from deepness.processing.tile_params import TileParams
 
-cv2 = LazyPackageLoader('cv2')
-
 
 class MapProcessorTrainingDataExport(MapProcessor):
     """
@@ -31,6 +31,17 @@ class MapProcessorTrainingDataExport(MapProcessor):
             **kwargs)
         self.params = params
         self.output_dir_path = self._create_output_dir()
+        self._number_of_skipped_tiles = 0
+
+    def _get_memory_items(self) -> List[MemoryItem]:
+        image_size_px = self.img_size_y_pixels * self.img_size_x_pixels
+        memory_items = super()._get_memory_items()
+        if self.params.segmentation_mask_layer_id is not None:
+            memory_items.append(MemoryItem('segmentation mask', image_size_px, can_be_memmapped=True))
+        if self.params.min_labelled_fraction > 0 and self.params.segmentation_mask_layer_id is not None:
+            memory_items.append(MemoryItem(  # int32 summed-area table, with a binary mask while creating it
+                'integral image', image_size_px * 4 + image_size_px, can_be_memmapped=False))
+        return memory_items
 
     def _create_output_dir(self) -> str:
         datetime_string = datetime.datetime.now().strftime("%d%m%Y_%H%M%S")
@@ -53,43 +64,98 @@ class MapProcessorTrainingDataExport(MapProcessor):
             
             segmentation_mask_full = segmentation_mask_full[np.newaxis, ...]
 
+        writer = TrainingDataWriter(
+            output_dir_path=self.output_dir_path,
+            output_format=self.params.output_format,
+            png_compression_level=self.params.png_compression_level,
+            tiles_per_shard=self.params.tiles_per_shard,
+            number_of_workers=self.params.number_of_workers)
+
+        segmentation_mask_integral_img = None
+        if export_segmentation_mask and self.params.min_labelled_fraction > 0:
+            segmentation_mask_integral_img = processing_utils.create_integral_image(segmentation_mask_full[0])
+
+        self._number_of_skipped_tiles = 0
+        nodata_values = self._get_input_nodata_values()
+
+        def tile_params_filter(tile_params: TileParams) -> bool:
+            is_tile_useful = self._is_tile_coverage_sufficient(tile_params, segmentation_mask_integral_img)
+            if not is_tile_useful:
+                self._number_of_skipped_tiles += 1
+            return is_tile_useful
+
         number_of_written_tiles = 0
-        for tile_img, tile_params in self.tiles_generator():
-            if self.isCanceled():
-                return MapProcessingResultCanceled()
+        is_canceled = False
+        try:
+            for tile_img, tile_params in self.tiles_generator(tile_params_filter=tile_params_filter):
+                if self.isCanceled():
+                    is_canceled = True
+                    break
+
+                tile_params = tile_params  # type: TileParams
 
-            tile_params = tile_params  # type: TileParams
+                if self.params.skip_empty_tiles and processing_utils.is_tile_empty(
+                        tile_img, nodata_values, min_valid_pixels_fraction=self.params.min_valid_pixels_fraction):
+                    self._number_of_skipped_tiles += 1
+                    continue
 
-            if self.params.export_image_tiles:
-                file_name = f'tile_img_{tile_params.x_bin_number}_{tile_params.y_bin_number}.png'
-                file_path = os.path.join(self.output_dir_path, file_name)
+                if self.params.export_image_tiles:
+                    file_name = f'tile_img_{tile_params.x_bin_number}_{tile_params.y_bin_number}'
 
-                if tile_img.dtype in [np.uint32, np.int32]:
-                    print(f'Exporting image with data type {tile_img.dtype} is not supported. Trimming to uint16. Consider changing the data type in the source image.')
-                    tile_img = tile_img.astype(np.uint16)
+                    if tile_img.dtype in [np.uint32, np.int32]:
+                        print(f'Exporting image with data type {tile_img.dtype} is not supported. Trimming to uint16. Consider changing the data type in the source image.')
+                        tile_img = tile_img.astype(np.uint16)
 
-                if tile_img.shape[-1] == 4:
-                    tile_img = cv2.cvtColor(tile_img, cv2.COLOR_RGBA2BGRA)
-                elif tile_img.shape[-1] == 3:
-                    tile_img = cv2.cvtColor(tile_img, cv2.COLOR_RGB2BGR)
+                    writer.add_tile(file_name, tile_img)
+                    number_of_written_tiles += 1
 
-                cv2.imwrite(file_path, tile_img)
-                number_of_written_tiles += 1
+                if export_segmentation_mask:
+                    segmentation_mask_for_tile = tile_params.get_entire_tile_from_full_img(segmentation_mask_full)
 
-            if export_segmentation_mask:
-                segmentation_mask_for_tile = tile_params.get_entire_tile_from_full_img(segmentation_mask_full)
-                
-                file_name = f'tile_mask_{tile_params.x_bin_number}_{tile_params.y_bin_number}.png'
-                file_path = os.path.join(self.output_dir_path, file_name)
-                
-                cv2.imwrite(file_path, segmentation_mask_for_tile[0])
+                    file_name = f'tile_mask_{tile_params.x_bin_number}_{tile_params.y_bin_number}'
+                    writer.add_tile(file_name, np.array(segmentation_mask_for_tile[0]))
+        except BaseException:
+            writer.abort()  # the original error is raised, not errors of the pending tiles
+            raise
+
+        writer.finish()  # also for canceled processing, to not leave unfinished shards
+        if is_canceled:
+            return MapProcessingResultCanceled()
 
         result_message = self._create_result_message(number_of_written_tiles)
         return MapProcessingResultSuccess(result_message)
 
+    def _is_tile_coverage_sufficient(self,
+                                     tile_params: TileParams,
+                                     segmentation_mask_integral_img: Optional[np.ndarray]) -> bool:
+        """ Check if the tile has enough pixels within the processed area and labelled in the segmentation mask.
+        Pixels are counted with the area mask chunks and the integral image of the segmentation mask,
+        so the check is fast, without reading the tile.
+        """
+        tile_size = self.params.tile_size_px
+        tile_xyxy = np.array([[
+            tile_params.start_pixel_x,
+            tile_params.start_pixel_y,
+            tile_params.start_pixel_x + tile_size - 1,
+            tile_params.start_pixel_y + tile_size - 1,
+        ]])
+
+        if self.area_mask_img is not None and self.params.min_area_coverage > 0:
+            pixels_in_area = self.area_mask_img.count_non_zero_pixels_in_rectangles(tile_xyxy)[0]
+            if pixels_in_area / tile_size**2 < self.params.min_area_coverage:
+                return False
+
+        if segmentation_mask_integral_img is not None:
+            labelled_pixels = processing_utils.count_non_zero_pixels_in_rectangles(segmentation_mask_integral_img, tile_xyxy)[0]
+            if labelled_pixels / tile_size**2 < self.params.min_labelled_fraction:
+                return False
+
+        return True
+
     def _create_result_message(self, number_of_written_tiles) -> str:
         total_area = self.img_size_x_pixels * self.img_size_y_pixels * self.params.resolution_m_per_px**2
         return f'Exporting data finished!\n' \
                f'Exported {number_of_written_tiles} tiles.\n' \
+               f'Skipped {self._number_of_skipped_tiles} tiles (not meeting the coverage or content criteria).\n' \
                f'Total processed area: {total_area:.2f} m^2\n' \
                f'Directory: "{self.output_dir_path}"'
@@ -1,10 +1,21 @@
 
 """ This file implements map processing functions common for all map processors using nural model """
 
-from typing import List
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
+
+from deepness.processing import processing_utils
 from deepness.processing.map_processor.map_processor import MapProcessor
+from deepness.processing.map_processor.utils.cache_key import compute_file_hash, create_cache_key
+from deepness.processing.map_processor.utils.incremental_manifest import IncrementalManifest
+from deepness.processing.map_processor.utils.processing_checkpoint import ProcessingCheckpoint
+from deepness.processing.map_processor.utils.raw_outputs_store import RawOutputsStore
+from deepness.processing.map_processor.utils.tiles_results_cache import TILES_RESULTS_CACHE
+from deepness.processing.memory_budget import MemoryItem
 from deepness.processing.models.model_base import ModelBase
+from deepness.processing.tile_params import TileParams
 
 
 class MapProcessorWithModel(MapProcessor):
@@ -18,6 +29,29 @@ class MapProcessorWithModel(MapProcessor):
         super().__init__(
             **kwargs)
         self.model = model
+        self._number_of_empty_tiles = 0
+        self._number_of_cached_tiles = 0  # results of tiles reused from `TILES_RESULTS_CACHE`
+
+    def _get_models(self) -> List[ModelBase]:
+        return [self.model]
+
+    def _get_processing_stats_values(self) -> Dict[str, Any]:
+        return dict(
+            **super()._get_processing_stats_values(),
+            model_file_name=os.path.basename(self.model.model_file_path),
+            number_of_threads=self.model.get_number_of_threads(),
+        )
+
+    def _get_memory_items(self) -> List[MemoryItem]:
+        # `self.model` is not set yet, it is called from the base class `__init__`
+        output_size_bytes = 0
+        for output_shape in self.params.model.get_output_shapes():
+            # dynamic dimensions (given as names) are spatial, with the size of the tile
+            dimensions = [d if isinstance(d, int) else self.params.tile_size_px for d in output_shape[1:]]
+            output_size_bytes += int(np.prod(dimensions)) * 4  # float32
+        return super()._get_memory_items() + [
+            MemoryItem('model outputs batch', self.params.batch_size * output_size_bytes, can_be_memmapped=False),
+        ]
 
     def _get_indexes_of_model_output_channels_to_create(self) -> List[int]:
         """
@@ -25,3 +59,179 @@ class MapProcessorWithModel(MapProcessor):
         (e.g. for which channels create a layer with results)
         """
         return self.model.get_number_of_output_channels()
+
+    def _create_empty_tiles_filter(self,
+                                   on_empty_tile: Optional[Callable[[TileParams], None]] = None
+                                   ) -> Callable[[np.ndarray, TileParams], bool]:
+        """ Create a tile image filter (see `tiles_generator`), rejecting empty tiles (only nodata or a single value),
+        so that the model is not run for them
+
+        :param on_empty_tile: function called for each empty tile, e.g. to set a background result for it
+        """
+        nodata_values = self._get_input_nodata_values()
+
+        def is_tile_not_empty(tile_img: np.ndarray, tile_params: TileParams) -> bool:
+            if not processing_utils.is_tile_empty(tile_img, nodata_values):
+                return True
+
+            self._number_of_empty_tiles += 1
+            if on_empty_tile is not None:
+                on_empty_tile(tile_params)
+            return False
+
+        return is_tile_not_empty
+
+    def _create_empty_tiles_result_message(self) -> str:
+        return f'Skipped {self._number_of_empty_tiles} empty tiles (only nodata or a single value)\n'
+
+    @staticmethod
+    def _create_incremental_result_message(incremental_manifest: IncrementalManifest) -> str:
+        return (f'Incremental processing: {incremental_manifest.get_number_of_changed_tiles()} tiles with changed input '
+                f'processed, results of {incremental_manifest.get_number_of_unchanged_tiles()} unchanged tiles reused\n')
+
+    def _create_results_reuse_message(self,
+                                      incremental_manifest: Optional[IncrementalManifest],
+                                      is_tiles_cache_used: bool,
+                                      is_from_raw_outputs: bool) -> str:
+        """ Create the part of the result message about results reused from the previous runs and skipped tiles """
+        txt = ''
+        if incremental_manifest is not None:
+            txt += self._create_incremental_result_message(incremental_manifest)
+        if is_tiles_cache_used:
+            txt += f'Results of {self._number_of_cached_tiles} tiles reused from the cache\n'
+        if is_from_raw_outputs:
+            txt += 'Post-processing done on the stored raw model outputs, without running the model\n'
+        if self.params.skip_empty_tiles:
+            txt += self._create_empty_tiles_result_message()
+        return txt
+
+    def _create_processing_key(self, with_processing_area: bool = True, **processing_values) -> str:
+        """ Create a key identifying the processing results, to store them between runs
+
+        :param with_processing_area: whether the key is specific for the processed area (extent and mask),
+            or only for the parameters of processing of single tiles
+        :param processing_values: processor-specific values which have an influence on the results
+        """
+        if with_processing_area:
+            area_mask_hash = None
+            if self.area_mask_img is not None:
+                area_mask_hash = self.area_mask_img.get_hash()  # without rasterizing the whole mask
+            processing_values.update(extent=self.extended_extent.toString(), area_mask_hash=area_mask_hash)
+        else:
+            processing_values.update(layer_extent=self.rlayer.extent().toString())  # global tiles grid anchor
+
+        return create_cache_key(
+            processor=self.__class__.__name__,
+            layer_source=self.rlayer.source(),
+            rlayer_units_per_pixel=self.rlayer_units_per_pixel,
+            tile_size_px=self.params.tile_size_px,
+            stride_px=self.stride_px,
+            input_channels_mapping=self.params.input_channels_mapping,
+            model_hash=compute_file_hash(self.model.model_file_path),
+            **processing_values,
+        )
+
+    def _create_tiles_results_cache_key(self, tiles_cache_size_mb: int, **processing_values) -> Optional[str]:
+        """ Prepare the shared cache of tile results (`TILES_RESULTS_CACHE`), if enabled
+
+        :param tiles_cache_size_mb: size limit of the cache. Cache disabled if 0
+        :param processing_values: processor-specific values which have an influence on the results
+        :return: key of the processing parameters, to be combined with the global tile position
+            (see `get_global_tile_xy_bins`) for the key of the tile. None if the cache is disabled
+        """
+        TILES_RESULTS_CACHE.set_max_size_bytes(tiles_cache_size_mb * 1024 * 1024)
+        if tiles_cache_size_mb <= 0:
+            return None
+
+        return self._create_processing_key(with_processing_area=False, **processing_values)
+
+    def _create_checkpoint(self, checkpoint_dir_path: Optional[str], **processing_values) -> Optional[ProcessingCheckpoint]:
+        """ Create (or resume) checkpoint of the processing, if enabled
+
+        :param checkpoint_dir_path: base directory for checkpoints. Checkpointing disabled if None
+        :param processing_values: processor-specific values which have an influence on the results
+        """
+        if checkpoint_dir_path is None:
+            return None
+
+        checkpoint_key = self._create_processing_key(**processing_values)
+        return ProcessingCheckpoint(
+            checkpoint_dir_path=os.path.join(checkpoint_dir_path, checkpoint_key),
+            x_bins_number=self.x_bins_number,
+            y_bins_number=self.y_bins_number)
+
+    def _create_incremental_manifest(self, incremental_dir_path: Optional[str], **processing_values) -> Optional[IncrementalManifest]:
+        """ Load the manifest of the previous run with the same parameters, if incremental processing is enabled.
+        Hashes of tiles input are not part of the key, so that results for the unchanged tiles can be reused
+
+        :param incremental_dir_path: base directory for results of the previous runs. Disabled if None
+        :param processing_values: processor-specific values which have an influence on the results
+        """
+        if incremental_dir_path is None:
+            return None
+
+        manifest_key = self._create_processing_key(incremental=True, **processing_values)
+        return IncrementalManifest(
+            manifest_dir_path=os.path.join(incremental_dir_path, manifest_key),
+            x_bins_number=self.x_bins_number,
+            y_bins_number=self.y_bins_number)
+
+    def _create_raw_outputs_store(self, raw_outputs_dir_path: Optional[str], **processing_values) -> Optional[RawOutputsStore]:
+        """ Create the store of raw model outputs, if enabled
+
+        :param raw_outputs_dir_path: base directory for stores of raw outputs. Disabled if None
+        :param processing_values: processor-specific values which have an influence on the raw outputs
+            (so not post-processing parameters)
+        """
+        if raw_outputs_dir_path is None:
+            return None
+
+        store_key = self._create_processing_key(raw_outputs=True, **processing_values)
+        return RawOutputsStore(store_dir_path=os.path.join(raw_outputs_dir_path, store_key))
+
+    def _compact_raw_outputs(self, raw_outputs: List[np.ndarray]) -> List[np.ndarray]:
+        """ Reduce size of raw outputs of a single tile, before adding them to the store """
+        return raw_outputs
+
+    def _get_raw_outputs_metadata(self) -> dict:
+        """ Values describing the stored raw outputs, saved with them """
+        return {}
+
+    def _raw_outputs_batched(self,
+                             raw_outputs_store: RawOutputsStore,
+                             tile_params_filter: Optional[Callable[[TileParams], bool]] = None,
+                             tile_img_filter: Optional[Callable[[np.ndarray, TileParams], bool]] = None,
+                             ) -> Iterator[Tuple[List[np.ndarray], List[TileParams]]]:
+        """ Iterate over raw model outputs for all tiles, in batches. If the store is complete, the outputs are read
+        from it (one tile in a batch), otherwise the model is run on all tiles and the outputs are added to the store
+
+        :param raw_outputs_store: store of the raw outputs
+        :param tile_params_filter: see `tiles_generator`. Not used if the outputs are read from the store
+        :param tile_img_filter: see `tiles_generator`. Not used if the outputs are read from the store
+        :return: tuples (raw outputs for the batch, as returned by `ModelBase.run_inference`, parameters of the tiles)
+        """
+        if raw_outputs_store.is_complete():
+            number_of_tiles = raw_outputs_store.get_number_of_tiles()
+            for i, (tile_number, raw_outputs) in enumerate(raw_outputs_store.iterate_tiles()):
+                self.setProgress(i / number_of_tiles * 100)
+                tile_params = self._create_tile_params(
+                    x_bin_number=tile_number % self.x_bins_number, y_bin_number=tile_number // self.x_bins_number)
+                yield [np.expand_dims(raw_output, axis=0) for raw_output in raw_outputs], [tile_params]
+            return
+
+        raw_outputs_store.create()
+        try:
+            for tile_img_batched, tile_params_batched in self.tiles_generator_batched(tile_params_filter=tile_params_filter,
+                                                                                      tile_img_filter=tile_img_filter):
+                raw_outputs_batched = self.model.run_inference(tile_img_batched, processing_stats=self.processing_stats)
+
+                for i, tile_params in enumerate(tile_params_batched):
+                    tile_number = tile_params.y_bin_number * self.x_bins_number + tile_params.x_bin_number
+                    raw_outputs_store.add_tile(
+                        tile_number, self._compact_raw_outputs([raw_output[i] for raw_output in raw_outputs_batched]))
+
+                yield raw_outputs_batched, tile_params_batched
+
+            raw_outputs_store.finish(**self._get_raw_outputs_metadata())
+        finally:
+            raw_outputs_store.close()  # not complete, if processing was interrupted
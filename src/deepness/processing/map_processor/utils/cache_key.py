@@ -0,0 +1,35 @@
+""" This file implements keys identifying cached processing data (e.g. tile embeddings or checkpoints),
+so that the data is reused only for the same processing
+"""
+
+import hashlib
+import json
+import os
+
+
+_file_hashes = {}  # (file_path, size, modification time) -> hash, to not read the same file again
+
+
+def compute_file_hash(file_path: str) -> str:
+    """ Hash of the file content (e.g. model), to detect a changed file with the same path """
+    file_stat = os.stat(file_path)
+    file_id = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+    if file_id in _file_hashes:
+        return _file_hashes[file_id]
+
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    _file_hashes[file_id] = file_hash.hexdigest()
+    return _file_hashes[file_id]
+
+
+def create_cache_key(**kwargs) -> str:
+    """ Create a key from all values which have an influence on the cached data
+
+    :param kwargs: values describing the processing (layer, extent, resolution, model hash, ...).
+        They need to have a deterministic string representation
+    """
+    description = json.dumps({name: str(value) for name, value in kwargs.items()}, sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
@@ -0,0 +1,164 @@
+""" This file implements the mask of the processed area, rasterized lazily chunk by chunk """
+
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+ChunkYX = Tuple[int, int]  # (y, x) number of the chunk
+
+
+class ChunkedAreaMask:
+    """
+    Mask of the processed area, with shape (height, width) - 255 within the area, 0 outside (as a uint8 image).
+    The mask is rasterized lazily, only for chunks which are used (e.g. for tiles to process).
+    Chunks are stored bit-packed, and chunks with a single value (e.g. far from all polygons) only as the value.
+
+    Supports reading with slices, as a numpy array (e.g. `mask[y_min:y_max, x_min:x_max]`).
+    """
+
+    DEFAULT_CHUNK_SIZE_PX = 1024
+    UNPACKED_CHUNKS_CACHE_SIZE = 16  # recently used chunks are kept unpacked, as neighbouring tiles read the same chunks
+
+    def __init__(self,
+                 shape: Tuple[int, int],
+                 rasterize_window: Callable[[int, int, int, int], Union[np.ndarray, int]],
+                 chunk_size_px: int = DEFAULT_CHUNK_SIZE_PX,
+                 mask_hash: Optional[str] = None):
+        """
+        :param shape: (height, width)
+        :param rasterize_window: function rasterizing the mask in a window (y_min, x_min, height, width).
+            Returns a uint8 image, or a single value for the whole window (e.g. 0 if there are no polygons in the window)
+        :param chunk_size_px: width and height of chunks
+        :param mask_hash: value identifying the mask (e.g. hash of rasterized polygons), see `get_hash`
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(np.uint8)
+        self.chunk_size_px = chunk_size_px
+        self._rasterize_window = rasterize_window
+        self._mask_hash = mask_hash
+        self._chunks = {}  # type: Dict[ChunkYX, Union[np.ndarray, int]]  # bit-packed chunk, or a single value
+        self._unpacked_chunks = OrderedDict()  # type: OrderedDict[ChunkYX, np.ndarray]
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the stored chunks """
+        return sum(chunk.nbytes for chunk in self._chunks.values() if isinstance(chunk, np.ndarray))
+
+    def get_hash(self) -> Optional[str]:
+        return self._mask_hash
+
+    def get_number_of_rasterized_chunks(self) -> int:
+        return len(self._chunks)
+
+    def _get_chunk_window(self, chunk_yx: ChunkYX) -> Tuple[int, int, int, int]:
+        """ (y_start, y_stop, x_start, x_stop) of the chunk in the mask (clipped to the mask) """
+        y_start, x_start = chunk_yx[0] * self.chunk_size_px, chunk_yx[1] * self.chunk_size_px
+        return (y_start, min(y_start + self.chunk_size_px, self.shape[0]),
+                x_start, min(x_start + self.chunk_size_px, self.shape[1]))
+
+    def _get_chunk(self, chunk_yx: ChunkYX) -> Union[np.ndarray, int]:
+        """ Get the unpacked chunk (clipped to the mask), or its single value. Rasterized on the first use """
+        y_start, y_stop, x_start, x_stop = self._get_chunk_window(chunk_yx)
+        chunk = self._chunks.get(chunk_yx)
+        if chunk is None:
+            chunk_img = self._rasterize_window(y_start, x_start, y_stop - y_start, x_stop - x_start)
+            if not isinstance(chunk_img, np.ndarray):
+                chunk = int(chunk_img)
+            elif np.all(chunk_img == chunk_img.flat[0]):
+                chunk = int(chunk_img.flat[0])
+            else:
+                chunk = np.packbits(chunk_img > 0)
+            self._chunks[chunk_yx] = chunk
+
+        if not isinstance(chunk, np.ndarray):
+            return chunk
+
+        chunk_img = self._unpacked_chunks.get(chunk_yx)
+        if chunk_img is None:
+            shape = (y_stop - y_start, x_stop - x_start)
+            chunk_img = np.unpackbits(chunk, count=shape[0] * shape[1]).reshape(shape) * np.uint8(255)
+            self._unpacked_chunks[chunk_yx] = chunk_img
+            if len(self._unpacked_chunks) > self.UNPACKED_CHUNKS_CACHE_SIZE:
+                self._unpacked_chunks.popitem(last=False)
+        else:
+            self._unpacked_chunks.move_to_end(chunk_yx)
+        return chunk_img
+
+    def _iterate_window_chunks(self, y_start: int, y_stop: int, x_start: int, x_stop: int
+                               ) -> Iterator[Tuple[Union[np.ndarray, int], Tuple[slice, slice], Tuple[slice, slice]]]:
+        """ Iterate over chunks intersecting the window of the mask
+
+        :return: generator of (chunk, (y, x) slice in the chunk, (y, x) slice in the window)
+        """
+        size = self.chunk_size_px
+        for chunk_y in range(y_start // size, (y_stop - 1) // size + 1):
+            for chunk_x in range(x_start // size, (x_stop - 1) // size + 1):
+                chunk_y_start, chunk_x_start = chunk_y * size, chunk_x * size
+                y_min, y_max = max(y_start, chunk_y_start), min(y_stop, chunk_y_start + size)
+                x_min, x_max = max(x_start, chunk_x_start), min(x_stop, chunk_x_start + size)
+                yield (self._get_chunk((chunk_y, chunk_x)),
+                       np.s_[y_min - chunk_y_start:y_max - chunk_y_start, x_min - chunk_x_start:x_max - chunk_x_start],
+                       np.s_[y_min - y_start:y_max - y_start, x_min - x_start:x_max - x_start])
+
+    def _parse_key(self, key) -> Tuple[int, int, int, int]:
+        """ Convert the indexing key to (y_start, y_stop, x_start, x_stop) """
+        if not isinstance(key, tuple) or len(key) != 2 or not all(isinstance(k, slice) for k in key):
+            raise Exception(f"Unsupported key for ChunkedAreaMask: {key}. Expected (y slice, x slice)")
+
+        y_start, y_stop, y_step = key[0].indices(self.shape[0])
+        x_start, x_stop, x_step = key[1].indices(self.shape[1])
+        if y_step != 1 or x_step != 1:
+            raise Exception("Steps in slices are not supported in ChunkedAreaMask")
+        return y_start, max(y_start, y_stop), x_start, max(x_start, x_stop)
+
+    def __getitem__(self, key) -> np.ndarray:
+        y_start, y_stop, x_start, x_stop = self._parse_key(key)
+        window = np.zeros((y_stop - y_start, x_stop - x_start), dtype=np.uint8)
+        if y_stop == y_start or x_stop == x_start:
+            return window
+
+        for chunk, chunk_slice, window_slice in self._iterate_window_chunks(y_start, y_stop, x_start, x_stop):
+            window[window_slice] = chunk if not isinstance(chunk, np.ndarray) else chunk[chunk_slice]
+        return window
+
+    def count_non_zero_pixels_in_rectangles(self, xyxy: np.ndarray) -> np.ndarray:
+        """ Count the mask pixels within rectangles (as `processing_utils.count_non_zero_pixels_in_rectangles`),
+        without an integral image of the whole mask
+
+        :param xyxy: rectangles (N, 4) in (x_min, y_min, x_max, y_max) format, with inclusive pixel coordinates.
+            Parts of the rectangles outside of the mask are ignored
+        :return: number of non-zero pixels within each rectangle (N,)
+        """
+        xyxy = np.asarray(xyxy, dtype=np.int64).reshape(-1, 4)
+        x_min = np.clip(xyxy[:, 0], 0, self.shape[1])
+        y_min = np.clip(xyxy[:, 1], 0, self.shape[0])
+        x_max = np.clip(xyxy[:, 2] + 1, x_min, self.shape[1])
+        y_max = np.clip(xyxy[:, 3] + 1, y_min, self.shape[0])
+
+        counts = np.zeros(len(xyxy), dtype=np.int64)
+        for i in range(len(xyxy)):
+            if y_max[i] == y_min[i] or x_max[i] == x_min[i]:
+                continue
+            for chunk, chunk_slice, window_slice in self._iterate_window_chunks(y_min[i], y_max[i], x_min[i], x_max[i]):
+                if isinstance(chunk, np.ndarray):
+                    counts[i] += np.count_nonzero(chunk[chunk_slice])
+                elif chunk:
+                    counts[i] += (window_slice[0].stop - window_slice[0].start) * (window_slice[1].stop - window_slice[1].start)
+        return counts
+
+    def apply_to_image(self, img: np.ndarray):
+        """ Set pixels of the image (height, width) outside of the mask to zero, in place (as `cv2.copyTo` with the mask) """
+        for chunk, chunk_slice, window_slice in self._iterate_window_chunks(0, self.shape[0], 0, self.shape[1]):
+            if isinstance(chunk, np.ndarray):
+                img[window_slice][chunk[chunk_slice] == 0] = 0
+            elif not chunk:
+                img[window_slice] = 0
+
+    def to_dense(self) -> np.ndarray:
+        """ Create the full mask (it may be large) """
+        return self[:, :]
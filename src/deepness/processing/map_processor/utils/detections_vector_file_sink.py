@@ -0,0 +1,117 @@
+""" This file implements writing of detections to a vector file on disk, instead of keeping them in a memory layer """
+
+import logging
+import os
+from typing import List
+
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransformContext, QgsFeature, QgsField, QgsFields,
+                       QgsVectorFileWriter, QgsVectorLayer, QgsWkbTypes)
+from qgis.PyQt.QtCore import QVariant
+
+from deepness.common.processing_parameters.detection_parameters import DetectionOutputFormat
+
+
+class DetectionsVectorFileSink:
+    """
+    Appends detection features (polygons with class, confidence and rotation attributes) to a layer in a vector file,
+    flushing them to disk in batches, so that all features never have to be kept in memory at once.
+
+    Spatial index is built once, after all features are written, as it is much faster than updating it
+    for every batch.
+    """
+
+    BATCH_SIZE = 10000  # number of features buffered in memory before writing them to the file
+
+    def __init__(self,
+                 file_path: str,
+                 layer_name: str,
+                 output_format: DetectionOutputFormat,
+                 crs: QgsCoordinateReferenceSystem):
+        """
+        :param file_path: path of the output file. For GeoPackage many layers can be saved in one file
+        :param layer_name: name of the layer in the file
+        :param output_format: format of the output file
+        :param crs: coordinate reference system of the features
+        """
+        self.file_path = file_path
+        self.layer_name = layer_name
+        self.output_format = output_format
+        self._features_batch = []  # type: List[QgsFeature]
+        self._number_of_features = 0
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = output_format.get_driver_name()
+        options.layerName = layer_name
+        if output_format == DetectionOutputFormat.GEOPACKAGE and os.path.exists(file_path):
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        else:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+
+        if output_format == DetectionOutputFormat.GEOPACKAGE:
+            options.layerOptions = ['SPATIAL_INDEX=NO']  # will be created once all features are written
+        elif output_format == DetectionOutputFormat.FLATGEOBUF:
+            options.layerOptions = ['SPATIAL_INDEX=YES']  # packed index, built by the driver when the file is closed
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._writer = QgsVectorFileWriter.create(
+            file_path,
+            self.get_fields(),
+            QgsWkbTypes.MultiPolygon,
+            crs,
+            QgsCoordinateTransformContext(),
+            options)
+
+        if self._writer.hasError() != QgsVectorFileWriter.NoError:
+            raise Exception(f'Cannot create file for detections "{file_path}": {self._writer.errorMessage()}')
+
+    @staticmethod
+    def get_fields() -> QgsFields:
+        """ Attributes of every detection feature """
+        fields = QgsFields()
+        fields.append(QgsField('class_id', QVariant.Int))
+        fields.append(QgsField('class_name', QVariant.String))
+        fields.append(QgsField('confidence', QVariant.Double))
+        fields.append(QgsField('rotation', QVariant.Double))  # rotation of the bounding box, in degrees
+        return fields
+
+    def add_feature(self, feature: QgsFeature):
+        """ Add a single feature, created with `get_fields()` attributes. It is written to the file with the next batch """
+        geometry = feature.geometry()
+        geometry.convertToMultiType()
+        feature.setGeometry(geometry)
+
+        self._features_batch.append(feature)
+        if len(self._features_batch) >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._features_batch:
+            return
+
+        if not self._writer.addFeatures(self._features_batch):
+            raise Exception(f'Failed to write detections to file "{self.file_path}": {self._writer.errorMessage()}')
+
+        self._number_of_features += len(self._features_batch)
+        self._features_batch = []
+
+    def finish(self) -> str:
+        """ Write the remaining features, close the file and build the spatial index
+
+        :return: uri of the created layer, to be loaded with the 'ogr' provider
+        """
+        self._flush()
+        del self._writer  # closes the file
+
+        layer_uri = self.get_layer_uri()
+        if self.output_format == DetectionOutputFormat.GEOPACKAGE:
+            vlayer = QgsVectorLayer(layer_uri, self.layer_name, 'ogr')
+            if not vlayer.dataProvider().createSpatialIndex():
+                logging.warning(f'Failed to create spatial index for "{layer_uri}"')
+
+        print(f'Saved {self._number_of_features} detections to "{layer_uri}"')
+        return layer_uri
+
+    def get_layer_uri(self) -> str:
+        if self.output_format == DetectionOutputFormat.GEOPACKAGE:
+            return f'{self.file_path}|layername={self.layer_name}'
+        return self.file_path
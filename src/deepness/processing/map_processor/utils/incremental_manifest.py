@@ -0,0 +1,108 @@
+""" This file implements a manifest of tiles input, for incremental processing of only the changed tiles """
+
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from deepness.processing.tile_params import TileParams
+
+
+class IncrementalManifest:
+    """
+    Keeps a hash of the input image of each tile, from the previous run with the same processing parameters.
+    Tiles with unchanged input do not need to be processed again - their previous results (kept by the map processor
+    in files within the manifest directory, see `get_file_path`) can be used.
+
+    Hash of a tile is updated only after its results are written (see `set_tile_processed`),
+    so the results of tiles with a valid hash are always up to date. Therefore an interrupted run can be continued
+    by just running it again.
+    """
+
+    TILES_HASHES_FILE_NAME = 'tiles_hashes.npy'
+    HASH_SIZE = 16  # bytes
+
+    def __init__(self, manifest_dir_path: str, x_bins_number: int, y_bins_number: int):
+        """
+        :param manifest_dir_path: directory for the manifest files, specific for the processing parameters
+            (see `cache_key.create_cache_key`)
+        :param x_bins_number: number of tiles in a row
+        :param y_bins_number: number of tiles in a column
+        """
+        self.manifest_dir_path = manifest_dir_path
+        self.x_bins_number = x_bins_number
+        self._tiles_hashes_file_path = os.path.join(manifest_dir_path, self.TILES_HASHES_FILE_NAME)
+        self._number_of_changed_tiles = 0
+        self._number_of_unchanged_tiles = 0
+
+        tiles_hashes = None
+        if os.path.exists(self._tiles_hashes_file_path):
+            tiles_hashes = np.load(self._tiles_hashes_file_path)
+            if tiles_hashes.shape != (x_bins_number * y_bins_number, self.HASH_SIZE):
+                tiles_hashes = None
+
+        self.has_previous_results = tiles_hashes is not None
+        if self.has_previous_results:
+            self._tiles_hashes = tiles_hashes
+        else:
+            shutil.rmtree(manifest_dir_path, ignore_errors=True)  # results for a different tiles plan
+            os.makedirs(manifest_dir_path)
+            self._tiles_hashes = np.zeros((x_bins_number * y_bins_number, self.HASH_SIZE), dtype=np.uint8)
+
+        self._new_tiles_hashes = {}  # hashes of changed tiles, until their results are written
+
+    @staticmethod
+    def compute_tile_hash(tile_img: np.ndarray) -> np.ndarray:
+        """ Hash of the tile image content (including its shape and data type) """
+        hasher = hashlib.blake2b(digest_size=IncrementalManifest.HASH_SIZE)
+        hasher.update(f'{tile_img.shape}{tile_img.dtype}'.encode())
+        hasher.update(np.ascontiguousarray(tile_img).data)
+        return np.frombuffer(hasher.digest(), dtype=np.uint8)
+
+    def get_file_path(self, file_name: str) -> str:
+        """ Path of a file with results, kept together with the manifest """
+        return os.path.join(self.manifest_dir_path, file_name)
+
+    def get_tile_number(self, tile_params: TileParams) -> int:
+        return tile_params.y_bin_number * self.x_bins_number + tile_params.x_bin_number
+
+    def is_tile_changed(self, tile_img: np.ndarray, tile_params: TileParams) -> bool:
+        """ Whether the tile input changed since the previous run (or the tile was not processed).
+        Can be used as a tile image filter for `MapProcessor.tiles_generator`
+        """
+        tile_number = self.get_tile_number(tile_params)
+        tile_hash = self.compute_tile_hash(tile_img)
+        if self.has_previous_results and np.array_equal(self._tiles_hashes[tile_number], tile_hash):
+            self._number_of_unchanged_tiles += 1
+            return False
+
+        # until the new results are written, the previous results of this tile are not valid
+        self._tiles_hashes[tile_number] = 0
+        self._new_tiles_hashes[tile_number] = tile_hash
+        self._number_of_changed_tiles += 1
+        return True
+
+    def set_tile_processed(self, tile_params: TileParams):
+        """ Mark the results of a changed tile as written """
+        tile_number = self.get_tile_number(tile_params)
+        self._tiles_hashes[tile_number] = self._new_tiles_hashes.pop(tile_number)
+
+    def invalidate_tile(self, tile_params: TileParams):
+        """ Mark the previous results of the tile as not valid, so that it will be processed in the next run """
+        tile_number = self.get_tile_number(tile_params)
+        self._tiles_hashes[tile_number] = 0
+        self._new_tiles_hashes.pop(tile_number, None)
+
+    def get_number_of_changed_tiles(self) -> int:
+        return self._number_of_changed_tiles
+
+    def get_number_of_unchanged_tiles(self) -> int:
+        return self._number_of_unchanged_tiles
+
+    def save(self):
+        """ Save the hashes of the tiles (replaced atomically). Results need to be written to disk before """
+        tmp_file_path = self._tiles_hashes_file_path + '.tmp.npy'
+        np.save(tmp_file_path, self._tiles_hashes)
+        os.replace(tmp_file_path, self._tiles_hashes_file_path)
+        self.has_previous_results = True
@@ -0,0 +1,101 @@
+""" This file implements checkpoints of map processing, so that an interrupted processing can be resumed """
+
+import os
+import shutil
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from deepness.processing.tile_params import TileParams
+
+
+class ProcessingCheckpoint:
+    """
+    Persists which tiles of the processing plan are already completed (as a bitmap), while the results themselves
+    are kept by the map processor in files within the checkpoint directory (see `get_file_path`).
+
+    Bitmap is saved periodically (not after every tile, as the results need to be flushed to disk first),
+    so after a crash at most CHECKPOINT_INTERVAL_S of processing is lost.
+    """
+
+    CHECKPOINT_INTERVAL_S = 30
+    COMPLETED_TILES_FILE_NAME = 'completed_tiles.npy'
+
+    def __init__(self, checkpoint_dir_path: str, x_bins_number: int, y_bins_number: int):
+        """
+        :param checkpoint_dir_path: directory for the checkpoint files, specific for the processing parameters
+            (see `cache_key.create_cache_key`)
+        :param x_bins_number: number of tiles in a row
+        :param y_bins_number: number of tiles in a column
+        """
+        self.checkpoint_dir_path = checkpoint_dir_path
+        self.x_bins_number = x_bins_number
+        self._completed_tiles_file_path = os.path.join(checkpoint_dir_path, self.COMPLETED_TILES_FILE_NAME)
+        self._last_save_time = time.monotonic()
+
+        completed_tiles = None
+        if os.path.exists(self._completed_tiles_file_path):
+            completed_tiles = np.load(self._completed_tiles_file_path)
+            if completed_tiles.shape != (x_bins_number * y_bins_number,):
+                completed_tiles = None
+
+        self.is_resumed = completed_tiles is not None
+        if self.is_resumed:
+            self._completed_tiles = completed_tiles
+            print(f'Resuming processing from checkpoint "{checkpoint_dir_path}", '
+                  f'{self.get_number_of_completed_tiles()} tiles already completed')
+        else:
+            shutil.rmtree(checkpoint_dir_path, ignore_errors=True)  # results of an unfinished previous checkpoint
+            os.makedirs(checkpoint_dir_path)
+            self._completed_tiles = np.zeros(x_bins_number * y_bins_number, dtype=bool)
+
+    def get_file_path(self, file_name: str) -> str:
+        """ Path of a file with results, kept together with the checkpoint """
+        return os.path.join(self.checkpoint_dir_path, file_name)
+
+    def get_tile_number(self, tile_params: TileParams) -> int:
+        return tile_params.y_bin_number * self.x_bins_number + tile_params.x_bin_number
+
+    def is_tile_to_process(self, tile_params: TileParams) -> bool:
+        """ Whether the tile was not completed yet. Can be used as a tile filter for `MapProcessor.tiles_generator` """
+        return not self._completed_tiles[self.get_tile_number(tile_params)]
+
+    def is_tile_number_completed(self, tile_number: int) -> bool:
+        return bool(self._completed_tiles[tile_number])
+
+    def get_number_of_completed_tiles(self) -> int:
+        return int(np.count_nonzero(self._completed_tiles))
+
+    def mark_tiles_completed(self,
+                             tiles_params: List[TileParams],
+                             flush_results: Optional[Callable[[], None]] = None):
+        """ Mark tiles as completed. If the checkpoint interval passed, results are flushed and the checkpoint saved
+
+        :param tiles_params: completed tiles
+        :param flush_results: function writing the results of the completed tiles to disk
+        """
+        for tile_params in tiles_params:
+            self._completed_tiles[self.get_tile_number(tile_params)] = True
+
+        if time.monotonic() - self._last_save_time >= self.CHECKPOINT_INTERVAL_S:
+            self.save(flush_results)
+
+    def save(self, flush_results: Optional[Callable[[], None]] = None):
+        """ Flush the results and save the bitmap of completed tiles (replaced atomically) """
+        if flush_results is not None:
+            flush_results()
+
+        tmp_file_path = self._completed_tiles_file_path + '.tmp.npy'
+        np.save(tmp_file_path, self._completed_tiles)
+        os.replace(tmp_file_path, self._completed_tiles_file_path)
+        self._last_save_time = time.monotonic()
+
+    def invalidate(self):
+        """ Mark the checkpoint as not resumable, e.g. before the results are modified in post-processing """
+        if os.path.exists(self._completed_tiles_file_path):
+            os.remove(self._completed_tiles_file_path)
+
+    def remove(self):
+        """ Remove the checkpoint with all results files, once processing is finished """
+        shutil.rmtree(self.checkpoint_dir_path, ignore_errors=True)
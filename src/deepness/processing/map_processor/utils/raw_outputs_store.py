@@ -0,0 +1,91 @@
+""" This file implements a store of raw model outputs for each tile, to repeat the post-processing without inference """
+
+import json
+import os
+import pickle
+import shutil
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class RawOutputsStore:
+    """
+    Raw model outputs (before post-processing, e.g. thresholding or NMS) of all processed tiles, saved on disk.
+    With the same processing parameters (apart from post-processing ones, like thresholds), post-processing
+    can be repeated from the stored outputs, without reading the tiles and running the model.
+
+    Outputs are appended tile by tile (in the order of processing) to a single file.
+    The metadata file is written last, so the store is complete only if the metadata file exists.
+    """
+
+    OUTPUTS_FILE_NAME = 'raw_outputs.pkl'
+    METADATA_FILE_NAME = 'metadata.json'
+
+    def __init__(self, store_dir_path: str):
+        """
+        :param store_dir_path: directory for the store files, specific for the processing parameters
+            (see `cache_key.create_cache_key`)
+        """
+        self.store_dir_path = store_dir_path
+        self._outputs_file_path = os.path.join(store_dir_path, self.OUTPUTS_FILE_NAME)
+        self._metadata_file_path = os.path.join(store_dir_path, self.METADATA_FILE_NAME)
+        self._outputs_file = None
+        self._number_of_tiles = 0
+
+    def is_complete(self) -> bool:
+        return os.path.exists(self._metadata_file_path)
+
+    def get_metadata(self) -> Dict[str, Any]:
+        with open(self._metadata_file_path) as f:
+            return json.load(f)
+
+    def create(self):
+        """ Start a new store, removing the previous one """
+        shutil.rmtree(self.store_dir_path, ignore_errors=True)
+        os.makedirs(self.store_dir_path)
+        self._outputs_file = open(self._outputs_file_path, 'wb')
+        self._number_of_tiles = 0
+
+    def remove(self):
+        shutil.rmtree(self.store_dir_path, ignore_errors=True)
+
+    def add_tile(self, tile_number: int, outputs: List[np.ndarray]):
+        """ Add raw outputs of a tile
+
+        :param tile_number: number of the tile in the processing (y_bin_number * x_bins_number + x_bin_number)
+        :param outputs: raw outputs of the tile (one array for each model output, without the batch dimension)
+        """
+        pickle.dump((tile_number, outputs), self._outputs_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._number_of_tiles += 1
+
+    def finish(self, **metadata):
+        """ Mark the store as complete
+
+        :param metadata: additional values describing the stored outputs
+        """
+        self.close()
+        metadata['number_of_tiles'] = self._number_of_tiles
+        with open(self._metadata_file_path, 'w') as f:
+            json.dump(metadata, f)
+
+    def close(self):
+        """ Close the outputs file. If the store was not finished, it stays incomplete """
+        if self._outputs_file is not None:
+            self._outputs_file.close()
+            self._outputs_file = None
+
+    def iterate_tiles(self) -> Iterator[Tuple[int, List[np.ndarray]]]:
+        """ Iterate over the stored tiles, in the order of processing
+
+        :return: tuples (tile_number, outputs)
+        """
+        with open(self._outputs_file_path, 'rb') as f:
+            for _ in range(self.get_metadata()['number_of_tiles']):
+                yield pickle.load(f)
+
+    def get_number_of_tiles(self) -> Optional[int]:
+        """ Number of tiles in the complete store, None if the store is not complete """
+        if not self.is_complete():
+            return None
+        return self.get_metadata()['number_of_tiles']
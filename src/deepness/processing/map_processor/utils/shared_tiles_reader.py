@@ -0,0 +1,91 @@
+""" This file implements reading of tiles shared by several map processors, processing the same tiles grid """
+
+import threading
+from typing import Callable, Dict, Hashable, List
+
+import numpy as np
+
+from deepness.processing.tile_params import TileParams
+
+
+class SharedTilesReader:
+    """
+    Reads each tile once for several map processors (consumers) processing the same tiles grid in parallel threads,
+    e.g. with different models. The tile image is read with the image channels needed by any of the consumers,
+    and each consumer gets only its own channels (model inputs, in the order of its channels mapping).
+
+    Consumers iterate over tiles in the same order (see `MapProcessor.tiles_generator`), reporting their position
+    also for tiles which they skip. A tile is kept until all consumers passed it, and consumers wait if they are
+    more than `max_tiles_ahead` tiles ahead of the slowest one, so that only a few tiles are kept in memory.
+    """
+
+    def __init__(self, read_tile_image: Callable[[TileParams], np.ndarray], max_tiles_ahead: int = 16):
+        """
+        :param read_tile_image: function reading the tile image (height, width, channels), with all channels
+        :param max_tiles_ahead: how many tiles a consumer can be ahead of the slowest consumer
+        """
+        self._read_tile_image = read_tile_image
+        self._max_tiles_ahead = max_tiles_ahead
+        self._condition = threading.Condition()
+        self._read_lock = threading.Lock()  # tiles are read one at a time, as the raster layer is shared
+        self._positions = {}  # type: Dict[Hashable, int]  # number of the current tile of each active consumer
+        self._channels_indexes = {}  # type: Dict[Hashable, List[int]]
+        self._tiles = {}  # type: Dict[int, np.ndarray]  # tile images still needed by some consumers
+        self.number_of_tiles_read = 0
+
+    @staticmethod
+    def _get_tile_number(tile_params: TileParams) -> int:
+        return tile_params.y_bin_number * tile_params.x_bins_number + tile_params.x_bin_number
+
+    def add_consumer(self, consumer: Hashable, channels_indexes: List[int]):
+        """
+        :param consumer: e.g. the map processor
+        :param channels_indexes: indexes of the channels of the read tile image, for inputs of the consumer model
+        """
+        with self._condition:
+            self._channels_indexes[consumer] = list(channels_indexes)
+            self._positions[consumer] = 0
+
+    def set_consumer_finished(self, consumer: Hashable):
+        """ Consumer will not read more tiles (e.g. it passed all tiles, or its processing failed),
+        so other consumers do not wait for it
+        """
+        with self._condition:
+            self._positions.pop(consumer, None)
+            self._remove_passed_tiles()
+            self._condition.notify_all()
+
+    def set_position(self, consumer: Hashable, tile_params: TileParams):
+        """ Report the tile which the consumer iterates over now (before deciding whether to read it).
+        Waits if the consumer is too far ahead of other consumers
+        """
+        tile_number = self._get_tile_number(tile_params)
+        with self._condition:
+            self._positions[consumer] = tile_number
+            self._remove_passed_tiles()
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: tile_number - min(self._positions.values()) <= self._max_tiles_ahead)
+
+    def _remove_passed_tiles(self):
+        min_position = min(self._positions.values(), default=None)
+        for tile_number in list(self._tiles):
+            if min_position is None or tile_number < min_position:
+                del self._tiles[tile_number]
+
+    def get_tile_image(self, consumer: Hashable, tile_params: TileParams) -> np.ndarray:
+        """ Get the tile image with channels of the consumer (read if no other consumer read it yet) """
+        tile_number = self._get_tile_number(tile_params)
+        with self._read_lock:
+            with self._condition:
+                tile_img = self._tiles.get(tile_number)
+
+            if tile_img is None:
+                tile_img = self._read_tile_image(tile_params)
+                with self._condition:
+                    self.number_of_tiles_read += 1
+                    is_needed_by_others = any(position <= tile_number for other_consumer, position in self._positions.items()
+                                              if other_consumer is not consumer)
+                    if is_needed_by_others:
+                        self._tiles[tile_number] = tile_img
+
+        return tile_img[:, :, self._channels_indexes[consumer]]
@@ -0,0 +1,269 @@
+""" This file implements an image stored in chunks, with only the written chunks allocated """
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+ChunkYX = Tuple[int, int]  # (y, x) number of the chunk
+
+
+@dataclass
+class ImageRegion:
+    """ Dense copy of a group of neighbouring chunks of `SparseChunkedImage` (see `iterate_regions`) """
+
+    y_min: int  # position of `img` in the image
+    x_min: int
+    img: np.ndarray  # (channels, height, width), zeros outside of the chunks of the region
+    chunks: List[ChunkYX]
+
+    def get_slice_yx(self) -> Tuple[slice, slice]:
+        """ Slice of the region in the (height, width) dimensions of the image """
+        return np.s_[self.y_min:self.y_min + self.img.shape[1], self.x_min:self.x_min + self.img.shape[2]]
+
+
+class SparseChunkedImage:
+    """
+    Image of shape (channels, height, width), split into square chunks in the (height, width) dimensions.
+    Only chunks with non-zero values written are allocated, other chunks are filled with zeros.
+    E.g. for results of processing within a few polygons scattered over a large extent, so that the memory
+    scales with the processed area, not with the extent.
+
+    Supports reading and writing with slices, as a numpy array (e.g. `img[:, y_min:y_max, x_min:x_max]`,
+    see `TileParams.set_mask_on_full_img`). Operations on the whole image are done region by region
+    (groups of neighbouring chunks, see `iterate_regions`) or chunk by chunk (see `iterate_chunks`).
+    """
+
+    DEFAULT_CHUNK_SIZE_PX = 1024
+
+    def __init__(self,
+                 shape: Tuple[int, int, int],
+                 dtype=np.uint8,
+                 chunk_size_px: int = DEFAULT_CHUNK_SIZE_PX,
+                 chunks_dir_path: Optional[str] = None):
+        """
+        :param shape: (channels, height, width)
+        :param chunk_size_px: width and height of chunks
+        :param chunks_dir_path: directory for memory-mapped files of chunks. Chunks are kept in memory if None
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size_px = chunk_size_px
+        self._chunks_dir_path = chunks_dir_path
+        self._chunks = {}  # type: Dict[ChunkYX, np.ndarray]
+        self._offset_yx = (0, 0)  # position of this image in the chunks grid, for cropped images (see `crop`)
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the allocated chunks """
+        return sum(chunk.nbytes for chunk in self._chunks.values())
+
+    def get_number_of_chunks(self) -> int:
+        """ Number of allocated chunks (including chunks outside of a cropped image) """
+        return len(self._chunks)
+
+    def _parse_key(self, key) -> Tuple[object, int, int, int, int]:
+        """ Convert the indexing key to (channels key, y_start, y_stop, x_start, x_stop) """
+        if not isinstance(key, tuple) or len(key) != 3 or not all(isinstance(k, slice) for k in key[1:]):
+            raise Exception(f"Unsupported key for SparseChunkedImage: {key}. Expected (channels, y slice, x slice)")
+
+        y_start, y_stop, y_step = key[1].indices(self.shape[1])
+        x_start, x_stop, x_step = key[2].indices(self.shape[2])
+        if y_step != 1 or x_step != 1:
+            raise Exception("Steps in slices are not supported in SparseChunkedImage")
+        return key[0], y_start, max(y_start, y_stop), x_start, max(x_start, x_stop)
+
+    def _iterate_window_chunks(self, y_start: int, y_stop: int, x_start: int, x_stop: int
+                               ) -> Iterator[Tuple[ChunkYX, Tuple[slice, slice], Tuple[slice, slice]]]:
+        """ Iterate over chunks (allocated or not) intersecting the window of the image
+
+        :return: generator of (chunk number, (y, x) slice in the chunk, (y, x) slice in the window)
+        """
+        size = self.chunk_size_px
+        offset_y, offset_x = self._offset_yx
+        for chunk_y in range((y_start + offset_y) // size, (y_stop - 1 + offset_y) // size + 1):
+            chunk_y_start = chunk_y * size - offset_y  # in the image coordinates
+            y_min, y_max = max(y_start, chunk_y_start), min(y_stop, chunk_y_start + size)
+            for chunk_x in range((x_start + offset_x) // size, (x_stop - 1 + offset_x) // size + 1):
+                chunk_x_start = chunk_x * size - offset_x
+                x_min, x_max = max(x_start, chunk_x_start), min(x_stop, chunk_x_start + size)
+                yield ((chunk_y, chunk_x),
+                       np.s_[y_min - chunk_y_start:y_max - chunk_y_start, x_min - chunk_x_start:x_max - chunk_x_start],
+                       np.s_[y_min - y_start:y_max - y_start, x_min - x_start:x_max - x_start])
+
+    def _allocate_chunk(self, chunk_yx: ChunkYX) -> np.ndarray:
+        chunk_shape = (self.shape[0], self.chunk_size_px, self.chunk_size_px)
+        if self._chunks_dir_path is None:
+            chunk = np.zeros(chunk_shape, dtype=self.dtype)
+        else:
+            os.makedirs(self._chunks_dir_path, exist_ok=True)
+            chunk = np.memmap(os.path.join(self._chunks_dir_path, f'chunk_{chunk_yx[0]}_{chunk_yx[1]}.dat'),
+                              dtype=self.dtype, mode='w+', shape=chunk_shape)
+        self._chunks[chunk_yx] = chunk
+        return chunk
+
+    def __getitem__(self, key) -> np.ndarray:
+        channels_key, y_start, y_stop, x_start, x_stop = self._parse_key(key)
+        channels_shape = np.empty((self.shape[0], 0))[channels_key].shape[:-1]
+        window = np.zeros(channels_shape + (y_stop - y_start, x_stop - x_start), dtype=self.dtype)
+        if y_stop == y_start or x_stop == x_start:
+            return window
+
+        for chunk_yx, chunk_slice, window_slice in self._iterate_window_chunks(y_start, y_stop, x_start, x_stop):
+            chunk = self._chunks.get(chunk_yx)
+            if chunk is not None:
+                window[(Ellipsis,) + window_slice] = chunk[(channels_key,) + chunk_slice]
+        return window
+
+    def __setitem__(self, key, value):
+        channels_key, y_start, y_stop, x_start, x_stop = self._parse_key(key)
+        if y_stop == y_start or x_stop == x_start:
+            return
+        channels_shape = np.empty((self.shape[0], 0))[channels_key].shape[:-1]
+        value = np.broadcast_to(np.asarray(value), channels_shape + (y_stop - y_start, x_stop - x_start))
+
+        for chunk_yx, chunk_slice, window_slice in self._iterate_window_chunks(y_start, y_stop, x_start, x_stop):
+            value_part = value[(Ellipsis,) + window_slice]
+            chunk = self._chunks.get(chunk_yx)
+            if chunk is None:
+                if not np.any(value_part):
+                    continue  # zeros are not stored
+                chunk = self._allocate_chunk(chunk_yx)
+            chunk[(channels_key,) + chunk_slice] = value_part
+
+    def crop(self, y_min: int, x_min: int, height: int, width: int) -> 'SparseChunkedImage':
+        """ Get a part of the image, sharing the chunks with this image (writes are visible in both) """
+        cropped_img = SparseChunkedImage(
+            shape=(self.shape[0], height, width),
+            dtype=self.dtype,
+            chunk_size_px=self.chunk_size_px,
+            chunks_dir_path=self._chunks_dir_path)
+        cropped_img._chunks = self._chunks
+        cropped_img._offset_yx = (self._offset_yx[0] + y_min, self._offset_yx[1] + x_min)
+        return cropped_img
+
+    def _get_chunk_window(self, chunk_yx: ChunkYX, margin_px: int = 0) -> Tuple[int, int, int, int]:
+        """ (y_start, y_stop, x_start, x_stop) of the chunk in the image (clipped to the image), extended by the margin """
+        y_start = chunk_yx[0] * self.chunk_size_px - self._offset_yx[0]
+        x_start = chunk_yx[1] * self.chunk_size_px - self._offset_yx[1]
+        return (max(y_start - margin_px, 0), min(y_start + self.chunk_size_px + margin_px, self.shape[1]),
+                max(x_start - margin_px, 0), min(x_start + self.chunk_size_px + margin_px, self.shape[2]))
+
+    def _get_chunks_within_image(self) -> Set[ChunkYX]:
+        chunks = set()
+        for chunk_yx in self._chunks:
+            y_start, y_stop, x_start, x_stop = self._get_chunk_window(chunk_yx)
+            if y_start < y_stop and x_start < x_stop:
+                chunks.add(chunk_yx)
+        return chunks
+
+    def iterate_chunks(self) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """ Iterate over allocated chunks (clipped to the image)
+
+        :return: generator of (y_min, x_min, chunk image)
+        """
+        for chunk_yx in sorted(self._get_chunks_within_image()):
+            y_start, y_stop, x_start, x_stop = self._get_chunk_window(chunk_yx)
+            yield y_start, x_start, self[:, y_start:y_stop, x_start:x_stop]
+
+    def iterate_regions(self, margin_px: int = 0) -> Iterator[ImageRegion]:
+        """ Iterate over groups of neighbouring allocated chunks (connected also diagonally), as dense images.
+        Connected objects in the image are always within a single region (they cannot cross not allocated chunks).
+
+        Regions may be modified and written back with `set_region` during the iteration
+        (regions are determined at the start, and filled with the values from before the modifications)
+
+        :param margin_px: margin around the chunks of the region, e.g. for filtering with a kernel.
+            Must be smaller than the chunk size
+        """
+        if margin_px >= self.chunk_size_px:
+            raise Exception("Region margin must be smaller than the chunk size!")
+
+        groups = self._group_neighbouring_chunks(self._get_chunks_within_image())
+        groups_imgs = []
+        for group in groups:
+            windows = [self._get_chunk_window(chunk_yx, margin_px=margin_px) for chunk_yx in group]
+            y_min, x_min = min(w[0] for w in windows), min(w[2] for w in windows)
+            y_max, x_max = max(w[1] for w in windows), max(w[3] for w in windows)
+
+            img = np.zeros((self.shape[0], y_max - y_min, x_max - x_min), dtype=self.dtype)
+            for chunk_yx in group:  # only chunks of the group, there may be other regions within the bounding box
+                y_start, y_stop, x_start, x_stop = self._get_chunk_window(chunk_yx)
+                img[:, y_start - y_min:y_stop - y_min, x_start - x_min:x_stop - x_min] = self[:, y_start:y_stop, x_start:x_stop]
+            groups_imgs.append(ImageRegion(y_min=y_min, x_min=x_min, img=img, chunks=group))
+
+        yield from groups_imgs
+
+    def set_region(self, region: ImageRegion):
+        """ Write the (modified) region back - its chunks, and the parts of the margin in the neighbouring chunks.
+        Values in the margin are merged with the maximum, as margins of different regions may share a chunk
+        (and only one of them may have non-zero values in each pixel, as regions are separated by whole chunks)
+        """
+        group = set(region.chunks)
+        neighbouring_chunks = {(chunk_y + dy, chunk_x + dx) for chunk_y, chunk_x in group
+                               for dy in (-1, 0, 1) for dx in (-1, 0, 1)} - group
+
+        region_y_stop = region.y_min + region.img.shape[1]
+        region_x_stop = region.x_min + region.img.shape[2]
+        for chunk_yx in sorted(group) + sorted(neighbouring_chunks):
+            y_start, y_stop, x_start, x_stop = self._get_chunk_window(chunk_yx)
+            y_start, y_stop = max(y_start, region.y_min), min(y_stop, region_y_stop)
+            x_start, x_stop = max(x_start, region.x_min), min(x_stop, region_x_stop)
+            if y_start >= y_stop or x_start >= x_stop:
+                continue
+
+            window_slice = np.s_[:, y_start:y_stop, x_start:x_stop]
+            region_part = region.img[:, y_start - region.y_min:y_stop - region.y_min,
+                                     x_start - region.x_min:x_stop - region.x_min]
+            if chunk_yx in group:
+                self[window_slice] = region_part
+            elif np.any(region_part):
+                self[window_slice] = np.maximum(self[window_slice], region_part)
+
+    @staticmethod
+    def _group_neighbouring_chunks(chunks: Set[ChunkYX]) -> List[List[ChunkYX]]:
+        groups = []
+        not_grouped_chunks = set(chunks)
+        while not_grouped_chunks:
+            first_chunk_yx = min(not_grouped_chunks)
+            not_grouped_chunks.remove(first_chunk_yx)
+            group = [first_chunk_yx]
+            to_visit = [first_chunk_yx]
+            while to_visit:
+                chunk_y, chunk_x = to_visit.pop()
+                for dy in (-1, 0, 1):
+                    for dx in (-1, 0, 1):
+                        neighbour_yx = (chunk_y + dy, chunk_x + dx)
+                        if neighbour_yx in not_grouped_chunks:
+                            not_grouped_chunks.remove(neighbour_yx)
+                            group.append(neighbour_yx)
+                            to_visit.append(neighbour_yx)
+            groups.append(sorted(group))
+        return groups
+
+    def count_values(self, channel: int) -> Dict[int, int]:
+        """ Count occurrences of each value in the channel (as `np.unique` with `return_counts`), without creating
+        the dense image. Not allocated chunks are counted as zeros
+        """
+        counts_map = {}  # type: Dict[int, int]
+        number_of_counted_pixels = 0
+        for _, _, chunk_img in self.iterate_chunks():
+            unique, counts = np.unique(chunk_img[channel], return_counts=True)
+            for value, count in zip(unique, counts):
+                counts_map[value] = counts_map.get(value, 0) + int(count)
+            number_of_counted_pixels += chunk_img.shape[1] * chunk_img.shape[2]
+
+        number_of_zeros = self.shape[1] * self.shape[2] - number_of_counted_pixels
+        if number_of_zeros > 0:
+            zero = self.dtype.type(0)
+            counts_map[zero] = counts_map.get(zero, 0) + number_of_zeros
+        return counts_map
+
+    def to_dense(self) -> np.ndarray:
+        """ Create the full image (it may be large) """
+        return self[:, :, :]
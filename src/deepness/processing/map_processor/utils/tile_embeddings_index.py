@@ -0,0 +1,134 @@
+""" This file implements an on-disk index of tile embeddings, so that a map can be searched for many query images,
+while running the model over the map only once
+"""
+
+import json
+import os
+import shutil
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class TileEmbeddingsIndex:
+    """
+    Embeddings of all processed tiles (memmapped float32 matrix, one row for each tile) with tile coordinates.
+    Embeddings are normalized when added, so cosine similarity for a query is just a matrix-vector product.
+
+    Index is valid only for the same layer, extent, resolution, tiles and model - all of them are part of the key,
+    which is used as the index directory name. The index is marked as complete only after all tiles are added,
+    so an interrupted processing doesn't leave a partial index to be used later.
+    """
+
+    EMBEDDINGS_FILE_NAME = 'embeddings.dat'
+    TILES_FILE_NAME = 'tiles.npy'
+    METADATA_FILE_NAME = 'metadata.json'
+
+    def __init__(self, index_dir: str):
+        """
+        :param index_dir: directory with the index files (specific for the index key, see `cache_key.create_cache_key`)
+        """
+        self.index_dir = index_dir
+        self._embeddings = None  # type: Optional[np.ndarray]
+        self._tiles_xy_bins = None  # type: Optional[np.ndarray]
+        self._number_of_added_tiles = 0
+
+    def exists(self) -> bool:
+        """ Whether a complete index was already created in the index directory """
+        return os.path.exists(os.path.join(self.index_dir, self.METADATA_FILE_NAME))
+
+    def create(self, number_of_tiles: int, embedding_size: int):
+        """ Start creating a new index, for a known number of tiles (overwriting previous, possibly partial, one) """
+        if number_of_tiles == 0:
+            raise Exception("Cannot create the tile embeddings index without any tiles!")  # an empty file cannot be mapped
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.makedirs(self.index_dir)
+
+        self._embeddings = np.memmap(
+            os.path.join(self.index_dir, self.EMBEDDINGS_FILE_NAME),
+            dtype=np.float32,
+            mode='w+',
+            shape=(number_of_tiles, embedding_size))
+        self._tiles_xy_bins = np.zeros((number_of_tiles, 2), dtype=np.int32)
+        self._number_of_added_tiles = 0
+
+    def add_tiles(self, tiles_xy_bins: List[tuple], embeddings: np.ndarray):
+        """ Add embeddings of a batch of tiles
+
+        :param tiles_xy_bins: (x_bin_number, y_bin_number) of each tile
+        :param embeddings: embeddings of the tiles, shape (N, embedding_size)
+        """
+        start = self._number_of_added_tiles
+        end = start + len(tiles_xy_bins)
+        self._embeddings[start:end] = self.normalize(embeddings)
+        self._tiles_xy_bins[start:end] = tiles_xy_bins
+        self._number_of_added_tiles = end
+
+    def finish(self):
+        """ Flush the embeddings to disk and mark the index as complete """
+        if self._number_of_added_tiles != len(self._tiles_xy_bins):
+            raise Exception(f'Index not complete - added {self._number_of_added_tiles} '
+                            f'of {len(self._tiles_xy_bins)} tiles')
+
+        self._embeddings.flush()
+        np.save(os.path.join(self.index_dir, self.TILES_FILE_NAME), self._tiles_xy_bins)
+
+        metadata = {
+            'number_of_tiles': int(self._embeddings.shape[0]),
+            'embedding_size': int(self._embeddings.shape[1]),
+        }
+        with open(os.path.join(self.index_dir, self.METADATA_FILE_NAME), 'w') as f:
+            json.dump(metadata, f)
+
+    def load(self):
+        """ Load an existing index (embeddings are memmapped, not read into memory) """
+        with open(os.path.join(self.index_dir, self.METADATA_FILE_NAME)) as f:
+            metadata = json.load(f)
+
+        self._embeddings = np.memmap(
+            os.path.join(self.index_dir, self.EMBEDDINGS_FILE_NAME),
+            dtype=np.float32,
+            mode='r',
+            shape=(metadata['number_of_tiles'], metadata['embedding_size']))
+        self._tiles_xy_bins = np.load(os.path.join(self.index_dir, self.TILES_FILE_NAME))
+        self._number_of_added_tiles = len(self._tiles_xy_bins)
+
+    def get_tiles_xy_bins(self) -> np.ndarray:
+        """ (x_bin_number, y_bin_number) of each tile in the index, shape (N, 2) """
+        return self._tiles_xy_bins
+
+    @staticmethod
+    def normalize(embeddings: np.ndarray) -> np.ndarray:
+        """ Scale embeddings (rows) to unit length """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    def query(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """ Calculate cosine similarity of query embeddings to all tiles in the index
+
+        :param query_embeddings: embeddings of the query images, shape (Q, embedding_size)
+        :return: cosine similarity for each query and each tile, shape (Q, N)
+        """
+        return self.normalize(query_embeddings) @ self._embeddings.T
+
+    def query_top_k(self, query_embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Find k tiles most similar to each query (exact search, with partial sorting of the similarities)
+
+        :param query_embeddings: embeddings of the query images, shape (Q, embedding_size)
+        :param k: number of tiles to find for each query. Limited to the number of tiles in the index
+        :return: tuple of (tiles indices, similarities), both of shape (Q, k), sorted from the most similar tile
+        """
+        similarities = self.query(query_embeddings)
+        k = min(k, similarities.shape[1])
+        if k == 0:  # e.g. no tiles in the index
+            empty_shape = (similarities.shape[0], 0)
+            return np.zeros(empty_shape, dtype=np.int64), np.zeros(empty_shape, dtype=similarities.dtype)
+
+        top_k_indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_k_similarities = np.take_along_axis(similarities, top_k_indices, axis=1)
+
+        order = np.argsort(-top_k_similarities, axis=1, kind='stable')
+        top_k_indices = np.take_along_axis(top_k_indices, order, axis=1)
+        top_k_similarities = np.take_along_axis(top_k_similarities, order, axis=1)
+        return top_k_indices, top_k_similarities
@@ -0,0 +1,101 @@
+""" This file implements a heatmap with a constant value for each tile, stored on a grid of tile edges
+instead of the full resolution image
+"""
+
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+
+class TilesGridHeatmap:
+    """
+    Mean of per-tile values (e.g. similarity to the query image) for each pixel of the processed image.
+
+    As the value is constant within a tile, the image is split into cells by all tile edges (in x and y),
+    and only one value per cell is stored. With overlapping tiles it is about (tile_size / stride)^2 values per tile,
+    instead of stride^2 pixels. Full resolution image is created only on request, or row by row when saving it.
+    """
+
+    def __init__(self,
+                 tiles_xy_px: np.ndarray,
+                 tile_size_px: int,
+                 image_shape_yx: Tuple[int, int]):
+        """
+        :param tiles_xy_px: position of the top-left corner of each tile in the image, in pixels, shape (N, 2)
+        :param tile_size_px: size of the (square) tiles
+        :param image_shape_yx: shape of the full resolution image
+        """
+        self.tiles_xy_px = np.asarray(tiles_xy_px, dtype=np.int64).reshape(-1, 2)
+        self.tile_size_px = tile_size_px
+        self.image_shape_yx = image_shape_yx
+
+        self._x_edges = self._get_cells_edges(self.tiles_xy_px[:, 0], image_shape_yx[1])
+        self._y_edges = self._get_cells_edges(self.tiles_xy_px[:, 1], image_shape_yx[0])
+
+        # range of cells covered by each tile
+        self._tiles_x_cells = np.searchsorted(self._x_edges, [self.tiles_xy_px[:, 0], self.tiles_xy_px[:, 0] + tile_size_px]).T
+        self._tiles_y_cells = np.searchsorted(self._y_edges, [self.tiles_xy_px[:, 1], self.tiles_xy_px[:, 1] + tile_size_px]).T
+
+        self._values_grid = None  # type: np.ndarray
+        self._outlines = []  # type: List[Tuple[int, int, int, float]]
+
+    def _get_cells_edges(self, tiles_start_px: np.ndarray, image_size_px: int) -> np.ndarray:
+        edges = np.concatenate([[0, image_size_px], tiles_start_px, tiles_start_px + self.tile_size_px])
+        return np.unique(np.clip(edges, 0, image_size_px))
+
+    def set_tiles_values(self, values: np.ndarray):
+        """ Calculate the mean of values of all tiles covering each cell (NaN if not covered by any tile)
+
+        :param values: value for each tile, shape (N,)
+        """
+        grid_shape = (len(self._y_edges) - 1, len(self._x_edges) - 1)
+        values_sum = np.zeros(grid_shape, dtype=np.float32)
+        tiles_count = np.zeros(grid_shape, dtype=np.int16)
+
+        for (x_start, x_end), (y_start, y_end), value in zip(self._tiles_x_cells, self._tiles_y_cells, values):
+            values_sum[y_start:y_end, x_start:x_end] += value
+            tiles_count[y_start:y_end, x_start:x_end] += 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._values_grid = values_sum / tiles_count
+
+    def add_tile_outline(self, x_px: int, y_px: int, size_px: int, value: float = 1):
+        """ Mark an outline of a square (e.g. the best tile) in the full resolution image """
+        self._outlines.append((x_px, y_px, size_px, value))
+
+    def get_grid_shape(self) -> Tuple[int, int]:
+        return self._values_grid.shape
+
+    def iterate_row_blocks(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """ Iterate over rows of the full resolution image, in blocks of rows with the same values
+
+        :return: generator of (first row number, image block)
+        """
+        x_repeats = np.diff(self._x_edges)
+        for cell_y, (y_start, y_end) in enumerate(zip(self._y_edges[:-1], self._y_edges[1:])):
+            row = np.repeat(self._values_grid[cell_y], x_repeats)
+            block = np.repeat(row[np.newaxis, :], y_end - y_start, axis=0)
+            self._draw_outlines(block, y_start)
+            yield int(y_start), block
+
+    def get_full_image(self) -> np.ndarray:
+        """ Create the full resolution image (it may be large) """
+        full_img = np.zeros(self.image_shape_yx, dtype=np.float32)
+        for y_start, block in self.iterate_row_blocks():
+            full_img[y_start:y_start + block.shape[0]] = block
+        return full_img
+
+    def _draw_outlines(self, block: np.ndarray, block_y_start: int):
+        block_y_end = block_y_start + block.shape[0]
+        for x, y, size, value in self._outlines:
+            # (y_min, y_max, x_min, x_max) of each line, the same as drawing on the full image
+            lines = [
+                (y, y + 1, x, x + size - 1),
+                (y + size - 1, y + size, x, x + size - 1),
+                (y, y + size - 1, x, x + 1),
+                (y, y + size - 1, x + size - 1, x + size),
+            ]
+            for y_min, y_max, x_min, x_max in lines:
+                y_min, y_max = max(y_min, block_y_start), min(y_max, block_y_end)
+                if y_min < y_max:
+                    block[y_min - block_y_start:y_max - block_y_start, x_min:x_max] = value
@@ -0,0 +1,69 @@
+""" This file implements an in-memory cache of model results for single tiles, shared between map processing runs """
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TilesResultsCache:
+    """
+    Least recently used cache of tile results, with a limit of the total size of the results.
+
+    Tiles are identified by their position in the global tiles grid (see `MapProcessor._is_tiles_grid_global`)
+    and a key of the processing parameters, so results can be reused e.g. while panning the map,
+    when processing the visible part of the map.
+    """
+
+    def __init__(self, max_size_bytes: int = 0):
+        self._max_size_bytes = max_size_bytes
+        self._size_bytes = 0
+        self._entries = OrderedDict()  # type: OrderedDict[Hashable, Tuple[Any, int]]
+        self._lock = threading.Lock()
+
+    def set_max_size_bytes(self, max_size_bytes: int):
+        with self._lock:
+            self._max_size_bytes = max_size_bytes
+            self._evict()
+
+    def get_size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """ Get the cached result, or None if it is not in the cache """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size_bytes: int):
+        """ Add the result to the cache, removing the least recently used results if the cache is full
+
+        :param key: key of the tile
+        :param value: result of the tile. Should not be modified after adding it to the cache
+        :param size_bytes: (approximate) size of the result
+        """
+        with self._lock:
+            if key in self._entries:
+                self._size_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size_bytes)
+            self._size_bytes += size_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def _evict(self):
+        while self._entries and self._size_bytes > self._max_size_bytes:
+            _, (_, size_bytes) = self._entries.popitem(last=False)
+            self._size_bytes -= size_bytes
+
+
+# shared by all map processors, so that results are available for the following runs
+TILES_RESULTS_CACHE = TilesResultsCache()
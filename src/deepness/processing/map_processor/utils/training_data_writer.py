@@ -0,0 +1,186 @@
+""" This file implements writing of exported training data (image and mask tiles), as loose PNG files or in shards,
+with image encoding done in a thread pool
+"""
+
+import io
+import json
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from deepness.common.lazy_package_loader import LazyPackageLoader
+from deepness.common.processing_parameters.training_data_export_parameters import TrainingDataExportFormat
+
+cv2 = LazyPackageLoader('cv2')
+
+
+class TrainingDataWriter:
+    """
+    Writes exported tiles in the chosen format:
+     - PNG_FILES - one PNG file for each tile (image or mask)
+     - TAR_SHARDS - PNG files packed into tar archives with `tiles_per_shard` files each
+     - NPZ_SHARDS - raw arrays (channels in RGB(A) order) packed into compressed npz archives with `tiles_per_shard` arrays each
+
+    For shards, an index file (INDEX_FILE_NAME) lists the files in each shard.
+    Writing is completed with `finish` (also for canceled export), or stopped with `abort` after a failure.
+
+    Encoding (PNG or zlib compression, which release the GIL) is done in a thread pool, so all cores can be used.
+    Number of tiles waiting for encoding is limited, to keep the memory usage bounded.
+    """
+
+    INDEX_FILE_NAME = 'index.json'
+
+    def __init__(self,
+                 output_dir_path: str,
+                 output_format: TrainingDataExportFormat,
+                 png_compression_level: int,
+                 tiles_per_shard: int,
+                 number_of_workers: Optional[int] = None):
+        """
+        :param output_dir_path: directory for the output files
+        :param output_format: format of the output files
+        :param png_compression_level: PNG compression level, 0-9 (higher - smaller files, slower)
+        :param tiles_per_shard: number of tiles (files) in one shard, for sharded formats
+        :param number_of_workers: number of encoding threads. Number of CPUs if None
+        """
+        self.output_dir_path = output_dir_path
+        self.output_format = output_format
+        self.png_compression_level = png_compression_level
+        self.tiles_per_shard = tiles_per_shard
+
+        self._number_of_workers = number_of_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self._number_of_workers)
+        self._pending = deque()  # type: Deque[Tuple[str, Future]]
+        self._max_pending = 2 * self._number_of_workers
+
+        self._shards = []  # type: List[Dict]  # for the index file
+        self._tar_file = None  # type: Optional[tarfile.TarFile]
+        self._npz_arrays = {}  # type: Dict[str, np.ndarray]
+
+    def add_tile(self, file_name: str, img: np.ndarray):
+        """ Add a tile to be written
+
+        :param file_name: name of the tile file, without extension (unique within the export)
+        :param img: tile image (H, W) or (H, W, C), with channels in RGB(A) order
+        """
+        if self.output_format == TrainingDataExportFormat.NPZ_SHARDS:
+            self._add_tile_to_npz_shard(file_name, img)
+            return
+
+        if self.output_format == TrainingDataExportFormat.PNG_FILES:
+            file_path = os.path.join(self.output_dir_path, f'{file_name}.png')
+            future = self._executor.submit(self._encode_and_save_png, file_path, img, self.png_compression_level)
+        elif self.output_format == TrainingDataExportFormat.TAR_SHARDS:
+            future = self._executor.submit(self._encode_png, img, self.png_compression_level)
+        else:
+            raise ValueError(f'Unknown training data export format: {self.output_format}')
+
+        self._pending.append((f'{file_name}.png', future))
+        while len(self._pending) > self._max_pending:
+            self._complete_oldest_pending()
+
+    def finish(self):
+        """ Wait for all tiles to be written, close the shards and save the index file """
+        try:
+            while self._pending:
+                self._complete_oldest_pending()
+
+            if self.output_format == TrainingDataExportFormat.NPZ_SHARDS:
+                self._save_npz_shard()
+                while self._pending:
+                    self._complete_oldest_pending()
+            elif self.output_format == TrainingDataExportFormat.TAR_SHARDS:
+                self._close_tar_shard()
+        finally:
+            self._executor.shutdown(wait=True)
+
+        if self.output_format != TrainingDataExportFormat.PNG_FILES:
+            index = {
+                'format': self.output_format.value,
+                'shards': self._shards,
+            }
+            with open(os.path.join(self.output_dir_path, self.INDEX_FILE_NAME), 'w') as f:
+                json.dump(index, f, indent=1)
+
+    def abort(self):
+        """ Stop writing after a failure - discard tiles waiting for encoding, without completing the shards
+        and saving the index file. Exceptions of the pending tiles are not raised, so that the original error is kept
+        """
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._npz_arrays = {}
+        self._executor.shutdown(wait=True)
+        self._close_tar_shard()
+
+    def _complete_oldest_pending(self):
+        file_name, future = self._pending.popleft()
+        result = future.result()  # raises the exception from the worker, if any
+
+        if self.output_format == TrainingDataExportFormat.TAR_SHARDS:
+            self._add_file_to_tar_shard(file_name, result)
+
+    def _add_file_to_tar_shard(self, file_name: str, data: bytes):
+        if self._tar_file is None:
+            shard_file_name = f'shard_{len(self._shards):06d}.tar'
+            self._tar_file = tarfile.open(os.path.join(self.output_dir_path, shard_file_name), 'w')
+            self._shards.append({'file': shard_file_name, 'members': []})
+
+        tar_info = tarfile.TarInfo(name=file_name)
+        tar_info.size = len(data)
+        self._tar_file.addfile(tar_info, io.BytesIO(data))
+        self._shards[-1]['members'].append(file_name)
+
+        if len(self._shards[-1]['members']) >= self.tiles_per_shard:
+            self._close_tar_shard()
+
+    def _close_tar_shard(self):
+        if self._tar_file is not None:
+            self._tar_file.close()
+            self._tar_file = None
+
+    def _add_tile_to_npz_shard(self, file_name: str, img: np.ndarray):
+        self._npz_arrays[file_name] = img
+        if len(self._npz_arrays) >= self.tiles_per_shard:
+            self._save_npz_shard()
+
+    def _save_npz_shard(self):
+        if not self._npz_arrays:
+            return
+
+        shard_file_name = f'shard_{len(self._shards):06d}.npz'
+        self._shards.append({'file': shard_file_name, 'members': list(self._npz_arrays.keys())})
+
+        file_path = os.path.join(self.output_dir_path, shard_file_name)
+        future = self._executor.submit(np.savez_compressed, file_path, **self._npz_arrays)
+        self._npz_arrays = {}
+
+        self._pending.append((shard_file_name, future))
+        while len(self._pending) > self._number_of_workers:  # shards are big, keep only a few of them in memory
+            self._complete_oldest_pending()
+
+    @staticmethod
+    def _convert_to_bgr(img: np.ndarray) -> np.ndarray:
+        if img.ndim == 3 and img.shape[-1] == 4:
+            return cv2.cvtColor(img, cv2.COLOR_RGBA2BGRA)
+        elif img.ndim == 3 and img.shape[-1] == 3:
+            return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        return img
+
+    @staticmethod
+    def _encode_png(img: np.ndarray, compression_level: int) -> bytes:
+        img = TrainingDataWriter._convert_to_bgr(img)
+        is_success, buffer = cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, compression_level])
+        if not is_success:
+            raise Exception('Failed to encode tile as PNG')
+        return buffer.tobytes()
+
+    @staticmethod
+    def _encode_and_save_png(file_path: str, img: np.ndarray, compression_level: int):
+        data = TrainingDataWriter._encode_png(img, compression_level)
+        with open(file_path, 'wb') as f:
+            f.write(data)
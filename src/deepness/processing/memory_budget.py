@@ -0,0 +1,163 @@
+"""
+This file implements planning of the memory used by the map processing, before the processing starts -
+to store large images on disk instead of RAM when needed, and to refuse processing which cannot fit in memory
+"""
+
+import enum
+import logging
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import List, Optional
+
+from deepness.common.defines import MEMORY_BUDGET_MB
+
+DEFAULT_AVAILABLE_MEMORY_FRACTION = 0.8  # fraction of the available RAM used as the budget, if not configured
+
+
+class StorageType(enum.Enum):
+    """ Where large images (e.g. the result image and the area mask) are stored during processing """
+
+    IN_MEMORY = 'in memory'
+    MEMMAP = 'memory-mapped file'  # on disk, in the temporary directory (as with the `local_cache` option)
+
+
+@dataclass
+class MemoryItem:
+    """ Memory needed for a single part of the processing, at its peak """
+
+    name: str
+    size_bytes: int
+    can_be_memmapped: bool  # whether it is stored in a memory-mapped file with `StorageType.MEMMAP`
+
+
+@dataclass
+class MemoryPlan:
+    """ Storage chosen for the processing, with the estimated memory usage """
+
+    memory_items: List[MemoryItem]
+    storage_type: StorageType
+    budget_bytes: Optional[int]  # None if unknown (no limit)
+    free_disk_bytes: Optional[int]  # in the temporary directory, None if unknown
+    is_storage_forced: bool = False  # whether the storage type was chosen by the user (`local_cache`)
+
+    def get_total_bytes(self) -> int:
+        """ Memory needed if everything was kept in RAM """
+        return sum(item.size_bytes for item in self.memory_items)
+
+    def get_memmapped_bytes(self) -> int:
+        if self.storage_type != StorageType.MEMMAP:
+            return 0
+        return sum(item.size_bytes for item in self.memory_items if item.can_be_memmapped)
+
+    def get_peak_memory_bytes(self) -> int:
+        """ Estimated peak RAM usage with the chosen storage """
+        return self.get_total_bytes() - self.get_memmapped_bytes()
+
+    def is_feasible(self) -> bool:
+        """ Whether the processing fits in the memory budget (and memory-mapped files fit on the disk) """
+        if self.budget_bytes is not None and self.get_peak_memory_bytes() > self.budget_bytes:
+            return False
+        if self.free_disk_bytes is not None and self.get_memmapped_bytes() > self.free_disk_bytes:
+            return False
+        return True
+
+    def is_memmap_chosen_automatically(self) -> bool:
+        return self.storage_type == StorageType.MEMMAP and not self.is_storage_forced
+
+    def create_message(self) -> str:
+        """ Explanation of the plan for the user, with the largest items """
+        items_txt = ', '.join(f'{item.name}: {_format_bytes(item.size_bytes)}'
+                              for item in sorted(self.memory_items, key=lambda item: item.size_bytes, reverse=True))
+        budget_txt = _format_bytes(self.budget_bytes) if self.budget_bytes is not None else 'unknown'
+
+        if not self.is_feasible():
+            if self.budget_bytes is not None and self.get_peak_memory_bytes() > self.budget_bytes:
+                txt = f'Processing needs about {_format_bytes(self.get_peak_memory_bytes())} of RAM ' \
+                      f'(with large images stored on disk), more than the memory budget ({budget_txt}).\n'
+            else:
+                txt = f'Processing needs {_format_bytes(self.get_memmapped_bytes())} of disk space for temporary files, ' \
+                      f'but only {_format_bytes(self.free_disk_bytes)} is free.\n'
+            return txt + f'Estimated memory usage - {items_txt}.\n' \
+                         f'Use a coarser resolution, a smaller processed area or a smaller batch size ' \
+                         f'(or set the DEEPNESS_MEMORY_BUDGET_MB environment variable).\n'
+
+        txt = f'Estimated peak memory: {_format_bytes(self.get_peak_memory_bytes())} (budget {budget_txt})'
+        if self.is_memmap_chosen_automatically():
+            txt += f', large images ({_format_bytes(self.get_memmapped_bytes())}) stored on disk to fit in the budget'
+        return txt + '\n'
+
+
+def _format_bytes(size_bytes: int) -> str:
+    if size_bytes >= 1024**3:
+        return f'{size_bytes / 1024**3:.1f} GB'
+    return f'{size_bytes / 1024**2:.0f} MB'
+
+
+def get_available_memory_bytes() -> Optional[int]:
+    """ Get the RAM available for new allocations (without swapping). None if it cannot be checked on this platform """
+    try:
+        import psutil  # shipped with QGIS on Windows
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        return psutil.virtual_memory().available
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024  # in kilobytes
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def get_memory_budget_bytes() -> Optional[int]:
+    """ Memory budget for the processing - from `MEMORY_BUDGET_MB` if configured,
+    otherwise a fraction of the currently available RAM. None if unknown
+    """
+    if MEMORY_BUDGET_MB:
+        return int(float(MEMORY_BUDGET_MB) * 1024**2)
+
+    available_memory_bytes = get_available_memory_bytes()
+    if available_memory_bytes is None:
+        return None
+    return int(available_memory_bytes * DEFAULT_AVAILABLE_MEMORY_FRACTION)
+
+
+def get_free_disk_bytes() -> Optional[int]:
+    """ Free space in the temporary directory, where memory-mapped files are created """
+    try:
+        return shutil.disk_usage(tempfile.gettempdir()).free
+    except OSError:
+        return None
+
+
+def plan_memory_usage(memory_items: List[MemoryItem],
+                      budget_bytes: Optional[int],
+                      free_disk_bytes: Optional[int],
+                      force_memmap: bool = False) -> MemoryPlan:
+    """ Choose where large images are stored - in RAM if everything fits in the budget,
+    in memory-mapped files otherwise. Check `MemoryPlan.is_feasible` before processing
+
+    :param memory_items: estimated memory of parts of the processing
+    :param budget_bytes: memory budget, no limit if None
+    :param free_disk_bytes: free disk space for memory-mapped files, no limit if None
+    :param force_memmap: whether memory-mapped files are always used (e.g. selected by the user)
+    """
+    total_bytes = sum(item.size_bytes for item in memory_items)
+    if force_memmap or (budget_bytes is not None and total_bytes > budget_bytes):
+        storage_type = StorageType.MEMMAP
+    else:
+        storage_type = StorageType.IN_MEMORY
+
+    memory_plan = MemoryPlan(
+        memory_items=memory_items,
+        storage_type=storage_type,
+        budget_bytes=budget_bytes,
+        free_disk_bytes=free_disk_bytes,
+        is_storage_forced=force_memmap)
+    logging.info(memory_plan.create_message())
+    return memory_plan
@@ -9,7 +9,7 @@ import numpy as np
 
 from deepness.common.processing_parameters.detection_parameters import DetectorType
 from deepness.processing.models.model_base import ModelBase
-from deepness.processing.processing_utils import BoundingBox
+from deepness.processing.processing_utils import BoundingBox, CompactMask
 
 
 @dataclass
@@ -32,10 +32,8 @@ class Detection:
     """float: confidence of the detection"""
     clss: int
     """int: class of the detected object"""
-    mask: Optional[np.ndarray] = None
-    """np.ndarray: mask of the detected object"""
-    mask_offsets: Optional[Tuple[int, int]] = None
-    """Tuple[int, int]: offsets of the mask"""
+    mask: Optional[CompactMask] = None
+    """CompactMask: mask of the detected object (cropped to the object area, with its position)"""
 
     def convert_to_global(self, offset_x: int, offset_y: int):
         """Apply (x,y) offset to bounding box coordinates
@@ -50,7 +48,7 @@ class Detection:
         self.bbox.apply_offset(offset_x=offset_x, offset_y=offset_y)
 
         if self.mask is not None:
-            self.mask_offsets = (offset_x, offset_y)
+            self.mask.apply_offset(offset_x=offset_x, offset_y=offset_y)
 
     def get_bbox_xyxy(self) -> np.ndarray:
         """Convert stored bounding box into x1y1x2y2 format
@@ -246,6 +244,53 @@ class Detector(ModelBase):
 
         return batch_detection
 
+    def get_candidates_confidences(self, detections_output: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Get confidence of each candidate detection (before NMS), the same as used for filtering in postprocessing
+
+        Parameters
+        ----------
+        detections_output : np.ndarray
+            First model output for a single tile
+
+        Returns
+        -------
+        Tuple[np.ndarray, int]
+            Confidence of each candidate, and axis of candidates in the model output
+        """
+        if self.model_type == DetectorType.YOLO_v5_v7_DEFAULT:
+            return detections_output[:, 4], 0
+        elif self.model_type == DetectorType.YOLO_v6:
+            return np.max(detections_output[:, 5:], axis=1), 0
+        elif self.model_type in (DetectorType.YOLO_v9, DetectorType.YOLO_ULTRALYTICS):
+            return np.max(detections_output[4:], axis=0), 1
+        elif self.model_type == DetectorType.YOLO_ULTRALYTICS_SEGMENTATION:
+            number_of_class = self.get_number_of_output_channels()[0]
+            return np.max(detections_output[4:4+number_of_class], axis=0), 1
+        elif self.model_type == DetectorType.YOLO_ULTRALYTICS_OBB:
+            return np.max(detections_output[4:-1], axis=0), 1
+        else:
+            raise NotImplementedError(f"Model type not implemented! ('{self.model_type}')")
+
+    def compact_raw_output(self, model_output: List[np.ndarray], min_confidence: float) -> List[np.ndarray]:
+        """Remove candidate detections with low confidence from the raw model output for a single tile.
+        Postprocessing of the compacted output gives the same results, as long as confidence >= min_confidence
+
+        Parameters
+        ----------
+        model_output : List[np.ndarray]
+            Raw model output for a single tile (one array for each output layer, without the batch dimension)
+        min_confidence : float
+            Minimum confidence of the kept candidates
+
+        Returns
+        -------
+        List[np.ndarray]
+            Compacted model output
+        """
+        confidences, candidates_axis = self.get_candidates_confidences(model_output[0])
+        candidates_indexes = np.nonzero(confidences >= min_confidence)[0]
+        return [np.take(model_output[0], candidates_indexes, axis=candidates_axis)] + list(model_output[1:])
+
     def _postprocessing_YOLO_v5_v7_DEFAULT(self, model_output):
         outputs_filtered = np.array(
             list(filter(lambda x: x[4] >= self.confidence, model_output))
@@ -377,7 +422,7 @@ class Detector(ModelBase):
         boxes = np.array(outputs_nms[:, :4], dtype=int)
         conf = np.max(outputs_nms[:, 4:4+number_of_class], axis=1)
         classes = np.argmax(outputs_nms[:, 4:4+number_of_class], axis=1)
-        masks_in = np.array(outputs_nms[:, mask_start_index:], dtype=float)
+        masks_in = np.array(outputs_nms[:, mask_start_index:], dtype=np.float32)
         
         masks = self.process_mask(protos, masks_in, boxes)
 
@@ -414,41 +459,63 @@ class Detector(ModelBase):
         return boxes, conf, classes, rots
 
     # based on https://github.com/ultralytics/ultralytics/blob/main/ultralytics/utils/ops.py#L638C1-L638C67
-    def process_mask(self, protos, masks_in, bboxes):
+    def process_mask(self, protos, masks_in, bboxes) -> List[CompactMask]:
+        """Create instance masks from the prototype masks and the mask coefficients of the detections
+
+        For each detection, the mask is computed (in float32) only within its bounding box in the prototype space,
+        and only this part is upsampled to the tile resolution. Therefore, time and memory usage is proportional
+        to the size of the detected objects, not to the number of detections multiplied by the tile size.
+
+        Parameters
+        ----------
+        protos : np.ndarray
+            Prototype masks (C, MH, MW)
+        masks_in : np.ndarray
+            Mask coefficients for each detection (N, C)
+        bboxes : np.ndarray
+            Bounding boxes in (x1,y1,x2,y2) format, in tile pixels (N, 4)
+
+        Returns
+        -------
+        List[CompactMask]
+            Masks of the detections, with positions in tile pixels
+        """
         c, mh, mw = protos.shape  # CHW
         ih, iw = self.input_shape[2:]
+        scale_x, scale_y = iw / mw, ih / mh
 
-        masks = self.sigmoid(np.matmul(masks_in, protos.astype(float).reshape(c, -1))).reshape(-1, mh, mw)
+        protos = protos.astype(np.float32, copy=False)
+        masks_in = masks_in.astype(np.float32, copy=False)
 
-        downsampled_bboxes = bboxes.copy().astype(float)
-        downsampled_bboxes[:, 0] *= mw / iw
-        downsampled_bboxes[:, 2] *= mw / iw
-        downsampled_bboxes[:, 3] *= mh / ih
-        downsampled_bboxes[:, 1] *= mh / ih
+        compact_masks = []
+        for mask_coefficients, bbox in zip(masks_in, bboxes):
+            # part of the prototype mask covering the bounding box, with a margin for the interpolation
+            x_min = int(np.clip(np.floor(bbox[0] / scale_x) - 1, 0, mw))
+            y_min = int(np.clip(np.floor(bbox[1] / scale_y) - 1, 0, mh))
+            x_max = int(np.clip(np.ceil(bbox[2] / scale_x) + 1, 0, mw))
+            y_max = int(np.clip(np.ceil(bbox[3] / scale_y) + 1, 0, mh))
 
-        masks = self.crop_mask(masks, downsampled_bboxes)
-        scaled_masks = np.zeros((len(masks), ih, iw))
+            x_offset, y_offset = round(x_min * scale_x), round(y_min * scale_y)
 
-        for i in range(len(masks)):
-            scaled_masks[i] = cv2.resize(masks[i], (iw, ih), interpolation=cv2.INTER_LINEAR)
+            if x_max <= x_min or y_max <= y_min:
+                compact_masks.append(CompactMask.from_mask(np.zeros((0, 0), np.uint8), x_offset, y_offset))
+                continue
 
-        masks = np.uint8(scaled_masks >= 0.5)
-            
-        return masks
+            # sigmoid(x) >= 0.5 is the same as x >= 0, so logits are thresholded directly. As they are interpolated
+            # before thresholding (instead of sigmoid values), a few pixels at the mask edges may differ
+            mask_logits = np.tensordot(mask_coefficients, protos[:, y_min:y_max, x_min:x_max], axes=1)
+            dsize = (round((x_max - x_min) * scale_x), round((y_max - y_min) * scale_y))
+            mask = cv2.resize(mask_logits, dsize, interpolation=cv2.INTER_LINEAR) >= 0
 
-    @staticmethod
-    def sigmoid(x):
-        return 1 / (1 + np.exp(-x))
+            # crop to the bounding box, in tile pixels (relative to the upsampled part)
+            mask[:, :max(int(bbox[0]) - x_offset, 0)] = False
+            mask[:max(int(bbox[1]) - y_offset, 0), :] = False
+            mask[:, max(int(bbox[2]) - x_offset, 0):] = False
+            mask[max(int(bbox[3]) - y_offset, 0):, :] = False
 
-    @staticmethod
-    # based on https://github.com/ultralytics/ultralytics/blob/main/ultralytics/utils/ops.py#L598C1-L614C65
-    def crop_mask(masks, boxes):
-        n, h, w = masks.shape
-        x1, y1, x2, y2 = np.split(boxes[:, :, None], 4, axis=1)  # x1 shape(n,1,1)
-        r = np.arange(w, dtype=x1.dtype)[None, None, :]  # rows shape(1,1,w)
-        c = np.arange(h, dtype=x1.dtype)[None, :, None]  # cols shape(1,h,1)
-
-        return masks * ((r >= x1) * (r < x2) * (c >= y1) * (c < y2))
+            compact_masks.append(CompactMask.from_mask(mask, x_offset, y_offset))
+
+        return compact_masks
 
     @staticmethod
     def xywh2xyxy(x: np.ndarray) -> np.ndarray:
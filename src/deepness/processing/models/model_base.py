@@ -7,6 +7,7 @@ import numpy as np
 
 from deepness.common.lazy_package_loader import LazyPackageLoader
 from deepness.common.processing_parameters.standardization_parameters import StandardizationParameters
+from deepness.processing.processing_stats import ProcessingStage, ProcessingStats, measure_stage
 
 ort = LazyPackageLoader('onnxruntime')
 
@@ -26,15 +27,8 @@ class ModelBase:
         """
         self.model_file_path = model_file_path
 
-        options = ort.SessionOptions()
-        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-
-        providers = [
-            'CUDAExecutionProvider',
-            'CPUExecutionProvider'
-        ]
-
-        self.sess = ort.InferenceSession(self.model_file_path, options=options, providers=providers)
+        self._number_of_threads = None  # type: Optional[int]  # threads of the session, ONNX Runtime default if None
+        self.sess = self._create_session()
         inputs = self.sess.get_inputs()
         if len(inputs) > 1:
             raise Exception("ONNX model: unsupported number of inputs")
@@ -48,6 +42,37 @@ class ModelBase:
         
         self.outputs_names = self.get_outputs_channel_names()
 
+    def _create_session(self):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self._number_of_threads is not None:
+            options.intra_op_num_threads = self._number_of_threads
+            options.inter_op_num_threads = 1
+
+        providers = [
+            'CUDAExecutionProvider',
+            'CPUExecutionProvider'
+        ]
+
+        return ort.InferenceSession(self.model_file_path, options=options, providers=providers)
+
+    def set_number_of_threads(self, number_of_threads: Optional[int]):
+        """ Set the number of CPU threads used by the inference session (the session is created again if it changes).
+        Should not be called while the model is running.
+
+        Parameters
+        ----------
+        number_of_threads : Optional[int]
+            Number of threads, or None for the ONNX Runtime default (all cores)
+        """
+        if number_of_threads == self._number_of_threads:
+            return
+        self._number_of_threads = number_of_threads
+        self.sess = self._create_session()
+
+    def get_number_of_threads(self) -> Optional[int]:
+        return self._number_of_threads
+
     @classmethod
     def get_model_type_from_metadata(cls, model_file_path: str) -> Optional[str]:
         """ Get model type from metadata
@@ -368,26 +393,50 @@ class ModelBase:
         """
         return self.input_shape[-3]
 
-    def process(self, tiles_batched: np.ndarray):
+    def process(self, tiles_batched: np.ndarray, processing_stats: Optional[ProcessingStats] = None):
         """ Process a single tile image
 
         Parameters
         ----------
         img : np.ndarray
             Image to process ([TILE_SIZE x TILE_SIZE x channels], type uint8, values 0 to 255)
+        processing_stats : Optional[ProcessingStats]
+            Stats to add the time of processing stages to, not measured if None
 
         Returns
         -------
         np.ndarray
             Single prediction
         """
-        input_batch = self.preprocessing(tiles_batched)
-        model_output = self.sess.run(
-            output_names=None,
-            input_feed={self.input_name: input_batch})
-        res = self.postprocessing(model_output)
+        model_output = self.run_inference(tiles_batched, processing_stats=processing_stats)
+        with measure_stage(processing_stats, ProcessingStage.POSTPROCESSING):
+            res = self.postprocessing(model_output)
         return res
 
+    def run_inference(self, tiles_batched: np.ndarray, processing_stats: Optional[ProcessingStats] = None) -> List[np.ndarray]:
+        """ Run the model on a batch of tiles, without postprocessing
+
+        Parameters
+        ----------
+        tiles_batched : np.ndarray
+            Batch of images to process (N,H,W,C), RGB, 0-255
+        processing_stats : Optional[ProcessingStats]
+            Stats to add the time of preprocessing and inference to, not measured if None
+
+        Returns
+        -------
+        List[np.ndarray]
+            Raw model outputs (one array for each output layer, with batch as the first dimension),
+            which can be passed to `postprocessing`
+        """
+        with measure_stage(processing_stats, ProcessingStage.PREPROCESSING):
+            input_batch = self.preprocessing(tiles_batched)
+        with measure_stage(processing_stats, ProcessingStage.INFERENCE):
+            model_output = self.sess.run(
+                output_names=None,
+                input_feed={self.input_name: input_batch})
+        return model_output
+
     def preprocessing(self, tiles_batched: np.ndarray) -> np.ndarray:
         """ Preprocess the batch of images for the model (resize, normalization, etc)
 
@@ -0,0 +1,171 @@
+"""
+This file implements a scheduler of map processing tasks, running them with a limited concurrency
+"""
+
+import enum
+import itertools
+from dataclasses import dataclass
+from typing import List, Optional
+
+from qgis.core import QgsApplication, QgsTaskManager
+from qgis.PyQt.QtCore import QObject, pyqtSignal
+
+from deepness.processing.map_processor.map_processing_result import MapProcessingResultCanceled, MapProcessingResultFailed
+from deepness.processing.map_processor.map_processor import MapProcessor
+
+
+class ProcessingJobStatus(enum.Enum):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    FINISHED = 'Finished'
+    FAILED = 'Failed'
+    CANCELED = 'Canceled'
+
+
+@dataclass
+class ProcessingJob:
+    """ Map processor added to the scheduler """
+
+    job_id: int
+    name: str  # name to display in the queue
+    map_processor: MapProcessor
+    status: ProcessingJobStatus = ProcessingJobStatus.QUEUED
+    number_of_threads: Optional[int] = None  # CPU threads for the models of the job, set when it is started
+
+    def get_progress(self) -> float:
+        """ Progress in percent """
+        if self.status == ProcessingJobStatus.FINISHED:
+            return 100.0
+        if self.status == ProcessingJobStatus.QUEUED:
+            return 0.0
+        return self.map_processor.progress()
+
+    def is_done(self) -> bool:
+        return self.status in [ProcessingJobStatus.FINISHED, ProcessingJobStatus.FAILED, ProcessingJobStatus.CANCELED]
+
+
+class ProcessingScheduler(QObject):
+    """
+    Queue of map processing tasks (e.g. inference and training data export), started in the QGIS task manager
+    in the order of adding, with at most `max_running_jobs` tasks running at the same time.
+
+    CPU threads budget is shared by the running tasks - each model session gets `budget // max_running_jobs` threads,
+    so that thread pools of concurrently running models do not oversubscribe the CPU. The number of threads is applied
+    by the task when it starts running (not in the GUI thread), as it recreates the model session.
+
+    Tasks using the same model object (e.g. many tasks added from the plugin GUI) run one after another,
+    as each task sets its own parameters (e.g. detection confidence) and number of threads of the model.
+    """
+
+    jobs_changed = pyqtSignal()  # a job was added, started, finished or its progress changed
+
+    def __init__(self,
+                 max_running_jobs: int = 1,
+                 cpu_threads_budget: Optional[int] = None,
+                 task_manager: Optional[QgsTaskManager] = None):
+        """
+        :param max_running_jobs: maximum number of tasks running at the same time
+        :param cpu_threads_budget: CPU threads for all running tasks. No limit (ONNX Runtime default) if None
+        :param task_manager: task manager to run the tasks in. QGIS application task manager by default
+        """
+        super().__init__()
+        self._max_running_jobs = max_running_jobs
+        self._cpu_threads_budget = cpu_threads_budget
+        self._task_manager = task_manager
+        self._jobs = []  # type: List[ProcessingJob]
+        self._job_ids = itertools.count()
+
+    def set_limits(self, max_running_jobs: int, cpu_threads_budget: Optional[int]):
+        """ Change the limits. Running tasks are not affected, queued tasks are started if the limit increased """
+        self._max_running_jobs = max(1, max_running_jobs)
+        self._cpu_threads_budget = cpu_threads_budget
+        self._start_queued_jobs()
+
+    def get_threads_per_job(self) -> Optional[int]:
+        """ Number of CPU threads for the model of a single task, None if not limited """
+        if self._cpu_threads_budget is None:
+            return None
+        return max(1, self._cpu_threads_budget // self._max_running_jobs)
+
+    def get_jobs(self) -> List[ProcessingJob]:
+        return list(self._jobs)
+
+    def get_running_jobs(self) -> List[ProcessingJob]:
+        return [job for job in self._jobs if job.status == ProcessingJobStatus.RUNNING]
+
+    def add_job(self, map_processor: MapProcessor, name: str) -> ProcessingJob:
+        """ Add the map processor to the queue. `map_processor.finished_signal` is emitted when it finishes
+        (also if it is canceled before starting)
+        """
+        job = ProcessingJob(job_id=next(self._job_ids), name=name, map_processor=map_processor)
+        map_processor.finished_signal.connect(lambda _: self._job_finished(job))
+        map_processor.progressChanged.connect(lambda _: self.jobs_changed.emit())
+        self._jobs.append(job)
+        self._start_queued_jobs()
+        self.jobs_changed.emit()
+        return job
+
+    def cancel_job(self, job_id: int):
+        """ Cancel the queued or running job """
+        for job in self._jobs:
+            if job.job_id != job_id or job.is_done():
+                continue
+
+            if job.status == ProcessingJobStatus.QUEUED:
+                job.status = ProcessingJobStatus.CANCELED
+                job.map_processor.finished_signal.emit(MapProcessingResultCanceled())
+                self.jobs_changed.emit()
+            else:
+                job.map_processor.cancel()  # finished_signal will be emitted by the task
+
+    def clear_done_jobs(self):
+        """ Remove finished and canceled jobs from the queue """
+        self._jobs = [job for job in self._jobs if not job.is_done()]
+        self.jobs_changed.emit()
+
+    def _get_task_manager(self) -> QgsTaskManager:
+        if self._task_manager is not None:
+            return self._task_manager
+        return QgsApplication.taskManager()
+
+    def _start_queued_jobs(self):
+        number_of_running_jobs = len(self.get_running_jobs())
+        for job in self._jobs:
+            if number_of_running_jobs >= self._max_running_jobs:
+                break
+            if job.status != ProcessingJobStatus.QUEUED:
+                continue
+            if self._is_any_model_used_by_running_job(job):
+                continue  # waits for the running job, later jobs may be started
+
+            self._set_number_of_threads(job)
+            job.status = ProcessingJobStatus.RUNNING
+            self._get_task_manager().addTask(job.map_processor)
+            number_of_running_jobs += 1
+
+    @staticmethod
+    def _get_job_models(job: ProcessingJob) -> list:
+        """ Models used by the job - the model of the map processor and the cascade model of detection, if any """
+        params = getattr(job.map_processor, 'params', None)
+        models = [getattr(job.map_processor, 'model', None), getattr(params, 'cascade_model', None)]
+        return [model for model in models if model is not None]  # no model e.g. for training data export
+
+    def _is_any_model_used_by_running_job(self, job: ProcessingJob) -> bool:
+        running_jobs_models = [model for running_job in self.get_running_jobs() for model in self._get_job_models(running_job)]
+        return any(model is running_model for model in self._get_job_models(job) for running_model in running_jobs_models)
+
+    def _set_number_of_threads(self, job: ProcessingJob):
+        job.number_of_threads = self.get_threads_per_job()
+        job.map_processor.set_number_of_threads(job.number_of_threads)
+
+    def _job_finished(self, job: ProcessingJob):
+        if job.status == ProcessingJobStatus.RUNNING:
+            result = job.map_processor.get_processing_result()
+            if isinstance(result, MapProcessingResultCanceled):
+                job.status = ProcessingJobStatus.CANCELED
+            elif isinstance(result, MapProcessingResultFailed):
+                job.status = ProcessingJobStatus.FAILED
+            else:
+                job.status = ProcessingJobStatus.FINISHED
+        self._start_queued_jobs()
+        self.jobs_changed.emit()
@@ -0,0 +1,140 @@
+"""
+This file implements measurement of time spent in stages of the map processing, to find its bottleneck
+"""
+
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+
+class ProcessingStage:
+    """ Names of the measured processing stages """
+
+    TILE_READ = 'tile_read'  # rendering tile image from the raster layer
+    PREPROCESSING = 'preprocessing'  # model input preparation (normalization, standardization, transposition)
+    INFERENCE = 'inference'  # ONNX Runtime session run
+    POSTPROCESSING = 'postprocessing'  # conversion of model outputs to tile results (e.g. thresholds, NMS)
+    STITCHING = 'stitching'  # placing tile results on the full result image
+    LAYERS_CREATION = 'layers_creation'  # creation of the output layers (e.g. vectorization of masks)
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    """ Get peak resident memory of the process (the whole QGIS process, not only of the single processing).
+    None if it cannot be checked on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if platform.system() == 'Darwin' else max_rss * 1024  # bytes on macOS, kilobytes on Linux
+
+    try:
+        import psutil  # shipped with QGIS on Windows
+    except ImportError:
+        return None
+    return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+
+
+class ProcessingStats:
+    """
+    Time spent in stages of the map processing (see `ProcessingStage`), with the throughput (tiles per second),
+    number of bytes read and peak memory, to find what a slow processing is bound by
+    and to compare different machines and processing parameters.
+
+    Stages are measured with `measure`. Stages may be nested (e.g. post-processing of the model output within tiles
+    stitching loop), then the time is counted in both of them.
+    """
+
+    def __init__(self):
+        self._stages_time_s = {}  # type: Dict[str, float]
+        self._stages_calls = {}  # type: Dict[str, int]
+        self.number_of_tiles_read = 0
+        self.bytes_read = 0
+        self._start_time = time.perf_counter()
+        self.total_time_s = None  # type: Optional[float]  # set when finished
+        self.peak_rss_bytes = None  # type: Optional[int]  # set when finished
+
+    def start(self):
+        self._start_time = time.perf_counter()
+
+    def finish(self):
+        self.total_time_s = time.perf_counter() - self._start_time
+        self.peak_rss_bytes = get_peak_rss_bytes()
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """ Measure time of the code in the `with` block, adding it to the `stage` """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stages_time_s[stage] = self._stages_time_s.get(stage, 0.0) + time.perf_counter() - start_time
+            self._stages_calls[stage] = self._stages_calls.get(stage, 0) + 1
+
+    def add_tile_read(self, tile_img: np.ndarray):
+        self.number_of_tiles_read += 1
+        self.bytes_read += tile_img.nbytes
+
+    def get_stage_time_s(self, stage: str) -> float:
+        return self._stages_time_s.get(stage, 0.0)
+
+    def get_tiles_per_second(self) -> Optional[float]:
+        if not self.total_time_s:
+            return None
+        return self.number_of_tiles_read / self.total_time_s
+
+    def to_dict(self, **extra_values) -> Dict[str, Any]:
+        """ Get the stats as a JSON-serializable dictionary
+
+        :param extra_values: additional values to include, e.g. processing parameters
+        """
+        return dict(
+            **extra_values,
+            machine=dict(
+                platform=platform.platform(),
+                processor=platform.processor(),
+                cpu_count=os.cpu_count(),
+            ),
+            total_time_s=self.total_time_s,
+            number_of_tiles_read=self.number_of_tiles_read,
+            tiles_per_second=self.get_tiles_per_second(),
+            bytes_read=self.bytes_read,
+            peak_rss_bytes=self.peak_rss_bytes,
+            stages={
+                stage: dict(time_s=time_s, calls=self._stages_calls[stage])
+                for stage, time_s in self._stages_time_s.items()
+            },
+        )
+
+    def save_json(self, file_path: str, **extra_values):
+        """ Save the stats to a JSON file, see `to_dict` """
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(**extra_values), f, indent=2)
+
+    def create_summary_message(self) -> str:
+        """ Short summary for the user, with the time of the slowest stages """
+        txt = f'Processing time: {self.total_time_s:.1f} s'
+        tiles_per_second = self.get_tiles_per_second()
+        if tiles_per_second:
+            txt += f' ({tiles_per_second:.2f} tiles/s)'
+
+        stages = sorted(self._stages_time_s.items(), key=lambda stage_time_s: stage_time_s[1], reverse=True)
+        if stages:
+            txt += ', ' + ', '.join(f'{stage}: {time_s:.1f} s' for stage, time_s in stages)
+        return txt + '\n'
+
+
+def measure_stage(processing_stats: Optional[ProcessingStats], stage: str):
+    """ `ProcessingStats.measure` if the stats are given, for code which is used also without measurement """
+    if processing_stats is None:
+        return nullcontext()
+    return processing_stats.measure(stage)
@@ -2,19 +2,22 @@
 This file contains utilities related to processing of the ortophoto
 """
 
+import hashlib
 import logging
 from dataclasses import dataclass
 from typing import List, Optional, Tuple
 
 import numpy as np
-from qgis.core import (Qgis, QgsCoordinateTransform, QgsFeature, QgsGeometry, QgsPointXY, QgsRasterLayer, QgsRectangle,
-                       QgsUnitTypes, QgsWkbTypes)
+from qgis.core import (Qgis, QgsCoordinateTransform, QgsFeature, QgsFeatureRequest, QgsGeometry, QgsPointXY,
+                       QgsRasterLayer, QgsRectangle, QgsSpatialIndex, QgsUnitTypes, QgsWkbTypes)
 
+from deepness.common.channels_mapping import ImageChannel, ImageChannelCompositeByte, ImageChannelStandaloneBand
 from deepness.common.defines import IS_DEBUG
 from deepness.common.lazy_package_loader import LazyPackageLoader
 from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters
 from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
 from deepness.common.temp_files_handler import TempFilesHandler
+from deepness.processing.map_processor.utils.chunked_area_mask import ChunkedAreaMask
 
 cv2 = LazyPackageLoader('cv2')
 
@@ -51,6 +54,60 @@ def get_numpy_data_type_for_qgis_type(data_type_qgis: Qgis.DataType):
     raise Exception(f"Invalid input layer data type ({data_type_qgis})!")
 
 
+def create_image_channels_for_rlayer(rlayer: Optional[QgsRasterLayer]) -> List[ImageChannel]:
+    """Create the image channels available in the raster layer (see `deepness.common.channels_mapping`)
+
+    Parameters
+    ----------
+    rlayer : Optional[QgsRasterLayer]
+        Raster layer (ortophoto), no channels if None
+
+    Returns
+    -------
+    List[ImageChannel]
+        Image channels of the layer
+    """
+    if rlayer:
+        number_of_image_bands = rlayer.bandCount()
+    else:
+        number_of_image_bands = 0
+
+    image_channels = []  # type: List[ImageChannel]
+
+    if number_of_image_bands == 1:
+        # if there is one band, then there is probably more "bands" hidden in a more complex data type (e.g. RGBA)
+        data_type = rlayer.dataProvider().dataType(1)
+        if data_type in [Qgis.DataType.Byte, Qgis.DataType.UInt16, Qgis.DataType.Int16,
+                         Qgis.DataType.Float32]:
+            image_channel = ImageChannelStandaloneBand(
+                band_number=1,
+                name=rlayer.bandName(1))
+            image_channels.append(image_channel)
+        elif data_type == Qgis.DataType.ARGB32:
+            # Alpha channel is at byte number 3, red is byte 2, ... - reversed order
+            band_names = [
+                'Alpha (band 4)',
+                'Red (band 1)',
+                'Green (band 2)',
+                'Blue (band 3)',
+            ]
+            for i in [1, 2, 3, 0]:  # We want order of model inputs as 'RGB' first and then 'A'
+                image_channel = ImageChannelCompositeByte(
+                    byte_number=3 - i,  # bytes are in reversed order
+                    name=band_names[i])
+                image_channels.append(image_channel)
+        else:
+            raise Exception("Invalid input layer data type!")
+    else:
+        for band_number in range(1, number_of_image_bands + 1):  # counted from 1
+            image_channel = ImageChannelStandaloneBand(
+                band_number=band_number,
+                name=rlayer.bandName(band_number))
+            image_channels.append(image_channel)
+
+    return image_channels
+
+
 def get_tile_image(
         rlayer: QgsRasterLayer,
         extent: QgsRectangle,
@@ -448,6 +505,153 @@ class BoundingBox:
             return [(int(x), int(y)) for x, y in zip(xys, yys)]
 
 
+@dataclass
+class CompactMask:
+    """
+    Memory-compact binary mask (e.g. of a single detected instance).
+    Only the bounding rectangle of the non-zero pixels is kept, bit-packed (8 pixels per byte),
+    together with the position of this rectangle in the image it was cropped from.
+    """
+    packed_data: np.ndarray
+    shape: Tuple[int, int]  # (height, width) of the cropped mask
+    x_offset: int = 0  # x position of the cropped mask top-left pixel
+    y_offset: int = 0  # y position of the cropped mask top-left pixel
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray, x_offset: int = 0, y_offset: int = 0) -> 'CompactMask':
+        """Create compact mask from a binary mask image, cropping it to the non-zero area
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            Binary mask (H, W), non-zero values are treated as the mask
+        x_offset : int
+            x position of the `mask` top-left pixel
+        y_offset : int
+            y position of the `mask` top-left pixel
+
+        Returns
+        -------
+        CompactMask
+            Compact representation of the mask
+        """
+        mask = np.ascontiguousarray(mask > 0, dtype=np.uint8)
+        if mask.size == 0:
+            return cls(packed_data=np.zeros(0, dtype=np.uint8), shape=(0, 0), x_offset=x_offset, y_offset=y_offset)
+
+        x, y, w, h = cv2.boundingRect(mask)
+        cropped_mask = mask[y:y + h, x:x + w]
+        return cls(
+            packed_data=np.packbits(cropped_mask, axis=None),
+            shape=(h, w),
+            x_offset=x_offset + x,
+            y_offset=y_offset + y,
+        )
+
+    def to_mask(self) -> np.ndarray:
+        """Unpack the mask to a binary image of the cropped area (values 0 and 1)
+
+        Returns
+        -------
+        np.ndarray
+            Mask image (H, W), type uint8
+        """
+        h, w = self.shape
+        return np.unpackbits(self.packed_data, count=h * w).reshape((h, w))
+
+    def is_empty(self) -> bool:
+        return self.shape[0] == 0 or self.shape[1] == 0
+
+    def apply_offset(self, offset_x: int, offset_y: int):
+        """Apply (x,y) offset to the mask position
+
+        Parameters
+        ----------
+        offset_x : int
+            x-axis offset in pixels
+        offset_y : int
+            y-axis offset in pixels
+        """
+        self.x_offset += offset_x
+        self.y_offset += offset_y
+
+
+def is_tile_empty(tile_img: np.ndarray,
+                  nodata_values: Optional[np.ndarray] = None,
+                  min_valid_pixels_fraction: float = 0.0) -> bool:
+    """Check if the tile has no content to process - all its pixels (or all but less than `min_valid_pixels_fraction`)
+    are nodata, or all pixels have the same value (e.g. black or white margins of a mosaic, without nodata value set)
+
+    Parameters
+    ----------
+    tile_img : np.ndarray
+        Tile image (H, W, C)
+    nodata_values : Optional[np.ndarray]
+        Nodata value for each channel (C,), NaN if not defined. Pixel is nodata if any of its channels is nodata
+    min_valid_pixels_fraction : float
+        Minimum fraction of pixels which are not nodata (0-1), for a tile partly covered by nodata to be not empty
+
+    Returns
+    -------
+    bool
+        True if the tile is empty
+    """
+    if nodata_values is not None:
+        nodata_pixels_mask = np.any(tile_img == nodata_values, axis=-1)
+        valid_pixels_fraction = 1 - np.count_nonzero(nodata_pixels_mask) / nodata_pixels_mask.size
+        if valid_pixels_fraction == 0 or valid_pixels_fraction < min_valid_pixels_fraction:
+            return True
+
+    return bool(np.all(tile_img.min(axis=(0, 1)) == tile_img.max(axis=(0, 1))))
+
+
+def create_integral_image(mask_img: np.ndarray) -> np.ndarray:
+    """Create summed-area table (integral image) counting the non-zero pixels of the mask
+
+    Parameters
+    ----------
+    mask_img : np.ndarray
+        Mask image (H, W)
+
+    Returns
+    -------
+    np.ndarray
+        Integral image (H+1, W+1), where value at (y, x) is the number of non-zero mask pixels in mask_img[:y, :x]
+    """
+    binary_mask_img = np.asarray(mask_img > 0, dtype=np.uint8)
+    # int32 is enough to count all pixels of images smaller than 2^31 pixels
+    sdepth = cv2.CV_32S if binary_mask_img.size < 2**31 else cv2.CV_64F
+    return cv2.integral(binary_mask_img, sdepth=sdepth)
+
+
+def count_non_zero_pixels_in_rectangles(integral_img: np.ndarray, xyxy: np.ndarray) -> np.ndarray:
+    """Count the non-zero mask pixels within many rectangles at once, using the integral image of the mask
+
+    Parameters
+    ----------
+    integral_img : np.ndarray
+        Integral image of the mask, see `create_integral_image`
+    xyxy : np.ndarray
+        Rectangles (N, 4) in (x_min, y_min, x_max, y_max) format, with inclusive pixel coordinates.
+        Parts of the rectangles outside of the mask are ignored.
+
+    Returns
+    -------
+    np.ndarray
+        Number of non-zero pixels within each rectangle (N,)
+    """
+    xyxy = np.asarray(xyxy, dtype=np.int64).reshape(-1, 4)
+    height, width = integral_img.shape[0] - 1, integral_img.shape[1] - 1
+
+    x_min = np.clip(xyxy[:, 0], 0, width)
+    y_min = np.clip(xyxy[:, 1], 0, height)
+    x_max = np.clip(xyxy[:, 2] + 1, x_min, width)
+    y_max = np.clip(xyxy[:, 3] + 1, y_min, height)
+
+    return integral_img[y_max, x_max] - integral_img[y_min, x_max] - integral_img[y_max, x_min] \
+        + integral_img[y_min, x_min]
+
+
 def transform_polygon_with_rings_epsg_to_extended_xy_pixels(
         polygons: List[List[QgsPointXY]],
         extended_extent: QgsRectangle,
@@ -515,37 +719,152 @@ def create_area_mask_image(vlayer_mask,
 
     # see https://docs.qgis.org/3.22/en/docs/pyqgis_developer_cookbook/vector.html#iterating-over-vector-layer
     for feature in features:
-        print("Feature ID: ", feature.id())
         geom = feature.geometry()
 
         if vlayer_mask.crs() != rlayer.crs():
             geom.transform(xform)
 
-        geom_single_type = QgsWkbTypes.isSingleType(geom.wkbType())
-
-        if geom.type() == QgsWkbTypes.PointGeometry:
-            logging.warning("Point geometry not supported!")
-        elif geom.type() == QgsWkbTypes.LineGeometry:
-            logging.warning("Line geometry not supported!")
-        elif geom.type() == QgsWkbTypes.PolygonGeometry:
-            polygons = []
-            if geom_single_type:
-                polygon = geom.asPolygon()  # polygon with rings
-                polygons.append(polygon)
-            else:
-                polygons = geom.asMultiPolygon()
-
-            for polygon_with_rings in polygons:
-                polygon_with_rings_xy = transform_polygon_with_rings_epsg_to_extended_xy_pixels(
-                    polygons=polygon_with_rings,
-                    extended_extent=extended_extent,
-                    img_size_y_pixels=image_shape_yx[0],
-                    rlayer_units_per_pixel=rlayer_units_per_pixel)
-                # first polygon is actual polygon
-                cv2.fillPoly(img, pts=polygon_with_rings_xy[:1], color=255)
-                if len(polygon_with_rings_xy) > 1:  # further polygons are rings
-                    cv2.fillPoly(img, pts=polygon_with_rings_xy[1:], color=0)
-        else:
-            print("Unknown or invalid geometry")
+        for polygon_with_rings_xy in _get_polygons_with_rings_in_extended_xy_pixels(
+                geom=geom,
+                extended_extent=extended_extent,
+                img_size_y_pixels=image_shape_yx[0],
+                rlayer_units_per_pixel=rlayer_units_per_pixel):
+            _fill_polygon_with_rings(img, polygon_with_rings_xy)
 
     return img
+
+
+def _get_polygons_with_rings_in_extended_xy_pixels(geom: QgsGeometry,
+                                                   extended_extent: QgsRectangle,
+                                                   img_size_y_pixels: int,
+                                                   rlayer_units_per_pixel: float) -> List[List[np.ndarray]]:
+    """ Get polygons (with rings) of the mask geometry, in pixels of extended_extent image.
+    Empty for geometries other than polygons
+    """
+    if geom.type() == QgsWkbTypes.PointGeometry:
+        logging.warning("Point geometry not supported!")
+        return []
+    if geom.type() == QgsWkbTypes.LineGeometry:
+        logging.warning("Line geometry not supported!")
+        return []
+    if geom.type() != QgsWkbTypes.PolygonGeometry:
+        logging.warning("Unknown or invalid geometry")
+        return []
+
+    if QgsWkbTypes.isSingleType(geom.wkbType()):
+        polygons = [geom.asPolygon()]  # polygon with rings
+    else:
+        polygons = geom.asMultiPolygon()
+
+    return [transform_polygon_with_rings_epsg_to_extended_xy_pixels(
+                polygons=polygon_with_rings,
+                extended_extent=extended_extent,
+                img_size_y_pixels=img_size_y_pixels,
+                rlayer_units_per_pixel=rlayer_units_per_pixel)
+            for polygon_with_rings in polygons]
+
+
+def _fill_polygon_with_rings(img: np.ndarray, polygon_with_rings_xy: List[np.ndarray], offset_xy: Tuple[int, int] = (0, 0)):
+    """ Fill the polygon on the mask image, with the rings cut out. `offset_xy` is added to the polygon coordinates """
+    # first polygon is actual polygon
+    cv2.fillPoly(img, pts=polygon_with_rings_xy[:1], color=255, offset=offset_xy)
+    if len(polygon_with_rings_xy) > 1:  # further polygons are rings
+        cv2.fillPoly(img, pts=polygon_with_rings_xy[1:], color=0, offset=offset_xy)
+
+
+def create_chunked_area_mask(vlayer_mask,
+                             rlayer: QgsRasterLayer,
+                             extended_extent: QgsRectangle,
+                             rlayer_units_per_pixel: float,
+                             image_shape_yx: Tuple[int, int]) -> Optional[ChunkedAreaMask]:
+    """
+    Mask determining area to process (within extended_extent coordinates), as `create_area_mask_image`,
+    but rasterized lazily - only for chunks of the mask which are used.
+    Features are read once, only within the extent, and polygons for each chunk are found with a spatial index.
+    None if no mask layer provided.
+    """
+    if vlayer_mask is None:
+        return None
+
+    request = QgsFeatureRequest().setNoAttributes()
+    if vlayer_mask.crs() != rlayer.crs():
+        xform = QgsCoordinateTransform()
+        xform.setSourceCrs(vlayer_mask.crs())
+        xform.setDestinationCrs(rlayer.crs())
+        reverse_xform = QgsCoordinateTransform()
+        reverse_xform.setSourceCrs(rlayer.crs())
+        reverse_xform.setDestinationCrs(vlayer_mask.crs())
+        request.setFilterRect(reverse_xform.transformBoundingBox(extended_extent))
+    else:
+        request.setFilterRect(extended_extent)
+
+    polygons_xy_by_id = {}  # polygons with rings in pixels, for each feature (numbered in the order of features)
+    spatial_index = QgsSpatialIndex()  # with bounding boxes in pixels
+    mask_hash = hashlib.sha256()
+    for feature_number, feature in enumerate(vlayer_mask.getFeatures(request)):
+        geom = feature.geometry()
+        if vlayer_mask.crs() != rlayer.crs():
+            geom.transform(xform)
+
+        polygons_xy = _get_polygons_with_rings_in_extended_xy_pixels(
+            geom=geom,
+            extended_extent=extended_extent,
+            img_size_y_pixels=image_shape_yx[0],
+            rlayer_units_per_pixel=rlayer_units_per_pixel)
+        if not polygons_xy:
+            continue
+
+        polygons_xy_by_id[feature_number] = polygons_xy
+        outlines_xy = np.concatenate([polygon_with_rings_xy[0] for polygon_with_rings_xy in polygons_xy])
+        spatial_index.addFeature(feature_number, QgsRectangle(*outlines_xy.min(axis=0), *outlines_xy.max(axis=0)))
+        for polygon_with_rings_xy in polygons_xy:
+            for ring_xy in polygon_with_rings_xy:
+                mask_hash.update(np.ascontiguousarray(ring_xy, dtype=np.int64).tobytes())
+            mask_hash.update(b';')
+
+    def rasterize_window(y_min: int, x_min: int, height: int, width: int):
+        feature_numbers = spatial_index.intersects(QgsRectangle(x_min, y_min, x_min + width, y_min + height))
+        if not feature_numbers:
+            return 0
+
+        img = np.zeros(shape=(height, width), dtype=np.uint8)
+        for feature_number in sorted(feature_numbers):  # in the order of features, as in `create_area_mask_image`
+            for polygon_with_rings_xy in polygons_xy_by_id[feature_number]:
+                _fill_polygon_with_rings(img, polygon_with_rings_xy, offset_xy=(-x_min, -y_min))
+        return img
+
+    return ChunkedAreaMask(
+        shape=image_shape_yx,
+        rasterize_window=rasterize_window,
+        mask_hash=mask_hash.hexdigest())
+
+
+def estimate_area_mask_bounding_boxes_size_px(vlayer_mask,
+                                              rlayer: QgsRasterLayer,
+                                              extended_extent: QgsRectangle,
+                                              rlayer_units_per_pixel: float,
+                                              image_shape_yx: Tuple[int, int],
+                                              margin_px: int) -> int:
+    """
+    Estimate the number of pixels (within extended_extent image) in bounding boxes of the mask features,
+    extended by a margin (e.g. for whole tiles), without rasterizing the mask.
+    Limited to the size of the whole image, as bounding boxes may overlap.
+    """
+    if vlayer_mask.crs() != rlayer.crs():
+        xform = QgsCoordinateTransform()
+        xform.setSourceCrs(vlayer_mask.crs())
+        xform.setDestinationCrs(rlayer.crs())
+
+    number_of_pixels = 0
+    for feature in vlayer_mask.getFeatures():
+        bbox = feature.geometry().boundingBox()
+        if vlayer_mask.crs() != rlayer.crs():
+            bbox = xform.transformBoundingBox(bbox)
+
+        bbox = bbox.intersect(extended_extent)
+        if bbox.isEmpty():
+            continue
+        number_of_pixels += (bbox.width() / rlayer_units_per_pixel + 2 * margin_px) \
+            * (bbox.height() / rlayer_units_per_pixel + 2 * margin_px)
+
+    return int(min(number_of_pixels, image_shape_yx[0] * image_shape_yx[1]))
@@ -0,0 +1,115 @@
+""" This file implements processing of several raster files (e.g. a survey split into many GeoTIFF files) as one mosaic """
+
+import glob
+import os
+from typing import List, Optional, Tuple
+
+from osgeo import gdal
+from qgis.core import (QgsCoordinateTransform, QgsFeature, QgsFeatureRequest, QgsGeometry, QgsProject, QgsRasterLayer,
+                       QgsRectangle, QgsVectorLayer)
+
+RASTER_FILE_EXTENSIONS = ['.tif', '.tiff', '.jp2', '.img', '.vrt']
+
+
+def find_raster_files(dir_path: str) -> List[str]:
+    """ Raster files (with one of `RASTER_FILE_EXTENSIONS`) in the directory, sorted by name """
+    return sorted(file_path for file_path in glob.glob(os.path.join(dir_path, '*'))
+                  if os.path.splitext(file_path)[1].lower() in RASTER_FILE_EXTENSIONS)
+
+
+def get_raster_footprint_xyxy(dataset: gdal.Dataset) -> Tuple[float, float, float, float]:
+    """ Extent of the raster (x_min, y_min, x_max, y_max) in the raster CRS units (for rasters without rotation) """
+    x_start, x_step, _, y_start, _, y_step = dataset.GetGeoTransform()
+    x_end = x_start + x_step * dataset.RasterXSize
+    y_end = y_start + y_step * dataset.RasterYSize
+    return min(x_start, x_end), min(y_start, y_end), max(x_start, x_end), max(y_start, y_end)
+
+
+def build_mosaic_vrt(raster_file_paths: List[str], vrt_file_path: str) -> List[Tuple[float, float, float, float]]:
+    """ Build a virtual raster (VRT) with all rasters, so that each read is taken from the rasters which intersect it.
+    The mosaic has the resolution of the most detailed raster, and its parts without any raster are empty (zeros)
+
+    :param raster_file_paths: rasters with the same CRS and number of bands
+    :param vrt_file_path: path of the created VRT file
+    :return: footprints of the rasters (x_min, y_min, x_max, y_max), in the CRS of the mosaic
+    """
+    if not raster_file_paths:
+        raise Exception("No raster files for the mosaic!")
+
+    footprints = []
+    first_dataset = None
+    for raster_file_path in raster_file_paths:
+        dataset = gdal.Open(raster_file_path)
+        if dataset is None:
+            raise Exception(f"Invalid raster file '{raster_file_path}'!")
+        if dataset.GetSpatialRef() is None:
+            raise Exception(f"Raster '{raster_file_path}' has no CRS! Rasters of the mosaic need the same CRS")
+        if first_dataset is None:
+            first_dataset = dataset
+        elif dataset.RasterCount != first_dataset.RasterCount:
+            raise Exception(f"Rasters of the mosaic need the same number of bands! '{raster_file_path}' has "
+                            f"{dataset.RasterCount} bands, while '{raster_file_paths[0]}' has {first_dataset.RasterCount}")
+        elif not dataset.GetSpatialRef().IsSame(first_dataset.GetSpatialRef()):
+            raise Exception(f"Rasters of the mosaic need the same CRS! CRS of '{raster_file_path}' "
+                            f"is different than of '{raster_file_paths[0]}'")
+        footprints.append(get_raster_footprint_xyxy(dataset))
+
+    vrt_dataset = gdal.BuildVRT(vrt_file_path, [os.path.abspath(path) for path in raster_file_paths], resolution='highest')
+    if vrt_dataset is None:
+        raise Exception(f"Failed to build the mosaic '{vrt_file_path}'!")
+    vrt_dataset.FlushCache()
+    vrt_dataset = None  # closes the file
+    return footprints
+
+
+def create_footprints_mask_layer(footprints: List[Tuple[float, float, float, float]],
+                                 rlayer: QgsRasterLayer,
+                                 vlayer_mask: Optional[QgsVectorLayer] = None) -> QgsVectorLayer:
+    """ Create a layer with the area covered by rasters of the mosaic, to skip tiles in gaps between the rasters
+
+    :param footprints: footprints of the rasters (x_min, y_min, x_max, y_max), in the rlayer CRS
+    :param rlayer: mosaic raster layer
+    :param vlayer_mask: polygons of the area to process. The layer has only their parts covered by the rasters, if given
+    :return: memory layer with the area to process, in the rlayer CRS
+    """
+    area = QgsGeometry.unaryUnion([QgsGeometry.fromRect(QgsRectangle(*footprint)) for footprint in footprints])
+
+    if vlayer_mask is not None:
+        mask_polygons = []
+        if vlayer_mask.crs() != rlayer.crs():
+            xform = QgsCoordinateTransform(vlayer_mask.crs(), rlayer.crs(), QgsProject.instance())
+        else:
+            xform = None
+        for feature in vlayer_mask.getFeatures(QgsFeatureRequest().setNoAttributes()):
+            geometry = QgsGeometry(feature.geometry())
+            if xform is not None:
+                geometry.transform(xform)
+            mask_polygons.append(geometry)
+        area = area.intersection(QgsGeometry.unaryUnion(mask_polygons))
+
+    vlayer = QgsVectorLayer("polygon", 'mosaic footprints', "memory")
+    vlayer.setCrs(rlayer.crs())
+    feature = QgsFeature(vlayer.fields())
+    feature.setGeometry(area)
+    vlayer.dataProvider().addFeatures([feature])
+    vlayer.updateExtents()
+    return vlayer
+
+
+def create_mosaic_layers(raster_file_paths: List[str],
+                         vrt_file_path: str,
+                         vlayer_mask: Optional[QgsVectorLayer] = None) -> Tuple[QgsRasterLayer, QgsVectorLayer]:
+    """ Create layers to process several rasters as one mosaic, with one tiles grid over all of them.
+    The mosaic is processed within the mask (`ProcessedAreaType.FROM_POLYGONS`), so that tiles in gaps between
+    the rasters are skipped, and results of all rasters are in one output
+
+    :param raster_file_paths: raster files (e.g. sources of raster layers), with the same CRS and number of bands
+    :param vrt_file_path: path of the created VRT file with the mosaic
+    :param vlayer_mask: polygons of the area to process, or None to process all rasters entirely
+    :return: tuple (mosaic raster layer, mask layer with the area to process)
+    """
+    footprints = build_mosaic_vrt(raster_file_paths, vrt_file_path)
+    rlayer = QgsRasterLayer(vrt_file_path, os.path.splitext(os.path.basename(vrt_file_path))[0])
+    if not rlayer.isValid():
+        raise Exception(f"Invalid mosaic raster layer '{vrt_file_path}'!")
+    return rlayer, create_footprints_mask_layer(footprints, rlayer, vlayer_mask)
@@ -3,7 +3,7 @@ This file contains utilities related to processing a tile.
 Tile is a small part of the ortophoto, which is being processed by the model one by one.
 """
 
-from typing import Optional, Tuple
+from typing import Tuple
 
 import numpy as np
 from qgis.core import QgsRectangle
@@ -137,17 +137,17 @@ class TileParams:
         ]
         return roi_slice_on_tile
 
-    def is_tile_within_mask(self, mask_img: Optional[np.ndarray]):
+    def is_tile_within_mask(self, mask_img):
         """
-        To check if tile is within the mask image
+        To check if tile is within the mask image (numpy array or `ChunkedAreaMask`, of shape (height, width))
         """
         if mask_img is None:
             return True  # if we don't have a mask, we are going to process all tiles
 
         roi_slice = self.get_slice_on_full_image_for_copying()
-        mask_roi = mask_img[roi_slice[0]]
+        mask_roi = mask_img[roi_slice[1:]]  # only the (y, x) slices, the mask has no channels dimension
         # check corners first
-        if mask_roi[0, 0] and mask_roi[1, -1] and mask_roi[-1, 0] and mask_roi[-1, -1]:
+        if mask_roi[0, 0] and mask_roi[0, -1] and mask_roi[-1, 0] and mask_roi[-1, -1]:
             return True  # all corners in mask, almost for sure a good tile
 
         coverage_percentage = cv2.countNonZero(mask_roi) / (mask_roi.shape[0] * mask_roi.shape[1]) * 100
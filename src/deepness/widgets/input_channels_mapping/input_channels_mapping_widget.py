@@ -9,12 +9,11 @@ from typing import Optional, List
 from qgis.PyQt import QtWidgets, uic
 from qgis.PyQt.QtWidgets import QComboBox
 from qgis.PyQt.QtWidgets import QLabel
-from qgis.core import Qgis, QgsRasterLayer
+from qgis.core import QgsRasterLayer
 
-from deepness.common.channels_mapping import ChannelsMapping, ImageChannelStandaloneBand, \
-    ImageChannelCompositeByte
-from deepness.common.channels_mapping import ImageChannel
+from deepness.common.channels_mapping import ChannelsMapping
 from deepness.common.config_entry_key import ConfigEntryKey
+from deepness.processing import processing_utils
 from deepness.processing.models.model_base import ModelBase
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -95,43 +94,7 @@ class InputChannelsMappingWidget(QtWidgets.QWidget, FORM_CLASS):
         """ Set the raster layer (ortophoto file) which is selected (for which we create the mapping here)"""
         self._rlayer = rlayer
 
-        if rlayer:
-            number_of_image_bands = rlayer.bandCount()
-        else:
-            number_of_image_bands = 0
-
-        image_channels = []  # type: List[ImageChannel]
-
-        if number_of_image_bands == 1:
-            # if there is one band, then there is probably more "bands" hidden in a more complex data type (e.g. RGBA)
-            data_type = rlayer.dataProvider().dataType(1)
-            if data_type in [Qgis.DataType.Byte, Qgis.DataType.UInt16, Qgis.DataType.Int16,
-                             Qgis.DataType.Float32]:
-                image_channel = ImageChannelStandaloneBand(
-                    band_number=1,
-                    name=rlayer.bandName(1))
-                image_channels.append(image_channel)
-            elif data_type == Qgis.DataType.ARGB32:
-                # Alpha channel is at byte number 3, red is byte 2, ... - reversed order
-                band_names = [
-                    'Alpha (band 4)',
-                    'Red (band 1)',
-                    'Green (band 2)',
-                    'Blue (band 3)',
-                ]
-                for i in [1, 2, 3, 0]:  # We want order of model inputs as 'RGB' first and then 'A'
-                    image_channel = ImageChannelCompositeByte(
-                        byte_number=3 - i,  # bytes are in reversed order
-                        name=band_names[i])
-                    image_channels.append(image_channel)
-            else:
-                raise Exception("Invalid input layer data type!")
-        else:
-            for band_number in range(1, number_of_image_bands + 1):  # counted from 1
-                image_channel = ImageChannelStandaloneBand(
-                    band_number=band_number,
-                    name=rlayer.bandName(band_number))
-                image_channels.append(image_channel)
+        image_channels = processing_utils.create_image_channels_for_rlayer(rlayer)
 
         self.label_imageInputs.setText(f'{len(image_channels)}')
         self._channels_mapping.set_image_channels(image_channels)
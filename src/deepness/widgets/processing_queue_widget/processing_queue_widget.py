@@ -0,0 +1,78 @@
+"""
+This file contains a single widget, which is embedded in the main dockwiget - to show the queue of processing tasks
+"""
+
+import os
+
+from qgis.PyQt import QtWidgets, uic
+from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtWidgets import QTableWidgetItem
+
+from deepness.common.config_entry_key import ConfigEntryKey
+
+FORM_CLASS, _ = uic.loadUiType(os.path.join(
+    os.path.dirname(__file__), 'processing_queue_widget.ui'))
+
+
+class ProcessingQueueWidget(QtWidgets.QWidget, FORM_CLASS):
+    """
+    Widget showing the queue of processing tasks (with their status and progress), allowing to cancel them
+    and to set the concurrency limits of the `ProcessingScheduler`.
+
+    UI design defined in the `processing_queue_widget.ui` file.
+    """
+
+    def __init__(self, parent=None):
+        super(ProcessingQueueWidget, self).__init__(parent)
+        self.setupUi(self)
+        self._processing_scheduler = None  # set later, as it lives in the main plugin class
+        self._create_connections()
+
+    def load_ui_from_config(self):
+        self.spinBox_maxRunningTasks.setValue(ConfigEntryKey.PROCESSING_MAX_RUNNING_TASKS.get())
+        self.spinBox_cpuThreads.setValue(ConfigEntryKey.PROCESSING_CPU_THREADS.get())
+
+    def save_ui_to_config(self):
+        ConfigEntryKey.PROCESSING_MAX_RUNNING_TASKS.set(self.spinBox_maxRunningTasks.value())
+        ConfigEntryKey.PROCESSING_CPU_THREADS.set(self.spinBox_cpuThreads.value())
+
+    def set_processing_scheduler(self, processing_scheduler):
+        """ Set the scheduler which queue is shown (`deepness.processing.processing_scheduler.ProcessingScheduler`) """
+        self._processing_scheduler = processing_scheduler
+        self._processing_scheduler.jobs_changed.connect(self._update_jobs_table)
+        self._limits_changed()
+        self._update_jobs_table()
+
+    def _create_connections(self):
+        self.spinBox_maxRunningTasks.valueChanged.connect(self._limits_changed)
+        self.spinBox_cpuThreads.valueChanged.connect(self._limits_changed)
+        self.pushButton_cancelTask.clicked.connect(self._cancel_selected_job)
+        self.pushButton_clearDoneTasks.clicked.connect(self._clear_done_jobs)
+
+    def _limits_changed(self):
+        if self._processing_scheduler is None:
+            return
+
+        cpu_threads = self.spinBox_cpuThreads.value()
+        self._processing_scheduler.set_limits(
+            max_running_jobs=self.spinBox_maxRunningTasks.value(),
+            cpu_threads_budget=cpu_threads if cpu_threads > 0 else None)
+
+    def _update_jobs_table(self):
+        jobs = self._processing_scheduler.get_jobs()
+        self.tableWidget_jobs.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            for column, text in enumerate([job.name, job.status.value, f'{job.get_progress():.0f} %']):
+                item = QTableWidgetItem(text)
+                item.setData(Qt.UserRole, job.job_id)
+                self.tableWidget_jobs.setItem(row, column, item)
+
+    def _cancel_selected_job(self):
+        selected_items = self.tableWidget_jobs.selectedItems()
+        if self._processing_scheduler is None or not selected_items:
+            return
+        self._processing_scheduler.cancel_job(selected_items[0].data(Qt.UserRole))
+
+    def _clear_done_jobs(self):
+        if self._processing_scheduler is not None:
+            self._processing_scheduler.clear_done_jobs()
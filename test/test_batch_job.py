@@ -0,0 +1,319 @@
+from test.test_utils import (get_dummy_fotomap_small_path, get_dummy_regression_model_path, get_dummy_segmentation_model_path,
+                             init_qgis)
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from deepness.common.channels_mapping import ImageChannelStandaloneBand
+from deepness.common.processing_overlap import ProcessingOverlapOptions
+from deepness.common.processing_parameters.detection_parameters import DetectionParameters, DetectorType
+from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
+from deepness.processing.batch_processing.batch_job import (BatchJob, check_raster_names_unique, create_channels_mapping,
+                                                          create_processing_parameters, get_default_parameter_values)
+
+
+def _create_model_mock():
+    model = MagicMock()
+    model.get_input_size_in_pixels.return_value = (512, 512)
+    model.get_model_batch_size.return_value = None
+    model.get_metadata_tiles_overlap.return_value = 15
+    model.get_metadata_segmentation_small_segment.return_value = None
+    model.get_metadata_regression_output_scaling.return_value = None
+    model.get_metadata_resolution.return_value = 5.0
+    model.get_metadata_segmentation_threshold.return_value = 0.6
+    model.get_metadata_detection_confidence.return_value = None
+    model.get_metadata_detection_iou_threshold.return_value = None
+    model.get_detector_type.return_value = None
+    return model
+
+
+def test_batch_job_from_file():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        os.makedirs(os.path.join(tmp_dir_path, 'rasters'))
+        for name in ['b.tif', 'a.tif', 'c.png']:
+            open(os.path.join(tmp_dir_path, 'rasters', name), 'w').close()
+
+        job_file_path = os.path.join(tmp_dir_path, 'job.json')
+        with open(job_file_path, 'w') as f:
+            json.dump({
+                'model_file_path': 'model.onnx',
+                'rasters': ['rasters/*.tif', '/data/other.tif'],
+                'output_dir_path': 'results',
+                'parameters': {'batch_size': 4},
+            }, f)
+
+        job = BatchJob.from_file(job_file_path)
+
+    assert job.model_file_path == os.path.join(tmp_dir_path, 'model.onnx')
+    assert job.raster_file_paths == [
+        os.path.join(tmp_dir_path, 'rasters', 'a.tif'),
+        os.path.join(tmp_dir_path, 'rasters', 'b.tif'),
+        '/data/other.tif',
+    ]
+    assert job.output_dir_path == os.path.join(tmp_dir_path, 'results')
+    assert job.model_type is None
+    assert job.mask_file_path is None
+    assert job.parameters == {'batch_size': 4}
+
+
+def test_batch_job_from_yaml_file_without_pyyaml():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        job_file_path = os.path.join(tmp_dir_path, 'job.yaml')
+        with open(job_file_path, 'w') as f:
+            f.write('model_file_path: model.onnx\n')
+
+        with patch('importlib.util.find_spec', return_value=None):
+            with pytest.raises(Exception, match='PyYAML is required'):
+                BatchJob.from_file(job_file_path)
+
+
+def test_batch_job_mosaic_from_directory():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        for name in ['b.tif', 'a.TIF', 'c.png', 'd.tif.aux.xml']:
+            open(os.path.join(tmp_dir_path, name), 'w').close()
+
+        job = BatchJob.from_dict({
+            'model_file_path': 'model.onnx',
+            'rasters': ['.'],
+            'output_dir_path': 'results',
+            'mosaic_name': 'survey',
+        }, base_dir_path=tmp_dir_path)
+
+    assert [os.path.basename(path) for path in job.raster_file_paths] == ['a.TIF', 'b.tif']
+    assert job.mosaic_name == 'survey'
+
+
+def test_batch_job_invalid_values():
+    values = {'model_file_path': 'model.onnx', 'rasters': ['a.tif'], 'output_dir_path': 'results'}
+
+    for invalid_values in [
+        {k: v for k, v in values.items() if k != 'rasters'},
+        {**values, 'unknown_key': 1},
+        {**values, 'parameters': {'input_layer_id': 'abc'}},
+    ]:
+        try:
+            BatchJob.from_dict(invalid_values)
+            assert False, f'No exception for {invalid_values}'
+        except Exception as e:
+            assert not isinstance(e, AssertionError)
+
+
+def test_batch_job_additional_models():
+    values = {
+        'model_file_path': 'trees.onnx',
+        'rasters': ['/data/a.tif'],
+        'output_dir_path': 'results',
+        'parameters': {'batch_size': 4},
+        'additional_models': [{'model_file_path': 'heights.onnx', 'model_type': 'Regressor'}],
+    }
+    job = BatchJob.from_dict(values, base_dir_path='/models')
+
+    assert [(model.model_file_path, model.model_type, model.parameters) for model in job.get_models()] == [
+        ('/models/trees.onnx', None, {'batch_size': 4}),
+        ('/models/heights.onnx', 'Regressor', {}),
+    ]
+
+    # results of both models would be saved in 'a_trees.tif'
+    with pytest.raises(Exception, match='same name'):
+        BatchJob.from_dict({**values, 'additional_models': [{'model_file_path': 'other/trees.onnx'}]})
+    with pytest.raises(Exception, match='set by the batch runner'):
+        BatchJob.from_dict({**values, 'additional_models': [{'model_file_path': 'b.onnx', 'parameters': {'model': 1}}]})
+
+
+def test_batch_job_raster_names():
+    job = BatchJob.from_dict({
+        'model_file_path': 'model.onnx',
+        'rasters': ['/data/a.tif', '/data/./a.tif', '/data/b.tif'],  # the same raster given twice
+        'output_dir_path': 'results',
+    })
+    assert job.raster_file_paths == ['/data/a.tif', '/data/b.tif']
+    check_raster_names_unique(job.raster_file_paths)
+
+    # results of both rasters would be saved in 'a.tif'
+    with pytest.raises(Exception, match='same name'):
+        check_raster_names_unique(['/data/2023/a.tif', '/data/2024/a.tif', '/data/b.tif'])
+    with pytest.raises(Exception, match='same name'):
+        check_raster_names_unique(['/data/a.tif', '/data/a.png'])
+
+
+def test_create_processing_parameters():
+    model = _create_model_mock()
+
+    params = create_processing_parameters(
+        parameters_class=SegmentationParameters,
+        default_values=get_default_parameter_values(model),
+        job_values={'batch_size': 2, 'processing_overlap': {'overlap_px': 64}},
+        model=model,
+        input_layer_id='layer_id',
+        mask_layer_id=None,
+        processed_area_type='Entire layer',
+        input_channels_mapping=None,
+    )
+
+    assert params.tile_size_px == 512
+    assert params.batch_size == 2
+    assert params.resolution_cm_per_px == 5.0
+    assert params.pixel_classification__probability_threshold == 0.6
+    assert params.postprocessing_dilate_erode_size == 0
+    assert params.processing_overlap.selected_option == ProcessingOverlapOptions.OVERLAP_IN_PIXELS
+    assert params.processing_overlap_px == 64
+
+    # enums given by values, and required parameters missing in the metadata
+    job_values = {'detector_type': 'YOLO_v9', 'confidence': 0.3}
+    runner_values = dict(model=model, input_layer_id='layer_id', mask_layer_id=None, processed_area_type='Entire layer',
+                         input_channels_mapping=None)
+    try:
+        create_processing_parameters(DetectionParameters, get_default_parameter_values(model), job_values, **runner_values)
+        assert False, 'No exception for missing iou_threshold'
+    except Exception as e:
+        assert 'iou_threshold' in str(e)
+
+    job_values['iou_threshold'] = 0.4
+    params = create_processing_parameters(DetectionParameters, get_default_parameter_values(model), job_values, **runner_values)
+    assert params.detector_type == DetectorType.YOLO_v9
+    assert params.processing_overlap.selected_option == ProcessingOverlapOptions.OVERLAP_IN_PERCENT
+
+
+def test_create_channels_mapping():
+    image_channels = [ImageChannelStandaloneBand(band_number=i + 1, name=name) for i, name in enumerate('rgba')]
+
+    channels_mapping = create_channels_mapping(image_channels, number_of_model_inputs=3)
+    assert [channels_mapping.get_image_channel_for_model_input(i).name for i in range(3)] == ['r', 'g', 'b']
+
+    channels_mapping = create_channels_mapping(image_channels, number_of_model_inputs=3, mapping_list=[2, 1, 0])
+    assert [channels_mapping.get_image_channel_for_model_input(i).name for i in range(3)] == ['b', 'g', 'r']
+
+
+def test_batch_runner_segmentation():
+    from deepness.processing.batch_processing.batch_runner import BatchRunner
+
+    init_qgis()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        # the same raster given twice is processed once, so it is copied under another name
+        other_raster_file_path = os.path.join(tmp_dir_path, 'other_fotomap.tif')
+        shutil.copyfile(get_dummy_fotomap_small_path(), other_raster_file_path)
+
+        job = BatchJob.from_dict({
+            'model_file_path': get_dummy_segmentation_model_path(),
+            'model_type': 'Segmentor',
+            'rasters': [get_dummy_fotomap_small_path(), other_raster_file_path],
+            'output_dir_path': os.path.join(tmp_dir_path, 'results'),
+            'parameters': {
+                'resolution_cm_per_px': 3,
+                'pixel_classification__probability_threshold': 0.5,
+                'processing_overlap': {'percentage': 20},
+            },
+        })
+
+        assert BatchRunner(job).run()
+
+        with open(os.path.join(job.output_dir_path, BatchRunner.SUMMARY_FILE_NAME)) as f:
+            summary = json.load(f)
+        assert [raster_summary['status'] for raster_summary in summary] == ['success', 'success']
+        assert os.path.exists(os.path.join(job.output_dir_path, 'dummy_fotomap_small.tif'))
+        assert os.path.exists(os.path.join(job.output_dir_path, 'other_fotomap.tif'))
+
+
+def test_batch_runner_segmentation_mosaic():
+    from osgeo import gdal
+
+    from deepness.processing.batch_processing.batch_runner import BatchRunner
+    from deepness.processing.raster_mosaic import get_raster_footprint_xyxy
+
+    init_qgis()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        # two distinct rasters - left and right quarter of the fotomap, with a gap between them
+        dataset = gdal.Open(get_dummy_fotomap_small_path())
+        crop_width = dataset.RasterXSize // 4
+        raster_file_paths = [os.path.join(tmp_dir_path, 'left.tif'), os.path.join(tmp_dir_path, 'right.tif')]
+        for raster_file_path, x_offset in zip(raster_file_paths, [0, dataset.RasterXSize - crop_width]):
+            gdal.Translate(raster_file_path, dataset, srcWin=[x_offset, 0, crop_width, dataset.RasterYSize])
+        dataset = None
+
+        job = BatchJob.from_dict({
+            'model_file_path': get_dummy_segmentation_model_path(),
+            'model_type': 'Segmentor',
+            'rasters': raster_file_paths,
+            'output_dir_path': os.path.join(tmp_dir_path, 'results'),
+            'mosaic_name': 'mosaic',
+            'parameters': {
+                'resolution_cm_per_px': 1,  # the gap between the rasters is wider than a tile
+                'pixel_classification__probability_threshold': 0.5,
+                'processing_overlap': {'percentage': 0},
+            },
+        })
+
+        assert BatchRunner(job).run()
+
+        with open(os.path.join(job.output_dir_path, BatchRunner.SUMMARY_FILE_NAME)) as f:
+            summary = json.load(f)
+        assert [raster_summary['status'] for raster_summary in summary] == ['success']  # one job for all rasters
+        assert not os.path.exists(os.path.join(job.output_dir_path, 'left.tif'))
+
+        # the mosaic reads from both rasters
+        vrt_dataset = gdal.Open(os.path.join(job.output_dir_path, 'mosaic.vrt'))
+        assert set(os.path.abspath(path) for path in raster_file_paths) <= set(vrt_dataset.GetFileList())
+        vrt_dataset = None
+
+        # one output covering both rasters
+        footprints = [get_raster_footprint_xyxy(gdal.Open(raster_file_path)) for raster_file_path in raster_file_paths]
+        output_footprint = get_raster_footprint_xyxy(gdal.Open(os.path.join(job.output_dir_path, 'mosaic.tif')))
+        union_footprint = (min(f[0] for f in footprints), min(f[1] for f in footprints),
+                           max(f[2] for f in footprints), max(f[3] for f in footprints))
+        assert np.allclose(output_footprint, union_footprint, atol=0.05)
+
+        # tiles in the gap between the rasters are not read
+        with open(os.path.join(job.output_dir_path, f'mosaic{BatchRunner.PROCESSING_STATS_FILE_SUFFIX}')) as f:
+            processing_stats = json.load(f)
+        assert 0 < processing_stats['number_of_tiles_read'] < processing_stats['number_of_tiles']
+
+
+def test_batch_runner_segmentation_and_regression():
+    from deepness.processing.batch_processing.batch_runner import BatchRunner
+
+    init_qgis()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        parameters = {'resolution_cm_per_px': 3, 'processing_overlap': {'percentage': 20}}
+        job = BatchJob.from_dict({
+            'model_file_path': get_dummy_segmentation_model_path(),
+            'model_type': 'Segmentor',
+            'rasters': [get_dummy_fotomap_small_path()],
+            'output_dir_path': tmp_dir_path,
+            'parameters': {**parameters, 'pixel_classification__probability_threshold': 0.5},
+            'additional_models': [{
+                'model_file_path': get_dummy_regression_model_path(),
+                'model_type': 'Regressor',
+                'parameters': parameters,
+            }],
+        })
+
+        assert BatchRunner(job).run()
+
+        with open(os.path.join(tmp_dir_path, BatchRunner.SUMMARY_FILE_NAME)) as f:
+            summary = json.load(f)
+        assert [raster_summary['status'] for raster_summary in summary] == ['success']  # both models in one pass
+        assert os.path.exists(os.path.join(tmp_dir_path, 'dummy_fotomap_small_dummy_model.tif'))
+        assert os.path.exists(os.path.join(tmp_dir_path, 'dummy_fotomap_small_dummy_regression_model.tif'))
+
+
+if __name__ == '__main__':
+    test_batch_job_from_file()
+    test_batch_job_from_yaml_file_without_pyyaml()
+    test_batch_job_mosaic_from_directory()
+    test_batch_job_invalid_values()
+    test_batch_job_additional_models()
+    test_batch_job_raster_names()
+    test_create_processing_parameters()
+    test_create_channels_mapping()
+    test_batch_runner_segmentation()
+    test_batch_runner_segmentation_mosaic()
+    test_batch_runner_segmentation_and_regression()
+    print('Done')
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+from deepness.processing.map_processor.utils.chunked_area_mask import ChunkedAreaMask
+from deepness.processing.processing_utils import count_non_zero_pixels_in_rectangles, create_integral_image
+
+
+def _create_masks(chunk_size_px=32):
+    dense_mask = np.zeros((150, 200), dtype=np.uint8)
+    cv2.fillPoly(dense_mask, pts=[np.array([[10, 10], [120, 30], [60, 100]])], color=255)
+    dense_mask[100:150, 150:200] = 255  # whole chunks within the area
+
+    rasterized_windows = []
+
+    def rasterize_window(y_min, x_min, height, width):
+        rasterized_windows.append((y_min, x_min))
+        window = dense_mask[y_min:y_min + height, x_min:x_min + width]
+        if not np.any(window):
+            return 0  # e.g. no polygons in the window
+        return window.copy()
+
+    chunked_mask = ChunkedAreaMask(dense_mask.shape, rasterize_window, chunk_size_px=chunk_size_px)
+    return chunked_mask, dense_mask, rasterized_windows
+
+
+def test_get_window():
+    chunked_mask, dense_mask, rasterized_windows = _create_masks()
+
+    np.testing.assert_array_equal(chunked_mask[20:50, 30:70], dense_mask[20:50, 30:70])
+    assert len(rasterized_windows) == 2 * 3  # rasterized lazily, only chunks within the window
+    np.testing.assert_array_equal(chunked_mask[20:50, 30:70], dense_mask[20:50, 30:70])
+    assert len(rasterized_windows) == 2 * 3
+
+    np.testing.assert_array_equal(chunked_mask.to_dense(), dense_mask)
+    assert len(rasterized_windows) == 5 * 7
+    assert chunked_mask.nbytes < dense_mask.nbytes / 8
+
+
+def test_count_non_zero_pixels_in_rectangles():
+    chunked_mask, dense_mask, _ = _create_masks()
+
+    rectangles = np.array([
+        [0, 0, 199, 149],  # entire mask
+        [10, 10, 120, 100],
+        [140, 90, 260, 260],  # partially outside of the mask
+        [-20, -20, 30, 30],  # negative coordinates
+        [300, 300, 310, 310],  # outside of the mask
+    ])
+    expected_counts = count_non_zero_pixels_in_rectangles(create_integral_image(dense_mask), rectangles)
+
+    assert chunked_mask.count_non_zero_pixels_in_rectangles(rectangles).tolist() == expected_counts.tolist()
+
+
+def test_apply_to_image():
+    chunked_mask, dense_mask, _ = _create_masks()
+    img = np.random.default_rng(0).integers(1, 10, size=dense_mask.shape, dtype=np.uint8)
+
+    expected_img = cv2.copyTo(src=img, mask=dense_mask)
+    chunked_mask.apply_to_image(img)
+
+    np.testing.assert_array_equal(img, expected_img)
+
+
+if __name__ == '__main__':
+    test_get_window()
+    test_count_non_zero_pixels_in_rectangles()
+    test_apply_to_image()
+    print('Done')
@@ -0,0 +1,53 @@
+import numpy as np
+
+from deepness.processing.models.detector import Detection
+from deepness.processing.processing_utils import BoundingBox, CompactMask
+
+
+def test_compact_mask_roundtrip():
+    mask = np.zeros((640, 640), dtype=np.uint8)
+    mask[100:150, 200:290] = 1
+    mask[120:130, 210:220] = 0  # hole
+
+    compact_mask = CompactMask.from_mask(mask)
+
+    assert compact_mask.shape == (50, 90)
+    assert compact_mask.x_offset == 200
+    assert compact_mask.y_offset == 100
+    assert compact_mask.packed_data.nbytes < mask.nbytes // 100
+
+    unpacked = compact_mask.to_mask()
+    assert np.array_equal(unpacked, mask[100:150, 200:290])
+
+
+def test_compact_mask_empty():
+    compact_mask = CompactMask.from_mask(np.zeros((64, 64), dtype=np.uint8), x_offset=3, y_offset=4)
+
+    assert compact_mask.is_empty()
+    assert compact_mask.to_mask().shape == (0, 0)
+
+
+def test_detection_with_compact_mask_convert_to_global():
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    mask[10:20, 30:40] = 1
+
+    det = Detection(
+        bbox=BoundingBox(x_min=30, x_max=39, y_min=10, y_max=19),
+        conf=0.9,
+        clss=0,
+        mask=CompactMask.from_mask(mask),
+    )
+    det.convert_to_global(offset_x=1000, offset_y=2000)
+
+    assert det.bbox.x_min == 1030
+    assert det.bbox.y_min == 2010
+    assert det.mask.x_offset == 1030
+    assert det.mask.y_offset == 2010
+    assert det.mask.to_mask().sum() == 100
+
+
+if __name__ == '__main__':
+    test_compact_mask_roundtrip()
+    test_compact_mask_empty()
+    test_detection_with_compact_mask_convert_to_global()
+    print('Done')
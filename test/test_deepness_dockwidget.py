@@ -77,6 +77,8 @@ def test_get_inference_parameters():
     ConfigEntryKey.PREPROCESSING_RESOLUTION.set(7)
     ConfigEntryKey.PROCESSED_AREA_TYPE.set(ProcessedAreaType.VISIBLE_PART.value)
     ConfigEntryKey.PREPROCESSING_TILES_OVERLAP.set(44)
+    ConfigEntryKey.TILES_CACHE_SIZE_MB.set(64)
+    ConfigEntryKey.SKIP_EMPTY_TILES.set(True)
 
     dockwidget = DeepnessDockWidget(iface=MagicMock())
     dockwidget._get_input_layer_id = MagicMock(return_value=1)  # fake input layer id, just to test
@@ -93,10 +95,26 @@ def test_get_inference_parameters():
     assert params.input_channels_mapping.get_number_of_model_inputs() == 3
     assert params.input_channels_mapping.get_number_of_image_channels() == 4
     assert params.input_channels_mapping.get_image_channel_index_for_model_input(2) == 2
+    assert params.tiles_cache_size_mb == 64
+    assert params.skip_empty_tiles
+
+
+def test_live_preview_only_for_visible_part():
+    qgs = init_qgis()
+
+    ConfigEntryKey.LIVE_PREVIEW_ENABLED.set(True)
+    ConfigEntryKey.PROCESSED_AREA_TYPE.set(ProcessedAreaType.VISIBLE_PART.value)
+
+    dockwidget = DeepnessDockWidget(iface=MagicMock())
+    assert dockwidget.is_live_preview_enabled()
+
+    dockwidget.comboBox_processedAreaSelection.setCurrentText(ProcessedAreaType.ENTIRE_LAYER.value)
+    assert not dockwidget.is_live_preview_enabled()
 
 
 if __name__ == '__main__':
     test_run_inference()
     test_run_data_export()
     test_get_inference_parameters()
+    test_live_preview_only_for_visible_part()
     print('Done')
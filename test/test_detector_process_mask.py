@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+from deepness.processing.models.detector import Detector
+
+
+def _create_detector_without_model(input_size: int) -> Detector:
+    detector = Detector.__new__(Detector)  # process_mask needs only the input shape, not the model itself
+    detector.input_shape = (1, 3, input_size, input_size)
+    return detector
+
+
+def _process_mask_full_tile(protos, masks_in, bboxes, input_size):
+    """ Previous implementation - sigmoid of full prototype masks, cropped at the prototype resolution and upsampled """
+    c, mh, mw = protos.shape
+    masks = 1 / (1 + np.exp(-np.matmul(masks_in, protos.astype(float).reshape(c, -1)))).reshape(-1, mh, mw)
+
+    downsampled_bboxes = bboxes.astype(float) * np.array([mw, mh, mw, mh]) / input_size
+    x1, y1, x2, y2 = np.split(downsampled_bboxes[:, :, None], 4, axis=1)
+    r = np.arange(mw)[None, None, :]
+    c = np.arange(mh)[None, :, None]
+    masks = masks * ((r >= x1) * (r < x2) * (c >= y1) * (c < y2))
+
+    return np.array([cv2.resize(mask, (input_size, input_size), interpolation=cv2.INTER_LINEAR) for mask in masks]) >= 0.5
+
+
+def test_process_mask_cropped_to_bounding_boxes():
+    detector = _create_detector_without_model(input_size=640)
+
+    protos = np.zeros((2, 160, 160), dtype=np.float32)
+    protos[0] = 1  # everything 'on' for the first prototype
+    protos[1, 40:80, 40:80] = 1  # a square, (160, 160) - (320, 320) in tile pixels
+
+    masks_in = np.array([
+        [1, 0],
+        [-1, 2],
+    ], dtype=np.float32)
+    bboxes = np.array([
+        [10, 20, 110, 60],
+        [100, 100, 400, 400],
+    ])
+
+    masks = detector.process_mask(protos, masks_in, bboxes)
+    assert len(masks) == 2
+
+    for compact_mask, (x1, y1, x2, y2) in zip(masks, bboxes):
+        mask = compact_mask.to_mask()
+        ys, xs = np.nonzero(mask)
+        xs += compact_mask.x_offset
+        ys += compact_mask.y_offset
+        assert xs.min() >= x1 and xs.max() < x2
+        assert ys.min() >= y1 and ys.max() < y2
+
+    # whole bounding box for the first mask
+    assert np.count_nonzero(masks[0].to_mask()) == 100 * 40
+
+    # for the second one - only the square (within the bounding box)
+    assert masks[1].x_offset == 160 and masks[1].y_offset == 160
+    assert masks[1].shape == (160, 160)
+    assert np.all(masks[1].to_mask()[2:-2, 2:-2])
+
+
+def test_process_mask_same_as_full_tile_implementation():
+    input_size = 640
+    detector = _create_detector_without_model(input_size=input_size)
+
+    rng = np.random.default_rng(0)
+    protos = cv2.GaussianBlur(rng.normal(size=(160, 160, 32)).astype(np.float32), (0, 0), 4).transpose((2, 0, 1)) * 10
+    masks_in = rng.normal(size=(20, 32)).astype(np.float32)
+    xy_min = rng.integers(0, 500, size=(20, 2))
+    bboxes = np.concatenate([xy_min, xy_min + rng.integers(20, 140, size=(20, 2))], axis=1)
+
+    expected_masks = _process_mask_full_tile(protos, masks_in, bboxes, input_size)
+    masks = detector.process_mask(protos, masks_in, bboxes)
+
+    different_pixels, total_pixels = 0, 0
+    different_inner_pixels, total_inner_pixels = 0, 0
+    for compact_mask, expected_mask, (x1, y1, x2, y2) in zip(masks, expected_masks, bboxes):
+        mask = np.zeros((input_size, input_size), dtype=bool)
+        mask_part = compact_mask.to_mask() > 0
+        mask[compact_mask.y_offset:compact_mask.y_offset + mask_part.shape[0],
+             compact_mask.x_offset:compact_mask.x_offset + mask_part.shape[1]] = mask_part
+
+        is_different = mask[y1:y2, x1:x2] != expected_mask[y1:y2, x1:x2]
+        different_pixels += np.count_nonzero(is_different)
+        total_pixels += is_different.size
+        # farther than a prototype pixel (4 tile pixels) from the bounding box edges
+        different_inner_pixels += np.count_nonzero(is_different[4:-4, 4:-4])
+        total_inner_pixels += is_different[4:-4, 4:-4].size
+
+    # Results are not identical. The previous implementation cropped masks at the prototype resolution,
+    # so masks faded out near the bounding box edges (about 3% of pixels differ in this case).
+    # Inside the boxes only pixels at the mask edges may differ, as logits are interpolated instead of
+    # sigmoid values (about 0.1% of pixels in this case).
+    assert different_pixels / total_pixels < 0.05
+    assert different_inner_pixels / total_inner_pixels < 0.005
+
+
+if __name__ == '__main__':
+    test_process_mask_cropped_to_bounding_boxes()
+    test_process_mask_same_as_full_tile_implementation()
+    print('Done')
@@ -0,0 +1,72 @@
+from test.test_utils import create_tile_params
+import os
+import tempfile
+
+import numpy as np
+
+from deepness.processing.map_processor.utils.incremental_manifest import IncrementalManifest
+
+
+def _process_tiles(manifest, tiles_imgs, x_bins_number, y_bins_number):
+    processed_tiles = []
+    for (x_bin_number, y_bin_number), tile_img in tiles_imgs.items():
+        tile_params = create_tile_params(x_bin_number, y_bin_number, x_bins_number, y_bins_number)
+        if manifest.is_tile_changed(tile_img, tile_params):
+            manifest.set_tile_processed(tile_params)
+            processed_tiles.append((x_bin_number, y_bin_number))
+    manifest.save()
+    return processed_tiles
+
+
+def test_incremental_manifest_only_changed_tiles_processed():
+    rng = np.random.default_rng(0)
+    tiles_imgs = {(x, y): rng.integers(0, 255, (8, 8, 3), dtype=np.uint8) for y in range(2) for x in range(3)}
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        manifest_dir_path = os.path.join(tmp_dir_path, 'manifest')
+        manifest = IncrementalManifest(manifest_dir_path, x_bins_number=3, y_bins_number=2)
+        assert not manifest.has_previous_results
+        assert len(_process_tiles(manifest, tiles_imgs, 3, 2)) == 6
+
+        tiles_imgs[(1, 1)] = tiles_imgs[(1, 1)].copy()
+        tiles_imgs[(1, 1)][0, 0, 0] += 1
+        manifest = IncrementalManifest(manifest_dir_path, x_bins_number=3, y_bins_number=2)
+        assert manifest.has_previous_results
+        assert _process_tiles(manifest, tiles_imgs, 3, 2) == [(1, 1)]
+        assert manifest.get_number_of_changed_tiles() == 1
+        assert manifest.get_number_of_unchanged_tiles() == 5
+
+        manifest = IncrementalManifest(manifest_dir_path, x_bins_number=3, y_bins_number=2)
+        assert _process_tiles(manifest, tiles_imgs, 3, 2) == []
+
+        # different tiles plan
+        manifest = IncrementalManifest(manifest_dir_path, x_bins_number=2, y_bins_number=2)
+        assert not manifest.has_previous_results
+
+
+def test_incremental_manifest_interrupted_run():
+    tile_img = np.ones((8, 8, 3), dtype=np.uint8)
+    changed_tile_img = np.zeros((8, 8, 3), dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        manifest = IncrementalManifest(tmp_dir_path, x_bins_number=2, y_bins_number=1)
+        _process_tiles(manifest, {(0, 0): tile_img, (1, 0): tile_img}, 2, 1)
+
+        manifest = IncrementalManifest(tmp_dir_path, x_bins_number=2, y_bins_number=1)
+        assert manifest.is_tile_changed(changed_tile_img, create_tile_params(0, 0, 2, 1))
+        manifest.save()  # interrupted before the results of the tile were written
+
+        manifest = IncrementalManifest(tmp_dir_path, x_bins_number=2, y_bins_number=1)
+        assert manifest.is_tile_changed(changed_tile_img, create_tile_params(0, 0, 2, 1))
+        assert not manifest.is_tile_changed(tile_img, create_tile_params(1, 0, 2, 1))
+
+        manifest.invalidate_tile(create_tile_params(1, 0, 2, 1))
+        manifest.save()
+        manifest = IncrementalManifest(tmp_dir_path, x_bins_number=2, y_bins_number=1)
+        assert manifest.is_tile_changed(tile_img, create_tile_params(1, 0, 2, 1))
+
+
+if __name__ == '__main__':
+    test_incremental_manifest_only_changed_tiles_processed()
+    test_incremental_manifest_interrupted_run()
+    print('Done')
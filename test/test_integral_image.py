@@ -0,0 +1,35 @@
+import numpy as np
+
+from deepness.processing.processing_utils import count_non_zero_pixels_in_rectangles, create_integral_image
+
+
+def test_count_non_zero_pixels_in_rectangles():
+    mask = np.zeros((300, 400), dtype=np.uint8)
+    mask[50:150, 100:350] = 255
+    mask[100:120, :] = 0
+
+    rectangles = np.array([
+        [0, 0, 399, 299],  # entire image
+        [100, 50, 349, 149],  # entire mask
+        [0, 0, 99, 49],  # outside of the mask
+        [340, 140, 500, 500],  # partially outside of the image
+        [-20, -20, 110, 60],  # negative coordinates
+    ])
+
+    integral_img = create_integral_image(mask)
+    counts = count_non_zero_pixels_in_rectangles(integral_img, rectangles)
+
+    expected_counts = [
+        np.count_nonzero(mask),
+        np.count_nonzero(mask),
+        0,
+        np.count_nonzero(mask[140:, 340:]),
+        np.count_nonzero(mask[:61, :111]),
+    ]
+
+    assert counts.tolist() == expected_counts
+
+
+if __name__ == '__main__':
+    test_count_non_zero_pixels_in_rectangles()
+    print('Done')
@@ -0,0 +1,54 @@
+import numpy as np
+
+from deepness.processing.processing_utils import is_tile_empty
+
+
+def test_is_tile_empty_uniform_tile():
+    tile_img = np.full((64, 64, 3), 255, dtype=np.uint8)
+    assert is_tile_empty(tile_img)
+
+    tile_img[10, 20, 1] = 254
+    assert not is_tile_empty(tile_img)
+
+
+def test_is_tile_empty_nodata():
+    nodata_values = np.array([0, 0, 0])
+    rng = np.random.default_rng(0)
+    tile_img = rng.integers(1, 255, (64, 64, 3), dtype=np.uint8)
+    assert not is_tile_empty(tile_img, nodata_values)
+
+    tile_img[:, :32, 0] = 0  # pixel is nodata if any of its channels is nodata
+    tile_img[:, 32:, 2] = 0
+    assert is_tile_empty(tile_img, nodata_values)
+
+    tile_img[5, 40, 2] = 7
+    assert not is_tile_empty(tile_img, nodata_values)
+
+
+def test_is_tile_empty_nan_nodata_not_matching():
+    nodata_values = np.array([np.nan, np.nan])
+    tile_img = np.full((16, 16, 2), np.nan, dtype=np.float32)
+    tile_img[0, 0, :] = 1.0
+    # NaN is never equal to the nodata value, and min/max are NaN for the whole channel
+    assert not is_tile_empty(tile_img, nodata_values)
+
+
+def test_is_tile_empty_partly_nodata():
+    nodata_values = np.array([0, 0, 0])
+    rng = np.random.default_rng(0)
+    tile_img = rng.integers(1, 255, (64, 64, 3), dtype=np.uint8)
+    tile_img[:48, :, 1] = 0  # 75% of the tile is nodata
+    assert not is_tile_empty(tile_img, nodata_values)
+    assert not is_tile_empty(tile_img, nodata_values, min_valid_pixels_fraction=0.25)
+    assert is_tile_empty(tile_img, nodata_values, min_valid_pixels_fraction=0.3)
+
+    # without nodata value, only a uniform tile is empty
+    assert not is_tile_empty(tile_img, None, min_valid_pixels_fraction=0.3)
+
+
+if __name__ == '__main__':
+    test_is_tile_empty_uniform_tile()
+    test_is_tile_empty_nodata()
+    test_is_tile_empty_nan_nodata_not_matching()
+    test_is_tile_empty_partly_nodata()
+    print('Done')
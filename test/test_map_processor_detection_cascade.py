@@ -0,0 +1,95 @@
+import os
+from pathlib import Path
+from test.test_utils import create_default_input_channels_mapping_for_rgb_bands, create_rlayer_from_file, init_qgis
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.common.processing_parameters.detection_parameters import DetectionParameters
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.processing.map_processor.map_processor_detection import MapProcessorDetection
+from deepness.processing.models.detector import Detector
+
+HOME_DIR = Path(__file__).resolve().parents[1]
+EXAMPLE_DATA_DIR = os.path.join(HOME_DIR, 'examples', 'yolov7_planes_detection_google_earth')
+
+MODEL_FILE_PATH = os.path.join(EXAMPLE_DATA_DIR, 'model_yolov7_tiny_planes_256_1c.onnx')
+RASTER_FILE_PATH = os.path.join(EXAMPLE_DATA_DIR, 'google_earth_planes_lawica.png')
+
+INPUT_CHANNELS_MAPPING = create_default_input_channels_mapping_for_rgb_bands()
+
+
+def test_is_tile_intersecting_regions():
+    tile_params = MagicMock()
+    tile_params.start_pixel_x = 100
+    tile_params.start_pixel_y = 200
+    tile_params.params.tile_size_px = 50
+
+    assert not MapProcessorDetection.is_tile_intersecting_regions(tile_params, np.zeros((0, 4)))
+    assert MapProcessorDetection.is_tile_intersecting_regions(tile_params, np.array([[90, 190, 110, 210]]))
+    assert MapProcessorDetection.is_tile_intersecting_regions(tile_params, np.array([[0, 0, 10, 10], [120, 220, 130, 230]]))
+    assert not MapProcessorDetection.is_tile_intersecting_regions(tile_params, np.array([[150, 200, 160, 240]]))
+    assert not MapProcessorDetection.is_tile_intersecting_regions(tile_params, np.array([[100, 0, 140, 200]]))
+
+
+def test_cascade_tile_size_for_model_with_dynamic_input_size():
+    map_processor = MagicMock()
+    map_processor.params.tile_size_px = 640
+    coarse_model = MagicMock()
+
+    coarse_model.get_input_size_in_pixels.return_value = (256, 256)
+    assert MapProcessorDetection._get_cascade_tile_size_px(map_processor, coarse_model) == 256
+
+    coarse_model.get_input_size_in_pixels.return_value = ('height', 'width')
+    coarse_model.get_metadata_tile_size.return_value = 512
+    assert MapProcessorDetection._get_cascade_tile_size_px(map_processor, coarse_model) == 512
+
+    coarse_model.get_metadata_tile_size.return_value = None
+    assert MapProcessorDetection._get_cascade_tile_size_px(map_processor, coarse_model) == 640
+
+
+def test_map_processor_detection_planes_example_cascade():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model_wrapper = Detector(MODEL_FILE_PATH)
+
+    params = DetectionParameters(
+        resolution_cm_per_px=70,
+        tile_size_px=model_wrapper.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=90),
+        model=model_wrapper,
+        confidence=0.5,
+        iou_threshold=0.4,
+        cascade_resolution_cm_per_px=140,
+        cascade_confidence=0.2,
+    )
+
+    map_processor = MapProcessorDetection(
+        rlayer=rlayer,
+        vlayer_mask=None,
+        map_canvas=MagicMock(),
+        params=params,
+    )
+
+    map_processor.run()
+
+    assert len(map_processor.get_all_detections()) == 2  # the same as without the cascade
+
+    total_tiles, skipped_tiles = map_processor.get_cascade_tiles_statistics()
+    assert total_tiles == map_processor.x_bins_number * map_processor.y_bins_number
+    assert 0 <= skipped_tiles < total_tiles
+
+
+if __name__ == '__main__':
+    test_is_tile_intersecting_regions()
+    test_cascade_tile_size_for_model_with_dynamic_input_size()
+    test_map_processor_detection_planes_example_cascade()
+    print('Done')
@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+from test.test_utils import create_default_input_channels_mapping_for_rgb_bands, create_rlayer_from_file, init_qgis
+from unittest.mock import MagicMock
+
+from qgis.core import QgsVectorLayer
+
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.common.processing_parameters.detection_parameters import DetectionOutputFormat, DetectionParameters
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.processing.map_processor.map_processor_detection import MapProcessorDetection
+from deepness.processing.models.detector import Detector
+
+HOME_DIR = Path(__file__).resolve().parents[1]
+EXAMPLE_DATA_DIR = os.path.join(HOME_DIR, 'examples', 'yolov7_planes_detection_google_earth')
+
+MODEL_FILE_PATH = os.path.join(EXAMPLE_DATA_DIR, 'model_yolov7_tiny_planes_256_1c.onnx')
+RASTER_FILE_PATH = os.path.join(EXAMPLE_DATA_DIR, 'google_earth_planes_lawica.png')
+
+INPUT_CHANNELS_MAPPING = create_default_input_channels_mapping_for_rgb_bands()
+
+
+def _run_detection_with_output_format(output_format: DetectionOutputFormat, output_file_path: str):
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model_wrapper = Detector(MODEL_FILE_PATH)
+
+    params = DetectionParameters(
+        resolution_cm_per_px=70,
+        tile_size_px=model_wrapper.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=90),
+        model=model_wrapper,
+        confidence=0.5,
+        iou_threshold=0.4,
+        output_format=output_format,
+        output_file_path=output_file_path,
+    )
+
+    map_processor = MapProcessorDetection(
+        rlayer=rlayer,
+        vlayer_mask=None,
+        map_canvas=MagicMock(),
+        params=params,
+    )
+
+    map_processor.run()
+    return map_processor
+
+
+def test_map_processor_detection_output_geopackage():
+    qgs = init_qgis()
+
+    output_file_path = '/tmp/qgis_test/detections_planes'
+    map_processor = _run_detection_with_output_format(DetectionOutputFormat.GEOPACKAGE, output_file_path)
+
+    assert len(map_processor.get_all_detections()) == 2
+
+    vlayer = QgsVectorLayer(f'{output_file_path}.gpkg', 'detections', 'ogr')  # single class, so a single layer
+    assert vlayer.isValid()
+    assert vlayer.featureCount() == 2
+    assert vlayer.fields().names()[-4:] == ['class_id', 'class_name', 'confidence', 'rotation']
+
+    for feature in vlayer.getFeatures():
+        assert feature['class_id'] == 0
+        assert feature['confidence'] >= 0.5
+
+
+def test_map_processor_detection_output_flatgeobuf():
+    qgs = init_qgis()
+
+    output_file_path = '/tmp/qgis_test/detections_planes'
+    map_processor = _run_detection_with_output_format(DetectionOutputFormat.FLATGEOBUF, output_file_path)
+
+    vlayer = QgsVectorLayer(f'{output_file_path}_0.fgb', 'detections', 'ogr')
+    assert vlayer.isValid()
+    assert vlayer.featureCount() == len(map_processor.get_all_detections())
+
+
+if __name__ == '__main__':
+    test_map_processor_detection_output_geopackage()
+    test_map_processor_detection_output_flatgeobuf()
+    print('Done')
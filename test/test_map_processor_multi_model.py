@@ -0,0 +1,122 @@
+from test.test_utils import (create_default_input_channels_mapping_for_rgba_bands, create_rlayer_from_file,
+                             get_dummy_fotomap_small_path, get_dummy_regression_model_path,
+                             get_dummy_segmentation_model_path, init_qgis)
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.common.processing_parameters.regression_parameters import RegressionParameters
+from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
+from deepness.processing.map_processor.map_processing_result import MapProcessingResultSuccess
+from deepness.processing.map_processor.map_processor_multi_model import MapProcessorMultiModel
+from deepness.processing.map_processor.map_processor_regression import MapProcessorRegression
+from deepness.processing.map_processor.map_processor_segmentation import MapProcessorSegmentation
+from deepness.processing.models.regressor import Regressor
+from deepness.processing.models.segmentor import Segmentor
+
+RASTER_FILE_PATH = get_dummy_fotomap_small_path()
+
+INPUT_CHANNELS_MAPPING = create_default_input_channels_mapping_for_rgba_bands()
+
+
+def _create_segmentation_parameters(rlayer, model: Segmentor) -> SegmentationParameters:
+    return SegmentationParameters(
+        resolution_cm_per_px=3,
+        tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        postprocessing_dilate_erode_size=5,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        pixel_classification__probability_threshold=0.5,
+        model=model,
+    )
+
+
+def _create_regression_parameters(rlayer, model: Regressor) -> RegressionParameters:
+    return RegressionParameters(
+        resolution_cm_per_px=3,
+        tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        output_scaling=1.0,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        model=model,
+    )
+
+
+def test_dummy_models_processing__segmentation_and_regression():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    segmentation_model = Segmentor(get_dummy_segmentation_model_path())
+    regression_model = Regressor(get_dummy_regression_model_path())
+    segmentation_params = _create_segmentation_parameters(rlayer, segmentation_model)
+    regression_params = _create_regression_parameters(rlayer, regression_model)
+
+    multi_model_processor = MapProcessorMultiModel(
+        rlayer=rlayer,
+        vlayer_mask=None,
+        map_canvas=MagicMock(),
+        models_with_params=[(segmentation_model, segmentation_params), (regression_model, regression_params)],
+    )
+    multi_model_processor.run()
+
+    results = multi_model_processor.get_processing_results()
+    assert all(isinstance(result, MapProcessingResultSuccess) for result in results)
+
+    # each tile is read once, for both models
+    segmentation_processor, regression_processor = multi_model_processor.map_processors
+    number_of_tiles = segmentation_processor.x_bins_number * segmentation_processor.y_bins_number
+    assert multi_model_processor.shared_tiles_reader.number_of_tiles_read == number_of_tiles
+
+    # results are the same as in separate runs of the models
+    single_segmentation_processor = MapProcessorSegmentation(
+        rlayer=rlayer, vlayer_mask=None, map_canvas=MagicMock(), params=segmentation_params)
+    single_segmentation_processor.run()
+    single_regression_processor = MapProcessorRegression(
+        rlayer=rlayer, vlayer_mask=None, map_canvas=MagicMock(), params=regression_params)
+    single_regression_processor.run()
+
+    segmentation_result_img = np.asarray(segmentation_processor.get_result_img())
+    assert segmentation_result_img.shape == (1, 561, 829)
+    np.testing.assert_array_equal(segmentation_result_img, np.asarray(single_segmentation_processor.get_result_img()))
+    np.testing.assert_array_equal(np.asarray(regression_processor.get_result_img()),
+                                  np.asarray(single_regression_processor.get_result_img()))
+
+
+def test_incompatible_tiles_grids():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    segmentation_model = Segmentor(get_dummy_segmentation_model_path())
+    regression_model = Regressor(get_dummy_regression_model_path())
+    regression_params = _create_regression_parameters(rlayer, regression_model)
+    regression_params.resolution_cm_per_px = 6
+
+    try:
+        MapProcessorMultiModel(
+            rlayer=rlayer,
+            vlayer_mask=None,
+            map_canvas=MagicMock(),
+            models_with_params=[(segmentation_model, _create_segmentation_parameters(rlayer, segmentation_model)),
+                                (regression_model, regression_params)],
+        )
+        assert False, 'No exception for different resolutions'
+    except Exception as e:
+        assert 'same tiles grid' in str(e)
+
+
+if __name__ == '__main__':
+    test_dummy_models_processing__segmentation_and_regression()
+    test_incompatible_tiles_grids()
+    print('Done')
@@ -1,16 +1,20 @@
+import os
+import tempfile
 from test.test_utils import (create_default_input_channels_mapping_for_rgb_bands, create_rlayer_from_file,
                              get_dummy_fotomap_area_crs3857_path, get_dummy_fotomap_area_path,
                              get_dummy_recognition_image_path, get_dummy_recognition_map_path,
                              get_dummy_recognition_model_path, init_qgis)
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pytest
 from qgis.core import QgsCoordinateReferenceSystem, QgsRectangle
 
 from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
 from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
 from deepness.common.processing_parameters.recognition_parameters import RecognitionParameters
+from deepness.processing.map_processor.map_processing_result import MapProcessingResultSuccess
 from deepness.processing.map_processor.map_processor_recognition import MapProcessorRecognition
 from deepness.processing.models.recognition import Recognition
 
@@ -68,6 +72,136 @@ def test_dummy_model_processing__entire_file():
     assert len(np.argwhere(result_img == result_img.min())) == 50176
 
 
+def test_dummy_model_processing__reuse_embeddings_index_for_many_queries():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model = Recognition(MODEL_FILE_PATH)
+    embeddings_index_dir = tempfile.mkdtemp()
+
+    def run_recognition(additional_query_image_paths):
+        params = RecognitionParameters(
+            resolution_cm_per_px=50,
+            tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+            batch_size=2,
+            local_cache=False,
+            processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+            mask_layer_id=None,
+            input_layer_id=rlayer.id(),
+            # a new channels mapping for each run (as in separate QGIS sessions), the index key needs to be the same
+            input_channels_mapping=create_default_input_channels_mapping_for_rgb_bands(),
+            processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=0),
+            model=model,
+            query_image_path=IMAGE_FILE_PATH,
+            additional_query_image_paths=additional_query_image_paths,
+            embeddings_index_dir=embeddings_index_dir,
+        )
+
+        map_processor = MapProcessorRecognition(
+            rlayer=rlayer,
+            vlayer_mask=None,
+            map_canvas=MagicMock(),
+            params=params,
+        )
+
+        map_processor.run()
+        return map_processor
+
+    first_map_processor = run_recognition(additional_query_image_paths=[])
+    assert len(os.listdir(embeddings_index_dir)) == 1  # index created
+
+    # second run uses the index, without running the model on tiles
+    with patch.object(MapProcessorRecognition, '_process_tile', side_effect=AssertionError('Tiles should not be processed')):
+        second_map_processor = run_recognition(additional_query_image_paths=[IMAGE_FILE_PATH])
+
+    result_imgs = second_map_processor.get_all_result_imgs()
+    assert len(result_imgs) == 2
+    assert np.allclose(result_imgs[0], first_map_processor.get_result_img())
+    assert np.allclose(result_imgs[1], first_map_processor.get_result_img())
+
+
+def test_dummy_model_processing__top_k():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model = Recognition(MODEL_FILE_PATH)
+
+    params = RecognitionParameters(
+        resolution_cm_per_px=50,
+        tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=2,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=0),
+        model=model,
+        query_image_path=IMAGE_FILE_PATH,
+        top_k=3,
+    )
+
+    map_processor = MapProcessorRecognition(
+        rlayer=rlayer,
+        vlayer_mask=None,
+        map_canvas=MagicMock(),
+        params=params,
+    )
+
+    map_processor.run()
+
+    matches = map_processor.get_top_k_matches()[0]
+    assert len(matches) == 3
+    scores = [score for _, _, score in matches]
+    assert scores == sorted(scores, reverse=True)
+    assert np.isclose(scores[0], 1.0, atol=1e-6)
+
+    # heatmap is not created in the top-k mode, unless requested
+    with pytest.raises(Exception):
+        map_processor.get_result_img()
+
+
+def test_dummy_model_processing__no_tiles_within_mask():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model = Recognition(MODEL_FILE_PATH)
+
+    params = RecognitionParameters(
+        resolution_cm_per_px=50,
+        tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=2,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=0),
+        model=model,
+        query_image_path=IMAGE_FILE_PATH,
+        top_k=3,
+        embeddings_index_dir=tempfile.mkdtemp(),
+    )
+
+    map_processor = MapProcessorRecognition(
+        rlayer=rlayer,
+        vlayer_mask=None,
+        map_canvas=MagicMock(),
+        params=params,
+    )
+    # mask of the processed area not covering any tile
+    map_processor.area_mask_img = np.zeros((map_processor.img_size_y_pixels, map_processor.img_size_x_pixels), dtype=np.uint8)
+
+    map_processor.run()
+
+    result = map_processor.get_processing_result()
+    assert isinstance(result, MapProcessingResultSuccess)
+    assert 'no tiles to process' in result.message
+
+
 if __name__ == '__main__':
     test_dummy_model_processing__entire_file()
+    test_dummy_model_processing__reuse_embeddings_index_for_many_queries()
+    test_dummy_model_processing__top_k()
+    test_dummy_model_processing__no_tiles_within_mask()
     print('Done')
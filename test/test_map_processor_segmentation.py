@@ -1,6 +1,7 @@
 from test.test_utils import (create_default_input_channels_mapping_for_rgba_bands, create_rlayer_from_file,
                              create_vlayer_from_file, get_dummy_fotomap_area_crs3857_path, get_dummy_fotomap_area_path,
                              get_dummy_fotomap_small_path, get_dummy_segmentation_model_path, init_qgis)
+import tempfile
 from unittest.mock import MagicMock
 
 import matplotlib.pyplot as plt
@@ -11,6 +12,7 @@ from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOver
 from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
 from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
 from deepness.processing.map_processor.map_processor_segmentation import MapProcessorSegmentation
+from deepness.processing.map_processor.utils.tiles_results_cache import TILES_RESULTS_CACHE
 from deepness.processing.models.segmentor import Segmentor
 
 RASTER_FILE_PATH = get_dummy_fotomap_small_path()
@@ -27,13 +29,13 @@ PROCESSED_EXTENT_1 = QgsRectangle(  # big part of the fotomap
     638840.370, 5802593.197,
     638857.695, 5802601.792)
 
-def model_process_mock_one_channel(x):
+def model_process_mock_one_channel(x, processing_stats=None):
     x = x[:, :, :, 0:1]
     x = np.transpose(x, (0, 3, 1, 2))
 
     return x
 
-def model_process_mock_two_channels(x):    
+def model_process_mock_two_channels(x, processing_stats=None):
     return [model_process_mock_one_channel(x), model_process_mock_one_channel(x)]
 
 
@@ -370,8 +372,96 @@ def test_generic_processing_test__specified_extent_from_active_map_extent_two_ch
     # just run - we will check the results in a more detailed test
     map_processor.run()
 
+def test_dummy_model_processing__incremental():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model = Segmentor(MODEL_FILE_PATH)
+
+    with tempfile.TemporaryDirectory() as incremental_dir_path:
+        params = SegmentationParameters(
+            resolution_cm_per_px=3,
+            tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+            batch_size=1,
+            local_cache=False,
+            processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+            mask_layer_id=None,
+            input_layer_id=rlayer.id(),
+            input_channels_mapping=INPUT_CHANNELS_MAPPING,
+            postprocessing_dilate_erode_size=5,
+            processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+            pixel_classification__probability_threshold=0.5,
+            model=model,
+            incremental_dir_path=incremental_dir_path,
+        )
+
+        result_imgs = []
+        number_of_processed_batches = []
+        for _ in range(2):
+            model.process = MagicMock(side_effect=Segmentor.process.__get__(model))
+            map_processor = MapProcessorSegmentation(
+                rlayer=rlayer,
+                vlayer_mask=None,
+                map_canvas=MagicMock(),
+                params=params,
+            )
+            map_processor.run()
+            result_imgs.append(np.array(map_processor.get_result_img()))
+            number_of_processed_batches.append(model.process.call_count)
+
+        assert number_of_processed_batches[0] > 0
+        assert number_of_processed_batches[1] == 0  # input did not change
+        assert np.array_equal(result_imgs[0], result_imgs[1])
+
+def test_dummy_model_processing__visible_part_with_tiles_cache():
+    qgs = init_qgis()
+    TILES_RESULTS_CACHE.clear()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    model = Segmentor(MODEL_FILE_PATH)
+
+    params = SegmentationParameters(
+        resolution_cm_per_px=3,
+        tile_size_px=model.get_input_size_in_pixels()[0],  # same x and y dimensions, so take x
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.VISIBLE_PART,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=INPUT_CHANNELS_MAPPING,
+        postprocessing_dilate_erode_size=5,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        pixel_classification__probability_threshold=0.5,
+        model=model,
+        tiles_cache_size_mb=64,
+    )
+
+    # the second visible extent is within the first one, so all its tiles are already in the cache
+    visible_extents = [PROCESSED_EXTENT_1, QgsRectangle(638843.0, 5802595.0, 638855.0, 5802600.0)]
+    number_of_processed_batches = []
+    for visible_extent in visible_extents:
+        model.process = MagicMock(side_effect=Segmentor.process.__get__(model))
+        map_canvas = MagicMock()
+        map_canvas.extent = lambda: visible_extent
+        map_canvas.mapSettings().destinationCrs = lambda: QgsCoordinateReferenceSystem("EPSG:32633")
+
+        map_processor = MapProcessorSegmentation(
+            rlayer=rlayer,
+            vlayer_mask=None,
+            map_canvas=map_canvas,
+            params=params,
+        )
+        map_processor.run()
+        number_of_processed_batches.append(model.process.call_count)
+
+    assert number_of_processed_batches[0] > 0
+    assert number_of_processed_batches[1] == 0
+    assert len(TILES_RESULTS_CACHE) == number_of_processed_batches[0]
+
 if __name__ == '__main__':
     # test_dummy_model_processing__entire_file()
+    test_dummy_model_processing__incremental()
+    test_dummy_model_processing__visible_part_with_tiles_cache()
     test_generic_processing_test__specified_extent_from_vlayer_one_channel()
     test_generic_processing_test__specified_extent_from_vlayer_two_channels()
     test_generic_processing_test__specified_extent_from_vlayer_crs3857_one_channel()
@@ -73,7 +73,52 @@ def test_export_dummy_fotomap():
         # print(np.sum(mask < 128), np.sum(mask >= 128))
 
 
+def test_export_dummy_fotomap_with_min_labelled_fraction():
+    qgs = init_qgis()
+
+    rlayer = create_rlayer_from_file(RASTER_FILE_PATH)
+    vlayer = create_vlayer_from_file(get_dummy_fotomap_area_path())
+
+    params = TrainingDataExportParameters(
+        export_image_tiles=True,
+        resolution_cm_per_px=3,
+        batch_size=1,
+        local_cache=False,
+        segmentation_mask_layer_id=vlayer.id(),
+        output_directory_path='/tmp/qgis_test',
+        tile_size_px=512,  # same x and y dimensions, so take x
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id=rlayer.id(),
+        input_channels_mapping=create_default_input_channels_mapping_for_rgba_bands(),
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        min_labelled_fraction=0.2,
+        skip_empty_tiles=True,
+    )
+
+    map_processor = MapProcessorTrainingDataExport(
+        rlayer=rlayer,
+        vlayer_mask=vlayer,  # layer with masks
+        map_canvas=MagicMock(),
+        params=params,
+    )
+
+    map_processor.run()
+
+    images_results = sorted(glob(os.path.join(map_processor.output_dir_path, '*_img_*.png')))
+    masks_results = sorted(glob(os.path.join(map_processor.output_dir_path, '*_mask_*.png')))
+
+    # only tiles with about 50% of labelled pixels are exported, tiles with less than 20% are skipped
+    assert len(images_results) == 2
+    assert len(masks_results) == 2
+
+    for mask_file in masks_results:
+        mask = cv2.imread(mask_file, cv2.IMREAD_UNCHANGED)
+        assert np.sum(mask >= 128) / mask.size >= 0.2
+
+
 if __name__ == '__main__':
     # test_export_google_earth()
     test_export_dummy_fotomap()
+    test_export_dummy_fotomap_with_min_labelled_fraction()
     print('Done')
@@ -0,0 +1,71 @@
+from deepness.processing.memory_budget import MemoryItem, StorageType, get_memory_budget_bytes, plan_memory_usage
+
+MB = 1024**2
+
+
+def _create_memory_items():
+    return [
+        MemoryItem('result image', 600 * MB, can_be_memmapped=True),
+        MemoryItem('area mask', 200 * MB, can_be_memmapped=True),
+        MemoryItem('tiles batch', 50 * MB, can_be_memmapped=False),
+    ]
+
+
+def test_plan_memory_usage_in_memory():
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=1000 * MB, free_disk_bytes=None)
+
+    assert memory_plan.storage_type == StorageType.IN_MEMORY
+    assert memory_plan.is_feasible()
+    assert memory_plan.get_peak_memory_bytes() == 850 * MB
+    assert memory_plan.get_memmapped_bytes() == 0
+    assert not memory_plan.is_memmap_chosen_automatically()
+
+    # without a known budget everything is kept in memory
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=None, free_disk_bytes=None)
+    assert memory_plan.storage_type == StorageType.IN_MEMORY
+    assert memory_plan.is_feasible()
+
+
+def test_plan_memory_usage_memmap():
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=500 * MB, free_disk_bytes=10000 * MB)
+
+    assert memory_plan.storage_type == StorageType.MEMMAP
+    assert memory_plan.is_feasible()
+    assert memory_plan.get_peak_memory_bytes() == 50 * MB
+    assert memory_plan.get_memmapped_bytes() == 800 * MB
+    assert memory_plan.is_memmap_chosen_automatically()
+    assert 'stored on disk' in memory_plan.create_message()
+
+    # selected by the user (local cache), even if it would fit in memory
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=1000 * MB, free_disk_bytes=None,
+                                    force_memmap=True)
+    assert memory_plan.storage_type == StorageType.MEMMAP
+    assert not memory_plan.is_memmap_chosen_automatically()
+
+
+def test_plan_memory_usage_not_feasible():
+    # not in the memory budget, even with large images on disk
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=40 * MB, free_disk_bytes=None)
+    assert memory_plan.storage_type == StorageType.MEMMAP
+    assert not memory_plan.is_feasible()
+    message = memory_plan.create_message()
+    assert 'more than the memory budget' in message
+    assert message.index('result image') < message.index('area mask')  # largest first
+
+    # not enough disk space for memory-mapped files
+    memory_plan = plan_memory_usage(_create_memory_items(), budget_bytes=500 * MB, free_disk_bytes=100 * MB)
+    assert not memory_plan.is_feasible()
+    assert 'disk space' in memory_plan.create_message()
+
+
+def test_get_memory_budget_bytes():
+    budget_bytes = get_memory_budget_bytes()
+    assert budget_bytes is None or budget_bytes > 0
+
+
+if __name__ == '__main__':
+    test_plan_memory_usage_in_memory()
+    test_plan_memory_usage_memmap()
+    test_plan_memory_usage_not_feasible()
+    test_get_memory_budget_bytes()
+    print('Done')
@@ -0,0 +1,71 @@
+from test.test_utils import create_tile_params
+import os
+import tempfile
+
+from deepness.processing.map_processor.utils.processing_checkpoint import ProcessingCheckpoint
+
+
+def test_processing_checkpoint_resume():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        checkpoint_dir_path = os.path.join(tmp_dir_path, 'checkpoint')
+        checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=3, y_bins_number=2)
+        assert not checkpoint.is_resumed
+
+        flushed = []
+        checkpoint.mark_tiles_completed([create_tile_params(0, 0, 3, 2), create_tile_params(1, 0, 3, 2)])
+        checkpoint.mark_tiles_completed([create_tile_params(2, 0, 3, 2)])
+        checkpoint.save(flush_results=lambda: flushed.append(True))
+        assert flushed == [True]
+
+        resumed_checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=3, y_bins_number=2)
+        assert resumed_checkpoint.is_resumed
+        assert resumed_checkpoint.get_number_of_completed_tiles() == 3
+        assert not resumed_checkpoint.is_tile_to_process(create_tile_params(2, 0, 3, 2))
+        assert resumed_checkpoint.is_tile_to_process(create_tile_params(0, 1, 3, 2))
+        assert resumed_checkpoint.is_tile_number_completed(2)
+        assert not resumed_checkpoint.is_tile_number_completed(3)
+
+
+def test_processing_checkpoint_not_saved_tiles_are_processed_again():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        checkpoint_dir_path = os.path.join(tmp_dir_path, 'checkpoint')
+        checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=2, y_bins_number=2)
+        checkpoint.mark_tiles_completed([create_tile_params(0, 0, 2, 2)])
+        checkpoint.save()
+        checkpoint.mark_tiles_completed([create_tile_params(1, 0, 2, 2)])  # checkpoint interval did not pass
+
+        resumed_checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=2, y_bins_number=2)
+        assert resumed_checkpoint.get_number_of_completed_tiles() == 1
+        assert resumed_checkpoint.is_tile_to_process(create_tile_params(1, 0, 2, 2))
+
+
+def test_processing_checkpoint_fresh_start():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        checkpoint_dir_path = os.path.join(tmp_dir_path, 'checkpoint')
+        checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=2, y_bins_number=2)
+        checkpoint.mark_tiles_completed([create_tile_params(0, 0, 2, 2)])
+        checkpoint.save()
+        with open(checkpoint.get_file_path('results.dat'), 'wb') as f:
+            f.write(b'partial results')
+
+        # different tiles plan - results of the previous checkpoint are not usable
+        checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=3, y_bins_number=2)
+        assert not checkpoint.is_resumed
+        assert checkpoint.get_number_of_completed_tiles() == 0
+        assert not os.path.exists(checkpoint.get_file_path('results.dat'))
+
+        checkpoint.mark_tiles_completed([create_tile_params(0, 0, 3, 2)])
+        checkpoint.save()
+        checkpoint.invalidate()
+        checkpoint = ProcessingCheckpoint(checkpoint_dir_path, x_bins_number=3, y_bins_number=2)
+        assert not checkpoint.is_resumed
+
+        checkpoint.remove()
+        assert not os.path.exists(checkpoint_dir_path)
+
+
+if __name__ == '__main__':
+    test_processing_checkpoint_resume()
+    test_processing_checkpoint_not_saved_tiles_are_processed_again()
+    test_processing_checkpoint_fresh_start()
+    print('Done')
@@ -0,0 +1,125 @@
+from test.test_utils import init_qgis
+from unittest.mock import MagicMock
+
+from deepness.processing.map_processor.map_processing_result import (MapProcessingResultCanceled,
+                                                                     MapProcessingResultSuccess)
+from deepness.processing.processing_scheduler import ProcessingJobStatus, ProcessingScheduler
+
+
+def _create_map_processor_mock(model=None, confidence=0.5):
+    map_processor = MagicMock()
+    map_processor.model = model
+    map_processor.params.cascade_model = None
+    map_processor.params.confidence = confidence
+    map_processor.get_processing_result.return_value = MapProcessingResultSuccess('')
+    return map_processor
+
+
+def _finish(map_processor):
+    """ Call the callback connected by the scheduler, as if the task finished """
+    finished_callback = map_processor.finished_signal.connect.call_args[0][0]
+    finished_callback(map_processor.get_processing_result())
+
+
+def test_processing_scheduler_concurrency_limit():
+    init_qgis()
+    task_manager = MagicMock()
+    scheduler = ProcessingScheduler(max_running_jobs=2, task_manager=task_manager)
+
+    map_processors = [_create_map_processor_mock() for _ in range(3)]
+    jobs = [scheduler.add_job(map_processor, name=f'job {i}') for i, map_processor in enumerate(map_processors)]
+
+    assert task_manager.addTask.call_count == 2
+    assert [job.status for job in jobs] == [ProcessingJobStatus.RUNNING] * 2 + [ProcessingJobStatus.QUEUED]
+
+    _finish(map_processors[0])
+    assert task_manager.addTask.call_count == 3
+    assert task_manager.addTask.call_args[0][0] is map_processors[2]
+    assert [job.status for job in jobs] == [ProcessingJobStatus.FINISHED] + [ProcessingJobStatus.RUNNING] * 2
+
+    scheduler.clear_done_jobs()
+    assert scheduler.get_jobs() == jobs[1:]
+
+
+def test_processing_scheduler_cancel_queued_job():
+    init_qgis()
+    task_manager = MagicMock()
+    scheduler = ProcessingScheduler(max_running_jobs=1, task_manager=task_manager)
+
+    running_job = scheduler.add_job(_create_map_processor_mock(), name='running')
+    queued_job = scheduler.add_job(_create_map_processor_mock(), name='queued')
+
+    scheduler.cancel_job(queued_job.job_id)
+    assert queued_job.status == ProcessingJobStatus.CANCELED
+    emitted_result = queued_job.map_processor.finished_signal.emit.call_args[0][0]
+    assert isinstance(emitted_result, MapProcessingResultCanceled)
+
+    scheduler.cancel_job(running_job.job_id)
+    running_job.map_processor.cancel.assert_called_once()
+
+    _finish(running_job.map_processor)
+    assert task_manager.addTask.call_count == 1  # canceled job is not started
+
+
+def test_processing_scheduler_cpu_threads_budget():
+    init_qgis()
+    task_manager = MagicMock()
+    scheduler = ProcessingScheduler(max_running_jobs=3, cpu_threads_budget=8, task_manager=task_manager)
+    assert scheduler.get_threads_per_job() == 2
+
+    model = MagicMock()
+    first_job = scheduler.add_job(_create_map_processor_mock(model), name='first')
+    assert first_job.number_of_threads == 2
+    first_job.map_processor.set_number_of_threads.assert_called_once_with(2)
+    model.set_number_of_threads.assert_not_called()  # the session is recreated when the task starts, not in the GUI thread
+
+    # the same model is used by a running job - the job waits for it
+    second_job = scheduler.add_job(_create_map_processor_mock(model), name='second')
+    assert second_job.status == ProcessingJobStatus.QUEUED
+    second_job.map_processor.set_number_of_threads.assert_not_called()
+
+    scheduler.set_limits(max_running_jobs=16, cpu_threads_budget=8)
+    assert scheduler.get_threads_per_job() == 1
+
+    scheduler.set_limits(max_running_jobs=1, cpu_threads_budget=None)
+    assert scheduler.get_threads_per_job() is None
+
+
+def test_processing_scheduler_jobs_sharing_model():
+    init_qgis()
+    model = MagicMock()
+
+    def start_task(map_processor):
+        # as in `MapProcessorDetection._run` - inference parameters are set when the task starts
+        map_processor.model.set_inference_params(confidence=map_processor.params.confidence)
+
+    task_manager = MagicMock()
+    task_manager.addTask.side_effect = start_task
+    scheduler = ProcessingScheduler(max_running_jobs=2, task_manager=task_manager)
+
+    first_map_processor = _create_map_processor_mock(model, confidence=0.3)
+    second_map_processor = _create_map_processor_mock(model, confidence=0.7)
+    other_map_processor = _create_map_processor_mock(MagicMock())
+    first_job = scheduler.add_job(first_map_processor, name='first')
+    second_job = scheduler.add_job(second_map_processor, name='second')
+    other_job = scheduler.add_job(other_map_processor, name='other')
+
+    # the second job waits for the model, the job with another model is started
+    assert [first_job.status, second_job.status, other_job.status] == \
+        [ProcessingJobStatus.RUNNING, ProcessingJobStatus.QUEUED, ProcessingJobStatus.RUNNING]
+    model.set_inference_params.assert_called_once_with(confidence=0.3)
+
+    _finish(other_map_processor)
+    assert second_job.status == ProcessingJobStatus.QUEUED
+
+    _finish(first_map_processor)
+    assert second_job.status == ProcessingJobStatus.RUNNING
+    model.set_inference_params.assert_called_with(confidence=0.7)
+
+
+if __name__ == '__main__':
+    test_processing_scheduler_concurrency_limit()
+    test_processing_scheduler_cancel_queued_job()
+    test_processing_scheduler_cpu_threads_budget()
+    test_processing_scheduler_jobs_sharing_model()
+    print('Done')
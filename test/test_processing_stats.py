@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from deepness.processing.processing_stats import ProcessingStage, ProcessingStats, get_peak_rss_bytes, measure_stage
+
+
+def test_processing_stats_measure():
+    stats = ProcessingStats()
+    stats.start()
+
+    for _ in range(3):
+        with stats.measure(ProcessingStage.TILE_READ):
+            time.sleep(0.01)
+        stats.add_tile_read(np.zeros((4, 4, 3), dtype=np.uint8))
+    with measure_stage(stats, ProcessingStage.INFERENCE):
+        time.sleep(0.02)
+    with measure_stage(None, ProcessingStage.INFERENCE):  # not measured
+        pass
+
+    stats.finish()
+
+    assert stats.get_stage_time_s(ProcessingStage.TILE_READ) >= 0.03
+    assert stats.get_stage_time_s(ProcessingStage.INFERENCE) >= 0.02
+    assert stats.get_stage_time_s(ProcessingStage.STITCHING) == 0.0
+    assert stats.total_time_s >= 0.05
+    assert stats.number_of_tiles_read == 3
+    assert stats.bytes_read == 3 * 4 * 4 * 3
+    assert 0 < stats.get_tiles_per_second() <= 3 / 0.05
+
+    stats_dict = stats.to_dict(batch_size=2)
+    assert stats_dict['batch_size'] == 2
+    assert stats_dict['stages'][ProcessingStage.TILE_READ]['calls'] == 3
+    assert stats_dict['stages'][ProcessingStage.INFERENCE]['calls'] == 1
+
+    message = stats.create_summary_message()
+    assert message.startswith('Processing time:')
+    assert message.index(ProcessingStage.TILE_READ) < message.index(ProcessingStage.INFERENCE)  # slowest first
+
+
+def test_processing_stats_save_json():
+    stats = ProcessingStats()
+    with stats.measure(ProcessingStage.POSTPROCESSING):
+        pass
+    stats.finish()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        file_path = os.path.join(tmp_dir_path, 'stats', 'run.json')
+        stats.save_json(file_path, processor='MapProcessorSegmentation')
+
+        with open(file_path) as f:
+            saved_stats = json.load(f)
+
+    assert saved_stats['processor'] == 'MapProcessorSegmentation'
+    assert saved_stats['number_of_tiles_read'] == 0
+    assert ProcessingStage.POSTPROCESSING in saved_stats['stages']
+    assert get_peak_rss_bytes() is None or saved_stats['peak_rss_bytes'] > 0
+
+
+if __name__ == '__main__':
+    test_processing_stats_measure()
+    test_processing_stats_save_json()
+    print('Done')
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from deepness.processing.raster_mosaic import build_mosaic_vrt
+
+
+def _create_raster(file_path: str, x_start: float, with_crs: bool = True):
+    dataset = gdal.GetDriverByName('GTiff').Create(file_path, 10, 10, 3, gdal.GDT_Byte)
+    dataset.SetGeoTransform([x_start, 1, 0, 100, 0, -1])
+    if with_crs:
+        dataset.SetProjection('EPSG:32633')
+    for i in range(3):
+        dataset.GetRasterBand(i + 1).WriteArray(np.full((10, 10), 255, dtype=np.uint8))
+    dataset.FlushCache()
+    dataset = None  # closes the file
+
+
+def test_build_mosaic_vrt():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        raster_file_paths = [os.path.join(tmp_dir_path, 'a.tif'), os.path.join(tmp_dir_path, 'b.tif')]
+        _create_raster(raster_file_paths[0], x_start=0)
+        _create_raster(raster_file_paths[1], x_start=30)  # with a gap of 20 units
+
+        footprints = build_mosaic_vrt(raster_file_paths, os.path.join(tmp_dir_path, 'mosaic.vrt'))
+        assert footprints == [(0, 90, 10, 100), (30, 90, 40, 100)]
+
+        vrt_dataset = gdal.Open(os.path.join(tmp_dir_path, 'mosaic.vrt'))
+        assert (vrt_dataset.RasterXSize, vrt_dataset.RasterYSize) == (40, 10)
+        img = vrt_dataset.GetRasterBand(1).ReadAsArray()
+        assert (img[:, :10] == 255).all() and (img[:, 10:30] == 0).all() and (img[:, 30:] == 255).all()
+
+
+def test_build_mosaic_vrt_raster_without_crs():
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        raster_file_paths = [os.path.join(tmp_dir_path, 'a.tif'), os.path.join(tmp_dir_path, 'b.tif')]
+        _create_raster(raster_file_paths[0], x_start=0)
+        _create_raster(raster_file_paths[1], x_start=30, with_crs=False)
+
+        with pytest.raises(Exception, match='has no CRS'):
+            build_mosaic_vrt(raster_file_paths, os.path.join(tmp_dir_path, 'mosaic.vrt'))
+
+
+if __name__ == '__main__':
+    test_build_mosaic_vrt()
+    test_build_mosaic_vrt_raster_without_crs()
+    print('Done')
@@ -0,0 +1,71 @@
+import tempfile
+
+import numpy as np
+
+from deepness.common.processing_parameters.detection_parameters import DetectorType
+from deepness.processing.map_processor.utils.raw_outputs_store import RawOutputsStore
+from deepness.processing.models.detector import Detector
+
+
+def test_raw_outputs_store_complete_only_after_finish():
+    rng = np.random.default_rng(0)
+    tiles_outputs = {tile_number: [rng.random((2, 8, 8)).astype(np.float16)] for tile_number in [0, 1, 5]}
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        store = RawOutputsStore(tmp_dir_path)
+        assert not store.is_complete()
+
+        store.create()
+        for tile_number, outputs in tiles_outputs.items():
+            store.add_tile(tile_number, outputs)
+        store.close()  # interrupted
+        assert not RawOutputsStore(tmp_dir_path).is_complete()
+
+        store.create()
+        for tile_number, outputs in tiles_outputs.items():
+            store.add_tile(tile_number, outputs)
+        store.finish(min_confidence=0.1)
+
+        store = RawOutputsStore(tmp_dir_path)
+        assert store.is_complete()
+        assert store.get_metadata()['min_confidence'] == 0.1
+        assert store.get_number_of_tiles() == 3
+
+        stored_tiles = list(store.iterate_tiles())
+        assert [tile_number for tile_number, _ in stored_tiles] == [0, 1, 5]
+        for tile_number, outputs in stored_tiles:
+            assert np.array_equal(outputs[0], tiles_outputs[tile_number][0])
+
+        store.remove()
+        assert not store.is_complete()
+
+
+def test_detector_compact_raw_output_same_detections():
+    detector = Detector.__new__(Detector)  # postprocessing does not need the model itself
+    detector.set_model_type_param(DetectorType.YOLO_v5_v7_DEFAULT)
+
+    rng = np.random.default_rng(0)
+    number_of_candidates = 1000
+    xywh = np.concatenate([rng.uniform(50, 200, (number_of_candidates, 2)), rng.uniform(5, 30, (number_of_candidates, 2))], axis=1)
+    model_output = np.concatenate([
+        xywh,
+        rng.random((number_of_candidates, 1)) ** 4,  # most candidates with low confidence
+        rng.random((number_of_candidates, 3)),
+    ], axis=1).astype(np.float32)
+
+    compacted_output = detector.compact_raw_output([model_output], min_confidence=0.2)
+    assert 0 < compacted_output[0].shape[0] < number_of_candidates / 2
+
+    for confidence in [0.2, 0.5]:
+        detector.set_inference_params(confidence=confidence, iou_threshold=0.4)
+        detections = detector.postprocessing([model_output[np.newaxis]])[0]
+        detections_from_compacted = detector.postprocessing([compacted_output[0][np.newaxis]])[0]
+        assert len(detections) > 0
+        assert [list(d.get_bbox_xyxy()) for d in detections] == [list(d.get_bbox_xyxy()) for d in detections_from_compacted]
+        assert [d.conf for d in detections] == [d.conf for d in detections_from_compacted]
+
+
+if __name__ == '__main__':
+    test_raw_outputs_store_complete_only_after_finish()
+    test_detector_compact_raw_output_same_detections()
+    print('Done')
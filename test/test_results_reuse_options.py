@@ -0,0 +1,68 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.common.processing_parameters.detection_parameters import DetectionParameters
+from deepness.common.processing_parameters.map_processing_parameters import ProcessedAreaType
+from deepness.common.processing_parameters.segmentation_parameters import SegmentationParameters
+
+
+def _create_segmentation_parameters(**kwargs) -> SegmentationParameters:
+    return SegmentationParameters(
+        resolution_cm_per_px=3,
+        tile_size_px=512,
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id='layer',
+        input_channels_mapping=MagicMock(),
+        postprocessing_dilate_erode_size=5,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        pixel_classification__probability_threshold=0.5,
+        model=MagicMock(),
+        **kwargs,
+    )
+
+
+def _create_detection_parameters(**kwargs) -> DetectionParameters:
+    return DetectionParameters(
+        resolution_cm_per_px=3,
+        tile_size_px=512,
+        batch_size=1,
+        local_cache=False,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        mask_layer_id=None,
+        input_layer_id='layer',
+        input_channels_mapping=MagicMock(),
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=20),
+        model=MagicMock(),
+        confidence=0.5,
+        iou_threshold=0.4,
+        **kwargs,
+    )
+
+
+def test_single_results_reuse_option():
+    _create_segmentation_parameters(checkpoint_dir_path='/tmp/checkpoints', skip_empty_tiles=True)
+    _create_segmentation_parameters(tiles_cache_size_mb=64)
+    _create_detection_parameters(incremental_dir_path='/tmp/incremental', cascade_resolution_cm_per_px=12)
+    _create_detection_parameters(raw_outputs_dir_path='/tmp/raw_outputs')
+
+
+def test_conflicting_results_reuse_options():
+    with pytest.raises(Exception, match='checkpoints, incremental processing cannot be used together'):
+        _create_segmentation_parameters(checkpoint_dir_path='/tmp/checkpoints', incremental_dir_path='/tmp/incremental')
+
+    with pytest.raises(Exception, match='tiles results cache, raw outputs store cannot be used together'):
+        _create_detection_parameters(tiles_cache_size_mb=64, raw_outputs_dir_path='/tmp/raw_outputs')
+
+    with pytest.raises(Exception, match='cascaded detection'):
+        _create_detection_parameters(raw_outputs_dir_path='/tmp/raw_outputs', cascade_resolution_cm_per_px=12)
+
+
+if __name__ == '__main__':
+    test_single_results_reuse_option()
+    test_conflicting_results_reuse_options()
+    print('Done')
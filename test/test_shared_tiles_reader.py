@@ -0,0 +1,89 @@
+from test.test_utils import create_tile_params
+import threading
+
+import numpy as np
+
+from deepness.processing.map_processor.utils.shared_tiles_reader import SharedTilesReader
+
+X_BINS_NUMBER = 5
+Y_BINS_NUMBER = 4
+
+
+def _create_reader(max_tiles_ahead=2):
+    read_tiles = []
+
+    def read_tile_image(tile_params):
+        read_tiles.append((tile_params.x_bin_number, tile_params.y_bin_number))
+        tile_img = np.zeros((4, 4, 3), dtype=np.uint8)
+        tile_img[:, :, 0] = tile_params.x_bin_number
+        tile_img[:, :, 1] = tile_params.y_bin_number
+        tile_img[:, :, 2] = 100
+        return tile_img
+
+    return SharedTilesReader(read_tile_image, max_tiles_ahead=max_tiles_ahead), read_tiles
+
+
+def _iterate_tiles(reader, consumer, is_tile_to_read, received_tiles):
+    """ As `MapProcessor.tiles_generator` """
+    for y_bin_number in range(Y_BINS_NUMBER):
+        for x_bin_number in range(X_BINS_NUMBER):
+            tile_params = create_tile_params(x_bin_number, y_bin_number, X_BINS_NUMBER, Y_BINS_NUMBER)
+            reader.set_position(consumer, tile_params)
+            if not is_tile_to_read(x_bin_number, y_bin_number):
+                continue
+            received_tiles.append(reader.get_tile_image(consumer, tile_params))
+    reader.set_consumer_finished(consumer)
+
+
+def test_tiles_read_once_for_all_consumers():
+    reader, read_tiles = _create_reader()
+    consumers_filters = {
+        'all': lambda x, y: True,
+        'even': lambda x, y: (x + y) % 2 == 0,
+        'first_row': lambda x, y: y == 0,
+    }
+    consumers_channels = {'all': [0, 1, 2], 'even': [2, 0], 'first_row': [1]}
+    received_tiles = {consumer: [] for consumer in consumers_filters}
+    for consumer, channels_indexes in consumers_channels.items():
+        reader.add_consumer(consumer, channels_indexes=channels_indexes)
+
+    threads = [threading.Thread(target=_iterate_tiles, args=(reader, consumer, is_tile_to_read, received_tiles[consumer]))
+               for consumer, is_tile_to_read in consumers_filters.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+    assert sorted(read_tiles) == sorted((x, y) for y in range(Y_BINS_NUMBER) for x in range(X_BINS_NUMBER))
+    assert reader.number_of_tiles_read == X_BINS_NUMBER * Y_BINS_NUMBER
+    assert len(reader._tiles) == 0  # all tiles released
+
+    assert len(received_tiles['all']) == X_BINS_NUMBER * Y_BINS_NUMBER
+    assert len(received_tiles['even']) == X_BINS_NUMBER * Y_BINS_NUMBER // 2
+    assert len(received_tiles['first_row']) == X_BINS_NUMBER
+    assert received_tiles['even'][1].shape == (4, 4, 2)
+    assert received_tiles['even'][1][0, 0].tolist() == [100, 2]  # (x, y) = (2, 0)
+    assert received_tiles['first_row'][3][0, 0].tolist() == [0]
+
+
+def test_finished_consumer_does_not_block_others():
+    reader, read_tiles = _create_reader(max_tiles_ahead=1)
+    reader.add_consumer('failed', channels_indexes=[0])
+    reader.add_consumer('working', channels_indexes=[0])
+
+    reader.set_consumer_finished('failed')  # e.g. processing failed before reading any tile
+    received_tiles = []
+    thread = threading.Thread(target=_iterate_tiles, args=(reader, 'working', lambda x, y: True, received_tiles))
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(received_tiles) == X_BINS_NUMBER * Y_BINS_NUMBER
+    assert len(reader._tiles) == 0  # tiles not kept, as no other consumer needs them
+
+
+if __name__ == '__main__':
+    test_tiles_read_once_for_all_consumers()
+    test_finished_consumer_does_not_block_others()
+    print('Done')
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+
+from deepness.processing.map_processor.utils.sparse_chunked_image import SparseChunkedImage
+
+
+def _create_images(chunk_size_px=16):
+    shape = (2, 100, 90)
+    sparse_img = SparseChunkedImage(shape, np.uint8, chunk_size_px=chunk_size_px)
+    dense_img = np.zeros(shape, dtype=np.uint8)
+
+    rng = np.random.default_rng(0)
+    for y_min, x_min, size in [(3, 5, 20), (60, 60, 25), (70, 2, 10)]:  # separated by at least one chunk
+        values = rng.integers(0, 3, size=(2, size, size), dtype=np.uint8)
+        sparse_img[:, y_min:y_min + size, x_min:x_min + size] = values
+        dense_img[:, y_min:y_min + size, x_min:x_min + size] = values
+    return sparse_img, dense_img
+
+
+def test_set_and_get():
+    sparse_img, dense_img = _create_images()
+
+    assert sparse_img.get_number_of_chunks() < (100 // 16 + 1) * (90 // 16 + 1)
+    np.testing.assert_array_equal(sparse_img.to_dense(), dense_img)
+    np.testing.assert_array_equal(sparse_img[:, 10:80, 1:50], dense_img[:, 10:80, 1:50])
+    np.testing.assert_array_equal(sparse_img[1, 50:, :-3], dense_img[1, 50:, :-3])
+
+    # zeros are not allocated
+    number_of_chunks = sparse_img.get_number_of_chunks()
+    sparse_img[:, 30:50, 30:50] = 0
+    assert sparse_img.get_number_of_chunks() == number_of_chunks
+
+
+def test_crop():
+    sparse_img, dense_img = _create_images()
+
+    cropped_img = sparse_img.crop(7, 9, 80, 70)
+    np.testing.assert_array_equal(cropped_img.to_dense(), dense_img[:, 7:87, 9:79])
+
+    cropped_img[:, 0:5, 0:5] = 7  # shared with the original image
+    assert np.all(sparse_img[:, 7:12, 9:14] == 7)
+
+
+def test_iterate_regions_median_blur():
+    sparse_img, dense_img = _create_images()
+    blur_size = 5
+    for i in range(dense_img.shape[0]):
+        dense_img[i] = cv2.medianBlur(dense_img[i], blur_size)
+
+    regions = list(sparse_img.iterate_regions(margin_px=blur_size // 2))
+    assert len(regions) == 3
+    for region in regions:
+        for i in range(region.img.shape[0]):
+            region.img[i] = cv2.medianBlur(region.img[i], blur_size)
+        sparse_img.set_region(region)
+
+    np.testing.assert_array_equal(sparse_img.to_dense(), dense_img)
+
+
+def test_iterate_chunks_and_count_values():
+    sparse_img, dense_img = _create_images()
+    cropped_img = sparse_img.crop(5, 5, 90, 80)
+    dense_img = dense_img[:, 5:95, 5:85]
+
+    assembled_img = np.zeros_like(dense_img)
+    for y_min, x_min, chunk_img in cropped_img.iterate_chunks():
+        assembled_img[:, y_min:y_min + chunk_img.shape[1], x_min:x_min + chunk_img.shape[2]] = chunk_img
+    np.testing.assert_array_equal(assembled_img, dense_img)
+
+    unique, counts = np.unique(dense_img[1], return_counts=True)
+    assert cropped_img.count_values(1) == dict(zip(unique, counts))
+
+
+if __name__ == '__main__':
+    test_set_and_get()
+    test_crop()
+    test_iterate_regions_median_blur()
+    test_iterate_chunks_and_count_values()
+    print('Done')
@@ -0,0 +1,91 @@
+import os
+import tempfile
+
+import numpy as np
+
+from deepness.common.channels_mapping import ChannelsMapping, ImageChannelStandaloneBand
+from deepness.processing.map_processor.utils.cache_key import create_cache_key
+from deepness.processing.map_processor.utils.tile_embeddings_index import TileEmbeddingsIndex
+
+
+def test_tile_embeddings_index_create_and_query():
+    index_dir = os.path.join(tempfile.mkdtemp(), 'index')
+    embeddings = np.array([
+        [1, 0, 0],
+        [0, 2, 0],
+        [1, 1, 0],
+    ], dtype=np.float32)
+    tiles_xy_bins = [(0, 0), (1, 0), (0, 1)]
+
+    index = TileEmbeddingsIndex(index_dir)
+    assert not index.exists()
+    index.create(number_of_tiles=3, embedding_size=3)
+    index.add_tiles(tiles_xy_bins[:2], embeddings[:2])
+    assert not index.exists()  # not finished yet
+    index.add_tiles(tiles_xy_bins[2:], embeddings[2:])
+    index.finish()
+    assert index.exists()
+
+    loaded_index = TileEmbeddingsIndex(index_dir)
+    loaded_index.load()
+    assert loaded_index.get_tiles_xy_bins().tolist() == [list(xy) for xy in tiles_xy_bins]
+
+    similarities = loaded_index.query(np.array([[3, 0, 0], [0, 0, 1]]))
+    assert similarities.shape == (2, 3)
+    assert np.allclose(similarities[0], [1, 0, 1 / np.sqrt(2)])
+    assert np.allclose(similarities[1], [0, 0, 0])
+
+
+def test_tile_embeddings_index_query_top_k():
+    index_dir = os.path.join(tempfile.mkdtemp(), 'index')
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(1000, 16)).astype(np.float32)
+    tiles_xy_bins = [(i % 40, i // 40) for i in range(1000)]
+
+    index = TileEmbeddingsIndex(index_dir)
+    index.create(number_of_tiles=1000, embedding_size=16)
+    index.add_tiles(tiles_xy_bins, embeddings)
+    index.finish()
+
+    queries = embeddings[[10, 500]] * 3
+    top_k_indices, top_k_similarities = index.query_top_k(queries, k=5)
+    assert top_k_indices.shape == (2, 5)
+    assert top_k_indices[:, 0].tolist() == [10, 500]  # the same embedding is the best match
+    assert np.allclose(top_k_similarities[:, 0], 1)
+
+    similarities = index.query(queries)
+    for indices, query_similarities in zip(top_k_indices, similarities):
+        assert indices.tolist() == np.argsort(-query_similarities)[:5].tolist()
+
+    top_k_indices, _ = index.query_top_k(queries, k=5000)  # more than the number of tiles
+    assert top_k_indices.shape == (2, 1000)
+
+    top_k_indices, top_k_similarities = index.query_top_k(queries, k=0)
+    assert top_k_indices.shape == top_k_similarities.shape == (2, 0)
+
+
+def test_tile_embeddings_index_key():
+    key = create_cache_key(layer_source='a.tif', resolution=0.5)
+    assert key == create_cache_key(resolution=0.5, layer_source='a.tif')
+    assert key != create_cache_key(layer_source='a.tif', resolution=1.0)
+
+
+def test_tile_embeddings_index_key_for_new_channels_mapping():
+    def create_channels_mapping():
+        channels_mapping = ChannelsMapping()
+        channels_mapping.set_image_channels([ImageChannelStandaloneBand(band_number=i + 1, name=name)
+                                             for i, name in enumerate(['red', 'green', 'blue'])])
+        channels_mapping.set_number_of_model_inputs_same_as_image_channels()
+        return channels_mapping
+
+    # e.g. created again in the next QGIS session, so the key cannot depend on the objects identity
+    assert create_cache_key(input_channels_mapping=create_channels_mapping()) \
+        == create_cache_key(input_channels_mapping=create_channels_mapping())
+
+
+if __name__ == '__main__':
+    test_tile_embeddings_index_create_and_query()
+    test_tile_embeddings_index_query_top_k()
+    test_tile_embeddings_index_key()
+    test_tile_embeddings_index_key_for_new_channels_mapping()
+    print('Done')
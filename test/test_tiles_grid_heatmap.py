@@ -0,0 +1,57 @@
+import numpy as np
+
+from deepness.processing.map_processor.utils.tiles_grid_heatmap import TilesGridHeatmap
+
+
+def _create_full_resolution_heatmap(tiles_xy_px, values, tile_size_px, image_shape_yx):
+    """ Reference implementation - accumulating values for each pixel """
+    values_sum = np.zeros(image_shape_yx, np.float32)
+    tiles_count = np.zeros(image_shape_yx, np.int16)
+    for (x, y), value in zip(tiles_xy_px, values):
+        values_sum[y:y + tile_size_px, x:x + tile_size_px] += value
+        tiles_count[y:y + tile_size_px, x:x + tile_size_px] += 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values_sum / tiles_count
+
+
+def test_tiles_grid_heatmap_same_as_full_resolution():
+    rng = np.random.default_rng(0)
+    tile_size_px = 256
+
+    for stride_px in [256, 230, 100]:
+        x_bins_number, y_bins_number = 5, 4
+        image_shape_yx = ((y_bins_number - 1) * stride_px + tile_size_px, (x_bins_number - 1) * stride_px + tile_size_px)
+        tiles_xy_bins = np.array([(x, y) for y in range(y_bins_number) for x in range(x_bins_number) if (x + y) % 5 != 1])
+        tiles_xy_px = tiles_xy_bins * stride_px
+        values = rng.random(len(tiles_xy_px)).astype(np.float32)
+
+        heatmap = TilesGridHeatmap(tiles_xy_px=tiles_xy_px, tile_size_px=tile_size_px, image_shape_yx=image_shape_yx)
+        heatmap.set_tiles_values(values)
+
+        grid_shape = heatmap.get_grid_shape()
+        assert grid_shape[0] <= 2 * y_bins_number and grid_shape[1] <= 2 * x_bins_number
+
+        expected_img = _create_full_resolution_heatmap(tiles_xy_px, values, tile_size_px, image_shape_yx)
+        assert np.array_equal(heatmap.get_full_image(), expected_img, equal_nan=True)
+
+
+def test_tiles_grid_heatmap_tile_outline():
+    heatmap = TilesGridHeatmap(tiles_xy_px=np.array([[0, 0], [10, 0]]), tile_size_px=20, image_shape_yx=(20, 30))
+    heatmap.set_tiles_values(np.array([0.25, 0.5]))
+    heatmap.add_tile_outline(x_px=10, y_px=0, size_px=20)
+
+    img = heatmap.get_full_image()
+    assert img[5, 5] == 0.25
+    assert img[5, 15] == 0.375
+    assert img[5, 25] == 0.5
+    assert np.all(img[0, 10:29] == 1)
+    assert np.all(img[0:19, 10] == 1)
+    assert np.all(img[0:19, 29] == 1)
+    assert np.all(img[19, 10:29] == 1)
+
+
+if __name__ == '__main__':
+    test_tiles_grid_heatmap_same_as_full_resolution()
+    test_tiles_grid_heatmap_tile_outline()
+    print('Done')
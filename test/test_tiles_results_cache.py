@@ -0,0 +1,46 @@
+import numpy as np
+
+from deepness.processing.map_processor.utils.tiles_results_cache import TilesResultsCache
+
+
+def test_tiles_results_cache_least_recently_used_removed():
+    cache = TilesResultsCache(max_size_bytes=300)
+    for i in range(3):
+        cache.put(('key', (i, 0)), np.full(100, i, dtype=np.uint8), size_bytes=100)
+    assert len(cache) == 3
+
+    assert cache.get(('key', (0, 0)))[0] == 0  # now the most recently used
+    cache.put(('key', (3, 0)), np.full(100, 3, dtype=np.uint8), size_bytes=100)
+
+    assert cache.get(('key', (1, 0))) is None
+    assert cache.get(('key', (0, 0))) is not None
+    assert cache.get(('other_key', (2, 0))) is None
+    assert cache.get_size_bytes() == 300
+
+    cache.put(('key', (2, 0)), np.full(50, 2, dtype=np.uint8), size_bytes=50)  # replaced
+    assert cache.get_size_bytes() == 250
+    assert len(cache.get(('key', (2, 0)))) == 50
+
+
+def test_tiles_results_cache_size_limit():
+    cache = TilesResultsCache(max_size_bytes=1000)
+    for i in range(10):
+        cache.put(i, i, size_bytes=100)
+    assert len(cache) == 10
+
+    cache.set_max_size_bytes(250)
+    assert len(cache) == 2
+    assert cache.get(9) == 9 and cache.get(8) == 8
+
+    cache.put('too big', 0, size_bytes=300)
+    assert len(cache) == 0
+
+    cache.set_max_size_bytes(0)  # disabled
+    cache.put(0, 0, size_bytes=1)
+    assert cache.get(0) is None
+
+
+if __name__ == '__main__':
+    test_tiles_results_cache_least_recently_used_removed()
+    test_tiles_results_cache_size_limit()
+    print('Done')
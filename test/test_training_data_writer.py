@@ -0,0 +1,111 @@
+import json
+import os
+import tarfile
+import tempfile
+
+import cv2
+import numpy as np
+
+from deepness.common.processing_parameters.training_data_export_parameters import TrainingDataExportFormat
+from deepness.processing.map_processor.utils.training_data_writer import TrainingDataWriter
+
+
+def _create_tiles(number_of_tiles):
+    rng = np.random.default_rng(0)
+    tiles = {}
+    for i in range(number_of_tiles):
+        tiles[f'tile_img_{i}_0'] = rng.integers(0, 255, size=(32, 32, 3), dtype=np.uint8)
+        tiles[f'tile_mask_{i}_0'] = (rng.random((32, 32)) > 0.5).astype(np.uint8) * 255
+    return tiles
+
+
+def _write_tiles(output_format, tiles, tiles_per_shard=4):
+    output_dir_path = tempfile.mkdtemp()
+    writer = TrainingDataWriter(
+        output_dir_path=output_dir_path,
+        output_format=output_format,
+        png_compression_level=1,
+        tiles_per_shard=tiles_per_shard,
+        number_of_workers=2)
+
+    for file_name, img in tiles.items():
+        writer.add_tile(file_name, img)
+    writer.finish()
+    return output_dir_path
+
+
+def _decode_png(data: bytes) -> np.ndarray:
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
+
+
+def test_training_data_writer_png_files():
+    tiles = _create_tiles(5)
+    output_dir_path = _write_tiles(TrainingDataExportFormat.PNG_FILES, tiles)
+
+    assert sorted(os.listdir(output_dir_path)) == sorted(f'{name}.png' for name in tiles)
+    for file_name, img in tiles.items():
+        with open(os.path.join(output_dir_path, f'{file_name}.png'), 'rb') as f:
+            assert np.array_equal(_decode_png(f.read()), img)
+
+
+def test_training_data_writer_tar_shards():
+    tiles = _create_tiles(5)
+    output_dir_path = _write_tiles(TrainingDataExportFormat.TAR_SHARDS, tiles)
+
+    with open(os.path.join(output_dir_path, TrainingDataWriter.INDEX_FILE_NAME)) as f:
+        index = json.load(f)
+
+    assert len(index['shards']) == 3  # 10 files, 4 in each shard
+    assert [member for shard in index['shards'] for member in shard['members']] == [f'{name}.png' for name in tiles]
+
+    for shard in index['shards']:
+        with tarfile.open(os.path.join(output_dir_path, shard['file'])) as tar_file:
+            assert tar_file.getnames() == shard['members']
+            for member in shard['members']:
+                img = _decode_png(tar_file.extractfile(member).read())
+                assert np.array_equal(img, tiles[member[:-len('.png')]])
+
+
+def test_training_data_writer_npz_shards():
+    tiles = _create_tiles(5)
+    output_dir_path = _write_tiles(TrainingDataExportFormat.NPZ_SHARDS, tiles)
+
+    with open(os.path.join(output_dir_path, TrainingDataWriter.INDEX_FILE_NAME)) as f:
+        index = json.load(f)
+
+    assert len(index['shards']) == 3
+    for shard in index['shards']:
+        with np.load(os.path.join(output_dir_path, shard['file'])) as npz_file:
+            assert sorted(npz_file.files) == sorted(shard['members'])
+            for member in shard['members']:
+                assert np.array_equal(npz_file[member], tiles[member])
+
+
+def test_training_data_writer_abort():
+    output_dir_path = tempfile.mkdtemp()
+    writer = TrainingDataWriter(
+        output_dir_path=output_dir_path,
+        output_format=TrainingDataExportFormat.TAR_SHARDS,
+        png_compression_level=1,
+        tiles_per_shard=4,
+        number_of_workers=1)
+
+    tiles = _create_tiles(2)
+    for file_name, img in tiles.items():
+        writer.add_tile(file_name, img)
+    writer.add_tile('invalid', np.zeros((32, 32, 2, 2), dtype=np.float64))  # fails in the encoding thread
+
+    writer.abort()  # e.g. after an error while reading tiles, pending tiles do not raise their errors
+
+    assert TrainingDataWriter.INDEX_FILE_NAME not in os.listdir(output_dir_path)
+
+
+if __name__ == '__main__':
+    test_training_data_writer_png_files()
+    test_training_data_writer_tar_shards()
+    test_training_data_writer_npz_shards()
+    test_training_data_writer_abort()
+    print('Done')
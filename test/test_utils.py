@@ -6,6 +6,9 @@ from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem, QgsProject,
 from qgis.PyQt.QtWidgets import QWidget
 
 from deepness.common.channels_mapping import ChannelsMapping, ImageChannelCompositeByte, ImageChannelStandaloneBand
+from deepness.common.processing_overlap import ProcessingOverlap, ProcessingOverlapOptions
+from deepness.common.processing_parameters.map_processing_parameters import MapProcessingParameters, ProcessedAreaType
+from deepness.processing.tile_params import TileParams
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_DATA_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, 'data'))
@@ -216,6 +219,33 @@ def create_default_input_channels_mapping_for_google_satellite_bands():
     return channels_mapping
 
 
+def create_tile_params(x_bin_number: int, y_bin_number: int, x_bins_number: int, y_bins_number: int) -> TileParams:
+    """
+    Create parameters of a tile in a grid of small tiles without overlap, e.g. for tests of tiles processing utilities
+    """
+    tile_size_px = 8
+    params = MapProcessingParameters(
+        resolution_cm_per_px=100,
+        processed_area_type=ProcessedAreaType.ENTIRE_LAYER,
+        tile_size_px=tile_size_px,
+        batch_size=1,
+        local_cache=False,
+        input_layer_id='',
+        mask_layer_id=None,
+        processing_overlap=ProcessingOverlap(ProcessingOverlapOptions.OVERLAP_IN_PERCENT, percentage=0),
+        input_channels_mapping=create_default_input_channels_mapping_for_rgb_bands(),
+    )
+    return TileParams(
+        x_bin_number=x_bin_number,
+        y_bin_number=y_bin_number,
+        x_bins_number=x_bins_number,
+        y_bins_number=y_bins_number,
+        params=params,
+        rlayer_units_per_pixel=1,
+        processing_extent=QgsRectangle(0, 0, x_bins_number * tile_size_px, y_bins_number * tile_size_px),
+    )
+
+
 class SignalCollector(QWidget):
     """
     Allows to intercept a signal and collect its data during unit testing